@@ -1,13 +1,21 @@
 """
 Streamlit 用户界面：Prompt 助手
+
+设置 RAG_SERVER_URL 时作为瘦客户端运行：检索与生成都交给 rag_server.py，本进程不加载索引和模型
 """
 import streamlit as st
 import json
 import time
+import weakref
 from ollama_client import OllamaClient
 from vector_store import VectorStore
-from rag_generator import RAGGenerator
-from config import TOP_K
+from rag_generator import RAGGenerator, parse_variants, variant_instruction
+from rag_client import RAGServiceClient
+from metrics import REGISTRY
+from llm_telemetry import LLMTelemetry, format_breakdown
+from stream_renderer import StreamRenderer, format_render_stats
+from config import (TOP_K, RETRIEVAL_MMR, RERANK_ENABLED, RETRIEVAL_FIELD_FUSION, OLLAMA_PRELOAD,
+                    RAG_SERVER_URL)
 
 
 # 页面配置
@@ -24,28 +32,43 @@ if 'rag_generator' not in st.session_state:
     st.session_state.rag_generator = None
 if 'ollama_client' not in st.session_state:
     st.session_state.ollama_client = None
+if 'rag_service' not in st.session_state:
+    st.session_state.rag_service = None
+
+
+class _SharedStoreLease:
+    """会话持有的共享向量库引用：会话结束、session state 被回收时自动归还"""
+    
+    def __init__(self, store: VectorStore):
+        self.store = store
+        weakref.finalize(self, store.release)
 
 
 def init_components():
     """初始化组件"""
     try:
+        if RAG_SERVER_URL:
+            # 瘦客户端模式：只建立到 RAG 服务的连接
+            if st.session_state.rag_service is None:
+                st.session_state.rag_service = RAGServiceClient(RAG_SERVER_URL)
+            return True
+        
         if st.session_state.ollama_client is None:
             st.session_state.ollama_client = OllamaClient()
             # 预热连接，减少首请求握手延迟
             st.session_state.ollama_client.warm_connection()
+            # 后台预加载模型并保持常驻（进程内只启动一次）
+            if OLLAMA_PRELOAD:
+                st.session_state.ollama_client.residency.start()
         
         if st.session_state.vector_store is None:
             # 使用占位符显示加载状态
             with st.spinner("正在初始化向量库..."):
-                st.session_state.vector_store = VectorStore()
-                if st.session_state.vector_store.exists():
-                    st.session_state.vector_store.load_index()
-                    # 预热 encoder（进行一次 encode，避免首次检索时慢）
-                    try:
-                        st.session_state.vector_store.encoder.encode(["预热"])
-                    except:
-                        pass
-                else:
+                # 进程内所有会话共享同一份索引和元数据（首次获取时加载并启动热加载）
+                store = VectorStore.acquire_shared()
+                st.session_state.vector_store_lease = _SharedStoreLease(store)
+                st.session_state.vector_store = store
+                if not store.exists():
                     st.warning("⚠️ 向量库不存在，请先构建索引")
                     return False
         
@@ -61,6 +84,22 @@ def init_components():
         return False
 
 
+def _format_stage_timings(timings: dict) -> str:
+    """将检索各阶段耗时格式化为一行说明"""
+    trace = f" · trace {timings['trace_id']}" if timings.get("trace_id") else ""
+    if timings.get("cache_hit"):
+        return "检索阶段: 命中缓存" + trace
+    parts = [f"编码 {timings.get('encode_ms', 0):.1f}ms", f"FAISS {timings.get('search_ms', 0):.1f}ms"]
+    if timings.get("fields_skipped"):
+        parts.append("字段索引未构建，已使用组合文本检索")
+    if "rerank_skipped" in timings:
+        if timings["rerank_skipped"]:
+            parts.append(f"精排已跳过（预计 {timings.get('rerank_estimate_ms', 0):.0f}ms 超出预算）")
+        else:
+            parts.append(f"精排 {timings['rerank_ms']:.1f}ms（{timings['rerank_pairs']} 条）")
+    return "检索阶段: " + " · ".join(parts) + trace
+
+
 def main():
     """主界面"""
     st.title("🎨 PromptRAG - AI 绘图提示词助手")
@@ -71,7 +110,14 @@ def main():
         st.header("⚙️ 系统状态")
         
         # 测试连接
-        if st.button("🔌 测试 Ollama 连接"):
+        if RAG_SERVER_URL:
+            if st.button("🔌 测试 RAG 服务连接"):
+                try:
+                    RAGServiceClient(RAG_SERVER_URL).health()
+                    st.success("✓ 连接成功")
+                except Exception as e:
+                    st.error(f"✗ 连接失败: {e}")
+        elif st.button("🔌 测试 Ollama 连接"):
             client = OllamaClient()
             if client.test_connection():
                 st.success("✓ 连接成功")
@@ -81,12 +127,27 @@ def main():
         st.markdown("---")
         
         # 向量库状态（使用缓存的实例，避免重复加载）
-        if st.session_state.vector_store is not None:
+        if RAG_SERVER_URL:
+            try:
+                health = RAGServiceClient(RAG_SERVER_URL, timeout=5).health()
+                st.success(f"✓ RAG 服务已就绪: {RAG_SERVER_URL}")
+                st.info(f"📊 索引大小: {health['index_size']} 条")
+                if health.get("index_version"):
+                    st.caption(f"索引版本: {health['index_version']}")
+                st.caption(
+                    f"🧠 {health['model']} · LLM 在途 {health['llm_inflight']}/{health['llm_concurrency']}，"
+                    f"排队 {health['llm_waiting']}"
+                )
+            except Exception as e:
+                st.error(f"✗ RAG 服务不可用: {e}")
+        elif st.session_state.vector_store is not None:
             store = st.session_state.vector_store
             if store.exists():
                 st.success("✓ 向量库已就绪")
                 if store.index is not None:
                     st.info(f"📊 索引大小: {store.index.ntotal} 条")
+                    if store.version:
+                        st.caption(f"索引版本: {store.version}")
             else:
                 st.warning("⚠️ 向量库未构建")
         else:
@@ -98,6 +159,47 @@ def main():
             else:
                 st.warning("⚠️ 向量库未构建")
         
+        # 模型常驻状态（后台轮询 /api/ps 的结果）
+        if st.session_state.ollama_client is not None:
+            residency = st.session_state.ollama_client.residency
+            loaded = residency.is_loaded()
+            if loaded:
+                st.caption(f"🔥 模型常驻中: {st.session_state.ollama_client.model}")
+            elif loaded is False:
+                st.caption(f"🧊 模型未加载: {st.session_state.ollama_client.model}（下次请求需冷启动）")
+        
+        # 语义缓存统计（进程内所有会话共享）
+        if st.session_state.get("rag_generator") is not None and st.session_state.rag_generator.cache is not None:
+            cache_stats = st.session_state.rag_generator.cache.stats()
+            st.caption(
+                f"♻️ 语义缓存: 命中率 {cache_stats['hit_ratio']:.0%}（{cache_stats['hits']}/{cache_stats['lookups']}），"
+                f"节省 LLM 生成 {cache_stats['saved_gpu_seconds']:.1f} 秒"
+            )
+        
+        # 运行指标（LLM 请求数、合并的重复请求数、各阶段耗时等）
+        with st.expander("📈 运行指标", expanded=False):
+            telemetry = LLMTelemetry.shared().summary(group_by="model_host")
+            for name, entry in telemetry.items():
+                lines = [f"**{name}**（最近 {entry['requests']} 次）"]
+                for field, label in (("queue_ms", "排队/网络"), ("load_ms", "加载"), ("prefill_ms", "预填充"),
+                                     ("decode_ms", "解码")):
+                    if field in entry:
+                        lines.append(f"{label}: p50 {entry[field]['p50']:.0f}ms / p95 {entry[field]['p95']:.0f}ms")
+                for field, label in (("prefill_tps", "预填充速度"), ("decode_tps", "解码速度")):
+                    if field in entry:
+                        lines.append(f"{label}: p50 {entry[field]['p50']:.0f} tok/s")
+                if entry.get("prefill_ttft_correlation") is not None:
+                    lines.append(f"提示词长度与首 token 耗时相关系数: {entry['prefill_ttft_correlation']:.2f}")
+                st.markdown("  \n".join(lines))
+            if RAG_SERVER_URL:
+                # 瘦客户端模式下检索与生成都发生在服务端，展示服务端的指标
+                try:
+                    st.code(RAGServiceClient(RAG_SERVER_URL, timeout=5).metrics(), language="text")
+                except Exception as e:
+                    st.caption(f"⚠️ 获取服务端指标失败: {e}")
+            else:
+                st.code(REGISTRY.render(), language="text")
+        
         st.markdown("---")
         st.markdown("### 📖 使用说明")
         st.markdown("""
@@ -110,6 +212,9 @@ def main():
     # 主界面
     if not init_components():
         st.stop()
+    # 瘦客户端模式下 RAGServiceClient 提供与 VectorStore.search / RAGGenerator.stream_generate 相同的接口
+    searcher = st.session_state.rag_service or st.session_state.vector_store
+    generator = st.session_state.rag_service or st.session_state.rag_generator
     
     # 搜索与生成区域
     col1, col2 = st.columns([3, 1])
@@ -123,22 +228,23 @@ def main():
     
     with col2:
         top_k = st.number_input("检索数量", min_value=1, max_value=10, value=TOP_K, step=1)
+        n_variants = st.number_input("备选数量", min_value=1, max_value=5, value=1, step=1,
+                                     help="一次调用生成多个风格各异的备选提示词（检索和上下文只处理一次）")
         col_btn1, col_btn2 = st.columns(2)
         with col_btn1:
             search_btn = st.button("🔍 仅检索", use_container_width=True, help="只执行检索，不生成")
         with col_btn2:
             generate_btn = st.button("🚀 生成", type="primary", use_container_width=True, help="检索 + 生成完整流程")
         fast_mode = st.checkbox("⚡ 低延迟生成（不带参考素材）", value=False, help="仅使用用户输入生成，跳过参考素材，减少上下文长度降低 TTFT")
-        # 模型预热按钮（可选）
-        if st.button("🔥 模型预热", use_container_width=True, help="调用一次短请求，让模型常驻以降低 TTFT"):
-            with st.spinner("正在预热模型..."):
+        diverse_mode = st.checkbox("🎯 多样化检索（MMR）", value=RETRIEVAL_MMR, help="去除近似重复的参考素材，用更少的上下文覆盖更多信息")
+        rerank_mode = st.checkbox("🏅 精排（Cross-Encoder）", value=RERANK_ENABLED, help="对候选结果重排序，超出延迟预算时自动跳过")
+        fields_mode = st.checkbox("🧩 分字段加权检索", value=RETRIEVAL_FIELD_FUSION, help="主体、风格、元素、氛围分别匹配后按权重融合（需构建字段索引，与 MMR 同时勾选时使用 MMR）")
+        # 模型预热按钮（可选，瘦客户端模式下由服务端负责模型常驻）
+        if not RAG_SERVER_URL and st.button("🔥 模型预热", use_container_width=True, help="加载模型并保持常驻，降低 TTFT（不做生成）"):
+            with st.spinner("正在加载模型..."):
                 try:
-                    st.session_state.rag_generator.client.generate(
-                        prompt="说一句话：模型预热完成。",
-                        system="你是一个简短回答助手，只需一句话。",
-                        temperature=0.1,
-                    )
-                    st.success("✓ 预热完成，可降低首 token 延迟")
+                    st.session_state.rag_generator.client.load_model()
+                    st.success("✓ 模型已加载，可降低首 token 延迟")
                 except Exception as e:
                     st.error(f"预热失败: {e}")
     
@@ -153,7 +259,11 @@ def main():
             progress_bar.progress(10)
             
             start_time = time.time()
-            retrieved = st.session_state.vector_store.search(user_input, top_k=top_k)
+            stage_timings = {}
+            retrieved = searcher.search(
+                user_input, top_k=top_k, mmr=diverse_mode, rerank=rerank_mode, fields=fields_mode,
+                timings=stage_timings
+            )
             search_time = time.time() - start_time
             retrieved_items = [item for item, _ in retrieved]
             
@@ -164,6 +274,7 @@ def main():
             st.markdown("---")
             st.subheader(f"🔍 检索结果（找到 {len(retrieved_items)} 条）")
             st.info(f"⏱️ 检索耗时: **{search_time:.3f} 秒**")
+            st.caption(_format_stage_timings(stage_timings))
             
             for i, ref in enumerate(retrieved_items, 1):
                 with st.expander(f"结果 {i}"):
@@ -199,54 +310,73 @@ def main():
         
         try:
             # 1. 检索阶段（可选）
+            stage_timings = {}
+            llm_stats = {}  # LLM 流结束时的统计对象（含 load_duration、residency）
             if fast_mode:
                 status_text.text("🔍 低延迟模式：跳过参考素材，直接生成...")
                 progress_bar.progress(20)
                 retrieved_items = []
                 search_time = 0.0
+                # 低延迟模式只用用户输入
+                if RAG_SERVER_URL:
+                    token_stream, _ = generator.stream_generate(
+                        user_input, on_done=llm_stats.update, n_variants=n_variants, retrieve=False
+                    )
+                else:
+                    token_stream = generator.client.stream_generate(
+                        prompt=f"用户意图: {user_input}\n\n{variant_instruction(n_variants)}",
+                        system=generator.system_prompt,
+                        temperature=0.7,
+                        on_done=llm_stats.update,
+                    )
             else:
                 status_text.text("🔍 步骤 1/2: 正在检索相似提示词...")
                 progress_bar.progress(10)
                 
+                # 检索 + 语义缓存查询（命中时 token_stream 直接输出缓存结果）
                 search_start = time.time()
-                retrieved = st.session_state.vector_store.search(user_input, top_k=top_k)
+                token_stream, retrieved_items = generator.stream_generate(
+                    user_input, top_k=top_k, mmr=diverse_mode, rerank=rerank_mode, fields=fields_mode,
+                    timings=stage_timings, on_done=llm_stats.update, n_variants=n_variants
+                )
                 search_time = time.time() - search_start
-                retrieved_items = [item for item, _ in retrieved]
                 
                 progress_bar.progress(30)
                 status_text.text(f"✓ 检索完成（耗时: {search_time:.3f}秒），找到 {len(retrieved_items)} 条相似提示词")
             
             # 2. 生成阶段（流式展示）
-            status_text.text("✨ 正在调用 Ollama 生成 Prompt（流式输出）...")
-            progress_bar.progress(40)
-            
-            # 构建上下文（低延迟模式只用用户输入）
-            if fast_mode:
-                context = f"用户意图: {user_input}"
+            if stage_timings.get("semantic_cache_hit"):
+                status_text.text("♻️ 命中语义缓存，直接复用相似请求的生成结果...")
             else:
-                context = st.session_state.rag_generator._build_context(user_input, retrieved_items)
-            user_prompt = f"{context}\n\n请根据以上信息，生成一段高质量的中文绘图提示词："
+                status_text.text("✨ 正在调用 Ollama 生成 Prompt（流式输出）...")
+            progress_bar.progress(40)
             
             generate_start = time.time()
-            token_placeholder = st.empty()
-            token_buffer = []
+            # 多个备选时每个备选一个占位区，随流式输出逐个填充
+            token_placeholders = [st.empty() for _ in range(n_variants)]
             first_token_time = None
             
-            for tok in st.session_state.rag_generator.client.stream_generate(
-                prompt=user_prompt,
-                system=st.session_state.rag_generator.system_prompt,
-                temperature=0.7
-            ):
+            def render_variants(text):
+                for i, variant in enumerate(parse_variants(text, n_variants)):
+                    token_placeholders[i].text(f"备选 {i + 1}：{variant}")
+            
+            # token 按时间 / 字节预算合并成帧再刷新，不再每个 token 推送一次完整文本
+            renderer = StreamRenderer(token_placeholders[0].text if n_variants == 1 else render_variants)
+            for tok in token_stream:
                 if first_token_time is None:
                     first_token_time = time.time()
                     ttft = first_token_time - generate_start
                     status_text.text(f"✨ 已收到首个 token，TTFT: {ttft:.3f} 秒")
                     progress_bar.progress(70)
-                token_buffer.append(tok)
-                token_placeholder.text("".join(token_buffer))
+                renderer.feed(tok)
+            final_prompt = renderer.finish().strip()
             
             generate_time = time.time() - generate_start
-            final_prompt = "".join(token_buffer).strip()
+            for placeholder in token_placeholders:
+                placeholder.empty()
+            variants = parse_variants(final_prompt, n_variants) if n_variants > 1 else [final_prompt]
+            if variants:
+                final_prompt = variants[0]
             
             progress_bar.progress(100)
             status_text.text(f"✓ 生成完成！总耗时: {search_time + generate_time:.3f}秒")
@@ -254,6 +384,7 @@ def main():
             # 组装结果
             result = {
                 "final_prompt": final_prompt,
+                "variants": variants,
                 "references": retrieved_items,
                 "user_intent": user_input
             }
@@ -276,9 +407,30 @@ def main():
                 st.metric("⏱️ 总耗时", f"{search_time + generate_time:.3f}秒")
             if first_token_time:
                 st.caption(f"TTFT (首 token 延迟): {ttft:.3f} 秒")
+                st.caption(format_render_stats(renderer.stats(),
+                                               (llm_stats.get("telemetry") or {}).get("decode_tps")))
+            if not fast_mode:
+                st.caption(_format_stage_timings(stage_timings))
+            if stage_timings.get("semantic_cache_hit"):
+                st.caption("♻️ 命中语义缓存：相似意图且参考素材相同，未调用 LLM")
+            if llm_stats.get("residency") == "cold":
+                st.caption(f"🧊 冷启动：本次请求先加载模型，耗时 {llm_stats.get('load_duration', 0) / 1e9:.1f} 秒")
+            elif llm_stats.get("residency") == "warm":
+                st.caption("🔥 模型已常驻，本次请求无需加载模型")
+            if llm_stats.get("telemetry"):
+                st.caption(f"LLM 耗时构成: {format_breakdown(llm_stats['telemetry'])}")
+            if llm_stats.get("scheduler"):
+                st.caption(f"⏳ 调度排队 {llm_stats['scheduler']['queue_ms']:.0f}ms（交互请求优先于后台批量任务）")
             
             # 可复制的 Prompt 框
-            st.code(result["final_prompt"], language="text")
+            if len(result["variants"]) > 1:
+                for i, variant in enumerate(result["variants"], 1):
+                    st.markdown(f"**备选 {i}**")
+                    st.code(variant, language="text")
+            else:
+                st.code(result["final_prompt"], language="text")
+            if len(result["variants"]) < n_variants:
+                st.caption(f"⚠️ 请求 {n_variants} 个备选，模型输出中只解析到 {len(result['variants'])} 个")
             
             # 复制按钮（Streamlit 原生支持）
             st.markdown("💡 点击上方代码框右上角的复制按钮即可复制")
@@ -325,7 +477,7 @@ def main():
     
     if search_btn and search_query:
         try:
-            results = st.session_state.vector_store.search(search_query, top_k=5)
+            results = searcher.search(search_query, top_k=5)
             
             if results:
                 st.markdown(f"找到 {len(results)} 个相似结果：")
@@ -0,0 +1,231 @@
+"""
+异步 Ollama 客户端：基于 asyncio + aiohttp，单线程即可维持大量并发请求
+"""
+import asyncio
+import contextlib
+import json
+import time
+from typing import AsyncGenerator, Callable, Dict
+import aiohttp
+import tracing
+from ollama_client import build_generate_payload, build_chat_payload
+from llm_scheduler import INTERACTIVE, LLMScheduler
+from llm_telemetry import trace_attributes
+from config import (
+    OLLAMA_HOST, OLLAMA_MODEL, REQUEST_TIMEOUT, MAX_RETRIES,
+    OLLAMA_MAX_CONNECTIONS, OLLAMA_MAX_CONNECTIONS_PER_HOST, OLLAMA_CONNECT_TIMEOUT, LLM_SCHEDULER,
+)
+
+
+class AsyncOllamaClient:
+    """
+    Ollama API 异步客户端，接口与 OllamaClient 一致（流式接口为异步生成器）
+
+    所有请求共用一个带连接池的 aiohttp 会话（keep-alive），连接数受
+    max_connections / max_connections_per_host 限制，超出的请求在连接池中排队。
+    会话在首次请求时于当前事件循环中创建，用完后调用 close()，或使用 async with。
+    启用调度（LLM_SCHEDULER）时与同一主机的 OllamaClient 共用调度器，按 priority 申请槽位。
+    """
+
+    def __init__(self, host: str = None, model: str = None, max_connections: int = None,
+                 max_connections_per_host: int = None, timeout: float = None, connect_timeout: float = None,
+                 priority: str = INTERACTIVE, scheduler: bool = None):
+        self.host = host or OLLAMA_HOST
+        self.model = model or OLLAMA_MODEL
+        self.base_url = f"{self.host}/api"
+        self.max_connections = OLLAMA_MAX_CONNECTIONS if max_connections is None else max_connections
+        self.max_connections_per_host = (
+            OLLAMA_MAX_CONNECTIONS_PER_HOST if max_connections_per_host is None else max_connections_per_host
+        )
+        self.timeout = timeout or REQUEST_TIMEOUT
+        self.connect_timeout = connect_timeout or OLLAMA_CONNECT_TIMEOUT
+        self.priority = priority
+        self.scheduler = LLMScheduler.for_host(self.host) if (LLM_SCHEDULER if scheduler is None else scheduler) else None
+        self._session = None
+
+    async def __aenter__(self) -> "AsyncOllamaClient":
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=self.max_connections_per_host,
+                keepalive_timeout=60,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        """关闭会话并释放连接池"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _timeout(self, timeout: float = None, stream: bool = False) -> aiohttp.ClientTimeout:
+        """单次请求超时：非流式限制总耗时；流式限制相邻两次读取的间隔（生成可能持续很久）"""
+        timeout = timeout or self.timeout
+        if stream:
+            return aiohttp.ClientTimeout(total=None, connect=self.connect_timeout, sock_read=timeout)
+        return aiohttp.ClientTimeout(total=timeout, connect=self.connect_timeout)
+
+    async def warm_connection(self, timeout: float = 5) -> bool:
+        """
+        轻量预热：建立连接并保活，降低首请求延迟
+        """
+        try:
+            async with self._get_session().get(f"{self.base_url}/tags", timeout=self._timeout(timeout)) as resp:
+                resp.raise_for_status()
+                await resp.read()
+            return True
+        except Exception:
+            return False
+
+    def _slot(self):
+        """向调度器申请槽位（未启用调度时不限制）"""
+        if self.scheduler is None:
+            return contextlib.nullcontext()
+        return self.scheduler.aslot(self.priority)
+
+    @tracing.traced("llm.request")
+    async def _make_request(self, endpoint: str, data: Dict, timeout: float = None) -> Dict:
+        """发送请求，带重试机制（指数退避）"""
+        request_span = tracing.current().set(endpoint=endpoint, model=self.model, priority=self.priority)
+        start = time.perf_counter()
+        async with self._slot() as ticket:
+            response = await self._send_request(endpoint, data, timeout)
+        if ticket is not None:
+            response["scheduler"] = ticket.report()
+        if request_span:
+            request_span.set(**trace_attributes(response, (time.perf_counter() - start) * 1000))
+        return response
+
+    async def _send_request(self, endpoint: str, data: Dict, timeout: float = None) -> Dict:
+        url = f"{self.base_url}/{endpoint}"
+        for retry_count in range(MAX_RETRIES + 1):
+            try:
+                async with self._get_session().post(url, json=data, timeout=self._timeout(timeout)) as response:
+                    response.raise_for_status()
+                    return await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if retry_count >= MAX_RETRIES:
+                    raise Exception(f"请求失败，已重试 {MAX_RETRIES} 次: {e!r}")
+                wait_time = 2 ** retry_count
+                print(f"请求失败，{wait_time}秒后重试... (尝试 {retry_count + 1}/{MAX_RETRIES})")
+                await asyncio.sleep(wait_time)
+
+    async def generate(self, prompt: str, system: str = None, temperature: float = 0.7,
+                       timeout: float = None, on_done: Callable[[Dict], None] = None) -> str:
+        """
+        生成文本
+
+        Args:
+            prompt: 用户提示词
+            system: 系统提示词
+            temperature: 温度参数
+            timeout: 本次请求的超时（秒），默认使用配置 REQUEST_TIMEOUT
+            on_done: 可选，以完整响应调用（含 eval_count、eval_duration 等耗时统计，
+                     启用调度时另含 scheduler: 请求类别与排队耗时）
+
+        Returns:
+            生成的文本内容
+        """
+        data = build_generate_payload(self.model, prompt, system, temperature)
+        response = await self._make_request("generate", data, timeout)
+        if on_done is not None:
+            on_done(response)
+        return response.get("response", "")
+
+    async def stream_generate(self, prompt: str, system: str = None, temperature: float = 0.7,
+                              timeout: float = None,
+                              on_done: Callable[[Dict], None] = None) -> AsyncGenerator[str, None]:
+        """
+        流式生成文本，逐步返回 token（异步生成器）
+
+        timeout: 相邻两次读取之间允许的最长等待（秒）
+        on_done: 流正常结束时以 Ollama 的最终统计对象调用（含 eval_count、eval_duration 等字段，
+                 启用调度时另含 scheduler: 请求类别与排队耗时）
+        """
+        data = build_generate_payload(self.model, prompt, system, temperature, stream=True)
+        # 异步生成器跨越多次 yield，span 的父子关系显式传递；首 token 前为 llm.ttft（含调度排队），之后为 llm.decode
+        stream_span = tracing.span("llm.stream", model=self.model, priority=self.priority)
+        ttft_span = tracing.span("llm.ttft", parent=stream_span)
+        decode_span = None
+        start = time.perf_counter()
+        try:
+            async with self._slot() as ticket, self._get_session().post(
+                f"{self.base_url}/generate", json=data, timeout=self._timeout(timeout, stream=True)
+            ) as r:
+                r.raise_for_status()
+                # aiohttp 按行切分，Ollama 每行是一个 JSON 对象
+                async for line in r.content:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        obj = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    # Ollama 流式返回中，done=true 表示结束，该对象携带本次请求的耗时与 token 统计
+                    if obj.get("done"):
+                        if ticket is not None:
+                            obj["scheduler"] = ticket.report()
+                        if stream_span:
+                            stream_span.set(**trace_attributes(obj, (time.perf_counter() - start) * 1000))
+                        if on_done is not None:
+                            on_done(obj)
+                        break
+                    token = obj.get("response", "")
+                    if token:
+                        if decode_span is None and stream_span:
+                            ttft_span.end()
+                            decode_span = tracing.span("llm.decode", parent=stream_span)
+                        yield token
+        except GeneratorExit:
+            stream_span.set(cancelled=True)
+            raise
+        finally:
+            ttft_span.end()
+            if decode_span is not None:
+                decode_span.end()
+            stream_span.end()
+
+    async def chat(self, messages: list, temperature: float = 0.7, timeout: float = None) -> str:
+        """
+        对话模式生成
+
+        Args:
+            messages: 消息列表，格式 [{"role": "user", "content": "..."}]
+            temperature: 温度参数
+            timeout: 本次请求的超时（秒）
+
+        Returns:
+            生成的文本内容
+        """
+        data = build_chat_payload(self.model, messages, temperature)
+        response = await self._make_request("chat", data, timeout)
+        return response.get("message", {}).get("content", "")
+
+    async def test_connection(self) -> bool:
+        """测试与 Ollama 服务的连接"""
+        try:
+            async with self._get_session().get(f"{self.base_url}/tags", timeout=self._timeout(5)) as response:
+                response.raise_for_status()
+                models = (await response.json(content_type=None)).get("models", [])
+            print(f"✓ 连接成功！可用模型: {[m.get('name') for m in models]}")
+            return True
+        except Exception as e:
+            print(f"✗ 连接失败: {e!r}")
+            return False
+
+
+if __name__ == "__main__":
+    # 测试连接
+    async def _main():
+        async with AsyncOllamaClient() as client:
+            await client.test_connection()
+
+    asyncio.run(_main())
@@ -0,0 +1,192 @@
+"""
+批量生成：从 JSONL 逐行读取用户意图，批量检索 + 并发调用 LLM，结果逐行写入 JSONL
+
+输入每行可以是：
+    {"intent": "雨夜的猫", "id": "job-1", ...}   （也接受 "user_intent" 字段，其余字段原样写回输出）
+    "雨夜的猫"                                    （JSON 字符串）
+    雨夜的猫                                      （纯文本）
+
+输出每行包含输入的其余字段、line（输入行号）、user_intent、final_prompt（失败时为 error）和 timings；
+加 --variants N 时另含 variants（一次 LLM 调用生成的 N 个备选）。
+加 --resume 时跳过输出文件中已成功的行并追加写入，中断后可直接重跑（失败的行会重新生成）。
+
+用法:
+    python batch_generate.py intents.jsonl prompts.jsonl --concurrency 8
+    python batch_generate.py intents.jsonl prompts.jsonl --unordered --resume
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, Iterator, Optional, Set, Tuple
+from tqdm import tqdm
+from config import BATCH_CONCURRENCY, BATCH_CHUNK_SIZE, OLLAMA_HOST
+
+
+def _parse_line(line: str) -> Optional[Dict]:
+    """解析一行输入，返回包含 intent 的记录；空行返回 None"""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError:
+        record = line
+    if isinstance(record, str):
+        return {"intent": record}
+    if not isinstance(record, dict):
+        raise ValueError(f"无法识别的输入: {line[:80]}")
+    record = dict(record)
+    intent = record.pop("intent", None) or record.pop("user_intent", None)
+    if not intent:
+        raise ValueError(f"缺少 intent 字段: {line[:80]}")
+    record["intent"] = intent
+    return record
+
+
+def _completed_lines(output_path: str) -> Set[int]:
+    """读取已有输出中成功生成的输入行号（--resume 用）"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 上次中断时写了一半的行
+            if "final_prompt" in record and "line" in record:
+                done.add(record["line"])
+    return done
+
+
+def _open_output(output_path: str, resume: bool):
+    """打开输出文件；续写时先补上中断时写了一半的行的换行符，避免和新结果粘在同一行"""
+    if output_path == "-":
+        return sys.stdout
+    if not resume:
+        return open(output_path, 'w', encoding='utf-8')
+    needs_newline = False
+    if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+        with open(output_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+    out = open(output_path, 'a', encoding='utf-8')
+    if needs_newline:
+        out.write("\n")
+    return out
+
+
+def _read_intents(input_path: str, skip: Set[int], records: Dict[int, Tuple[int, Dict]],
+                  errors: list) -> Iterator[str]:
+    """
+    逐行读取意图（惰性，不把整个文件读入内存）
+
+    records 记录 生成序号 → (输入行号, 输入记录)，输出时取出；无法解析的行写入 errors
+    """
+    f = sys.stdin if input_path == "-" else open(input_path, 'r', encoding='utf-8')
+    try:
+        position = 0
+        for line_no, line in enumerate(f, 1):
+            if line_no in skip:
+                continue
+            try:
+                record = _parse_line(line)
+            except ValueError as e:
+                errors.append({"line": line_no, "error": str(e)})
+                continue
+            if record is None:
+                continue
+            records[position] = (line_no, record)
+            position += 1
+            yield record["intent"]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def _count_lines(input_path: str) -> Optional[int]:
+    if input_path == "-":
+        return None
+    with open(input_path, 'rb') as f:
+        return sum(1 for line in f if line.strip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PromptRAG 批量生成（JSONL 输入 / 输出）")
+    parser.add_argument("input", help="意图 JSONL 文件（- 表示标准输入）")
+    parser.add_argument("output", help="结果 JSONL 文件（- 表示标准输出）")
+    parser.add_argument("--top-k", type=int, default=None, help="检索数量（默认使用配置 TOP_K）")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="同时在途的 LLM 请求数")
+    parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE, help="每次一起编码、检索的意图条数")
+    parser.add_argument("--variants", type=int, default=1, help="每条意图的备选提示词数量（一次 LLM 调用生成）")
+    parser.add_argument("--unordered", action="store_true", help="按完成顺序写出（默认按输入顺序）")
+    parser.add_argument("--no-cache", dest="cache", action="store_false", help="不使用语义缓存")
+    parser.add_argument("--references", action="store_true", help="输出中包含参考素材")
+    parser.add_argument("--resume", action="store_true", help="跳过输出文件中已成功的行，追加写入")
+    parser.add_argument("--host", default=None, help=f"Ollama 服务地址（默认: {OLLAMA_HOST}）")
+    parser.add_argument("--model", default=None, help="模型名称（默认使用配置 OLLAMA_MODEL）")
+    args = parser.parse_args()
+
+    from llm_scheduler import BATCH
+    from ollama_client import OllamaClient
+    from rag_generator import RAGGenerator
+    from vector_store import VectorStore
+
+    store = VectorStore.acquire_shared()
+    if not store.exists():
+        raise SystemExit("✗ 向量库不存在，请先运行 python build_index.py")
+    generator = RAGGenerator(store, OllamaClient(host=args.host, model=args.model, priority=BATCH))
+
+    to_stdout = args.output == "-"
+    skip = _completed_lines(args.output) if args.resume and not to_stdout else set()
+    if skip:
+        print(f"✓ 跳过已完成的 {len(skip)} 行", file=sys.stderr)
+    total = _count_lines(args.input)
+    records: Dict[int, Tuple[int, Dict]] = {}
+    errors = []
+    succeeded = failed = 0
+
+    out = _open_output(args.output, args.resume)
+    start = time.perf_counter()
+    try:
+        results = generator.generate_many(
+            _read_intents(args.input, skip, records, errors), top_k=args.top_k, use_cache=args.cache,
+            concurrency=args.concurrency, chunk_size=args.chunk_size, ordered=not args.unordered,
+            n_variants=args.variants,
+        )
+        with tqdm(total=total - len(skip) if total is not None else None, desc="生成中", file=sys.stderr) as pbar:
+            for result in results:
+                line_no, record = records.pop(result["index"])
+                output = {key: value for key, value in record.items() if key != "intent"}
+                output.update(line=line_no, user_intent=result["user_intent"])
+                if "error" in result:
+                    output["error"] = result["error"]
+                    failed += 1
+                else:
+                    output["final_prompt"] = result["final_prompt"]
+                    if args.variants > 1:
+                        output["variants"] = result["variants"]
+                    succeeded += 1
+                if args.references:
+                    output["references"] = result["references"]
+                output["timings"] = result["timings"]
+                out.write(json.dumps(output, ensure_ascii=False) + "\n")
+                out.flush()
+                pbar.update(1)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        store.release()
+
+    elapsed = time.perf_counter() - start
+    done = succeeded + failed
+    print(f"\n✓ 完成 {succeeded} 条，失败 {failed} 条，无法解析 {len(errors)} 行，"
+          f"耗时 {elapsed:.1f}s（{done / elapsed if elapsed else 0:.2f} 条/秒）", file=sys.stderr)
+    for error in errors[:10]:
+        print(f"  ✗ 第 {error['line']} 行: {error['error']}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
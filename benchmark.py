@@ -0,0 +1,1136 @@
+"""
+性能基准脚本：在真实语料上对比不同实现的耗时
+
+用法:
+    python benchmark.py encode [--limit 2000] [--batch-size 64]
+    python benchmark.py load [--index db/knowledge.index] [--queries 200]
+    python benchmark.py pack [--repeat 5]
+    python benchmark.py mmr [--queries 50] [--ttft]
+    python benchmark.py coarse [--source db|synthetic] [--factors 5 10 20]
+    python benchmark.py retrieval [--source corpus|synthetic] [--model ...|--vectors ...] [--output run.json]
+    python benchmark.py compare baseline.json run.json [--tolerance 0.1]
+    python benchmark.py shards [--counts 1 2 4 8] [--n 200000]
+    python benchmark.py fields [--limit 5000] [--weights subject:0.4,style:0.2,elements:0.2,mood:0.2]
+    python benchmark.py stream-decode [--tokens 20000] [--lines-per-chunk 1]
+    python benchmark.py variants [--n 4] [--queries 10] [--mock]
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import jsonlines
+import numpy as np
+from typing import List
+from config import PROCESSED_DATA_DIR, RAW_DATA_DIR, INDEX_PATH, METADATA_PATH, PACK_PATH, FIELD_WEIGHTS
+
+
+def load_corpus_texts(store, limit: int = None) -> List[str]:
+    """
+    读取真实语料，返回检索文本列表
+
+    优先使用 data/processed 下的结构化数据（与 build_index 的检索文本一致），
+    否则退化为 data/raw 下的原始提示词。
+    """
+    texts = []
+    sources = []
+    if os.path.exists(PROCESSED_DATA_DIR):
+        sources = [os.path.join(PROCESSED_DATA_DIR, f) for f in sorted(os.listdir(PROCESSED_DATA_DIR)) if f.endswith('.jsonl')]
+    structured = bool(sources)
+    if not structured and os.path.exists(RAW_DATA_DIR):
+        sources = [os.path.join(RAW_DATA_DIR, f) for f in sorted(os.listdir(RAW_DATA_DIR)) if f.endswith('.jsonl')]
+
+    for path in sources:
+        with jsonlines.open(path) as reader:
+            for item in reader:
+                if structured:
+                    text = store._build_search_text(item)
+                else:
+                    text = (item.get("prompt") or "").strip()
+                if text:
+                    texts.append(text)
+                if limit and len(texts) >= limit:
+                    return texts
+    return texts
+
+
+def _padding_stats(lengths: List[int], batches: List[List[int]]) -> dict:
+    """统计批次 padding 后的 token 总数与有效 token 数"""
+    real = sum(lengths)
+    padded = sum(max(lengths[i] for i in batch) * len(batch) for batch in batches)
+    return {
+        "batches": len(batches),
+        "real_tokens": real,
+        "padded_tokens": padded,
+        "padding_ratio": padded / real if real else 0.0,
+    }
+
+
+def bench_encode(args):
+    """对比固定批大小编码与按 token 长度分桶编码"""
+    from vector_store import VectorStore
+
+    store = VectorStore()
+    texts = load_corpus_texts(store, limit=args.limit)
+    if not texts:
+        print("✗ 未找到语料，请检查 data/processed 或 data/raw")
+        return
+    print(f"语料: {len(texts)} 条")
+
+    lengths = store._token_lengths(texts)
+
+    # 旧实现：sentence-transformers 按字符长度排序后固定条数分批
+    char_order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+    fixed_batches = [char_order[i:i + args.batch_size] for i in range(0, len(texts), args.batch_size)]
+    bucket_batches = store._plan_batches(lengths)
+
+    # 预热，避免首次调用的初始化开销计入
+    store.encoder.encode(texts[:8], show_progress_bar=False)
+
+    start = time.perf_counter()
+    fixed = store.encoder.encode(texts, batch_size=args.batch_size, show_progress_bar=False)
+    fixed_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bucketed = store._encode_texts(texts)
+    bucket_time = time.perf_counter() - start
+
+    max_diff = float(np.max(np.abs(np.asarray(fixed, dtype='float32') - bucketed)))
+
+    results = {
+        "texts": len(texts),
+        "fixed": {"batch_size": args.batch_size, "seconds": fixed_time,
+                  "texts_per_sec": len(texts) / fixed_time, **_padding_stats(lengths, fixed_batches)},
+        "bucketed": {"seconds": bucket_time,
+                     "texts_per_sec": len(texts) / bucket_time, **_padding_stats(lengths, bucket_batches)},
+        "speedup": fixed_time / bucket_time if bucket_time else 0.0,
+        "max_abs_diff": max_diff,
+    }
+
+    print("\n" + "=" * 60)
+    for name in ("fixed", "bucketed"):
+        r = results[name]
+        print(f"{name:>9}: {r['seconds']:.2f}s  {r['texts_per_sec']:.1f} 条/秒  "
+              f"批次 {r['batches']}  padding 比 {r['padding_ratio']:.2f}")
+    print(f"加速比: {results['speedup']:.2f}x，向量最大偏差: {max_diff:.2e}")
+
+    _save_results(args, results)
+
+
+def _rss_mb(field: str = "VmRSS") -> float:
+    """
+    当前进程常驻内存（MB），Linux 读 /proc，其他平台退化为峰值 RSS
+
+    field 可选 VmRSS（总量）、RssAnon（私有匿名内存）、RssFile（文件映射，可在进程间共享、可被回收）
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if field != "VmRSS":
+        return 0.0
+    import resource
+    import sys
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 单位为字节，Linux 为 KB
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _drop_page_cache(path: str) -> bool:
+    """尽力将文件从操作系统页缓存中逐出，模拟冷启动（不支持的平台返回 False）"""
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        return True
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def bench_load(args):
+    """对比 full / mmap 两种索引加载模式的冷启动与热启动延迟"""
+    from vector_store import VectorStore
+
+    if not os.path.exists(args.index):
+        print(f"✗ 索引文件不存在: {args.index}")
+        return
+
+    rng = np.random.default_rng(0)
+    results = {"index": args.index, "size_mb": os.path.getsize(args.index) / (1024 * 1024), "runs": []}
+    print(f"索引文件: {args.index} ({results['size_mb']:.1f} MB)")
+
+    for mode in ("full", "mmap"):
+        for temperature in ("cold", "warm"):
+            dropped = _drop_page_cache(args.index) if temperature == "cold" else False
+            rss_before = _rss_mb()
+            anon_before = _rss_mb("RssAnon")
+
+            start = time.perf_counter()
+            index = VectorStore._read_faiss_index(args.index, mode=mode)
+            load_time = time.perf_counter() - start
+
+            queries = rng.standard_normal((args.queries, index.d)).astype('float32')
+            start = time.perf_counter()
+            index.search(queries[:1], args.top_k)
+            first_search = time.perf_counter() - start
+
+            latencies = []
+            for i in range(1, args.queries):
+                start = time.perf_counter()
+                index.search(queries[i:i + 1], args.top_k)
+                latencies.append(time.perf_counter() - start)
+
+            run = {
+                "mode": mode,
+                "cache": temperature,
+                "page_cache_dropped": dropped,
+                "load_ms": load_time * 1000,
+                "first_search_ms": first_search * 1000,
+                "search_p50_ms": _percentile(latencies, 50) * 1000,
+                "search_p99_ms": _percentile(latencies, 99) * 1000,
+                "rss_delta_mb": _rss_mb() - rss_before,
+                "rss_anon_delta_mb": _rss_mb("RssAnon") - anon_before,
+            }
+            results["runs"].append(run)
+            del index
+
+            note = "" if temperature == "warm" or dropped else "（无法清空页缓存，冷启动数据仅供参考）"
+            print(f"{mode:>4}/{temperature}: 加载 {run['load_ms']:.1f}ms  首次检索 {run['first_search_ms']:.2f}ms  "
+                  f"p50 {run['search_p50_ms']:.2f}ms  p99 {run['search_p99_ms']:.2f}ms  "
+                  f"RSS +{run['rss_delta_mb']:.1f}MB（私有 +{run['rss_anon_delta_mb']:.1f}MB）{note}")
+
+    _save_results(args, results)
+
+
+def bench_pack(args):
+    """对比知识包与“索引文件 + JSONL 元数据”的加载耗时"""
+    import faiss
+    from knowledge_pack import KnowledgePack
+
+    for path in (args.index, args.metadata, args.pack):
+        if not os.path.exists(path):
+            print(f"✗ 文件不存在: {path}（请先运行 python build_index.py）")
+            return
+
+    def load_files():
+        index = faiss.read_index(args.index)
+        metadata = []
+        with open(args.metadata, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    metadata.append(json.loads(line))
+        return index, metadata
+
+    def load_pack(mmap_index=False):
+        pack = KnowledgePack(args.pack)
+        return pack.read_index(mmap_index), pack.metadata()
+
+    results = {"repeat": args.repeat}
+    for name, loader in (("files", load_files), ("pack", load_pack), ("pack_mmap", lambda: load_pack(True))):
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            index, metadata = loader()
+            # 模拟一次检索结果组装：取前 5 条元数据
+            _ = [metadata[i] for i in range(min(5, len(metadata)))]
+            timings.append(time.perf_counter() - start)
+        results[name] = {
+            "records": len(metadata),
+            "load_p50_ms": _percentile(timings, 50) * 1000,
+            "load_min_ms": min(timings) * 1000,
+        }
+        print(f"{name:>9}: {len(metadata)} 条  加载 p50 {results[name]['load_p50_ms']:.1f}ms  "
+              f"最快 {results[name]['load_min_ms']:.1f}ms")
+
+    results["speedup"] = results["files"]["load_p50_ms"] / max(results["pack"]["load_p50_ms"], 1e-9)
+    print(f"知识包加载加速比: {results['speedup']:.1f}x（不含模型指纹校验）")
+    _save_results(args, results)
+
+
+def _mean_pairwise_similarity(vectors: np.ndarray) -> float:
+    """参考素材之间的平均余弦相似度（越高越冗余）"""
+    if len(vectors) < 2:
+        return 0.0
+    v = vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12)
+    sim = v @ v.T
+    n = len(v)
+    return float((sim.sum() - np.trace(sim)) / (n * (n - 1)))
+
+
+def bench_mmr(args):
+    """对比普通检索与 MMR 多样化检索：上下文 token 数、参考冗余度，以及（可选）TTFT"""
+    from vector_store import VectorStore
+    from rag_generator import RAGGenerator
+
+    store = VectorStore()
+    if not store.exists():
+        print("✗ 向量库不存在，请先运行 python build_index.py")
+        return
+    store.load_index()
+    generator = RAGGenerator(store)
+
+    corpus = load_corpus_texts(store, limit=args.limit)
+    step = max(1, len(corpus) // args.queries)
+    queries = corpus[::step][:args.queries]
+    print(f"查询: {len(queries)} 条，top_k={args.top_k}，fetch_k={args.fetch_k}，λ={args.mmr_lambda}")
+
+    results = {"queries": len(queries), "top_k": args.top_k, "fetch_k": args.fetch_k,
+               "mmr_lambda": args.mmr_lambda, "modes": {}}
+    for mode, use_mmr in (("flat", False), ("mmr", True)):
+        tokens, chars, redundancy, search_ms, ttfts = [], [], [], [], []
+        for query in queries:
+            start = time.perf_counter()
+            retrieved = store.search(query, top_k=args.top_k, mmr=use_mmr,
+                                     fetch_k=args.fetch_k, mmr_lambda=args.mmr_lambda)
+            search_ms.append((time.perf_counter() - start) * 1000)
+            items = [item for item, _ in retrieved]
+
+            context = generator._build_context(query, items)
+            chars.append(len(context))
+            tokens.append(store._token_lengths([context])[0])
+            vectors = store._encode_texts([store._build_search_text(item) for item in items])
+            redundancy.append(_mean_pairwise_similarity(vectors))
+
+            if args.ttft:
+                user_prompt = f"{context}\n\n请根据以上信息，生成一段高质量的中文绘图提示词："
+                start = time.perf_counter()
+                for _ in generator.client.stream_generate(user_prompt, system=generator.system_prompt):
+                    ttfts.append(time.perf_counter() - start)
+                    break
+
+        stats = {
+            "context_chars_mean": float(np.mean(chars)),
+            "context_tokens_mean": float(np.mean(tokens)),
+            "reference_similarity_mean": float(np.mean(redundancy)),
+            "search_p50_ms": _percentile(search_ms, 50),
+        }
+        if ttfts:
+            stats["ttft_p50_ms"] = _percentile(ttfts, 50) * 1000
+            stats["ttft_p95_ms"] = _percentile(ttfts, 95) * 1000
+        results["modes"][mode] = stats
+        line = (f"{mode:>4}: 上下文 {stats['context_tokens_mean']:.0f} tokens（{stats['context_chars_mean']:.0f} 字符）  "
+                f"参考相似度 {stats['reference_similarity_mean']:.3f}  检索 p50 {stats['search_p50_ms']:.1f}ms")
+        if ttfts:
+            line += f"  TTFT p50 {stats['ttft_p50_ms']:.0f}ms"
+        print(line)
+
+    print("注：token 数按 Embedding 模型的 tokenizer 估算，仅用于相对比较")
+    _save_results(args, results)
+
+
+def synthetic_vectors(n: int, dim: int, clusters: int = 64, seed: int = 0) -> np.ndarray:
+    """生成带聚类结构的单位向量（模拟真实 Embedding 分布）"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype('float32')
+    labels = rng.integers(0, clusters, n)
+    vectors = centers[labels] + 0.6 * rng.standard_normal((n, dim)).astype('float32')
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _noisy_queries(vectors: np.ndarray, n: int, noise: float = 0.3, seed: int = 1) -> np.ndarray:
+    """以库内向量加噪声作为查询，模拟“相似但不完全相同”的用户意图"""
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vectors), min(n, len(vectors)), replace=False)
+    queries = vectors[picks] + noise * rng.standard_normal((len(picks), vectors.shape[1])).astype('float32') / np.sqrt(vectors.shape[1])
+    return (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype('float32')
+
+
+def recall_at_k(approx: np.ndarray, exact: np.ndarray) -> float:
+    """recall@k：近似结果与精确 Top-K 的平均重合比例"""
+    k = exact.shape[1]
+    hits = [len(set(a[a >= 0]) & set(e[e >= 0])) for a, e in zip(approx, exact)]
+    return float(np.mean(hits) / k)
+
+
+def bench_coarse(args):
+    """两阶段检索：二值码 / PCA 降维码粗排 + 全精度精排，报告 recall@k 与延迟"""
+    import faiss
+    from vector_store import VectorStore
+
+    if args.source == "db":
+        if not os.path.exists(args.index):
+            print(f"✗ 索引文件不存在: {args.index}")
+            return
+        full = faiss.read_index(args.index)
+        vectors = full.reconstruct_n(0, full.ntotal)
+    else:
+        vectors = synthetic_vectors(args.n, args.dim)
+        full = faiss.IndexFlatL2(vectors.shape[1])
+        full.add(vectors)
+    queries = _noisy_queries(vectors, args.queries)
+    print(f"向量: {len(vectors)} × {vectors.shape[1]}（{args.source}），查询: {len(queries)} 条，k={args.top_k}")
+
+    def run(search_fn):
+        latencies, ids = [], []
+        for q in queries:
+            q = q[None, :]
+            start = time.perf_counter()
+            _, idx = search_fn(q)
+            latencies.append((time.perf_counter() - start) * 1000)
+            ids.append(idx[0])
+        return np.array(ids), latencies
+
+    exact_ids, flat_lat = run(lambda q: full.search(q, args.top_k))
+    results = {"source": args.source, "n": len(vectors), "dim": int(vectors.shape[1]), "top_k": args.top_k,
+               "configs": [{"mode": "flat", "recall": 1.0, "p50_ms": _percentile(flat_lat, 50),
+                            "p99_ms": _percentile(flat_lat, 99), "code_bytes": int(vectors.shape[1] * 4)}]}
+    print(f"{'flat':>12}: recall@{args.top_k} 1.000  p50 {_percentile(flat_lat, 50):.2f}ms  "
+          f"p99 {_percentile(flat_lat, 99):.2f}ms  每条 {vectors.shape[1] * 4}B")
+
+    for mode in ("binary", "pca"):
+        start = time.perf_counter()
+        coarse_index = VectorStore._build_coarse_index(vectors, mode, pca_dim=args.pca_dim)
+        build_s = time.perf_counter() - start
+        code_bytes = vectors.shape[1] // 8 if mode == "binary" else min(args.pca_dim, vectors.shape[1]) * 4
+        for factor in args.factors:
+            ids, lat = run(lambda q: VectorStore._coarse_to_fine(full, (mode, coarse_index), q, args.top_k, factor))
+            config = {"mode": mode, "shortlist_factor": factor, "recall": recall_at_k(ids, exact_ids),
+                      "p50_ms": _percentile(lat, 50), "p99_ms": _percentile(lat, 99),
+                      "build_s": build_s, "code_bytes": code_bytes}
+            results["configs"].append(config)
+            print(f"{mode + '×' + str(factor):>12}: recall@{args.top_k} {config['recall']:.3f}  "
+                  f"p50 {config['p50_ms']:.2f}ms  p99 {config['p99_ms']:.2f}ms  每条 {code_bytes}B  构建 {build_s:.1f}s")
+
+    _save_results(args, results)
+
+
+def _build_flat(vectors: np.ndarray, args, workdir: str):
+    import faiss
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    return index.search, {"index_bytes": int(faiss.serialize_index(index).nbytes)}
+
+
+def _build_flat_mmap(vectors: np.ndarray, args, workdir: str):
+    import faiss
+    from vector_store import VectorStore
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    path = os.path.join(workdir, "flat.index")
+    faiss.write_index(index, path)
+    del index
+    mapped = VectorStore._read_faiss_index(path, mode="mmap")
+    return mapped.search, {"index_bytes": os.path.getsize(path), "resident": "file-backed"}
+
+
+def _make_coarse_builder(mode: str):
+    def build(vectors: np.ndarray, args, workdir: str):
+        import faiss
+        from vector_store import VectorStore
+        full = faiss.IndexFlatL2(vectors.shape[1])
+        full.add(vectors)
+        coarse = VectorStore._build_coarse_index(vectors, mode, pca_dim=args.pca_dim)
+        serialize = faiss.serialize_index_binary if mode == "binary" else faiss.serialize_index
+        search = lambda q, k: VectorStore._coarse_to_fine(full, (mode, coarse), q, k, args.shortlist_factor)
+        return search, {"index_bytes": int(faiss.serialize_index(full).nbytes),
+                        "code_bytes": int(serialize(coarse).nbytes),
+                        "shortlist_factor": args.shortlist_factor}
+    return build
+
+
+def _build_sharded(vectors: np.ndarray, args, workdir: str):
+    import faiss
+    from sharded_search import ShardedIndex, write_shards
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    shard_dir = os.path.join(workdir, "shards")
+    write_shards(index, [{} for _ in range(index.ntotal)], shard_dir, args.shards)
+    sharded = ShardedIndex(shard_dir, load_mode="full")
+    return sharded.search, {"index_bytes": int(faiss.serialize_index(index).nbytes), "shards": args.shards}
+
+
+# 检索基准覆盖的索引模式：名称 → 构建函数 (vectors, args, workdir) -> (search(q, k), 附加信息)
+RETRIEVAL_MODES = {
+    "flat": _build_flat,
+    "flat_mmap": _build_flat_mmap,
+    "coarse_binary": _make_coarse_builder("binary"),
+    "coarse_pca": _make_coarse_builder("pca"),
+    "sharded": _build_sharded,
+}
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _environment() -> dict:
+    import faiss
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "faiss": getattr(faiss, "__version__", ""),
+        "numpy": np.__version__,
+    }
+
+
+def _load_raw_prompts(path: str) -> List[str]:
+    """读取原始语料（extracted_prompts.jsonl 格式）并去重"""
+    seen = set()
+    prompts = []
+    with jsonlines.open(path) as reader:
+        for item in reader:
+            text = (item.get("prompt") or "").strip()
+            if text and text not in seen:
+                seen.add(text)
+                prompts.append(text)
+    return prompts
+
+
+def _corpus_vectors(args) -> dict:
+    """
+    真实语料向量：随机留出 holdout 条原始提示词作为查询，其余作为文档
+
+    --vectors 指定预计算向量（npz，含 docs / queries）时完全离线运行；
+    否则用 --model 指定的（小型本地）Embedding 模型编码，并可用 --save-vectors 保存供后续复用。
+    """
+    if args.vectors:
+        data = np.load(args.vectors)
+        print(f"使用预计算向量: {args.vectors}")
+        return {"docs": data["docs"].astype('float32'), "queries": data["queries"].astype('float32')}
+
+    from vector_store import VectorStore
+
+    prompts = _load_raw_prompts(args.corpus)
+    if args.limit:
+        prompts = prompts[:args.limit]
+    rng = np.random.default_rng(args.seed)
+    order = rng.permutation(len(prompts))
+    holdout = min(args.queries, len(prompts) // 5)
+    query_texts = [prompts[i] for i in order[:holdout]]
+    doc_texts = [prompts[i] for i in order[holdout:]]
+    print(f"语料: {args.corpus}，文档 {len(doc_texts)} 条，留出查询 {len(query_texts)} 条")
+
+    store = VectorStore(model_name=args.model)
+    store.encode_query("预热")
+
+    start = time.perf_counter()
+    docs = store._encode_texts(doc_texts, show_progress_bar=True)
+    build_s = time.perf_counter() - start
+
+    encode_latencies = []
+    queries = np.zeros((len(query_texts), store.dimension), dtype='float32')
+    for i, text in enumerate(query_texts):
+        start = time.perf_counter()
+        queries[i] = store.encode_query(text)[0]
+        encode_latencies.append((time.perf_counter() - start) * 1000)
+
+    if args.save_vectors:
+        np.savez(args.save_vectors, docs=docs, queries=queries)
+        print(f"✓ 向量已保存: {args.save_vectors}")
+
+    return {
+        "docs": docs,
+        "queries": queries,
+        "encode": {
+            "model": store.model_name,
+            "build_docs_per_sec": len(doc_texts) / build_s if build_s else 0.0,
+            "build_seconds": build_s,
+            "query_p50_ms": _percentile(encode_latencies, 50),
+            "query_p99_ms": _percentile(encode_latencies, 99),
+        },
+    }
+
+
+def bench_retrieval(args):
+    """检索基准与召回回归：各索引模式的延迟、QPS、构建耗时、内存与 recall@k（以精确 Flat 检索为基准）"""
+    import faiss
+
+    if args.source == "corpus":
+        data = _corpus_vectors(args)
+    else:
+        docs = synthetic_vectors(args.n, args.dim, seed=args.seed)
+        data = {"docs": docs, "queries": _noisy_queries(docs, args.queries, seed=args.seed + 1)}
+    docs, queries = data["docs"], data["queries"]
+    ks = sorted(set(args.k))
+    max_k = max(ks)
+    print(f"文档向量: {docs.shape[0]} × {docs.shape[1]}，查询: {len(queries)} 条，k={ks}")
+
+    exact = faiss.IndexFlatL2(docs.shape[1])
+    exact.add(docs)
+    _, exact_ids = exact.search(queries, max_k)
+
+    results = {
+        "suite": "retrieval",
+        "environment": _environment(),
+        "params": {"source": args.source, "docs": int(docs.shape[0]), "dim": int(docs.shape[1]),
+                   "queries": int(len(queries)), "k": ks, "seed": args.seed},
+        "encode": data.get("encode"),
+        "modes": {},
+    }
+    if results["encode"]:
+        e = results["encode"]
+        print(f"编码: 构建 {e['build_docs_per_sec']:.1f} 条/秒，单条查询 p50 {e['query_p50_ms']:.1f}ms  p99 {e['query_p99_ms']:.1f}ms")
+
+    modes = args.modes or list(RETRIEVAL_MODES)
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in modes:
+            rss_before = _rss_mb()
+            start = time.perf_counter()
+            search, info = RETRIEVAL_MODES[name](docs, args, workdir)
+            build_s = time.perf_counter() - start
+            rss_delta = _rss_mb() - rss_before
+
+            # 预热
+            search(queries[:1], max_k)
+            latencies = []
+            ids = np.full((len(queries), max_k), -1, dtype='int64')
+            run_start = time.perf_counter()
+            for i in range(len(queries)):
+                start = time.perf_counter()
+                _, idx = search(queries[i:i + 1], max_k)
+                latencies.append((time.perf_counter() - start) * 1000)
+                ids[i] = idx[0]
+            elapsed = time.perf_counter() - run_start
+
+            stats = {
+                "build_seconds": build_s,
+                "build_vectors_per_sec": len(docs) / build_s if build_s else 0.0,
+                "search_p50_ms": _percentile(latencies, 50),
+                "search_p99_ms": _percentile(latencies, 99),
+                "qps": len(queries) / elapsed if elapsed else 0.0,
+                "rss_delta_mb": rss_delta,
+                **info,
+            }
+            for k in ks:
+                stats[f"recall@{k}"] = recall_at_k(ids[:, :k], exact_ids[:, :k])
+            results["modes"][name] = stats
+
+            recalls = "  ".join(f"R@{k} {stats[f'recall@{k}']:.3f}" for k in ks)
+            print(f"{name:>14}: p50 {stats['search_p50_ms']:.2f}ms  p99 {stats['search_p99_ms']:.2f}ms  "
+                  f"QPS {stats['qps']:.0f}  构建 {build_s:.2f}s  RSS +{rss_delta:.0f}MB  {recalls}")
+
+    _save_results(args, results)
+
+
+# compare 时各指标的方向：1 越大越好，-1 越小越好
+_METRIC_DIRECTIONS = {
+    "qps": 1, "build_vectors_per_sec": 1, "build_docs_per_sec": 1,
+    "search_p50_ms": -1, "search_p99_ms": -1, "query_p50_ms": -1, "query_p99_ms": -1,
+    "build_seconds": -1, "rss_delta_mb": -1,
+}
+
+
+def bench_compare(args):
+    """对比两次 retrieval 结果，超出容差的退化以非零退出码报告（可用于 CI）"""
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)
+
+    regressions = []
+
+    def compare_section(label: str, old: dict, new: dict):
+        for metric, new_value in new.items():
+            old_value = old.get(metric)
+            if not isinstance(new_value, (int, float)) or not isinstance(old_value, (int, float)):
+                continue
+            if metric.startswith("recall@"):
+                delta = new_value - old_value
+                flag = delta < -args.recall_tolerance
+                print(f"  {label:>14} {metric:<22} {old_value:10.3f} → {new_value:10.3f}  ({delta:+.3f}){'  ✗ 退化' if flag else ''}")
+            elif metric in _METRIC_DIRECTIONS:
+                change = (new_value - old_value) / old_value if old_value else 0.0
+                flag = change * _METRIC_DIRECTIONS[metric] < -args.tolerance
+                if metric.endswith("_ms") and abs(new_value - old_value) < args.min_delta_ms:
+                    # 亚毫秒级的抖动不算退化
+                    flag = False
+                print(f"  {label:>14} {metric:<22} {old_value:10.2f} → {new_value:10.2f}  ({change:+.1%}){'  ✗ 退化' if flag else ''}")
+            else:
+                continue
+            if flag:
+                regressions.append(f"{label}.{metric}")
+
+    print(f"基准: {args.baseline}（{baseline.get('environment', {}).get('git_commit', '')}）")
+    print(f"当前: {args.current}（{current.get('environment', {}).get('git_commit', '')}）")
+    if baseline.get("params") != current.get("params"):
+        print("⚠️  两次运行的参数不同，对比结果仅供参考")
+    if baseline.get("encode") and current.get("encode"):
+        compare_section("encode", baseline["encode"], current["encode"])
+    for name, stats in current.get("modes", {}).items():
+        if name in baseline.get("modes", {}):
+            compare_section(name, baseline["modes"][name], stats)
+        else:
+            print(f"  {name:>14} （基准中不存在，跳过）")
+
+    if regressions:
+        print(f"\n✗ 发现 {len(regressions)} 项退化: {', '.join(regressions)}")
+        sys.exit(1)
+    print("\n✓ 未发现超出容差的退化")
+
+
+def bench_shards(args):
+    """分片检索：随分片数增加的启动耗时、单查询延迟、批量吞吐，以及工作进程崩溃后的恢复耗时"""
+    import faiss
+    from concurrent.futures import ThreadPoolExecutor
+    from sharded_search import ShardedIndex, write_shards
+
+    vectors = synthetic_vectors(args.n, args.dim, seed=args.seed)
+    queries = _noisy_queries(vectors, args.queries, seed=args.seed + 1)
+    index = faiss.IndexFlatL2(args.dim)
+    index.add(vectors)
+    metadata = [{"id": i} for i in range(args.n)]
+    print(f"合成向量: {args.n} × {args.dim}，查询 {len(queries)} 条，top_k={args.top_k}，批大小 {args.batch}")
+
+    faiss.omp_set_num_threads(1)
+    _, exact_ids = index.search(queries, args.top_k)
+
+    def measure(search) -> dict:
+        search(queries[:1], args.top_k)
+        latencies = []
+        for i in range(len(queries)):
+            start = time.perf_counter()
+            search(queries[i:i + 1], args.top_k)
+            latencies.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        for i in range(0, len(queries), args.batch):
+            search(queries[i:i + args.batch], args.top_k)
+        batch_qps = len(queries) / (time.perf_counter() - start)
+        _, ids = search(queries, args.top_k)
+        return {
+            "p50_ms": _percentile(latencies, 50),
+            "p99_ms": _percentile(latencies, 99),
+            "single_qps": len(queries) / (sum(latencies) / 1000),
+            "batch_qps": batch_qps,
+            "recall": recall_at_k(ids, exact_ids),
+        }
+
+    results = {"suite": "shards", "environment": _environment(),
+               "params": {"n": args.n, "dim": args.dim, "queries": len(queries), "top_k": args.top_k,
+                          "batch": args.batch},
+               "baseline": measure(index.search), "counts": {}}
+    b = results["baseline"]
+    print(f"{'进程内 Flat':>10}: p50 {b['p50_ms']:.2f}ms  p99 {b['p99_ms']:.2f}ms  "
+          f"单查询 QPS {b['single_qps']:.0f}  批量 QPS {b['batch_qps']:.0f}")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for count in args.counts:
+            shard_dir = os.path.join(workdir, f"shards_{count}")
+            write_shards(index, metadata, shard_dir, count)
+            start = time.perf_counter()
+            sharded = ShardedIndex(shard_dir, load_mode="full", omp_threads=1)
+            startup_s = time.perf_counter() - start
+            stats = measure(sharded.search)
+            stats["startup_seconds"] = startup_s
+
+            # 杀掉一个工作进程，测量下一次检索（含检测与重启）的耗时
+            sharded._workers[0].process.kill()
+            sharded._workers[0].process.join()
+            start = time.perf_counter()
+            _, ids = sharded.search(queries[:1], args.top_k)
+            stats["recovery_ms"] = (time.perf_counter() - start) * 1000
+            stats["recovered_correctly"] = bool((ids[0] == exact_ids[0]).all())
+
+            # 多线程并发提交（检索在分片锁上串行，主要体现分片内并行扫描的收益）
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                start = time.perf_counter()
+                list(pool.map(lambda i: sharded.search(queries[i:i + 1], args.top_k), range(len(queries))))
+                stats["concurrent_qps"] = len(queries) / (time.perf_counter() - start)
+            sharded.close()
+
+            results["counts"][str(count)] = stats
+            print(f"{count:>6} 分片: p50 {stats['p50_ms']:.2f}ms  p99 {stats['p99_ms']:.2f}ms  "
+                  f"单查询 QPS {stats['single_qps']:.0f}  批量 QPS {stats['batch_qps']:.0f}  "
+                  f"并发 QPS {stats['concurrent_qps']:.0f}  启动 {startup_s:.1f}s  "
+                  f"崩溃恢复 {stats['recovery_ms']:.0f}ms  recall {stats['recall']:.3f}")
+
+    _save_results(args, results)
+
+
+def _load_structured_items(limit: int = None) -> List[dict]:
+    """读取 data/processed 下的结构化数据"""
+    items = []
+    if not os.path.exists(PROCESSED_DATA_DIR):
+        return items
+    for name in sorted(os.listdir(PROCESSED_DATA_DIR)):
+        if not name.endswith('.jsonl'):
+            continue
+        with jsonlines.open(os.path.join(PROCESSED_DATA_DIR, name)) as reader:
+            for item in reader:
+                items.append(item)
+                if limit and len(items) >= limit:
+                    return items
+    return items
+
+
+def bench_fields(args):
+    """分字段加权融合检索：额外构建成本、查询延迟开销，以及检索结果主体命中率"""
+    import faiss
+    from vector_store import VectorStore, _IndexSnapshot, parse_field_weights
+
+    items = _load_structured_items(limit=args.limit)
+    if not items:
+        print(f"✗ 未找到结构化数据，请先运行 python process_data.py（{PROCESSED_DATA_DIR}）")
+        return
+    store = VectorStore()
+    weights = parse_field_weights(args.weights)
+    print(f"记录: {len(items)} 条，融合权重: {weights}")
+
+    start = time.perf_counter()
+    embeddings, _ = store._encode_items(items)
+    base_s = time.perf_counter() - start
+    start = time.perf_counter()
+    embeddings, field_vectors = store._encode_items(items, with_fields=True)
+    fields_s = time.perf_counter() - start
+
+    index = faiss.IndexFlatL2(store.dimension)
+    index.add(embeddings)
+    field_indexes = store._new_field_indexes(field_vectors)
+    snapshot = _IndexSnapshot(index, items, "bench", None, field_indexes)
+    field_bytes = sum(int(faiss.serialize_index(i).nbytes) for i in field_indexes.values())
+
+    # 以带主体的记录的原始提示词作为查询，检查结果的主体是否与查询一致
+    rng = np.random.default_rng(args.seed)
+    pool = [item for item in items if item.get("subject") and item.get("raw")]
+    picks = rng.choice(len(pool), min(args.queries, len(pool)), replace=False)
+    queries = [pool[i] for i in picks]
+
+    results = {"records": len(items), "queries": len(queries), "top_k": args.top_k, "weights": weights,
+               "build": {"combined_seconds": base_s, "with_fields_seconds": fields_s,
+                         "overhead": fields_s / base_s - 1 if base_s else 0.0,
+                         "field_index_mb": field_bytes / (1024 * 1024)},
+               "modes": {}}
+    print(f"构建: 仅组合文本 {base_s:.1f}s，含字段向量 {fields_s:.1f}s（+{results['build']['overhead']:.0%}），"
+          f"字段索引 {results['build']['field_index_mb']:.1f}MB")
+
+    query_vectors = [store.encode_query(item["raw"]) for item in queries]
+    for mode, search in (("combined", lambda qv: store._search_vector(snapshot, qv, args.top_k)),
+                         ("fields", lambda qv: store._search_fields(snapshot, qv, args.top_k, weights))):
+        search(query_vectors[0])
+        latencies, subject_hits = [], []
+        for item, qv in zip(queries, query_vectors):
+            start = time.perf_counter()
+            retrieved = search(qv)
+            latencies.append((time.perf_counter() - start) * 1000)
+            subject_hits.append(np.mean([r.get("subject") == item["subject"] for r, _ in retrieved]))
+        stats = {
+            "search_p50_ms": _percentile(latencies, 50),
+            "search_p99_ms": _percentile(latencies, 99),
+            "subject_hit_rate": float(np.mean(subject_hits)),
+        }
+        results["modes"][mode] = stats
+        print(f"{mode:>8}: 检索 p50 {stats['search_p50_ms']:.2f}ms  p99 {stats['search_p99_ms']:.2f}ms  "
+              f"主体命中率 {stats['subject_hit_rate']:.3f}")
+
+    _save_results(args, results)
+
+
+class _MockRaw:
+    """
+    模拟 urllib3 响应体：按网络数据块返回；指定 amt 时把数据块再切成 amt 字节
+    （与 chunked 传输下 urllib3 HTTPResponse.stream 的行为一致）
+    """
+
+    def __init__(self, chunks: List[bytes]):
+        self._chunks = chunks
+
+    def stream(self, amt=None, decode_content=True):
+        for chunk in self._chunks:
+            if amt is None:
+                yield chunk
+            else:
+                for i in range(0, len(chunk), amt):
+                    yield chunk[i:i + amt]
+
+
+def _mock_stream_chunks(tokens: int, lines_per_chunk: int, seed: int) -> List[bytes]:
+    """构造 Ollama 风格的 NDJSON 流（中英文混合 token + done 统计对象），按每块若干行切分"""
+    rng = np.random.default_rng(seed)
+    vocab = ["猫", "赛博朋克", "，", " neon", " rain", "夜晚", " cinematic", "光影", " 8k", "。"]
+    lines = [
+        json.dumps({"model": "qwen2.5:32b", "created_at": "2025-01-01T00:00:00.000000Z",
+                    "response": vocab[i], "done": False}, ensure_ascii=False).encode('utf-8') + b"\n"
+        for i in rng.integers(0, len(vocab), tokens)
+    ]
+    lines.append(json.dumps({"model": "qwen2.5:32b", "done": True, "eval_count": tokens,
+                             "eval_duration": tokens * 20_000_000, "prompt_eval_duration": 150_000_000}).encode() + b"\n")
+    return [b"".join(lines[i:i + lines_per_chunk]) for i in range(0, len(lines), lines_per_chunk)]
+
+
+def _decode_legacy(response) -> tuple:
+    """旧实现：iter_lines(chunk_size=1, decode_unicode=True)，逐字节读取，丢弃 done 统计对象"""
+    tokens = []
+    for line in response.iter_lines(chunk_size=1, decode_unicode=True):
+        if not line:
+            continue
+        try:
+            obj = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if obj.get("done"):
+            break
+        token = obj.get("response", "")
+        if token:
+            tokens.append(token)
+    return tokens, None
+
+
+def _decode_buffered(response) -> tuple:
+    """新实现：iter_content(chunk_size=None) + 增量 NDJSON 解码，保留 done 统计对象"""
+    from ollama_client import iter_ndjson
+    tokens, stats = [], None
+    for obj in iter_ndjson(response.iter_content(chunk_size=None)):
+        if obj.get("done"):
+            stats = obj
+            break
+        token = obj.get("response", "")
+        if token:
+            tokens.append(token)
+    return tokens, stats
+
+
+def bench_stream_decode(args):
+    """流式 NDJSON 解码：每 1k token 的 CPU 耗时，旧实现（逐字节）vs 缓冲增量解码"""
+    import requests
+
+    chunks = _mock_stream_chunks(args.tokens, args.lines_per_chunk, args.seed)
+    total_bytes = sum(len(c) for c in chunks)
+    print(f"模拟流: {args.tokens} token，{len(chunks)} 个数据块，{total_bytes / 1024:.0f}KB")
+
+    def make_response():
+        response = requests.Response()
+        response.status_code = 200
+        response.headers["Content-Type"] = "application/x-ndjson"
+        response.raw = _MockRaw(chunks)
+        return response
+
+    results = {"tokens": args.tokens, "chunks": len(chunks), "bytes": total_bytes, "decoders": {}}
+    outputs = {}
+    for name, decode in (("legacy", _decode_legacy), ("buffered", _decode_buffered)):
+        decode(make_response())
+        cpu_ms = []
+        for _ in range(args.repeat):
+            response = make_response()
+            start = time.process_time()
+            outputs[name] = decode(response)
+            cpu_ms.append((time.process_time() - start) * 1000)
+        per_1k = float(np.median(cpu_ms)) / args.tokens * 1000
+        results["decoders"][name] = {"cpu_ms_per_1k_tokens": per_1k, "cpu_ms_median": float(np.median(cpu_ms)),
+                                     "final_stats": outputs[name][1] is not None}
+        print(f"{name:>8}: 每 1k token CPU {per_1k:.2f}ms（中位数，{args.repeat} 次），"
+              f"保留最终统计: {'是' if outputs[name][1] is not None else '否'}")
+
+    if outputs["legacy"][0] != outputs["buffered"][0]:
+        print("✗ 两种实现解码出的 token 不一致")
+        sys.exit(1)
+    legacy = results["decoders"]["legacy"]["cpu_ms_per_1k_tokens"]
+    buffered = results["decoders"]["buffered"]["cpu_ms_per_1k_tokens"]
+    results["speedup"] = legacy / buffered if buffered else 0.0
+    print(f"✓ token 一致，缓冲解码快 {results['speedup']:.1f} 倍")
+    _save_results(args, results)
+
+
+def _run_variant_stream(generator, intent: str, n_variants: int) -> dict:
+    """一次流式生成：返回墙钟时间、首 token 延迟、检索耗时与 Ollama 的预填充 / 解码 token 数"""
+    timings, stats = {}, {}
+    start = time.perf_counter()
+    tokens, _ = generator.stream_generate(intent, timings=timings, use_cache=False, on_done=stats.update,
+                                          n_variants=n_variants)
+    ttft = None
+    text = []
+    for token in tokens:
+        if ttft is None:
+            ttft = (time.perf_counter() - start) * 1000
+        text.append(token)
+    return {
+        "wall_ms": (time.perf_counter() - start) * 1000,
+        "ttft_ms": ttft or 0.0,
+        "retrieval_ms": timings.get("encode_ms", 0) + timings.get("search_ms", 0) + timings.get("rerank_ms", 0),
+        "prompt_tokens": stats.get("prompt_eval_count") or 0,
+        "eval_tokens": stats.get("eval_count") or 0,
+        "text": "".join(text),
+    }
+
+
+def bench_variants(args):
+    """多个备选提示词：N 次独立生成（每次重新检索、预填充）vs 一次调用生成 N 个"""
+    from load_test import _load_texts
+    from mock_ollama_server import MockServerThread, mock_from_args
+    from ollama_client import OllamaClient
+    from rag_generator import RAGGenerator, parse_variants
+    from vector_store import VectorStore
+
+    store = VectorStore.acquire_shared()
+    if not store.exists():
+        raise SystemExit("✗ 向量库不存在，请先运行 python build_index.py")
+    server = MockServerThread(mock_from_args(args)).start() if args.mock else None
+    host = server.url if server else args.host
+    generator = RAGGenerator(store, OllamaClient(host=host, model=args.model))
+    generator.client.load_model()
+    intents = _load_texts(args.queries, args.corpus)
+    print(f"{len(intents)} 条意图，每条 {args.n} 个备选{'（模拟服务）' if server else ''}")
+
+    modes = {"separate": [], "single_call": []}
+    try:
+        for intent in intents:
+            runs = [_run_variant_stream(generator, intent, 1) for _ in range(args.n)]
+            modes["separate"].append({
+                "wall_ms": sum(r["wall_ms"] for r in runs),
+                "ttft_ms": runs[0]["ttft_ms"],
+                "retrieval_ms": sum(r["retrieval_ms"] for r in runs),
+                "prompt_tokens": sum(r["prompt_tokens"] for r in runs),
+                "eval_tokens": sum(r["eval_tokens"] for r in runs),
+                "variants": sum(1 for r in runs if r["text"].strip()),
+            })
+            run = _run_variant_stream(generator, intent, args.n)
+            run["variants"] = len(parse_variants(run.pop("text"), args.n))
+            modes["single_call"].append(run)
+    finally:
+        if server is not None:
+            server.stop()
+        store.release()
+
+    results = {"queries": len(intents), "n_variants": args.n, "mock": bool(server), "modes": {}}
+    for name, samples in modes.items():
+        summary = {field: float(np.mean([s[field] for s in samples]))
+                   for field in ("wall_ms", "ttft_ms", "retrieval_ms", "prompt_tokens", "eval_tokens", "variants")}
+        results["modes"][name] = summary
+        print(f"{name:>12}: 每条意图 {summary['wall_ms']:.0f}ms，首 token {summary['ttft_ms']:.0f}ms，"
+              f"检索 {summary['retrieval_ms']:.1f}ms，预填充 {summary['prompt_tokens']:.0f} tokens，"
+              f"解码 {summary['eval_tokens']:.0f} tokens，得到 {summary['variants']:.1f} 个备选")
+    separate, single = results["modes"]["separate"], results["modes"]["single_call"]
+    results["speedup"] = separate["wall_ms"] / single["wall_ms"] if single["wall_ms"] else 0.0
+    print(f"✓ 一次调用生成 {args.n} 个备选快 {results['speedup']:.2f} 倍，"
+          f"预填充 token 减少 {1 - single['prompt_tokens'] / max(separate['prompt_tokens'], 1):.0%}")
+    _save_results(args, results)
+
+
+def _save_results(args, results: dict):
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"✓ 结果已保存: {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PromptRAG 性能基准")
+    parser.add_argument("--output", help="将结果以 JSON 格式写入文件")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_encode = sub.add_parser("encode", help="Embedding 批量编码：固定批大小 vs 按长度分桶")
+    p_encode.add_argument("--limit", type=int, default=2000, help="最多使用的语料条数")
+    p_encode.add_argument("--batch-size", type=int, default=64, help="固定批大小（旧实现）")
+    p_encode.set_defaults(func=bench_encode)
+
+    p_load = sub.add_parser("load", help="索引加载：full vs mmap，冷/热启动延迟")
+    p_load.add_argument("--index", default=INDEX_PATH, help="FAISS 索引文件路径")
+    p_load.add_argument("--queries", type=int, default=200, help="随机查询条数")
+    p_load.add_argument("--top-k", type=int, default=5)
+    p_load.set_defaults(func=bench_load)
+
+    p_pack = sub.add_parser("pack", help="加载耗时：知识包 vs 索引文件 + JSONL 元数据")
+    p_pack.add_argument("--index", default=INDEX_PATH)
+    p_pack.add_argument("--metadata", default=METADATA_PATH)
+    p_pack.add_argument("--pack", default=PACK_PATH)
+    p_pack.add_argument("--repeat", type=int, default=5)
+    p_pack.set_defaults(func=bench_pack)
+
+    p_mmr = sub.add_parser("mmr", help="检索多样化：普通检索 vs MMR（上下文 token 数、冗余度、TTFT）")
+    p_mmr.add_argument("--queries", type=int, default=50, help="从语料中均匀抽取的查询条数")
+    p_mmr.add_argument("--limit", type=int, default=5000, help="最多读取的语料条数")
+    p_mmr.add_argument("--top-k", type=int, default=5)
+    p_mmr.add_argument("--fetch-k", type=int, default=20)
+    p_mmr.add_argument("--mmr-lambda", type=float, default=0.5)
+    p_mmr.add_argument("--ttft", action="store_true", help="同时调用 Ollama 测量首 token 延迟")
+    p_mmr.set_defaults(func=bench_mmr)
+
+    p_coarse = sub.add_parser("coarse", help="两阶段检索：二值码 / PCA 粗排 + 全精度精排的 recall@k 与延迟")
+    p_coarse.add_argument("--source", choices=["db", "synthetic"], default="db", help="向量来源")
+    p_coarse.add_argument("--index", default=INDEX_PATH, help="source=db 时读取的 FAISS 索引")
+    p_coarse.add_argument("--n", type=int, default=100000, help="source=synthetic 时的向量条数")
+    p_coarse.add_argument("--dim", type=int, default=1024, help="source=synthetic 时的向量维度")
+    p_coarse.add_argument("--queries", type=int, default=200)
+    p_coarse.add_argument("--top-k", type=int, default=5)
+    p_coarse.add_argument("--pca-dim", type=int, default=256)
+    p_coarse.add_argument("--factors", type=int, nargs="+", default=[5, 10, 20, 50], help="粗排候选数系数")
+    p_coarse.set_defaults(func=bench_coarse)
+
+    p_ret = sub.add_parser("retrieval", help="检索基准与召回回归：各索引模式的延迟、QPS、内存与 recall@k")
+    p_ret.add_argument("--source", choices=["corpus", "synthetic"], default="corpus", help="向量来源")
+    p_ret.add_argument("--corpus", default=os.path.join(RAW_DATA_DIR, "extracted_prompts.jsonl"), help="真实语料 JSONL")
+    p_ret.add_argument("--model", help="编码语料使用的 Embedding 模型（默认使用配置值，离线可指定小型本地模型）")
+    p_ret.add_argument("--vectors", help="预计算向量 npz（含 docs / queries），指定后不加载模型")
+    p_ret.add_argument("--save-vectors", help="将编码得到的向量保存为 npz，供后续离线复用")
+    p_ret.add_argument("--limit", type=int, help="最多使用的语料条数")
+    p_ret.add_argument("--n", type=int, default=100000, help="source=synthetic 时的向量条数")
+    p_ret.add_argument("--dim", type=int, default=1024, help="source=synthetic 时的向量维度")
+    p_ret.add_argument("--queries", type=int, default=200, help="查询条数（corpus 模式下为留出的提示词条数）")
+    p_ret.add_argument("--k", type=int, nargs="+", default=[1, 5, 10], help="recall@k 的 k 值")
+    p_ret.add_argument("--modes", nargs="+", choices=list(RETRIEVAL_MODES), help="只测试指定的索引模式")
+    p_ret.add_argument("--pca-dim", type=int, default=256)
+    p_ret.add_argument("--shortlist-factor", type=int, default=20)
+    p_ret.add_argument("--shards", type=int, default=4, help="sharded 模式的分片数")
+    p_ret.add_argument("--seed", type=int, default=0)
+    p_ret.set_defaults(func=bench_retrieval)
+
+    p_cmp = sub.add_parser("compare", help="对比两次 retrieval 结果，报告退化")
+    p_cmp.add_argument("baseline", help="基准结果 JSON")
+    p_cmp.add_argument("current", help="当前结果 JSON")
+    p_cmp.add_argument("--tolerance", type=float, default=0.1, help="延迟/吞吐/内存允许的相对退化（默认 10%%）")
+    p_cmp.add_argument("--min-delta-ms", type=float, default=0.1, help="延迟绝对变化小于该值时不算退化")
+    p_cmp.add_argument("--recall-tolerance", type=float, default=0.01, help="recall 允许的绝对下降")
+    p_cmp.set_defaults(func=bench_compare)
+
+    p_shards = sub.add_parser("shards", help="分片检索：延迟与吞吐随分片数的变化、崩溃恢复耗时")
+    p_shards.add_argument("--counts", type=int, nargs="+", default=[1, 2, 4, 8], help="测试的分片数")
+    p_shards.add_argument("--n", type=int, default=200000, help="合成向量条数")
+    p_shards.add_argument("--dim", type=int, default=1024)
+    p_shards.add_argument("--queries", type=int, default=200)
+    p_shards.add_argument("--top-k", type=int, default=5)
+    p_shards.add_argument("--batch", type=int, default=32, help="批量检索时每批的查询数")
+    p_shards.add_argument("--seed", type=int, default=0)
+    p_shards.set_defaults(func=bench_shards)
+
+    p_fields = sub.add_parser("fields", help="分字段加权融合检索：额外构建成本与查询延迟开销")
+    p_fields.add_argument("--limit", type=int, default=5000, help="最多使用的结构化记录条数")
+    p_fields.add_argument("--queries", type=int, default=100)
+    p_fields.add_argument("--top-k", type=int, default=5)
+    p_fields.add_argument("--weights", default=FIELD_WEIGHTS, help="融合权重，格式 字段:权重,...")
+    p_fields.add_argument("--seed", type=int, default=0)
+    p_fields.set_defaults(func=bench_fields)
+
+    p_stream = sub.add_parser("stream-decode", help="流式 NDJSON 解码：逐字节 iter_lines vs 缓冲增量解码的 CPU 开销")
+    p_stream.add_argument("--tokens", type=int, default=20000, help="模拟流的 token 数")
+    p_stream.add_argument("--lines-per-chunk", type=int, default=1, help="每个网络数据块包含的行数（Ollama 逐 token 刷新时为 1）")
+    p_stream.add_argument("--repeat", type=int, default=5)
+    p_stream.add_argument("--seed", type=int, default=0)
+    p_stream.set_defaults(func=bench_stream_decode)
+
+    from mock_ollama_server import add_mock_arguments
+    p_var = sub.add_parser("variants", help="多个备选提示词：N 次独立生成 vs 一次调用生成 N 个（耗时、预填充 token）")
+    p_var.add_argument("--n", type=int, default=4, help="每条意图的备选数量")
+    p_var.add_argument("--queries", type=int, default=10, help="意图条数")
+    p_var.add_argument("--corpus", default=os.path.join(RAW_DATA_DIR, "extracted_prompts.jsonl"),
+                       help="原始语料 JSONL（不存在时使用合成意图）")
+    p_var.add_argument("--host", default=None, help="Ollama 服务地址（默认使用配置 OLLAMA_HOST）")
+    p_var.add_argument("--model", default=None, help="模型名称（默认使用配置 OLLAMA_MODEL）")
+    p_var.add_argument("--mock", action="store_true", help="在进程内启动模拟 Ollama 服务")
+    add_mock_arguments(p_var)
+    p_var.set_defaults(func=bench_variants)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,7 @@ load_dotenv()
 
 # Ollama 服务端配置（PC 端）
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+OLLAMA_HOSTS = [h.strip() for h in os.getenv("OLLAMA_HOSTS", "").split(",") if h.strip()]  # 备用 Ollama 主机（逗号分隔），熔断或对冲时使用
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "qwen2.5:32b")  # 根据实际模型名称调整
 
 # Embedding 模型配置（运行在 Mac 端）
@@ -16,7 +17,11 @@ EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "BAAI/bge-m3")  # 多语言支持
 MODEL_CACHE_DIR = os.path.join(os.getcwd(), "models")  # 模型下载缓存目录
 
 # Ollama 保活配置（降低 TTFT）
-OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "5m")  # 示例：30m、2h；设置为 "0" 关闭保活
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "5m")  # 示例：30m、2h；设置为 "0" 关闭保活，"-1" 永久常驻
+OLLAMA_PRELOAD = os.getenv("OLLAMA_PRELOAD", "false").lower() in ("1", "true", "yes")  # 启动时预加载模型并保持常驻（后台轮询 /api/ps）
+OLLAMA_PIN_MODELS = [m.strip() for m in os.getenv("OLLAMA_PIN_MODELS", "").split(",") if m.strip()]  # 需要常驻的模型（逗号分隔），默认为 OLLAMA_MODEL
+OLLAMA_RESIDENCY_POLL = float(os.getenv("OLLAMA_RESIDENCY_POLL", "30"))  # 轮询 /api/ps 的间隔（秒），发现常驻模型被卸载时重新加载；0 只在启动时加载一次
+OLLAMA_COLD_LOAD_MS = float(os.getenv("OLLAMA_COLD_LOAD_MS", "500"))  # 响应的 load_duration 超过该值（毫秒）视为冷启动
 
 # 数据路径配置
 DATA_DIR = "data"
@@ -27,11 +32,79 @@ PROCESSED_DATA_DIR = os.path.join(DATA_DIR, "processed")  # 存放处理后的 J
 DB_DIR = "db"  # 向量索引数据库目录
 INDEX_PATH = os.path.join(DB_DIR, "knowledge.index")
 METADATA_PATH = os.path.join(DB_DIR, "metadata.jsonl")
+MANIFEST_PATH = os.path.join(DB_DIR, "manifest.json")  # 索引版本清单，构建完成后最后写入
+BINARY_INDEX_PATH = os.path.join(DB_DIR, "knowledge.binary.index")  # 粗排索引：符号二值化码（Hamming 距离）
+PCA_INDEX_PATH = os.path.join(DB_DIR, "knowledge.pca.index")  # 粗排索引：PCA 降维码
+PACK_PATH = os.path.join(DB_DIR, "knowledge.pack")  # 单文件知识包（索引 + 元数据 + 过滤侧索引 + 模型指纹）
+INDEX_FORMAT = os.getenv("INDEX_FORMAT", "auto")  # 加载来源：auto 优先知识包；pack 仅知识包；files 仅索引/元数据文件（构建时不生成知识包）
 VECTOR_DIM = 1024  # bge-m3 的维度，如果使用其他模型需要调整
+INDEX_LOAD_MODE = os.getenv("INDEX_LOAD_MODE", "full")  # 索引加载模式：full 整体读入内存；mmap 内存映射按需载入（低内存机器）
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))  # 分片数：>0 时构建索引同时按 ID 区间切分，检索由多个工作进程并行完成；0 关闭
+SHARD_DIR = os.path.join(DB_DIR, "shards")  # 分片索引与元数据目录
+SHARD_TIMEOUT = float(os.getenv("SHARD_TIMEOUT", "10"))  # 分片工作进程单次应答超时（秒），超时视为崩溃并重启
+
+# Embedding 批量编码配置（按 token 长度分桶，批大小由 token 预算决定）
+EMBED_TOKEN_BUDGET = int(os.getenv("EMBED_TOKEN_BUDGET", "16384"))  # 每批 padding 后的 token 总数上限
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "256"))  # 单批最多条数（短文本时避免批过大）
 
 # RAG 检索配置
 TOP_K = 5  # 检索 Top-K 个相似结果
+RETRIEVAL_MMR = os.getenv("RETRIEVAL_MMR", "false").lower() in ("1", "true", "yes")  # 默认是否启用 MMR 多样化检索
+MMR_FETCH_K = int(os.getenv("MMR_FETCH_K", "20"))  # MMR 先召回的候选数
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.5"))  # MMR 相关性权重（1 只看相关性，0 只看多样性）
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() in ("1", "true", "yes")  # 默认是否启用 Cross-Encoder 重排序
+RERANK_MODEL = os.getenv("RERANK_MODEL", "BAAI/bge-reranker-base")  # 重排序模型（CPU 运行）
+RERANK_BACKEND = os.getenv("RERANK_BACKEND", "torch")  # 重排序推理后端：torch / onnx
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))  # 参与重排序的候选数
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150"))  # 重排序延迟预算（毫秒），预计超出时跳过
+COARSE_MODE = os.getenv("COARSE_MODE", "none")  # 两阶段检索的粗排码：none 关闭；binary 二值码；pca 降维码（构建索引时只生成该模式）
+COARSE_PCA_DIM = int(os.getenv("COARSE_PCA_DIM", "256"))  # PCA 降维后的维度
+COARSE_SHORTLIST_FACTOR = int(os.getenv("COARSE_SHORTLIST_FACTOR", "20"))  # 粗排候选数 = top_k × 该系数，再用全精度向量精排
+FIELD_INDEXES = os.getenv("FIELD_INDEXES", "false").lower() in ("1", "true", "yes")  # 是否构建并加载分字段向量索引（subject / style / elements / mood）
+FIELD_INDEX_DIR = os.path.join(DB_DIR, "fields")  # 分字段向量索引目录
+RETRIEVAL_FIELD_FUSION = os.getenv("RETRIEVAL_FIELD_FUSION", "false").lower() in ("1", "true", "yes")  # 默认是否启用分字段加权融合检索
+FIELD_WEIGHTS = os.getenv("FIELD_WEIGHTS", "subject:0.4,style:0.2,elements:0.2,mood:0.2")  # 融合权重，格式 字段:权重,...
+FIELD_FETCH_FACTOR = int(os.getenv("FIELD_FETCH_FACTOR", "10"))  # 每个字段召回 top_k × 该系数个候选，再对候选并集精确计算融合分数
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "256"))  # 检索结果 LRU 缓存条数，0 关闭
+FAISS_OMP_THREADS = int(os.getenv("FAISS_OMP_THREADS", "1"))  # FAISS 检索的 OpenMP 线程数（多会话并发时建议 1），0 使用 FAISS 默认值
+INDEX_RELOAD_INTERVAL = float(os.getenv("INDEX_RELOAD_INTERVAL", "5"))  # 索引热加载轮询间隔（秒），0 关闭
+
+# 语义缓存配置（相似意图 + 相同参考素材时复用已生成的 Prompt）
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")  # 是否启用语义缓存
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))  # 查询向量余弦相似度不低于该值才命中
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))  # 缓存有效期（秒），0 不过期
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1024"))  # 最多缓存条数，超出时淘汰最近最少使用的条目
 
 # 请求配置
 REQUEST_TIMEOUT = 300  # Ollama 请求超时时间（秒）
 MAX_RETRIES = 3  # 最大重试次数
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "64"))  # 异步客户端连接池的总连接数上限，0 不限制
+OLLAMA_MAX_CONNECTIONS_PER_HOST = int(os.getenv("OLLAMA_MAX_CONNECTIONS_PER_HOST", "0"))  # 异步客户端单个主机的连接数上限，0 不限制
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "10"))  # 建立连接的超时时间（秒）
+ETL_CONCURRENCY = int(os.getenv("ETL_CONCURRENCY", "1"))  # ETL 同时在途的解析请求数，>1 时使用异步客户端
+OLLAMA_SINGLE_FLIGHT = os.getenv("OLLAMA_SINGLE_FLIGHT", "false").lower() in ("1", "true", "yes")  # 合并同时在途的相同 LLM 请求（模型、系统提示词、提示词、参数均相同）；被合并的调用方共享同一次采样结果
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))  # 单个主机连续失败多少次后熔断，0 关闭熔断
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))  # 熔断后多少秒进入半开状态、放行一个探测请求
+OLLAMA_HEDGE = os.getenv("OLLAMA_HEDGE", "false").lower() in ("1", "true", "yes")  # 首字节超过截止时间仍未到达时，向另一台可用的备用主机再发一份请求，取先返回者（只有一台可用主机时不对冲）
+OLLAMA_HEDGE_QUANTILE = float(os.getenv("OLLAMA_HEDGE_QUANTILE", "0.95"))  # 对冲截止时间取最近首字节延迟的分位数
+OLLAMA_HEDGE_MIN_DELAY = float(os.getenv("OLLAMA_HEDGE_MIN_DELAY", "0.5"))  # 对冲截止时间下限（秒）
+OLLAMA_HEDGE_INITIAL_DELAY = float(os.getenv("OLLAMA_HEDGE_INITIAL_DELAY", "30"))  # 延迟样本不足时使用的对冲截止时间（秒）
+TELEMETRY_WINDOW = int(os.getenv("TELEMETRY_WINDOW", "500"))  # LLM 遥测每个模型 / 主机保留的最近请求数（用于滚动分位数）
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))  # 批量生成时同时在途的 LLM 请求数
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "64"))  # 批量生成每次一起编码、检索的意图条数
+RAG_SERVER_HOST = os.getenv("RAG_SERVER_HOST", "127.0.0.1")  # RAG HTTP 服务监听地址
+RAG_SERVER_PORT = int(os.getenv("RAG_SERVER_PORT", "8765"))  # RAG HTTP 服务端口
+RAG_SERVER_ENCODE_WORKERS = int(os.getenv("RAG_SERVER_ENCODE_WORKERS", "2"))  # RAG 服务中执行查询编码与检索的线程数
+RAG_SERVER_LLM_CONCURRENCY = int(os.getenv("RAG_SERVER_LLM_CONCURRENCY", "8"))  # RAG 服务同时在途的 LLM 请求数，超出的请求排队（启用 LLM_SCHEDULER 时由调度器槽位决定）
+RAG_SERVER_URL = os.getenv("RAG_SERVER_URL", "")  # 设置后 Streamlit 作为瘦客户端调用该 RAG 服务，不在本进程加载索引和模型
+LLM_SCHEDULER = os.getenv("LLM_SCHEDULER", "false").lower() in ("1", "true", "yes")  # 在 Ollama 客户端前按优先级（交互 / 批量）调度请求，并限制每个主机的并发
+LLM_SCHEDULER_SLOTS = int(os.getenv("LLM_SCHEDULER_SLOTS", "4"))  # 每个 Ollama 主机同时在途的请求数，应与服务端 OLLAMA_NUM_PARALLEL 一致
+LLM_SCHEDULER_RESERVED = int(os.getenv("LLM_SCHEDULER_RESERVED", "1"))  # 为交互请求保留的槽位数（批量请求最多占用 SLOTS - RESERVED 个）
+LLM_SCHEDULER_WEIGHTS = os.getenv("LLM_SCHEDULER_WEIGHTS", "interactive:4,batch:1")  # 槽位争用时各类别的分配权重，格式 类别:权重,...
+LLM_SCHEDULER_MAX_QUEUE = os.getenv("LLM_SCHEDULER_MAX_QUEUE", "interactive:32,batch:256")  # 各类别排队上限：交互请求超出时立即拒绝，批量请求超出时延后
+TRACING = os.getenv("TRACING", "false").lower() in ("1", "true", "yes")  # 记录检索 / 生成各阶段的嵌套耗时（trace），用于定位慢请求
+TRACE_EXPORTERS = os.getenv("TRACE_EXPORTERS", "jsonl")  # 追踪导出器，逗号分隔：jsonl（写入 TRACE_PATH）、console（打印到标准错误）
+TRACE_PATH = os.getenv("TRACE_PATH", os.path.join("logs", "traces.jsonl"))  # jsonl 导出器的输出文件
+TRACE_MIN_MS = float(os.getenv("TRACE_MIN_MS", "0"))  # 只导出总耗时不低于该值（毫秒）的 trace，0 表示全部导出
+STREAM_RENDER_INTERVAL_MS = float(os.getenv("STREAM_RENDER_INTERVAL_MS", "50"))  # 流式输出时界面两次刷新的最短间隔（毫秒），期间到达的 token 合并为一帧
+STREAM_RENDER_MAX_CHARS = int(os.getenv("STREAM_RENDER_MAX_CHARS", "512"))  # 未刷新的字符数达到该值时不等间隔、立即刷新
@@ -3,20 +3,25 @@ ETL Pipeline：数据清洗与结构化模块
 从 Excel/CSV 读取原始提示词，通过 Qwen 3 解析成结构化 JSON
 """
 import pandas as pd
+import asyncio
 import json
 import jsonlines
 import os
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from tqdm import tqdm
 from ollama_client import OllamaClient
-from config import PROCESSED_DATA_DIR, RAW_DATA_DIR
+from llm_scheduler import BATCH
+from config import PROCESSED_DATA_DIR, RAW_DATA_DIR, ETL_CONCURRENCY
 
 
 class ETLPipeline:
     """ETL 数据处理管道"""
     
-    def __init__(self, ollama_client: OllamaClient = None):
-        self.client = ollama_client or OllamaClient()
+    def __init__(self, ollama_client: OllamaClient = None, async_client=None):
+        # 批量解析默认使用 batch 类别，与界面的交互请求共用 Ollama 时让出优先权
+        self.client = ollama_client or OllamaClient(priority=BATCH)
+        # 异步客户端（AsyncOllamaClient），并发处理时按需创建
+        self._async_client = async_client
         self.system_prompt = self._get_system_prompt()
         
         # 确保目录存在
@@ -72,19 +77,45 @@ class ETLPipeline:
 
 现在开始解析用户提供的提示词，并将结果转换为中文。"""
     
+    @property
+    def async_client(self):
+        """异步 Ollama 客户端（与同步客户端使用相同的服务地址和模型）"""
+        if self._async_client is None:
+            from async_ollama_client import AsyncOllamaClient
+            self._async_client = AsyncOllamaClient(host=self.client.host, model=self.client.model,
+                                                   priority=self.client.priority)
+        return self._async_client
+    
     def _parse_with_llm(self, raw_text: str) -> Optional[Dict]:
         """使用 Qwen 3 解析原始文本为结构化 JSON"""
         try:
-            # 构造提示词
-            user_prompt = f"请解析以下提示词：\n\n{raw_text}"
-            
             # 调用 Ollama
             response = self.client.generate(
-                prompt=user_prompt,
+                prompt=f"请解析以下提示词：\n\n{raw_text}",
                 system=self.system_prompt,
                 temperature=0.3  # 较低温度保证输出稳定
             )
-            
+        except Exception as e:
+            print(f"解析过程出错: {e}")
+            return None
+        return self._parse_response(response, raw_text)
+    
+    async def _aparse_with_llm(self, raw_text: str) -> Optional[Dict]:
+        """_parse_with_llm 的异步版本"""
+        try:
+            response = await self.async_client.generate(
+                prompt=f"请解析以下提示词：\n\n{raw_text}",
+                system=self.system_prompt,
+                temperature=0.3
+            )
+        except Exception as e:
+            print(f"解析过程出错: {e}")
+            return None
+        return self._parse_response(response, raw_text)
+    
+    def _parse_response(self, response: str, raw_text: str) -> Optional[Dict]:
+        """从模型输出中提取结构化 JSON"""
+        try:
             # 清理响应，提取 JSON
             response = response.strip()
             # 移除可能的 markdown 代码块标记
@@ -229,18 +260,9 @@ class ETLPipeline:
             print(f"✗ 加载 CSV 失败: {e}")
             return []
     
-    def process_batch(self, texts: List[str], output_path: str = None, append: bool = False) -> str:
-        """
-        批量处理文本，生成结构化 JSONL 文件
-        
-        Args:
-            texts: 原始文本列表
-            output_path: 输出文件路径（可选）
-            append: 是否追加模式（True=追加，False=覆盖）
-        
-        Returns:
-            输出文件路径
-        """
+    def _prepare_batch(self, texts: List[str], output_path: str = None,
+                       append: bool = False) -> Tuple[List[str], str, bool]:
+        """确定输出路径，追加模式下过滤掉已处理过的文本"""
         if output_path is None:
             output_path = os.path.join(PROCESSED_DATA_DIR, "structured_data.jsonl")
         
@@ -267,6 +289,39 @@ class ETLPipeline:
             if skipped_count > 0:
                 print(f"  跳过 {skipped_count} 条已存在的记录")
         
+        return texts, output_path, append
+    
+    @staticmethod
+    def _fallback_record(text: str) -> Dict:
+        """解析失败时保存的原始数据"""
+        return {
+            "subject": "",
+            "art_style": "",
+            "visual_elements": [],
+            "mood": "",
+            "technical": [],
+            "raw": text
+        }
+    
+    def process_batch(self, texts: List[str], output_path: str = None, append: bool = False,
+                      concurrency: int = None) -> str:
+        """
+        批量处理文本，生成结构化 JSONL 文件
+        
+        Args:
+            texts: 原始文本列表
+            output_path: 输出文件路径（可选）
+            append: 是否追加模式（True=追加，False=覆盖）
+            concurrency: 同时在途的请求数（默认使用配置 ETL_CONCURRENCY），>1 时使用异步客户端
+        
+        Returns:
+            输出文件路径
+        """
+        concurrency = concurrency or ETL_CONCURRENCY
+        if concurrency > 1:
+            return asyncio.run(self.aprocess_batch(texts, output_path, append, concurrency))
+        
+        texts, output_path, append = self._prepare_batch(texts, output_path, append)
         if not texts:
             print("\n所有记录都已存在，无需处理")
             return output_path
@@ -286,15 +341,68 @@ class ETLPipeline:
                 else:
                     failed_count += 1
                     # 即使解析失败，也保存原始数据
-                    writer.write({
-                        "subject": "",
-                        "art_style": "",
-                        "visual_elements": [],
-                        "mood": "",
-                        "technical": [],
-                        "raw": text
-                    })
+                    writer.write(self._fallback_record(text))
+        
+        self._print_summary(processed_count, failed_count, append, output_path)
+        return output_path
+    
+    async def aprocess_batch(self, texts: List[str], output_path: str = None, append: bool = False,
+                             concurrency: int = None) -> str:
+        """
+        并发批量处理（单线程 asyncio，最多 concurrency 个请求同时在途）
+        
+        结果按输入顺序写入：先完成的请求在内存中等待前面的结果，保证与串行处理的输出一致。
+        """
+        concurrency = concurrency or max(ETL_CONCURRENCY, 1)
+        texts, output_path, append = self._prepare_batch(texts, output_path, append)
+        if not texts:
+            print("\n所有记录都已存在，无需处理")
+            return output_path
         
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def parse(i: int, text: str):
+            async with semaphore:
+                return i, await self._aparse_with_llm(text)
+        
+        processed_count = 0
+        failed_count = 0
+        done = {}
+        next_index = 0
+        mode = 'a' if append else 'w'
+        tasks = []
+        print(f"并发处理: 最多 {concurrency} 个请求同时进行")
+        scheduler = self.async_client.scheduler
+        if scheduler is not None and concurrency > scheduler.limits[self.async_client.priority]:
+            print(f"⚠️  已启用 LLM_SCHEDULER：{self.async_client.priority} 类请求在 {scheduler.host} 上最多占用 "
+                  f"{scheduler.limits[self.async_client.priority]} 个槽位，实际并发低于 {concurrency}"
+                  f"（调整 LLM_SCHEDULER_SLOTS / LLM_SCHEDULER_RESERVED）")
+        try:
+            with jsonlines.open(output_path, mode=mode) as writer:
+                tasks = [asyncio.create_task(parse(i, text)) for i, text in enumerate(texts)]
+                for future in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="处理中"):
+                    i, parsed = await future
+                    done[i] = parsed
+                    # 写出已连续完成的前缀
+                    while next_index in done:
+                        parsed = done.pop(next_index)
+                        if parsed:
+                            writer.write(parsed)
+                            processed_count += 1
+                        else:
+                            failed_count += 1
+                            writer.write(self._fallback_record(texts[next_index]))
+                        next_index += 1
+        finally:
+            for task in tasks:
+                task.cancel()
+            await self.async_client.close()
+        
+        self._print_summary(processed_count, failed_count, append, output_path)
+        return output_path
+    
+    @staticmethod
+    def _print_summary(processed_count: int, failed_count: int, append: bool, output_path: str):
         print(f"\n✓ 处理完成！")
         print(f"  成功: {processed_count} 条")
         print(f"  失败: {failed_count} 条")
@@ -303,8 +411,6 @@ class ETLPipeline:
         else:
             print(f"  模式: 覆盖文件")
         print(f"  输出文件: {output_path}")
-        
-        return output_path
 
 
 if __name__ == "__main__":
@@ -0,0 +1,253 @@
+"""
+知识包模块：将索引、元数据和模型指纹打包为单个带版本的文件
+
+文件布局（所有段按 64 字节对齐，便于 mmap 后零拷贝访问）:
+    [0:8)    魔数 b"PRAGPACK"
+    [8:12)   格式版本 uint32
+    [12:16)  头部长度 uint32
+    [16:...) 头部 JSON（模型指纹、条数、各段的 offset/length/dtype）
+    各数据段:
+        index         faiss.serialize_index 序列化后的索引
+        meta_offsets  uint64[n+1]，第 i 条元数据位于 meta_blob[offsets[i]:offsets[i+1]]
+        meta_blob     紧凑 JSON（UTF-8）拼接，按需逐条解码
+        probe_vectors float32[p, dim]，模型指纹的探针向量
+
+用法:
+    python knowledge_pack.py pack   # 将 db/ 下的索引和元数据打包
+    python knowledge_pack.py info   # 查看知识包信息
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import numpy as np
+import faiss
+from collections.abc import Sequence
+from typing import Dict, List, Optional
+from config import INDEX_PATH, METADATA_PATH, PACK_PATH
+
+PACK_MAGIC = b"PRAGPACK"
+PACK_FORMAT_VERSION = 1
+_ALIGN = 64
+_PREAMBLE = struct.Struct("<8sII")
+
+# 模型指纹探针文本：同一模型对这些文本的向量应几乎一致
+PROBE_TEXTS = ["赛博朋克风格的雨夜猫咪", "a watercolor landscape at sunset", "8k, masterpiece, highly detailed"]
+# 探针向量余弦相似度低于该阈值即视为不同模型
+PROBE_MIN_SIMILARITY = 0.999
+
+
+class PackFormatError(ValueError):
+    """知识包格式错误或与当前模型不匹配"""
+
+
+def _align(offset: int) -> int:
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class PackedMetadata(Sequence):
+    """知识包中的元数据：基于 mmap 的只读序列，访问某一条时才解码"""
+
+    def __init__(self, buffer, offsets: np.ndarray, blob_start: int):
+        self._buffer = buffer
+        self._offsets = offsets
+        self._blob_start = blob_start
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        start = self._blob_start + int(self._offsets[i])
+        end = self._blob_start + int(self._offsets[i + 1])
+        return json.loads(self._buffer[start:end])
+
+
+class KnowledgePack:
+    """已打开的知识包（mmap 只读）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, header_len = _PREAMBLE.unpack_from(self._mmap, 0)
+        if magic != PACK_MAGIC:
+            raise PackFormatError(f"不是有效的知识包文件: {path}")
+        if version != PACK_FORMAT_VERSION:
+            raise PackFormatError(f"不支持的知识包格式版本: {version}（当前支持 {PACK_FORMAT_VERSION}）")
+
+        header_start = _PREAMBLE.size
+        self.header = json.loads(self._mmap[header_start:header_start + header_len])
+        self.sections = self.header["sections"]
+        self.fingerprint = self.header["fingerprint"]
+        self.version = self.header.get("version")
+
+    def _view(self, name: str) -> np.ndarray:
+        """返回某个数据段的零拷贝 numpy 视图"""
+        section = self.sections[name]
+        dtype = np.dtype(section["dtype"])
+        count = section["length"] // dtype.itemsize
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.frombuffer(self._mmap, dtype=dtype, count=count, offset=section["offset"])
+
+    def read_index(self, mmap_index: bool = False):
+        """
+        读取索引
+
+        mmap_index=False 时反序列化到私有内存（一次拷贝）；True 时直接引用知识包的内存映射
+        （Flat 索引的向量零拷贝，页面按需载入并在进程间共享，索引只读），FAISS 版本不支持时退化为反序列化
+        """
+        view = self._view("index")
+        if mmap_index:
+            reader_class = getattr(faiss, "ZeroCopyIOReader", None)
+            flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+            if reader_class is not None and flag is not None:
+                try:
+                    index = faiss.read_index(reader_class(faiss.swig_ptr(view), view.nbytes),
+                                             flag | faiss.IO_FLAG_READ_ONLY)
+                except RuntimeError:
+                    pass
+                else:
+                    # 索引直接引用映射内存：视图（及其背后的 mmap）须与索引同生命周期
+                    faiss.add_to_referenced_objects(index, view)
+                    return index
+            print("⚠️  当前索引类型或 FAISS 版本不支持从知识包零拷贝映射，改为整体读入内存")
+        return faiss.deserialize_index(view)
+
+    def metadata(self) -> PackedMetadata:
+        return PackedMetadata(self._mmap, self._view("meta_offsets"), self.sections["meta_blob"]["offset"])
+
+    def probe_vectors(self) -> np.ndarray:
+        dim = self.fingerprint["dimension"]
+        return self._view("probe_vectors").reshape(-1, dim)
+
+    def check_fingerprint(self, model_name: str, dimension: int, probe_vectors: np.ndarray):
+        """校验知识包与当前 Embedding 模型是否一致，不一致时抛出 PackFormatError"""
+        expected = self.fingerprint
+        if expected["dimension"] != dimension:
+            raise PackFormatError(
+                f"知识包向量维度 {expected['dimension']} 与当前模型 {model_name} 的维度 {dimension} 不一致"
+            )
+        similarity = _probe_similarity(self.probe_vectors(), probe_vectors)
+        if similarity < PROBE_MIN_SIMILARITY:
+            raise PackFormatError(
+                f"知识包由模型 {expected['model']} 构建，与当前模型 {model_name} 不匹配"
+                f"（探针向量相似度 {similarity:.4f}），请重新构建索引"
+            )
+
+    def close(self):
+        self._mmap.close()
+
+
+def _probe_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """逐行余弦相似度的最小值"""
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return float(np.min(np.sum(a * b, axis=1)))
+
+
+def write_pack(path: str, index, metadata: List[Dict], model_name: str,
+               probe_vectors: np.ndarray, version: str = None) -> str:
+    """
+    写入知识包（先写临时文件再原子替换）
+
+    Args:
+        path: 输出路径
+        index: FAISS 索引
+        metadata: 元数据列表（与索引行号一一对应）
+        model_name: Embedding 模型名称
+        probe_vectors: 模型对 PROBE_TEXTS 的向量
+        version: 索引版本号
+
+    Returns:
+        输出路径
+    """
+    blobs = [json.dumps(item, ensure_ascii=False, separators=(',', ':')).encode('utf-8') for item in metadata]
+    offsets = np.zeros(len(blobs) + 1, dtype='<u8')
+    np.cumsum([len(b) for b in blobs], out=offsets[1:])
+    probe_vectors = np.ascontiguousarray(probe_vectors, dtype='<f4')
+
+    payloads = {
+        "index": (faiss.serialize_index(index), "u1"),
+        "meta_offsets": (offsets, "<u8"),
+        "meta_blob": (b"".join(blobs), "u1"),
+        "probe_vectors": (probe_vectors, "<f4"),
+    }
+
+    header = {
+        "format_version": PACK_FORMAT_VERSION,
+        "version": version or str(time.time_ns()),
+        "count": int(index.ntotal),
+        "fingerprint": {
+            "model": model_name,
+            "dimension": int(index.d),
+            "probe_texts": PROBE_TEXTS,
+        },
+        "sections": {},
+    }
+
+    # 头部长度依赖各段 offset，反复计算直到数据起始位置稳定
+    data_start = 0
+    while True:
+        offset = data_start
+        for name, (payload, dtype) in payloads.items():
+            length = len(payload) if isinstance(payload, bytes) else payload.nbytes
+            header["sections"][name] = {"offset": offset, "length": length, "dtype": dtype}
+            offset = _align(offset + length)
+        header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        required_start = _align(_PREAMBLE.size + len(header_bytes))
+        if required_start == data_start:
+            break
+        data_start = required_start
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_PREAMBLE.pack(PACK_MAGIC, PACK_FORMAT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, (payload, _) in payloads.items():
+            f.seek(header["sections"][name]["offset"])
+            f.write(payload if isinstance(payload, bytes) else payload.tobytes())
+    os.replace(tmp_path, path)
+    return path
+
+
+def open_pack(path: str = None) -> KnowledgePack:
+    return KnowledgePack(path or PACK_PATH)
+
+
+def _print_info(pack: KnowledgePack):
+    fp = pack.fingerprint
+    print(f"知识包: {pack.path} ({os.path.getsize(pack.path) / (1024 * 1024):.1f} MB)")
+    print(f"  格式版本: {pack.header['format_version']}，索引版本: {pack.version}")
+    print(f"  记录数: {pack.header['count']}")
+    print(f"  模型: {fp['model']}（{fp['dimension']} 维）")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "info"
+    if command == "pack":
+        from vector_store import VectorStore
+        store = VectorStore()
+        if not os.path.exists(INDEX_PATH) or not os.path.exists(METADATA_PATH):
+            print("✗ 索引不存在，请先运行 python build_index.py")
+            sys.exit(1)
+        index, metadata, version = store._read_loose_files()
+        store.save_pack(index=index, metadata=metadata, version=version)
+        _print_info(open_pack())
+    elif command == "info":
+        if not os.path.exists(PACK_PATH):
+            print(f"✗ 知识包不存在: {PACK_PATH}")
+            sys.exit(1)
+        _print_info(open_pack())
+    else:
+        print(__doc__)
@@ -0,0 +1,278 @@
+"""
+LLM 请求调度：按优先级类别（交互 / 批量）分配每个 Ollama 主机的并发槽位
+
+同一主机上的 ETL 批量解析与界面中的交互生成共用 Ollama 的并行槽位，不加控制时交互请求会排在
+成百上千个解析请求之后。调度器位于客户端与 Ollama 之间：
+
+- 槽位按权重公平分配：空出槽位时，交给「在途数 / 权重」最小且有请求排队的类别，
+  交互请求因此直接越过排队中的批量请求；只有一类请求时可以用满全部槽位
+- 为交互请求保留 reserved 个槽位：批量请求最多占用 slots - reserved 个，交互请求无需等待批量请求完成。
+  slots 与 Ollama 端 OLLAMA_NUM_PARALLEL 一致时，这一保留对其他进程（如 process_data.py）同样有效
+- 每个类别有排队上限：超出时交互请求立即拒绝（SchedulerRejected），批量请求延后（在队列外等待，有空位再入队）
+- 每个请求记录自己的排队耗时（Ticket.queue_ms），并计入 llm_scheduler_wait_seconds 指标
+
+同步调用（线程）与异步调用（asyncio）共用同一个调度器。
+"""
+import asyncio
+import contextlib
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+from config import LLM_SCHEDULER_SLOTS, LLM_SCHEDULER_RESERVED, LLM_SCHEDULER_WEIGHTS, LLM_SCHEDULER_MAX_QUEUE
+from metrics import REGISTRY
+
+INTERACTIVE, BATCH = "interactive", "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+
+# 排队已满时的处理方式：交互请求快速失败（用户可以立即重试或改用其他主机），批量请求延后不丢弃
+FULL_POLICY = {INTERACTIVE: "reject", BATCH: "defer"}
+
+_WAIT_SECONDS = REGISTRY.histogram(
+    "llm_scheduler_wait_seconds", "LLM 请求在调度器中的排队耗时（秒）",
+    (0.001, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60),
+)
+_WAITING = REGISTRY.gauge("llm_scheduler_waiting", "在调度器中排队（含延后）的 LLM 请求数")
+_INFLIGHT = REGISTRY.gauge("llm_scheduler_inflight", "已获得槽位、正在进行的 LLM 请求数")
+_REJECTED = REGISTRY.counter("llm_scheduler_rejected_total", "调度器拒绝的 LLM 请求数（排队已满或等待超时）")
+_DEFERRED = REGISTRY.counter("llm_scheduler_deferred_total", "排队已满、被延后的 LLM 请求数")
+
+
+class SchedulerRejected(Exception):
+    """调度器拒绝了请求（排队已满或等待超时），请求未发送"""
+
+
+def parse_class_values(spec: str) -> Dict[str, float]:
+    """
+    解析按类别的取值（如 "interactive:4,batch:1"）
+
+    Raises:
+        ValueError: 类别未知或格式错误
+    """
+    values = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, value = part.partition(":")
+        name = name.strip()
+        if name not in PRIORITIES:
+            raise ValueError(f"未知的请求类别: {name}（可选: {', '.join(PRIORITIES)}）")
+        values[name] = float(value)
+    return values
+
+
+class Ticket:
+    """一次槽位申请：记录类别、排队耗时与状态（waiting → granted → released，或 cancelled）"""
+
+    __slots__ = ("priority", "enqueued_at", "granted_at", "state", "_grant")
+
+    def __init__(self, priority: str, grant):
+        self.priority = priority
+        self.enqueued_at = time.perf_counter()
+        self.granted_at = None
+        self.state = "waiting"
+        self._grant = grant
+
+    @property
+    def queue_ms(self) -> float:
+        end = self.granted_at if self.granted_at is not None else time.perf_counter()
+        return (end - self.enqueued_at) * 1000
+
+    def report(self) -> Dict:
+        """写入 LLM 统计对象的调度信息"""
+        return {"priority": self.priority, "queue_ms": self.queue_ms}
+
+
+class LLMScheduler:
+    """
+    单个 Ollama 主机的优先级调度器（进程内按主机共享，见 for_host）
+
+    acquire / aacquire 申请槽位（阻塞 / 异步等待），用完调用 release；
+    也可使用 slot / aslot 上下文管理器。
+    """
+
+    # 进程级注册表：同一主机的所有客户端（同步与异步）共享槽位
+    _registry: Dict[str, "LLMScheduler"] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, host: str, slots: int = None, reserved: int = None, weights: Dict[str, float] = None,
+                 max_queue: Dict[str, float] = None, full_policy: Dict[str, str] = None):
+        self.host = host
+        self.slots = max(1, LLM_SCHEDULER_SLOTS if slots is None else slots)
+        reserved = LLM_SCHEDULER_RESERVED if reserved is None else reserved
+        # 每个类别最多占用的槽位数：交互请求可以用满，批量请求让出保留槽位（至少保留一个给批量）
+        self.limits = {INTERACTIVE: self.slots, BATCH: max(1, self.slots - max(0, reserved))}
+        self.weights = {INTERACTIVE: 4.0, BATCH: 1.0}
+        self.weights.update(parse_class_values(LLM_SCHEDULER_WEIGHTS) if weights is None else weights)
+        self.max_queue = {INTERACTIVE: 32, BATCH: 256}
+        self.max_queue.update(parse_class_values(LLM_SCHEDULER_MAX_QUEUE) if max_queue is None else max_queue)
+        self.full_policy = dict(FULL_POLICY, **(full_policy or {}))
+        self._lock = threading.Lock()
+        self._queues = {p: deque() for p in PRIORITIES}
+        self._deferred = {p: deque() for p in PRIORITIES}
+        self._inflight = {p: 0 for p in PRIORITIES}
+        self._granted = {p: 0 for p in PRIORITIES}
+        self._rejected = {p: 0 for p in PRIORITIES}
+
+    @classmethod
+    def for_host(cls, host: str) -> "LLMScheduler":
+        with cls._registry_lock:
+            scheduler = cls._registry.get(host)
+            if scheduler is None:
+                scheduler = cls(host)
+                cls._registry[host] = scheduler
+            return scheduler
+
+    # ---- 调度核心（均在 self._lock 内调用）----
+
+    def _pick(self) -> Optional[str]:
+        """选择下一个获得槽位的类别：有请求排队、未达上限的类别中「在途数 / 权重」最小者，相同时交互优先"""
+        if sum(self._inflight.values()) >= self.slots:
+            return None
+        candidates = [p for p in PRIORITIES
+                      if self._queues[p] and self._inflight[p] < self.limits[p] and self.weights.get(p, 0) > 0]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda p: (self._inflight[p] / self.weights[p], PRIORITIES.index(p)))
+
+    def _dispatch(self) -> list:
+        """把空闲槽位分给排队的请求，返回获得槽位的 Ticket（在锁外通知）"""
+        granted = []
+        while True:
+            priority = self._pick()
+            if priority is None:
+                break
+            ticket = self._queues[priority].popleft()
+            self._promote(priority)
+            ticket.state = "granted"
+            ticket.granted_at = time.perf_counter()
+            self._inflight[priority] += 1
+            self._granted[priority] += 1
+            granted.append(ticket)
+        self._update_gauges()
+        return granted
+
+    def _promote(self, priority: str):
+        """队列有空位时，把延后的请求移入队列"""
+        while self._deferred[priority] and len(self._queues[priority]) < self.max_queue[priority]:
+            self._queues[priority].append(self._deferred[priority].popleft())
+
+    def _update_gauges(self):
+        for p in PRIORITIES:
+            _WAITING.set(len(self._queues[p]) + len(self._deferred[p]), priority=p, host=self.host)
+            _INFLIGHT.set(self._inflight[p], priority=p, host=self.host)
+
+    def _notify(self, granted: list):
+        host = self.host
+        for ticket in granted:
+            _WAIT_SECONDS.observe(ticket.queue_ms / 1000, priority=ticket.priority, host=host)
+            ticket._grant()
+
+    def _reject(self, priority: str, reason: str, message: str):
+        self._rejected[priority] += 1
+        _REJECTED.inc(priority=priority, reason=reason, host=self.host)
+        raise SchedulerRejected(message)
+
+    def _enqueue(self, priority: str, grant) -> Ticket:
+        if priority not in PRIORITIES:
+            raise ValueError(f"未知的请求类别: {priority}（可选: {', '.join(PRIORITIES)}）")
+        ticket = Ticket(priority, grant)
+        with self._lock:
+            if len(self._queues[priority]) < self.max_queue[priority] and not self._deferred[priority]:
+                self._queues[priority].append(ticket)
+            elif self.full_policy[priority] == "reject":
+                self._reject(priority, "queue_full",
+                             f"Ollama 主机 {self.host} 的 {priority} 请求排队已满（{len(self._queues[priority])} 个）")
+            else:
+                _DEFERRED.inc(priority=priority, host=self.host)
+                self._deferred[priority].append(ticket)
+            granted = self._dispatch()
+        self._notify(granted)
+        return ticket
+
+    def _cancel(self, ticket: Ticket) -> bool:
+        """放弃等待；返回 False 表示已经获得槽位（与超时同时发生）"""
+        with self._lock:
+            if ticket.state != "waiting":
+                return False
+            ticket.state = "cancelled"
+            for queue in (self._queues[ticket.priority], self._deferred[ticket.priority]):
+                if ticket in queue:
+                    queue.remove(ticket)
+            self._promote(ticket.priority)
+            self._update_gauges()
+        return True
+
+    # ---- 对外接口 ----
+
+    def acquire(self, priority: str = INTERACTIVE, timeout: float = None) -> Ticket:
+        """
+        申请一个槽位（阻塞直到获得）
+
+        Raises:
+            SchedulerRejected: 排队已满（拒绝策略）或超过 timeout 秒仍未获得槽位
+        """
+        event = threading.Event()
+        ticket = self._enqueue(priority, event.set)
+        if not event.wait(timeout) and self._cancel(ticket):
+            with self._lock:
+                self._reject(priority, "timeout", f"等待 Ollama 主机 {self.host} 的空闲槽位超过 {timeout:g} 秒")
+        return ticket
+
+    async def aacquire(self, priority: str = INTERACTIVE, timeout: float = None) -> Ticket:
+        """acquire 的异步版本（等待期间不占用线程）"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def grant():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        ticket = self._enqueue(priority, grant)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except BaseException as e:
+            if not self._cancel(ticket):
+                # 取消与获得槽位同时发生：归还槽位
+                self.release(ticket)
+            if isinstance(e, asyncio.TimeoutError):
+                with self._lock:
+                    self._reject(priority, "timeout", f"等待 Ollama 主机 {self.host} 的空闲槽位超过 {timeout:g} 秒")
+            raise
+        return ticket
+
+    def release(self, ticket: Ticket):
+        """归还槽位（重复调用无效）"""
+        with self._lock:
+            if ticket.state != "granted":
+                return
+            ticket.state = "released"
+            self._inflight[ticket.priority] -= 1
+            granted = self._dispatch()
+        self._notify(granted)
+
+    @contextlib.contextmanager
+    def slot(self, priority: str = INTERACTIVE, timeout: float = None):
+        ticket = self.acquire(priority, timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    @contextlib.asynccontextmanager
+    async def aslot(self, priority: str = INTERACTIVE, timeout: float = None):
+        ticket = await self.aacquire(priority, timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self) -> Dict:
+        """各类别的在途数、排队数、延后数、累计获得槽位与被拒绝的次数"""
+        with self._lock:
+            return {
+                "slots": self.slots,
+                **{p: {"inflight": self._inflight[p], "waiting": len(self._queues[p]),
+                       "deferred": len(self._deferred[p]), "granted": self._granted[p],
+                       "rejected": self._rejected[p], "limit": self.limits[p], "weight": self.weights[p]}
+                   for p in PRIORITIES},
+            }
@@ -0,0 +1,195 @@
+"""
+LLM 性能遥测：从 Ollama 响应的耗时字段拆分每次请求的时间构成，按模型 / 主机聚合
+
+Ollama 在非流式响应和流式响应的最后一个对象中返回（单位纳秒）：
+    load_duration         加载模型耗时（也包含等待空闲并行槽位的时间）
+    prompt_eval_count     提示词 token 数（命中 KV 缓存的部分不计入）
+    prompt_eval_duration  预填充耗时
+    eval_count            生成的 token 数
+    eval_duration         解码耗时
+    total_duration        服务端处理总耗时
+"""
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+import numpy as np
+from config import TELEMETRY_WINDOW
+from metrics import REGISTRY
+
+_NS_PER_MS = 1e6
+
+_PREFILL_TPS = REGISTRY.histogram(
+    "ollama_prefill_tokens_per_second", "预填充速度（提示词 token/秒）",
+    (50, 100, 200, 400, 800, 1600, 3200, 6400),
+)
+_DECODE_TPS = REGISTRY.histogram(
+    "ollama_decode_tokens_per_second", "解码速度（生成 token/秒）",
+    (2, 5, 10, 20, 40, 80, 160),
+)
+_PROMPT_TOKENS = REGISTRY.histogram(
+    "ollama_prompt_tokens", "提示词 token 数",
+    (128, 256, 512, 1024, 2048, 4096, 8192),
+)
+_LOAD_SECONDS = REGISTRY.histogram(
+    "ollama_load_seconds", "模型加载 / 等待槽位耗时（秒）",
+    (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60),
+)
+_QUEUE_SECONDS = REGISTRY.histogram(
+    "ollama_queue_seconds", "排队与网络耗时（秒）：墙钟时间减去加载、预填充与解码",
+    (0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10),
+)
+_PREFILL_SECONDS = REGISTRY.histogram(
+    "ollama_prefill_seconds", "预填充耗时（秒）",
+    (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10),
+)
+
+# summary() 输出的字段
+FIELDS = ("wall_ms", "queue_ms", "load_ms", "prefill_ms", "decode_ms",
+          "prompt_tokens", "eval_tokens", "prefill_tps", "decode_tps")
+
+
+def derive(stats: Dict, wall_ms: float) -> Dict:
+    """
+    由 Ollama 的耗时字段推导单次请求的时间构成
+
+    queue_ms = 墙钟时间 - 加载 - 预填充 - 解码：网络传输、Ollama 请求排队、分词等模型计算之外的时间
+    """
+    load_ms = (stats.get("load_duration") or 0) / _NS_PER_MS
+    prefill_ms = (stats.get("prompt_eval_duration") or 0) / _NS_PER_MS
+    decode_ms = (stats.get("eval_duration") or 0) / _NS_PER_MS
+    prompt_tokens = stats.get("prompt_eval_count") or 0
+    eval_tokens = stats.get("eval_count") or 0
+    return {
+        "wall_ms": wall_ms,
+        "queue_ms": max(0.0, wall_ms - load_ms - prefill_ms - decode_ms),
+        "load_ms": load_ms,
+        "prefill_ms": prefill_ms,
+        "decode_ms": decode_ms,
+        "prompt_tokens": prompt_tokens,
+        "eval_tokens": eval_tokens,
+        "prefill_tps": prompt_tokens / (prefill_ms / 1000) if prefill_ms > 0 else None,
+        "decode_tps": eval_tokens / (decode_ms / 1000) if decode_ms > 0 else None,
+    }
+
+
+class LLMTelemetry:
+    """
+    请求遥测聚合（线程安全，进程内共享）
+
+    每个 (模型, 主机) 保留最近 window 次请求的时间构成，用于计算滚动分位数；
+    同时写入累积直方图，可通过 render() 导出为 Prometheus 文本格式。
+    """
+
+    _shared_instance = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, window: int = None):
+        self.window = TELEMETRY_WINDOW if window is None else window
+        self._lock = threading.Lock()
+        self._records: Dict[tuple, deque] = {}
+
+    @classmethod
+    def shared(cls) -> "LLMTelemetry":
+        """进程级共享实例"""
+        with cls._shared_lock:
+            if cls._shared_instance is None:
+                cls._shared_instance = cls()
+            return cls._shared_instance
+
+    def record(self, model: str, host: str, stats: Dict, wall_ms: float) -> Dict:
+        """记录一次请求，返回推导出的时间构成"""
+        record = derive(stats, wall_ms)
+        labels = {"model": model, "host": host}
+        if record["prefill_tps"] is not None:
+            _PREFILL_TPS.observe(record["prefill_tps"], **labels)
+        if record["decode_tps"] is not None:
+            _DECODE_TPS.observe(record["decode_tps"], **labels)
+        _PROMPT_TOKENS.observe(record["prompt_tokens"], **labels)
+        _LOAD_SECONDS.observe(record["load_ms"] / 1000, **labels)
+        _QUEUE_SECONDS.observe(record["queue_ms"] / 1000, **labels)
+        _PREFILL_SECONDS.observe(record["prefill_ms"] / 1000, **labels)
+        with self._lock:
+            records = self._records.get((model, host))
+            if records is None:
+                records = self._records[(model, host)] = deque(maxlen=self.window)
+            records.append(record)
+        return record
+
+    def summary(self, group_by: str = "model") -> Dict[str, Dict]:
+        """
+        滚动窗口内的统计：{分组: {"requests": n, 字段: {"mean", "p50", "p95"}}}
+
+        group_by: "model"、"host"、"model_host" 或 None（全部合并）
+        """
+        with self._lock:
+            snapshot = {key: list(records) for key, records in self._records.items()}
+        groups: Dict[str, List[Dict]] = {}
+        for (model, host), records in snapshot.items():
+            name = {"model": model, "host": host, "model_host": f"{model}@{host}"}.get(group_by, "all")
+            groups.setdefault(name, []).extend(records)
+
+        result = {}
+        for name, records in groups.items():
+            entry = {"requests": len(records)}
+            for field in FIELDS:
+                values = [r[field] for r in records if r[field] is not None]
+                if values:
+                    entry[field] = {
+                        "mean": float(np.mean(values)),
+                        "p50": float(np.percentile(values, 50)),
+                        "p95": float(np.percentile(values, 95)),
+                    }
+            entry["prefill_ttft_correlation"] = self._prefill_correlation(records)
+            result[name] = entry
+        return result
+
+    @staticmethod
+    def _prefill_correlation(records: List[Dict]) -> Optional[float]:
+        """提示词 token 数与（排队 + 加载 + 预填充）耗时的相关系数：接近 1 说明长上下文是 TTFT 的主要来源"""
+        if len(records) < 3:
+            return None
+        tokens = np.array([r["prompt_tokens"] for r in records], dtype=float)
+        ttft = np.array([r["queue_ms"] + r["load_ms"] + r["prefill_ms"] for r in records], dtype=float)
+        if tokens.std() == 0 or ttft.std() == 0:
+            return None
+        return float(np.corrcoef(tokens, ttft)[0, 1])
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+    @staticmethod
+    def render() -> str:
+        """Prometheus 文本格式（包含全部运行指标）"""
+        return REGISTRY.render()
+
+
+def trace_attributes(stats: Dict, wall_ms: float = None) -> Dict:
+    """
+    LLM 最终统计对象中记入追踪 span 的属性：主机、冷热启动、token 数与各阶段耗时、调度排队耗时
+
+    stats 中没有 telemetry（未经 OllamaClient 记录）时，传入 wall_ms 即按 derive 现场计算
+    """
+    record = stats.get("telemetry") or (derive(stats, wall_ms) if wall_ms is not None else {})
+    attributes = {key: record[key] for key in ("prompt_tokens", "eval_tokens", "load_ms", "prefill_ms", "decode_ms")
+                  if key in record}
+    for key in ("host", "residency"):
+        if stats.get(key) is not None:
+            attributes[key] = stats[key]
+    if stats.get("scheduler"):
+        attributes["scheduler_queue_ms"] = stats["scheduler"]["queue_ms"]
+    return attributes
+
+
+def format_breakdown(record: Dict) -> str:
+    """将单次请求的时间构成格式化为一行说明"""
+    parts = [f"排队/网络 {record['queue_ms']:.0f}ms", f"加载 {record['load_ms']:.0f}ms",
+             f"预填充 {record['prefill_ms']:.0f}ms（{record['prompt_tokens']} tokens"]
+    if record["prefill_tps"] is not None:
+        parts[-1] += f"，{record['prefill_tps']:.0f} tok/s"
+    parts[-1] += "）"
+    decode = f"解码 {record['decode_ms']:.0f}ms（{record['eval_tokens']} tokens"
+    if record["decode_tps"] is not None:
+        decode += f"，{record['decode_tps']:.1f} tok/s"
+    parts.append(decode + "）")
+    return " · ".join(parts)
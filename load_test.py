@@ -0,0 +1,341 @@
+"""
+端到端压测：驱动 ETLPipeline 与 RAGGenerator，报告吞吐与延迟分位数
+
+默认连接 OLLAMA_HOST；加 --mock 时在进程内启动模拟 Ollama 服务（mock_ollama_server.py），无需 GPU。
+
+用法:
+    python load_test.py etl --mock --records 500 --concurrency 16
+    python load_test.py rag --mock --requests 200 --concurrency 8 [--slots 4 --decode-tps 40]
+    python load_test.py rag --host http://192.168.1.100:11434 --requests 50 --output run.json
+    python load_test.py rag --mock --server local --requests 200 --concurrency 32   # 经 RAG HTTP 服务（rag_server.py）
+    python load_test.py rag --server http://127.0.0.1:8765 --requests 100
+    python load_test.py rag --mock --batch-workers 16 --requests 50   # 后台同时运行批量解析时的交互延迟
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+import numpy as np
+import requests
+from config import OLLAMA_HOST, RAW_DATA_DIR
+
+# 语料不存在时使用的合成意图
+_SUBJECTS = ["雨夜的猫", "雪山上的城堡", "未来城市", "森林中的少女", "海边灯塔", "机械巨龙", "樱花街道", "沙漠商队"]
+_STYLES = ["赛博朋克", "油画", "水彩", "吉卜力风格", "写实摄影", "浮世绘"]
+
+
+def _load_texts(count: int, corpus: str) -> List[str]:
+    """读取原始语料，不存在时生成合成文本；数量不足时循环补齐并编号（避免被请求合并）"""
+    texts = []
+    if corpus and os.path.exists(corpus):
+        from benchmark import _load_raw_prompts
+        texts = _load_raw_prompts(corpus)[:count]
+    if not texts:
+        texts = [f"{style}风格的{subject}" for subject, style in itertools.product(_SUBJECTS, _STYLES)]
+    if len(texts) >= count:
+        return texts[:count]
+    return [f"{text} #{i}" for i, text in zip(range(count), itertools.cycle(texts))]
+
+
+def _latency_stats(values: List[float]) -> Dict:
+    if not values:
+        return {}
+    return {
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(np.max(values)),
+    }
+
+
+def _format_latency(name: str, stats: Dict) -> str:
+    if not stats:
+        return f"{name}: 无数据"
+    return (f"{name}: p50 {stats['p50']:.0f}ms  p95 {stats['p95']:.0f}ms  "
+            f"p99 {stats['p99']:.0f}ms  max {stats['max']:.0f}ms")
+
+
+def _mock_stats(host: str) -> Dict:
+    """读取模拟服务的计数（真实 Ollama 没有该接口）"""
+    try:
+        response = requests.get(f"{host}/mock/stats", timeout=2)
+        response.raise_for_status()
+        return response.json()
+    except Exception:
+        return {}
+
+
+def run_etl(args, host: str) -> Dict:
+    """ETL 压测：批量解析，统计每条记录的解析耗时与整体吞吐"""
+    from ollama_client import OllamaClient
+    from etl_pipeline import ETLPipeline
+    from llm_scheduler import BATCH
+
+    texts = _load_texts(args.records, args.corpus)
+    pipeline = ETLPipeline(ollama_client=OllamaClient(host=host, model=args.model, priority=BATCH))
+    latencies = []
+    failures = []
+
+    # 记录每次解析的耗时（包装实例方法，不改动流水线本身）
+    parse, aparse = pipeline._parse_with_llm, pipeline._aparse_with_llm
+
+    def timed_parse(text):
+        start = time.perf_counter()
+        result = parse(text)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if result is None:
+            failures.append(text)
+        return result
+
+    async def timed_aparse(text):
+        start = time.perf_counter()
+        result = await aparse(text)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if result is None:
+            failures.append(text)
+        return result
+
+    pipeline._parse_with_llm, pipeline._aparse_with_llm = timed_parse, timed_aparse
+
+    with tempfile.TemporaryDirectory() as workdir:
+        output_path = os.path.join(workdir, "structured_data.jsonl")
+        start = time.perf_counter()
+        pipeline.process_batch(texts, output_path=output_path, concurrency=args.concurrency)
+        elapsed = time.perf_counter() - start
+
+    return {
+        "records": len(texts),
+        "concurrency": args.concurrency,
+        "failed": len(failures),
+        "elapsed_seconds": elapsed,
+        "throughput_per_second": len(texts) / elapsed if elapsed else 0.0,
+        "latency_ms": _latency_stats(latencies),
+    }
+
+
+def _start_batch_load(workers: int, host: str, model: str, corpus: str):
+    """
+    后台批量负载：workers 个线程持续发送 ETL 解析请求（batch 类别），模拟同时运行的 process_data.py
+
+    返回停止函数，调用后等待进行中的请求结束并返回完成数
+    """
+    from etl_pipeline import ETLPipeline
+    from llm_scheduler import BATCH
+    from ollama_client import OllamaClient
+
+    pipeline = ETLPipeline(ollama_client=OllamaClient(host=host, model=model, priority=BATCH))
+    texts = _load_texts(max(workers * 8, 64), corpus)
+    stop = threading.Event()
+    completed = []
+
+    def worker(offset: int):
+        # 各线程使用不同的文本，避免被请求合并
+        for text in itertools.cycle(texts[offset::workers]):
+            if stop.is_set():
+                return
+            pipeline._parse_with_llm(f"[batch] {text}")
+            completed.append(1)
+
+    threads = [threading.Thread(target=worker, args=(i,), name=f"batch-load-{i}", daemon=True)
+               for i in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    def finish() -> Dict:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return {"workers": workers, "completed": len(completed)}
+
+    return finish
+
+
+def run_rag(args, host: str) -> Dict:
+    """
+    RAG 压测：多线程并发流式生成，统计首 token 延迟、总耗时与吞吐
+
+    指定 --server 时经 RAG HTTP 服务生成（local 表示在本进程内启动一个），否则直接调用 RAGGenerator
+    """
+    from ollama_client import OllamaClient
+    from rag_generator import RAGGenerator
+    from vector_store import VectorStore
+
+    server = None
+    if args.server and args.server != "local":
+        url = args.server
+    else:
+        store = VectorStore.acquire_shared()
+        if not store.exists():
+            raise SystemExit("✗ 向量库不存在，请先运行 python build_index.py")
+        client = OllamaClient(host=host, model=args.model)
+        if args.warmup:
+            client.load_model()
+        if args.server == "local":
+            from rag_server import RAGService, RAGServerThread
+            server = RAGServerThread(RAGService(store, ollama_host=host, model=args.model)).start()
+            url = server.url
+            print(f"✓ RAG 服务已启动: {url}")
+        else:
+            generator = RAGGenerator(store, client)
+
+    if args.server:
+        from rag_client import RAGServiceClient
+        local = threading.local()
+
+        def get_generator():
+            # requests.Session 不保证线程安全，每个线程使用自己的客户端（各自复用连接）
+            if not hasattr(local, "client"):
+                local.client = RAGServiceClient(url)
+            return local.client
+    else:
+        def get_generator():
+            return generator
+
+    intents = _load_texts(args.requests, args.corpus)
+    stop_batch_load = _start_batch_load(args.batch_workers, host, args.model, args.corpus) if args.batch_workers else None
+    lock = threading.Lock()
+    samples = []
+    errors = []
+
+    def run_one(intent: str):
+        timings = {}
+        stats = {}
+        start = time.perf_counter()
+        ttft = None
+        tokens = 0
+        try:
+            token_stream, _ = get_generator().stream_generate(intent, timings=timings, use_cache=args.cache,
+                                                              on_done=stats.update)
+            for _ in token_stream:
+                if ttft is None:
+                    ttft = (time.perf_counter() - start) * 1000
+                tokens += 1
+        except Exception as e:
+            with lock:
+                errors.append(repr(e))
+            return
+        total = (time.perf_counter() - start) * 1000
+        with lock:
+            samples.append({
+                "total_ms": total,
+                "ttft_ms": ttft,
+                "retrieval_ms": timings.get("encode_ms", 0) + timings.get("search_ms", 0),
+                "tokens": tokens,
+                "queue_ms": (stats.get("telemetry") or {}).get("queue_ms"),
+                "scheduler_ms": (stats.get("scheduler") or {}).get("queue_ms"),
+            })
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(run_one, intents))
+    elapsed = time.perf_counter() - start
+    batch_load = stop_batch_load() if stop_batch_load is not None else None
+    service = None
+    if args.server:
+        service = RAGServiceClient(url).health()
+    if server is not None:
+        server.stop()
+    if not args.server or server is not None:
+        store.release()
+
+    total_tokens = sum(s["tokens"] for s in samples)
+    return {
+        "requests": len(intents),
+        "concurrency": args.concurrency,
+        "failed": len(errors),
+        "errors": errors[:10],
+        "elapsed_seconds": elapsed,
+        "throughput_per_second": len(samples) / elapsed if elapsed else 0.0,
+        "tokens_per_second": total_tokens / elapsed if elapsed else 0.0,
+        "latency_ms": _latency_stats([s["total_ms"] for s in samples]),
+        "ttft_ms": _latency_stats([s["ttft_ms"] for s in samples if s["ttft_ms"] is not None]),
+        "retrieval_ms": _latency_stats([s["retrieval_ms"] for s in samples]),
+        "queue_ms": _latency_stats([s["queue_ms"] for s in samples if s["queue_ms"] is not None]),
+        "scheduler_ms": _latency_stats([s["scheduler_ms"] for s in samples if s["scheduler_ms"] is not None]),
+        **({"batch_load": batch_load} if batch_load else {}),
+        **({"service": service} if service else {}),
+    }
+
+
+def main():
+    from mock_ollama_server import MockServerThread, add_mock_arguments, mock_from_args
+
+    parser = argparse.ArgumentParser(description="PromptRAG 端到端压测")
+    parser.add_argument("--output", help="将结果以 JSON 格式写入文件")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_etl = sub.add_parser("etl", help="ETL 批量解析的吞吐与延迟")
+    p_etl.add_argument("--records", type=int, default=200, help="解析的记录数")
+    p_etl.add_argument("--concurrency", type=int, default=8, help="同时在途的解析请求数")
+
+    p_rag = sub.add_parser("rag", help="RAG 流式生成的吞吐、首 token 延迟与总延迟")
+    p_rag.add_argument("--requests", type=int, default=100, help="请求总数")
+    p_rag.add_argument("--concurrency", type=int, default=8, help="并发请求数（线程数）")
+    p_rag.add_argument("--cache", action="store_true", help="允许使用语义缓存（默认关闭，测量真实生成）")
+    p_rag.add_argument("--no-warmup", dest="warmup", action="store_false", help="压测前不预加载模型")
+    p_rag.add_argument("--batch-workers", type=int, default=0,
+                       help="后台同时运行的批量解析线程数（batch 类别），用于观察调度器对交互延迟的保护")
+    p_rag.add_argument("--server", default=None,
+                       help="经 RAG HTTP 服务生成：服务地址，或 local 表示在本进程内启动（默认直接调用 RAGGenerator）")
+
+    for p in (p_etl, p_rag):
+        p.add_argument("--host", default=None, help=f"Ollama 服务地址（默认: {OLLAMA_HOST}）")
+        p.add_argument("--model", default=None, help="模型名称（默认使用配置 OLLAMA_MODEL）")
+        p.add_argument("--corpus", default=os.path.join(RAW_DATA_DIR, "extracted_prompts.jsonl"),
+                       help="原始语料 JSONL（不存在时使用合成文本）")
+        p.add_argument("--mock", action="store_true", help="在进程内启动模拟 Ollama 服务")
+        add_mock_arguments(p)
+
+    args = parser.parse_args()
+
+    server = None
+    if args.mock:
+        if args.model and not args.models:
+            args.models = [args.model]
+        server = MockServerThread(mock_from_args(args)).start()
+        host = server.url
+        print(f"✓ 模拟 Ollama 服务已启动: {host}（{args.slots} 个槽位，解码 {args.decode_tps:g} token/s，"
+              f"失败率 {args.fail_rate:.0%}）")
+    else:
+        host = args.host or OLLAMA_HOST
+
+    try:
+        results = run_etl(args, host) if args.command == "etl" else run_rag(args, host)
+    finally:
+        mock = _mock_stats(host)
+        if server is not None:
+            server.stop()
+
+    if mock:
+        results["server"] = mock
+    count = results.get("records", results.get("requests"))
+    print(f"\n{'=' * 60}")
+    print(f"{args.command.upper()} 压测: {count} 条，并发 {results['concurrency']}，失败 {results['failed']}")
+    print(f"耗时 {results['elapsed_seconds']:.1f}s，吞吐 {results['throughput_per_second']:.2f} 条/秒")
+    if "tokens_per_second" in results:
+        print(f"生成 {results['tokens_per_second']:.1f} token/秒")
+    print(_format_latency("总延迟", results["latency_ms"]))
+    for key, name in (("ttft_ms", "首 token"), ("retrieval_ms", "检索"), ("scheduler_ms", "调度排队"),
+                      ("queue_ms", "排队/网络")):
+        if key in results:
+            print(_format_latency(name, results[key]))
+    if "batch_load" in results:
+        print(f"后台批量: {results['batch_load']['workers']} 个线程，完成 {results['batch_load']['completed']} 条")
+    if mock:
+        print(f"服务端: 最大并发 {mock.get('max_in_flight')}，模型加载 {mock.get('loads')} 次，"
+              f"注入失败 {mock.get('failures')} 次")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"✓ 结果已保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+"""
+模拟 Ollama 服务：无需 GPU 即可在本地运行 ETL / RAG 流程、开发并发功能和做回归压测
+
+实现 /api/tags、/api/ps、/api/generate（流式 / 非流式 / 空提示词加载模型）与 /api/chat，
+按配置的预填充 / 解码速度和并行槽位数模拟耗时，返回与 Ollama 相同的耗时字段；
+支持故障注入（按比例返回 500 或卡住），ETL 系统提示词下返回符合结构化 schema 的 JSON，
+要求多个备选时按“【变体k】”标记输出 k 段文本。
+
+用法:
+    python mock_ollama_server.py [--port 11434] [--slots 4] [--decode-tps 40] [--fail-rate 0.05]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from aiohttp import web
+from server_thread import AppServerThread
+
+# 生成普通文本时使用的词表
+_VOCAB = ["赛博朋克", "风格", "的", "雨夜", "猫咪", "，", "霓虹灯", "倒映", "在", "湿润", "街道", "上", "，",
+          "电影感", "光影", "，", "8k", "，", "杰作", "，", "高度细节", "。"]
+_STYLES = ["赛博朋克", "油画", "水彩", "印象派", "写实摄影", "动漫"]
+_MOODS = ["阴郁", "充满活力", "神秘", "宁静", "梦幻"]
+_ELEMENTS = ["霓虹灯", "雨", "城市街道", "森林", "星空", "雾气", "古建筑", "海浪"]
+_TECHNICAL = ["8k", "杰作", "高度细节", "光线追踪", "电影感光影"]
+# RAGGenerator 要求一次输出多个备选时的指令（见 rag_generator.variant_instruction）
+_VARIANTS_REQUEST = re.compile(r"生成 (\d+) 段")
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _parse_keep_alive(value, default: float) -> float:
+    """keep_alive → 秒；负数表示永久常驻"""
+    if value is None:
+        return default
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    for suffix in ("ms", "s", "m", "h"):
+        if text.endswith(suffix):
+            try:
+                return float(text[:-len(suffix)]) * units[suffix]
+            except ValueError:
+                return default
+    try:
+        return float(text)
+    except ValueError:
+        return default
+
+
+def count_tokens(text: str) -> int:
+    """粗略估算 token 数（中文约 1 字 1 token，英文约 4 字符 1 token）"""
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return max(1, (len(text) - ascii_chars) + ascii_chars // 4)
+
+
+class MockOllama:
+    """
+    模拟 Ollama 服务的状态与耗时模型
+
+    slots: 并行槽位数（对应 OLLAMA_NUM_PARALLEL），超出的请求排队，排队时间计入 load_duration（与 Ollama 一致）
+    load_ms: 模型未加载时的冷加载耗时；模型在 keep_alive 到期后卸载
+    fail_rate / stall_rate: 按比例返回 500 / 卡住 stall_seconds 秒后再处理
+    """
+
+    def __init__(self, models: List[str] = None, slots: int = 4, prefill_tps: float = 2000.0,
+                 decode_tps: float = 40.0, max_tokens: int = 64, load_ms: float = 2000.0,
+                 keep_alive: float = 300.0, fail_rate: float = 0.0, stall_rate: float = 0.0,
+                 stall_seconds: float = 30.0, seed: int = 0):
+        self.models = models or ["qwen2.5:32b"]
+        self.slots = slots
+        self.prefill_tps = prefill_tps
+        self.decode_tps = decode_tps
+        self.max_tokens = max_tokens
+        self.load_ms = load_ms
+        self.default_keep_alive = keep_alive
+        self.fail_rate = fail_rate
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self._rng = random.Random(seed)
+        self._semaphore = None
+        self._loaded: Dict[str, float] = {}  # 模型名 → 卸载时间（time.time()，inf 为永久）
+        self._load_locks: Dict[str, asyncio.Lock] = {}
+        self.stats = {"requests": 0, "generate": 0, "chat": 0, "stream": 0, "loads": 0,
+                      "failures": 0, "stalls": 0, "in_flight": 0, "max_in_flight": 0}
+
+    # ---------- 模型加载与常驻 ----------
+
+    def _is_loaded(self, model: str) -> bool:
+        expires = self._loaded.get(model)
+        if expires is None:
+            return False
+        if expires < time.time():
+            del self._loaded[model]
+            return False
+        return True
+
+    def _pin(self, model: str, keep_alive):
+        seconds = _parse_keep_alive(keep_alive, self.default_keep_alive)
+        if seconds == 0:
+            self._loaded.pop(model, None)
+        else:
+            self._loaded[model] = float("inf") if seconds < 0 else time.time() + seconds
+
+    async def _ensure_loaded(self, model: str) -> float:
+        """加载模型，返回加载耗时（秒）"""
+        lock = self._load_locks.setdefault(model, asyncio.Lock())
+        async with lock:
+            if self._is_loaded(model):
+                return 0.0
+            self.stats["loads"] += 1
+            await asyncio.sleep(self.load_ms / 1000)
+            self._loaded[model] = time.time() + self.default_keep_alive
+            return self.load_ms / 1000
+
+    # ---------- 内容生成 ----------
+
+    @staticmethod
+    def _is_etl(system: str) -> bool:
+        return bool(system) and "subject" in system and "art_style" in system
+
+    def _etl_json(self, prompt: str) -> str:
+        """按输入文本确定性地生成符合 ETL schema 的 JSON"""
+        text = prompt.split("\n\n", 1)[-1].strip()
+        rng = random.Random(int(hashlib.md5(text.encode('utf-8')).hexdigest()[:8], 16))
+        return json.dumps({
+            "subject": text[:20] or "未命名主体",
+            "art_style": rng.choice(_STYLES),
+            "visual_elements": rng.sample(_ELEMENTS, 3),
+            "mood": rng.choice(_MOODS),
+            "technical": rng.sample(_TECHNICAL, 2),
+            "raw": text,
+        }, ensure_ascii=False)
+
+    def _tokens(self, prompt: str, system: str) -> List[str]:
+        if self._is_etl(system):
+            text = self._etl_json(prompt)
+            # 按 4 个字符切分为 token，流式输出时逐段返回
+            return [text[i:i + 4] for i in range(0, len(text), 4)]
+        match = _VARIANTS_REQUEST.search(prompt)
+        if match:
+            # 每个备选的长度与单次生成相同，解码 token 数随备选数线性增长
+            tokens = []
+            for k in range(1, int(match.group(1)) + 1):
+                tokens.append(f"\n【变体{k}】" if k > 1 else f"【变体{k}】")
+                tokens.extend(_VOCAB[(i + k) % len(_VOCAB)] for i in range(self.max_tokens))
+            return tokens
+        return [_VOCAB[i % len(_VOCAB)] for i in range(self.max_tokens)]
+
+    # ---------- 请求处理 ----------
+
+    def _maybe_fail(self) -> Optional[web.Response]:
+        if self.fail_rate and self._rng.random() < self.fail_rate:
+            self.stats["failures"] += 1
+            return web.json_response({"error": "mock: injected failure"}, status=500)
+        return None
+
+    async def _maybe_stall(self):
+        if self.stall_rate and self._rng.random() < self.stall_rate:
+            self.stats["stalls"] += 1
+            await asyncio.sleep(self.stall_seconds)
+
+    async def _acquire(self, model: str, keep_alive) -> Tuple[float, float]:
+        """排队获取槽位并确保模型已加载，返回 (load_duration 秒, 开始时间)"""
+        start = time.perf_counter()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.slots)
+        await self._semaphore.acquire()
+        try:
+            await self._ensure_loaded(model)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        self._pin(model, keep_alive)
+        self.stats["in_flight"] += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+        return time.perf_counter() - start, start
+
+    def _release(self):
+        self.stats["in_flight"] -= 1
+        self._semaphore.release()
+
+    def _final(self, model: str, load_s: float, start: float, prompt_tokens: int, prefill_s: float,
+               eval_tokens: int, decode_s: float) -> Dict:
+        return {
+            "model": model,
+            "created_at": _now_iso(),
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((time.perf_counter() - start) * 1e9),
+            "load_duration": int(load_s * 1e9),
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(prefill_s * 1e9),
+            "eval_count": eval_tokens,
+            "eval_duration": int(decode_s * 1e9),
+        }
+
+    async def _run(self, request: web.Request, model: str, prompt: str, system: str, stream: bool,
+                   keep_alive, chat: bool):
+        """执行一次生成：排队 → 加载 → 预填充 → 解码"""
+        failure = self._maybe_fail()
+        if failure is not None:
+            return failure
+        await self._maybe_stall()
+
+        load_s, start = await self._acquire(model, keep_alive)
+        try:
+            prompt_tokens = count_tokens((system or "") + prompt)
+            prefill_s = prompt_tokens / self.prefill_tps
+            await asyncio.sleep(prefill_s)
+            tokens = self._tokens(prompt, system)
+            step = 1 / self.decode_tps
+
+            def chunk(token: str) -> Dict:
+                body = {"model": model, "created_at": _now_iso(), "done": False}
+                if chat:
+                    body["message"] = {"role": "assistant", "content": token}
+                else:
+                    body["response"] = token
+                return body
+
+            if not stream:
+                await asyncio.sleep(step * len(tokens))
+                final = self._final(model, load_s, start, prompt_tokens, prefill_s, len(tokens), step * len(tokens))
+                text = "".join(tokens)
+                if chat:
+                    final["message"] = {"role": "assistant", "content": text}
+                else:
+                    final["response"] = text
+                return web.json_response(final)
+
+            self.stats["stream"] += 1
+            response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+            response.enable_chunked_encoding()
+            await response.prepare(request)
+            decode_start = time.perf_counter()
+            try:
+                for token in tokens:
+                    await asyncio.sleep(step)
+                    await response.write(json.dumps(chunk(token), ensure_ascii=False).encode('utf-8') + b"\n")
+                final = self._final(model, load_s, start, prompt_tokens, prefill_s, len(tokens),
+                                    time.perf_counter() - decode_start)
+                if chat:
+                    final["message"] = {"role": "assistant", "content": ""}
+                else:
+                    final["response"] = ""
+                await response.write(json.dumps(final).encode('utf-8') + b"\n")
+                await response.write_eof()
+            except ConnectionResetError:
+                # 客户端提前断开（调用方退出、对冲请求落选），与 Ollama 一样停止生成
+                pass
+            return response
+        finally:
+            self._release()
+
+    async def handle_generate(self, request: web.Request):
+        body = await request.json()
+        self.stats["requests"] += 1
+        model = body.get("model") or self.models[0]
+        if "prompt" not in body or not body.get("prompt"):
+            # 空提示词：只加载模型（Ollama 的预加载方式）
+            load_s = await self._ensure_loaded(model)
+            self._pin(model, body.get("keep_alive"))
+            return web.json_response({"model": model, "created_at": _now_iso(), "response": "", "done": True,
+                                      "done_reason": "load", "load_duration": int(load_s * 1e9)})
+        self.stats["generate"] += 1
+        return await self._run(request, model, body["prompt"], body.get("system", ""),
+                               body.get("stream", True), body.get("keep_alive"), chat=False)
+
+    async def handle_chat(self, request: web.Request):
+        body = await request.json()
+        self.stats["requests"] += 1
+        self.stats["chat"] += 1
+        messages = body.get("messages") or []
+        system = "\n".join(m.get("content", "") for m in messages if m.get("role") == "system")
+        prompt = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        return await self._run(request, body.get("model") or self.models[0], prompt, system,
+                               body.get("stream", True), body.get("keep_alive"), chat=True)
+
+    async def handle_tags(self, request: web.Request):
+        return web.json_response({"models": [{"name": m, "model": m, "size": 0} for m in self.models]})
+
+    async def handle_ps(self, request: web.Request):
+        models = []
+        for model in list(self._loaded):
+            if self._is_loaded(model):
+                expires = self._loaded[model]
+                expires_at = ("2318-01-01T00:00:00Z" if expires == float("inf")
+                              else (datetime.now(timezone.utc) + timedelta(seconds=expires - time.time())).isoformat())
+                models.append({"name": model, "model": model, "size_vram": 0, "expires_at": expires_at})
+        return web.json_response({"models": models})
+
+    async def handle_stats(self, request: web.Request):
+        """模拟服务的计数（非 Ollama 接口，供压测脚本读取）"""
+        return web.json_response(self.stats)
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/api/tags", self.handle_tags)
+        app.router.add_get("/api/ps", self.handle_ps)
+        app.router.add_post("/api/generate", self.handle_generate)
+        app.router.add_post("/api/chat", self.handle_chat)
+        app.router.add_get("/mock/stats", self.handle_stats)
+        return app
+
+
+class MockServerThread(AppServerThread):
+    """在后台线程中运行模拟服务（供压测脚本与测试嵌入使用）"""
+
+    _thread_name = "mock-ollama"
+    _label = "模拟 Ollama 服务"
+
+    def __init__(self, mock: MockOllama = None, host: str = "127.0.0.1", port: int = 0):
+        self.mock = mock or MockOllama()
+        super().__init__(self.mock.make_app, host, port)
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser):
+    """模拟服务的命令行参数（mock_ollama_server.py 与 load_test.py 共用）"""
+    parser.add_argument("--models", nargs="+", default=None, help="可用模型列表（默认使用配置 OLLAMA_MODEL）")
+    parser.add_argument("--slots", type=int, default=4, help="并行槽位数（对应 OLLAMA_NUM_PARALLEL）")
+    parser.add_argument("--prefill-tps", type=float, default=2000.0, help="预填充速度（token/秒）")
+    parser.add_argument("--decode-tps", type=float, default=40.0, help="解码速度（token/秒）")
+    parser.add_argument("--max-tokens", type=int, default=64, help="普通生成返回的 token 数")
+    parser.add_argument("--load-ms", type=float, default=2000.0, help="模型冷加载耗时（毫秒）")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="返回 500 的请求比例")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="卡住的请求比例")
+    parser.add_argument("--stall-seconds", type=float, default=30.0, help="卡住的时长（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def mock_from_args(args) -> MockOllama:
+    from config import OLLAMA_MODEL
+    return MockOllama(models=args.models or [OLLAMA_MODEL], slots=args.slots, prefill_tps=args.prefill_tps,
+                      decode_tps=args.decode_tps, max_tokens=args.max_tokens, load_ms=args.load_ms,
+                      fail_rate=args.fail_rate, stall_rate=args.stall_rate, stall_seconds=args.stall_seconds,
+                      seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟 Ollama 服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=11434, help="监听端口")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    mock = mock_from_args(args)
+    print(f"✓ 模拟 Ollama 服务: http://{args.host}:{args.port}（模型 {mock.models}，{mock.slots} 个槽位，"
+          f"解码 {mock.decode_tps:g} token/s）")
+    web.run_app(mock.make_app(), host=args.host, port=args.port, print=None, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
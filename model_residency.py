@@ -0,0 +1,139 @@
+"""
+模型常驻管理：启动时预加载模型、轮询 /api/ps 掌握已加载的模型、被卸载后重新加载，
+并根据 Ollama 返回的 load_duration 判断每次请求由热模型还是冷启动提供
+"""
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from config import OLLAMA_PIN_MODELS, OLLAMA_RESIDENCY_POLL, OLLAMA_COLD_LOAD_MS
+from metrics import REGISTRY
+
+_MODEL_LOADED = REGISTRY.gauge("ollama_model_loaded", "模型是否已加载在 Ollama 主机上（来自 /api/ps）")
+_MODEL_REQUESTS = REGISTRY.counter("ollama_model_requests_total", "按模型与常驻状态（warm / cold）统计的请求数")
+_MODEL_PRELOADS = REGISTRY.counter("ollama_model_preloads_total", "预加载 / 被卸载后重新加载模型的次数")
+
+
+class ModelResidency:
+    """
+    单个 Ollama 主机上某个模型的常驻管理（进程内按 (主机, 模型) 共享）
+
+    pinned 中的模型在 start() 时预加载，后台线程每 poll_interval 秒查询一次 /api/ps，
+    发现被卸载（keep_alive 到期、显存被其他模型挤占）时重新加载。
+    """
+
+    _instances: Dict[Tuple[str, str], "ModelResidency"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, client, pinned: List[str] = None, poll_interval: float = None,
+                 cold_threshold_ms: float = None):
+        self.client = client
+        self.host = client.host
+        self.pinned = list(pinned) if pinned is not None else (OLLAMA_PIN_MODELS or [client.model])
+        self.poll_interval = OLLAMA_RESIDENCY_POLL if poll_interval is None else poll_interval
+        self.cold_threshold_ms = OLLAMA_COLD_LOAD_MS if cold_threshold_ms is None else cold_threshold_ms
+        self._lock = threading.Lock()
+        self._loaded: Dict[str, Dict] = {}  # 模型名 → /api/ps 返回的条目
+        self._last_refresh = 0.0
+        self._thread = None
+        self._stop = threading.Event()
+
+    @classmethod
+    def shared(cls, client) -> "ModelResidency":
+        """按 (主机, 模型) 共享的实例：同一主机上使用不同模型的客户端各自常驻自己的模型"""
+        key = (client.host, client.model)
+        with cls._instances_lock:
+            residency = cls._instances.get(key)
+            if residency is None:
+                residency = cls(client)
+                cls._instances[key] = residency
+            return residency
+
+    def refresh(self) -> Dict[str, Dict]:
+        """查询 /api/ps，更新已加载模型列表"""
+        models = self.client.running_models()
+        loaded = {}
+        for entry in models:
+            for name in {entry.get("name"), entry.get("model")} - {None}:
+                loaded[name] = entry
+        with self._lock:
+            for name in set(self._loaded) - set(loaded):
+                _MODEL_LOADED.set(0, host=self.host, model=name)
+            self._loaded = loaded
+            self._last_refresh = time.time()
+        for entry in models:
+            _MODEL_LOADED.set(1, host=self.host, model=entry.get("name") or entry.get("model"))
+        return loaded
+
+    def loaded_models(self) -> Dict[str, Dict]:
+        """最近一次轮询时已加载的模型（不发送请求）"""
+        with self._lock:
+            return dict(self._loaded)
+
+    def is_loaded(self, model: str = None) -> Optional[bool]:
+        """模型是否已加载；尚未轮询过时返回 None"""
+        model = model or self.client.model
+        with self._lock:
+            if not self._last_refresh:
+                return None
+            return model in self._loaded
+
+    def preload(self, models: List[str] = None) -> Dict[str, bool]:
+        """加载模型（空提示词的 /api/generate 请求，不做生成）"""
+        results = {}
+        for model in models or self.pinned:
+            try:
+                start = time.perf_counter()
+                self.client.load_model(model)
+                _MODEL_PRELOADS.inc(host=self.host, model=model)
+                print(f"✓ 模型已加载: {model}（{time.perf_counter() - start:.1f} 秒）")
+                results[model] = True
+            except Exception as e:
+                print(f"⚠️ 模型加载失败: {model}: {e}")
+                results[model] = False
+        return results
+
+    def ensure_pinned(self) -> List[str]:
+        """重新加载被卸载的常驻模型，返回本次重新加载的模型列表"""
+        try:
+            loaded = self.refresh()
+        except Exception as e:
+            print(f"⚠️ 查询已加载模型失败: {e}")
+            return []
+        missing = [m for m in self.pinned if m not in loaded]
+        if missing:
+            self.preload(missing)
+            try:
+                self.refresh()
+            except Exception:
+                pass
+        return missing
+
+    def start(self) -> "ModelResidency":
+        """预加载常驻模型并启动后台轮询（重复调用无副作用）"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return self
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=f"ollama-residency-{self.host}-{self.client.model}",
+                                            daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.ensure_pinned()
+            if self.poll_interval <= 0:
+                return
+            self._stop.wait(self.poll_interval)
+
+    def observe(self, model: str, stats: Dict) -> str:
+        """
+        根据响应中的 load_duration（纳秒）判断本次请求由热模型（warm）还是冷启动（cold）提供，计入指标
+        """
+        load_ms = (stats.get("load_duration") or 0) / 1e6
+        state = "cold" if load_ms >= self.cold_threshold_ms else "warm"
+        _MODEL_REQUESTS.inc(host=self.host, model=model, residency=state)
+        return state
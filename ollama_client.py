@@ -2,22 +2,230 @@
 Ollama 客户端：负责与 PC 端的 Ollama 服务通信
 """
 import requests
+import hashlib
+import itertools
 import json
+import threading
 import time
-from typing import Dict, Optional, Generator
-from config import OLLAMA_HOST, OLLAMA_MODEL, REQUEST_TIMEOUT, MAX_RETRIES,OLLAMA_KEEP_ALIVE
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Generator
+from config import (
+    OLLAMA_HOST, OLLAMA_MODEL, REQUEST_TIMEOUT, MAX_RETRIES,OLLAMA_KEEP_ALIVE, OLLAMA_SINGLE_FLIGHT,
+    OLLAMA_HOSTS, OLLAMA_CONNECT_TIMEOUT, OLLAMA_HEDGE, OLLAMA_HEDGE_QUANTILE, OLLAMA_HEDGE_MIN_DELAY,
+    OLLAMA_HEDGE_INITIAL_DELAY, LLM_SCHEDULER,
+)
+import tracing
+from llm_scheduler import INTERACTIVE, LLMScheduler
+from llm_telemetry import LLMTelemetry, trace_attributes
+from metrics import REGISTRY
+from model_residency import ModelResidency
+from resilience import CircuitBreaker, CircuitOpenError, LatencyWindow
+from single_flight import SingleFlight
+
+_REQUESTS = REGISTRY.counter("ollama_requests_total", "调用方发起的 LLM 请求数")
+_UPSTREAM_REQUESTS = REGISTRY.counter("ollama_upstream_requests_total", "实际发送到 Ollama 的请求数")
+_COALESCED_REQUESTS = REGISTRY.counter("ollama_coalesced_requests_total", "合并到在途相同请求、未发送到 Ollama 的请求数")
+_INFLIGHT = REGISTRY.gauge("ollama_inflight_requests", "正在进行的上游 Ollama 请求数")
+_HEDGED_REQUESTS = REGISTRY.counter("ollama_hedged_requests_total", "超过对冲截止时间、额外发出的对冲请求数")
+_HEDGE_WINS = REGISTRY.counter("ollama_hedge_wins_total", "对冲请求先于原请求返回的次数")
+
+
+def _loads_line(line: bytes) -> Optional[Dict]:
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        obj = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+    return obj if isinstance(obj, dict) else None
+
+
+def iter_ndjson(chunks: Iterable[bytes]) -> Iterator[Dict]:
+    """
+    增量 NDJSON 解码：缓冲网络数据块，每凑齐一行立即解析并返回一个 JSON 对象
+
+    只对完整的行解码，多字节字符被数据块截断也不会出错；无法解析的行被跳过。
+    """
+    buffer = b""
+    for chunk in chunks:
+        if not chunk:
+            continue
+        buffer += chunk
+        if b"\n" not in chunk:
+            continue
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            obj = _loads_line(line)
+            if obj is not None:
+                yield obj
+    obj = _loads_line(buffer)
+    if obj is not None:
+        yield obj
+
+
+def keep_alive_value(keep_alive=None):
+    """
+    keep_alive 请求参数：Ollama 接受时长字符串（"5m"）或秒数，纯数字字符串（"0"、"-1"）转为数字
+    """
+    keep_alive = OLLAMA_KEEP_ALIVE if keep_alive is None else keep_alive
+    if isinstance(keep_alive, str) and keep_alive.strip().lstrip("-").isdigit():
+        return int(keep_alive)
+    return keep_alive
+
+
+def build_generate_payload(model: str, prompt: str, system: str = None, temperature: float = 0.7,
+                           stream: bool = False) -> Dict:
+    """构建 /api/generate 请求体（同步与异步客户端共用）"""
+    data = {
+        "model": model,
+        "prompt": prompt,
+        "stream": stream,
+        # keep_alive 是请求级参数，放在 options 中会被 Ollama 忽略
+        "keep_alive": keep_alive_value(),
+        "options": {
+            "temperature": temperature,
+        }
+    }
+    if system:
+        data["system"] = system
+    return data
+
+
+def build_chat_payload(model: str, messages: list, temperature: float = 0.7) -> Dict:
+    """构建 /api/chat 请求体（同步与异步客户端共用）"""
+    return {
+        "model": model,
+        "messages": messages,
+        "stream": False,
+        "keep_alive": keep_alive_value(),
+        "options": {
+            "temperature": temperature
+        }
+    }
 
 
 class OllamaClient:
-    """Ollama API 客户端封装"""
-    
-    def __init__(self, host: str = None, model: str = None):
+    """
+    Ollama API 客户端封装
+
+    single_flight=True 时，同时在途的相同请求（主机、接口、请求体均相同）只向 Ollama 发送一次：
+    非流式调用共享同一个响应，流式调用通过扇出缓冲区接收同一串 token。合并表在所有实例间共享。
+
+    每个主机有一个熔断器（进程内共享）：熔断中的主机被跳过，全部熔断时立即失败而不是等待超时。
+    hedge=True 时，若首字节（非流式为完整响应，流式为第一行）在截止时间内未到达，
+    向另一台可用的备用主机再发一份请求，取先返回者（只有一台可用主机时不对冲）。
+    截止时间取最近首字节延迟的 OLLAMA_HEDGE_QUANTILE 分位数。
+
+    启用调度（LLM_SCHEDULER）时，上游请求先按 priority（interactive / batch）向主机的调度器申请槽位，
+    排队耗时写入统计对象的 scheduler 字段；合并到在途请求的调用不占用槽位。
+    """
+
+    # 进程级合并表：Streamlit 每个会话各自持有客户端实例，重复请求往往来自不同实例
+    _single_flight = SingleFlight("ollama")
+    # 进程级首字节延迟窗口（按接口），用于推导对冲截止时间
+    _latency = LatencyWindow()
+    _hedge_pool = None
+    _hedge_pool_lock = threading.Lock()
+
+    def __init__(self, host: str = None, model: str = None, single_flight: bool = None,
+                 hosts: List[str] = None, hedge: bool = None, priority: str = INTERACTIVE,
+                 scheduler: bool = None):
         self.host = host or OLLAMA_HOST
         self.model = model or OLLAMA_MODEL
         self.base_url = f"{self.host}/api"
+        self.single_flight = OLLAMA_SINGLE_FLIGHT if single_flight is None else single_flight
+        # 候选主机：主主机在前，其后为备用主机
+        self.hosts = list(dict.fromkeys([self.host] + list(OLLAMA_HOSTS if hosts is None else hosts)))
+        self.hedge = OLLAMA_HEDGE if hedge is None else hedge
+        # 请求类别：界面等交互请求为 interactive，ETL、批量生成为 batch
+        self.priority = priority
+        # 主主机的调度器（RAG 服务据此统一申请槽位并展示排队情况）；
+        # 客户端自行调度时，每次尝试向实际发送请求的主机（重试换主机、对冲请求）的调度器申请槽位
+        self.scheduler = LLMScheduler.for_host(self.host) if (LLM_SCHEDULER if scheduler is None else scheduler) else None
         # 复用 HTTP 连接，降低 TCP/TLS/握手开销
         self.session = requests.Session()
 
+    def _flight_key(self, endpoint: str, data: Dict) -> str:
+        """合并键：主机 + 接口 + 请求体（含模型、系统提示词、提示词与全部参数）"""
+        payload = json.dumps([self.base_url, endpoint, data], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    @tracing.traced("llm.request")
+    def _request(self, endpoint: str, data: Dict) -> Dict:
+        """发送非流式请求；启用合并时与在途的相同请求共享响应"""
+        _REQUESTS.inc(endpoint=endpoint, mode="unary")
+        request_span = tracing.current().set(endpoint=endpoint, model=self.model, priority=self.priority)
+        if not self.single_flight:
+            response = self._upstream_request(endpoint, data)
+        else:
+            response, shared = self._single_flight.do(
+                self._flight_key(endpoint, data), lambda: self._upstream_request(endpoint, data)
+            )
+            if shared:
+                _COALESCED_REQUESTS.inc(endpoint=endpoint, mode="unary")
+            request_span.set(coalesced=shared)
+        if request_span:
+            request_span.set(**trace_attributes(response))
+        return response
+
+    def _acquire_slot(self, host: str, trace_parent=None):
+        """向 host 的调度器申请槽位（未启用调度时返回 None），排队时间记为 llm.queue span"""
+        if self.scheduler is None:
+            return None
+        with tracing.span("llm.queue", parent=trace_parent, priority=self.priority, host=host):
+            return LLMScheduler.for_host(host).acquire(self.priority)
+
+    @staticmethod
+    def _release_slot(host: str, ticket):
+        """归还 host 调度器的槽位（重复调用无效）"""
+        if ticket is not None:
+            LLMScheduler.for_host(host).release(ticket)
+
+    def _upstream_request(self, endpoint: str, data: Dict) -> Dict:
+        _UPSTREAM_REQUESTS.inc(endpoint=endpoint, mode="unary")
+        _INFLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            response = self._make_request(endpoint, data, tracing.current())
+        finally:
+            _INFLIGHT.dec()
+        self._observe(response, (time.perf_counter() - start) * 1000)
+        return response
+
+    def _observe(self, stats: Dict, wall_ms: float):
+        """
+        记录本次请求的常驻状态与时间构成：写入 stats["residency"]（warm / cold）、
+        stats["host"]（实际应答的主机）与 stats["telemetry"]（见 llm_telemetry.derive）
+        """
+        model = stats.get("model") or self.model
+        host = stats.setdefault("host", self.host)
+        stats["residency"] = self.residency.observe(model, stats)
+        stats["telemetry"] = LLMTelemetry.shared().record(model, host, stats, wall_ms)
+
+    @property
+    def residency(self) -> ModelResidency:
+        """当前主机的模型常驻管理（进程内共享）"""
+        return ModelResidency.shared(self)
+
+    def load_model(self, model: str = None, keep_alive=None) -> Dict:
+        """
+        加载模型并按 keep_alive 保持常驻：不带提示词的 /api/generate 请求只加载模型、不做生成
+        """
+        response = self.session.post(
+            f"{self.base_url}/generate",
+            json={"model": model or self.model, "keep_alive": keep_alive_value(keep_alive)},
+            timeout=(OLLAMA_CONNECT_TIMEOUT, REQUEST_TIMEOUT),
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def running_models(self, timeout: float = 5) -> List[Dict]:
+        """当前加载在 Ollama 主机上的模型（/api/ps）"""
+        response = self.session.get(f"{self.base_url}/ps", timeout=timeout)
+        response.raise_for_status()
+        return response.json().get("models", [])
+
     def warm_connection(self, timeout: int = 5):
         """
         轻量预热：建立连接并保活，降低首请求延迟
@@ -29,29 +237,141 @@ class OllamaClient:
         except Exception:
             return False
     
-    def _make_request(self, endpoint: str, data: Dict, retry_count: int = 0) -> Dict:
-        """发送请求，带重试机制"""
-        url = f"{self.base_url}/{endpoint}"
-        
+    def _ready_hosts(self) -> List[str]:
+        """未熔断的主机：近期无失败的在前，其余保持配置顺序"""
+        breakers = [CircuitBreaker.for_host(h) for h in self.hosts]
+        return [b.host for b in sorted((b for b in breakers if b.available()), key=lambda b: b.failures > 0)]
+
+    @classmethod
+    def _get_hedge_pool(cls) -> ThreadPoolExecutor:
+        with cls._hedge_pool_lock:
+            if cls._hedge_pool is None:
+                cls._hedge_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="ollama-hedge")
+            return cls._hedge_pool
+
+    def _hedge_delay(self, key: str) -> float:
+        p = self._latency.quantile(key, OLLAMA_HEDGE_QUANTILE)
+        return OLLAMA_HEDGE_INITIAL_DELAY if p is None else max(OLLAMA_HEDGE_MIN_DELAY, p)
+
+    def _attempt(self, host: str, key: str, send: Callable, trace_parent=None):
+        """
+        向单个主机发送一次请求：启用调度时先向该主机的调度器申请槽位，再经熔断器放行，记录成功 / 失败与首字节延迟
+
+        send(host, ticket) 负责在请求完成后归还槽位（流式请求在流结束时归还）；出错时由这里归还
+        """
+        ticket = self._acquire_slot(host, trace_parent)
+        breaker = CircuitBreaker.for_host(host)
+        if not breaker.allow():
+            self._release_slot(host, ticket)
+            raise CircuitOpenError(f"Ollama 主机 {host} 处于熔断状态")
+        start = time.perf_counter()
         try:
-            response = self.session.post(
-                url,
-                json=data,
-                timeout=REQUEST_TIMEOUT,
-                stream=False
-            )
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            if retry_count < MAX_RETRIES:
-                wait_time = 2 ** retry_count  # 指数退避
-                print(f"请求失败，{wait_time}秒后重试... (尝试 {retry_count + 1}/{MAX_RETRIES})")
-                time.sleep(wait_time)
-                return self._make_request(endpoint, data, retry_count + 1)
+            result = send(host, ticket)
+        except requests.exceptions.HTTPError as e:
+            self._release_slot(host, ticket)
+            # 4xx（如模型不存在）与主机健康无关，不计入熔断
+            if e.response is None or e.response.status_code >= 500:
+                breaker.record_failure()
             else:
-                raise Exception(f"请求失败，已重试 {MAX_RETRIES} 次: {str(e)}")
+                breaker.record_success()
+            raise
+        except Exception:
+            self._release_slot(host, ticket)
+            # 连接错误、超时以及无法解析的响应都计为失败；否则半开状态的探测名额永远不会归还
+            breaker.record_failure()
+            raise
+        except BaseException:
+            self._release_slot(host, ticket)
+            # KeyboardInterrupt 等本地中断：归还探测名额，不计入主机健康
+            breaker.release()
+            raise
+        breaker.record_success()
+        self._latency.observe(key, time.perf_counter() - start)
+        return result
+
+    def _hedged(self, key: str, send: Callable, discard: Callable = None, trace_parent=None):
+        """选择主机发送请求；启用对冲时超过截止时间再发一份，取先成功者，落选的结果交给 discard 释放"""
+        hosts = self._ready_hosts()
+        if not hosts:
+            raise CircuitOpenError(f"所有 Ollama 主机均处于熔断状态: {self.hosts}")
+        if not self.hedge or len(hosts) < 2:
+            # 没有其他可用主机时不对冲：向同一主机再发一份只会在它已经变慢时加倍占用 GPU
+            return self._attempt(hosts[0], key, send, trace_parent)
+
+        pool = self._get_hedge_pool()
+        primary = pool.submit(self._attempt, hosts[0], key, send, trace_parent)
+        futures = [primary]
+        done, _ = wait(futures, timeout=self._hedge_delay(key))
+        if not done:
+            _HEDGED_REQUESTS.inc(endpoint=key)
+            # 对冲请求同样占用备用主机调度器的槽位
+            futures.append(pool.submit(self._attempt, hosts[1], key, send, trace_parent))
+
+        pending, error, winner = set(futures), None, None
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                elif winner is None:
+                    winner = future
+                elif discard is not None:
+                    discard(future.result())
+        if winner is None:
+            raise error
+        if winner is not primary:
+            _HEDGE_WINS.inc(endpoint=key)
+        if discard is not None:
+            for future in pending:
+                future.add_done_callback(lambda f: f.exception() is None and discard(f.result()))
+        return winner.result()
+
+    def _with_retries(self, key: str, send: Callable, discard: Callable = None, trace_parent=None):
+        """发送请求，带重试机制：有其他可用主机时立即换主机重试，否则指数退避；所有主机熔断时立即失败"""
+        for retry_count in range(MAX_RETRIES + 1):
+            try:
+                return self._hedged(key, send, discard, trace_parent)
+            except CircuitOpenError as e:
+                if not self._ready_hosts():
+                    raise Exception(f"请求失败: {e}")
+                error = e
+            except requests.exceptions.RequestException as e:
+                error = e
+            if retry_count >= MAX_RETRIES:
+                raise Exception(f"请求失败，已重试 {MAX_RETRIES} 次: {str(error)}")
+            ready = self._ready_hosts()
+            if not ready:
+                raise Exception(f"请求失败，所有 Ollama 主机均处于熔断状态: {str(error)}")
+            if len(ready) > 1:
+                print(f"请求失败，切换主机重试... (尝试 {retry_count + 1}/{MAX_RETRIES})")
+                continue
+            wait_time = 2 ** retry_count  # 指数退避
+            print(f"请求失败，{wait_time}秒后重试... (尝试 {retry_count + 1}/{MAX_RETRIES})")
+            time.sleep(wait_time)
+
+    def _make_request(self, endpoint: str, data: Dict, trace_parent=None) -> Dict:
+        """发送非流式请求（启用调度时响应另含 scheduler: 请求类别与排队耗时）"""
+        def send(host: str, ticket) -> Dict:
+            try:
+                response = self.session.post(
+                    f"{host}/api/{endpoint}",
+                    json=data,
+                    timeout=(OLLAMA_CONNECT_TIMEOUT, REQUEST_TIMEOUT),
+                    stream=False
+                )
+                response.raise_for_status()
+                result = response.json()
+            finally:
+                self._release_slot(host, ticket)
+            result["host"] = host
+            if ticket is not None:
+                result["scheduler"] = ticket.report()
+            return result
+
+        return self._with_retries(endpoint, send, trace_parent=trace_parent)
     
-    def generate(self, prompt: str, system: str = None, temperature: float = 0.7) -> str:
+    def generate(self, prompt: str, system: str = None, temperature: float = 0.7,
+                 on_done: Callable[[Dict], None] = None) -> str:
         """
         生成文本
         
@@ -59,24 +379,16 @@ class OllamaClient:
             prompt: 用户提示词
             system: 系统提示词
             temperature: 温度参数
+            on_done: 可选，以完整响应调用（含耗时统计、residency: warm / cold、telemetry 时间构成，
+                     启用调度时另含 scheduler: 请求类别与排队耗时）
         
         Returns:
             生成的文本内容
         """
-        data = {
-            "model": self.model,
-            "prompt": prompt,
-            "stream": False,
-            "options": {
-                "temperature": temperature,
-                "keep_alive": OLLAMA_KEEP_ALIVE,
-            }
-        }
-        
-        if system:
-            data["system"] = system
-        
-        response = self._make_request("generate", data)
+        data = build_generate_payload(self.model, prompt, system, temperature)
+        response = self._request("generate", data)
+        if on_done is not None:
+            on_done(response)
         return response.get("response", "")
 
     def stream_generate(
@@ -84,44 +396,126 @@ class OllamaClient:
         prompt: str,
         system: str = None,
         temperature: float = 0.7,
+        on_done: Callable[[Dict], None] = None,
     ) -> Generator[str, None, None]:
         """
         流式生成文本，逐步返回 token
+
+        启用合并时，若相同请求的流正在进行，则加入该流：先补齐已生成的 token，再同步接收后续 token。
+
+        on_done: 流正常结束时以 Ollama 的最终统计对象调用（含 eval_count、eval_duration、
+                 prompt_eval_duration 等字段，以及 residency: warm / cold、telemetry 时间构成，
+                 启用调度时另含 scheduler: 请求类别与排队耗时）；
+                 调用方提前退出或连接中断时不调用
         """
-        data = {
-            "model": self.model,
-            "prompt": prompt,
-            "stream": True,
-            "options": {
-                "temperature": temperature,
-                "keep_alive": OLLAMA_KEEP_ALIVE,
-                }
-        }
+        data = build_generate_payload(self.model, prompt, system, temperature, stream=True)
+        _REQUESTS.inc(endpoint="generate", mode="stream")
+        stream_span = tracing.span("llm.stream", model=self.model, priority=self.priority)
+        try:
+            if not self.single_flight:
+                tokens = self._upstream_stream(data, stream_span)
+            else:
+                # 上游流在合并器的后台线程中读取，span 的父子关系通过参数显式传递
+                tokens, shared = self._single_flight.stream(
+                    self._flight_key("generate", data), lambda: self._upstream_stream(data, stream_span)
+                )
+                if shared:
+                    _COALESCED_REQUESTS.inc(endpoint="generate", mode="stream")
+                stream_span.set(coalesced=shared)
+            stats = yield from (self._trace_stream(tokens, stream_span) if stream_span else tokens)
+        finally:
+            stream_span.end()
+        if on_done is not None and stats is not None:
+            on_done(stats)
+
+    @staticmethod
+    def _trace_stream(tokens, stream_span) -> Generator[str, None, Optional[Dict]]:
+        """透传 token，记录首 token 前（llm.ttft）与解码（llm.decode）两个 span，返回上游的最终统计对象"""
+        ttft_span = tracing.span("llm.ttft", parent=stream_span)
+        decode_span = None
+        count = 0
+        stats = None
+        try:
+            while True:
+                try:
+                    token = next(tokens)
+                except StopIteration as stop:
+                    stats = stop.value
+                    break
+                if decode_span is None:
+                    ttft_span.end()
+                    decode_span = tracing.span("llm.decode", parent=stream_span)
+                count += 1
+                yield token
+        except GeneratorExit:
+            stream_span.set(cancelled=True)
+            close = getattr(tokens, "close", None)
+            if close is not None:
+                close()
+            raise
+        finally:
+            ttft_span.end()
+            if decode_span is not None:
+                decode_span.set(chunks=count).end()
+            if stats is not None:
+                stream_span.set(**trace_attributes(stats))
+        return stats
 
-        if system:
-            data["system"] = system
+    def _open_stream(self, host: str, ticket, data: Dict):
+        """
+        建立流式连接并解码出第一个 JSON 对象（首字节到达），返回 (响应, 第一个对象, 对象迭代器, 主机, 槽位)
 
-        with self.session.post(
-            f"{self.base_url}/generate",
+        槽位在流结束时由调用方（或 _close_stream）归还
+        """
+        r = self.session.post(
+            f"{host}/api/generate",
             json=data,
-            timeout=REQUEST_TIMEOUT,
+            timeout=(OLLAMA_CONNECT_TIMEOUT, REQUEST_TIMEOUT),
             stream=True
-        ) as r:
+        )
+        try:
             r.raise_for_status()
-            # 逐行读取，chunk_size=1 可减少等待缓冲
-            for line in r.iter_lines(chunk_size=1, decode_unicode=True):
-                if not line:
-                    continue
-                try:
-                    obj = json.loads(line)
-                except json.JSONDecodeError:
-                    continue
-                # Ollama 流式返回中，done=true 表示结束
-                if obj.get("done"):
-                    break
-                token = obj.get("response", "")
-                if token:
-                    yield token
+            # chunk_size=None：数据块一到达就返回（Ollama 使用 chunked 传输，每个 token 单独刷新），由 iter_ndjson 拼行
+            objects = iter_ndjson(r.iter_content(chunk_size=None))
+            first = next(objects, None)
+        except BaseException:
+            r.close()
+            raise
+        return r, first, objects, host, ticket
+
+    def _close_stream(self, opened):
+        """关闭 _open_stream 建立的连接并归还槽位（对冲落选的流）"""
+        opened[0].close()
+        self._release_slot(opened[3], opened[4])
+
+    def _upstream_stream(self, data: Dict, trace_parent=None) -> Generator[str, None, Optional[Dict]]:
+        """读取上游流并逐个返回 token；生成器的返回值为 done=true 的最终统计对象（连接提前结束时为 None）"""
+        _UPSTREAM_REQUESTS.inc(endpoint="generate", mode="stream")
+        _INFLIGHT.inc()
+        host, ticket = None, None
+        try:
+            start = time.perf_counter()
+            r, first, objects, host, ticket = self._with_retries(
+                "generate:stream", lambda host, ticket: self._open_stream(host, ticket, data),
+                discard=self._close_stream, trace_parent=trace_parent,
+            )
+            with r:
+                for obj in itertools.chain([first] if first is not None else [], objects):
+                    # Ollama 流式返回中，done=true 表示结束，该对象携带本次请求的耗时与 token 统计
+                    if obj.get("done"):
+                        obj["host"] = host
+                        if ticket is not None:
+                            obj["scheduler"] = ticket.report()
+                        self._observe(obj, (time.perf_counter() - start) * 1000)
+                        return obj
+                    token = obj.get("response", "")
+                    if token:
+                        yield token
+            return None
+        finally:
+            _INFLIGHT.dec()
+            # 流结束、出错或调用方提前关闭时归还应答主机的槽位
+            self._release_slot(host, ticket)
     
     def chat(self, messages: list, temperature: float = 0.7) -> str:
         """
@@ -134,16 +528,8 @@ class OllamaClient:
         Returns:
             生成的文本内容
         """
-        data = {
-            "model": self.model,
-            "messages": messages,
-            "stream": False,
-            "options": {
-                "temperature": temperature
-            }
-        }
-        
-        response = self._make_request("chat", data)
+        data = build_chat_payload(self.model, messages, temperature)
+        response = self._request("chat", data)
         return response.get("message", {}).get("content", "")
     
     def test_connection(self) -> bool:
@@ -0,0 +1,123 @@
+"""
+RAG 服务客户端（同步）：调用 rag_server.py 的 HTTP 接口
+
+search / generate / stream_generate 的参数与返回值分别与 VectorStore.search、RAGGenerator.generate、
+RAGGenerator.stream_generate 一致，Streamlit 与脚本可以直接替换使用，本进程不加载索引和模型。
+"""
+import json
+from typing import Callable, Dict, Iterator, List, Tuple
+import requests
+from config import RAG_SERVER_URL, REQUEST_TIMEOUT, OLLAMA_CONNECT_TIMEOUT
+
+
+def iter_sse(chunks: Iterator[bytes]) -> Iterator[Tuple[str, Dict]]:
+    """增量解析 SSE 字节流，逐个返回 (事件名, data 解析出的 JSON)"""
+    buffer = b""
+    for chunk in chunks:
+        buffer += chunk
+        start = 0
+        while True:
+            end = buffer.find(b"\n\n", start)
+            if end < 0:
+                break
+            event, data = "message", []
+            for line in buffer[start:end].decode('utf-8').split("\n"):
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    data.append(line[5:].lstrip())
+            start = end + 2
+            if data:
+                yield event, json.loads("\n".join(data))
+        buffer = buffer[start:]
+
+
+class RAGServiceError(RuntimeError):
+    pass
+
+
+class RAGServiceClient:
+    """rag_server.py 的同步客户端（连接复用，线程安全程度与 requests.Session 相同）"""
+
+    def __init__(self, url: str = None, timeout: float = None):
+        self.url = (url or RAG_SERVER_URL).rstrip("/")
+        self.timeout = timeout or REQUEST_TIMEOUT
+        self.session = requests.Session()
+
+    def _post(self, path: str, payload: Dict, stream: bool = False) -> requests.Response:
+        response = self.session.post(f"{self.url}{path}", json=payload, stream=stream,
+                                     timeout=(OLLAMA_CONNECT_TIMEOUT, self.timeout))
+        if response.status_code >= 400:
+            try:
+                message = response.json().get("error", response.text)
+            except ValueError:
+                message = response.text
+            response.close()
+            raise RAGServiceError(f"RAG 服务返回 {response.status_code}: {message}")
+        return response
+
+    def health(self) -> Dict:
+        response = self.session.get(f"{self.url}/health", timeout=(OLLAMA_CONNECT_TIMEOUT, 10))
+        response.raise_for_status()
+        return response.json()
+
+    def metrics(self) -> str:
+        response = self.session.get(f"{self.url}/metrics", timeout=(OLLAMA_CONNECT_TIMEOUT, 10))
+        response.raise_for_status()
+        return response.text
+
+    def search(self, query: str, top_k: int = 5, mmr: bool = None, rerank: bool = None, fields: bool = None,
+               timings: Dict = None) -> List[Tuple[Dict, float]]:
+        """同 VectorStore.search，返回 (元数据, 距离) 元组列表"""
+        data = self._post("/search", {"query": query, "top_k": top_k, "mmr": mmr, "rerank": rerank,
+                                      "fields": fields}).json()
+        if timings is not None:
+            timings.update(data.get("timings", {}))
+        return [(r["item"], r["distance"]) for r in data["results"]]
+
+    def generate(self, user_intent: str, top_k: int = None, mmr: bool = None, rerank: bool = None,
+                 fields: bool = None, use_cache: bool = True, n_variants: int = 1) -> Dict:
+        """同 RAGGenerator.generate"""
+        return self._post("/generate", {"intent": user_intent, "top_k": top_k, "mmr": mmr, "rerank": rerank,
+                                        "fields": fields, "use_cache": use_cache, "n_variants": n_variants}).json()
+
+    def stream_generate(self, user_intent: str, top_k: int = None, mmr: bool = None, rerank: bool = None,
+                        fields: bool = None, timings: Dict = None, use_cache: bool = True,
+                        on_done: Callable[[Dict], None] = None, n_variants: int = 1, retrieve: bool = True):
+        """
+        同 RAGGenerator.stream_generate，返回 (token_generator, references)
+
+        在收到参考素材（检索完成）后返回；retrieve=False 时跳过参考素材，只用用户意图生成
+        """
+        response = self._post("/generate/stream", {
+            "intent": user_intent, "top_k": top_k, "mmr": mmr, "rerank": rerank, "fields": fields,
+            "use_cache": use_cache, "n_variants": n_variants, "retrieve": retrieve,
+        }, stream=True)
+        events = iter_sse(response.iter_content(chunk_size=None))
+        try:
+            event, data = next(events)
+        except StopIteration:
+            response.close()
+            raise RAGServiceError("RAG 服务提前关闭了连接")
+        if event != "references":
+            response.close()
+            raise RAGServiceError(data.get("error", f"意外的事件: {event}"))
+        if timings is not None:
+            timings.update(data.get("timings", {}))
+
+        def tokens():
+            try:
+                for event, data in events:
+                    if event == "token":
+                        yield data["text"]
+                    elif event == "done":
+                        if on_done is not None and data.get("llm"):
+                            on_done(data["llm"])
+                        return
+                    elif event == "error":
+                        raise RAGServiceError(data.get("error", "生成失败"))
+                raise RAGServiceError("RAG 服务提前关闭了连接")
+            finally:
+                response.close()
+
+        return tokens(), data["references"]
@@ -1,20 +1,91 @@
 """
 RAG 生成模块：结合检索结果和用户意图，生成最终 Prompt
 """
-from typing import List, Dict
+import asyncio
+import itertools
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, ThreadPoolExecutor, wait
+import numpy as np
+from typing import List, Dict, Generator, Iterable, Iterator, Optional, Tuple
+import tracing
 from ollama_client import OllamaClient
 from vector_store import VectorStore
-from config import TOP_K
+from semantic_cache import SemanticCache
+from config import TOP_K, SEMANTIC_CACHE_ENABLED, BATCH_CONCURRENCY, BATCH_CHUNK_SIZE
+
+# 语义缓存命中时，每次输出的字符数
+_REPLAY_CHUNK = 8
+
+# 多个备选提示词的分隔标记：【变体1】（也兼容 "变体 1:"、"### 变体1" 等写法）
+_VARIANT_MARKER = re.compile(r"^[ \t#*]*[【\[]?[ \t]*变体[ \t]*(\d+)[ \t]*[】\]]?[ \t]*[:：.、]?[ \t]*", re.M)
+# 模型没有按标记输出时，退化为按编号列表（1. / 1、/ 1)）拆分
+_NUMBERED_ITEM = re.compile(r"^[ \t]*(\d+)[.、)）][ \t]*", re.M)
+# 流式输出时末尾尚未收全的标记（如 "【变"）
+_PARTIAL_MARKER = re.compile(r"\s*[【\[][ \t]*(?:变(?:体[ \t]*\d*)?)?[ \t]*$")
+# 估算 token 数：中日韩字符约各占一个 token，其余字符约 4 个一个 token
+_CJK_CHAR = re.compile(r"[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的 token 数（不加载分词器，用于追踪与日志）"""
+    cjk = len(_CJK_CHAR.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def variant_instruction(n_variants: int) -> str:
+    """要求模型在一次调用中输出多个备选提示词的指令（放在用户提示词末尾）"""
+    if n_variants <= 1:
+        return "请根据以上信息，生成一段高质量的中文绘图提示词："
+    return (f"请根据以上信息，生成 {n_variants} 段构图、风格或氛围各不相同的高质量中文绘图提示词。"
+            f"每段单独成行并以“【变体k】”开头（k 为 1 到 {n_variants}），不要输出其他内容：")
+
+
+def parse_variants(text: str, n_variants: int = None) -> List[str]:
+    """
+    从一次生成的输出中拆分出各个备选提示词
+    
+    流式输出过程中也可以对已收到的文本调用（最后一段可能尚未写完）。
+    没有找到标记或编号时，整段文本作为唯一的结果。
+    """
+    for pattern in (_VARIANT_MARKER, _NUMBERED_ITEM):
+        matches = list(pattern.finditer(text))
+        if matches:
+            ends = [m.start() for m in matches[1:]] + [len(text)]
+            variants = [text[m.end():end].strip() for m, end in zip(matches, ends)]
+            variants[-1] = _PARTIAL_MARKER.sub("", variants[-1])
+            variants = [v for v in variants if v]
+            return variants[:n_variants] if n_variants else variants
+    text = text.strip()
+    return [text] if text else []
 
 
 class RAGGenerator:
     """RAG 检索增强生成器"""
     
-    def __init__(self, vector_store: VectorStore, ollama_client: OllamaClient = None):
+    def __init__(self, vector_store: VectorStore, ollama_client: OllamaClient = None, async_client=None,
+                 cache: SemanticCache = None, executor: Executor = None):
         self.vector_store = vector_store
         self.client = ollama_client or OllamaClient()
+        # 语义缓存：默认在启用时使用进程级共享实例（所有会话共用）
+        if cache is None and SEMANTIC_CACHE_ENABLED:
+            cache = SemanticCache.shared()
+        self.cache = cache
+        # 异步客户端（AsyncOllamaClient），调用异步接口时按需创建
+        self._async_client = async_client
+        # 异步接口中执行检索（查询编码 + FAISS）的线程池，None 时使用事件循环的默认线程池
+        self.executor = executor
         self.system_prompt = self._get_system_prompt()
     
+    @property
+    def async_client(self):
+        """异步 Ollama 客户端（与同步客户端使用相同的服务地址和模型）"""
+        if self._async_client is None:
+            from async_ollama_client import AsyncOllamaClient
+            self._async_client = AsyncOllamaClient(host=self.client.host, model=self.client.model,
+                                                   priority=self.client.priority)
+        return self._async_client
+    
     def _get_system_prompt(self) -> str:
         """获取用于生成最终 Prompt 的系统提示词"""
         return """你是一位专业的 AI 绘图提示词工程师。你的任务是根据用户意图和参考素材，生成一段高质量、可直接用于 ComfyUI 的中文提示词。
@@ -58,66 +129,447 @@ class RAGGenerator:
         
         return "\n".join(context_parts)
     
-    def generate(self, user_intent: str, top_k: int = None) -> Dict:
+    @tracing.traced("rag.context")
+    def _build_user_prompt(self, user_intent: str, retrieved_items: List[Dict], n_variants: int = 1) -> str:
+        """上下文 + 生成指令（n_variants > 1 时要求一次输出多个带标记的备选提示词）"""
+        context = self._build_context(user_intent, retrieved_items)
+        user_prompt = f"{context}\n\n{variant_instruction(n_variants)}"
+        context_span = tracing.current()
+        if context_span:
+            context_span.set(references=len(retrieved_items), chars=len(user_prompt),
+                             tokens_est=estimate_tokens(user_prompt) + estimate_tokens(self.system_prompt))
+        return user_prompt
+    
+    @staticmethod
+    def _split_variants(text: str, n_variants: int) -> Tuple[str, List[str]]:
+        """返回 (final_prompt, variants)；多个备选时 final_prompt 为第一个"""
+        if n_variants <= 1:
+            return text, [text]
+        variants = parse_variants(text, n_variants)
+        return (variants[0] if variants else text), variants
+    
+    @tracing.traced("rag.retrieve")
+    def _retrieve(self, user_intent: str, top_k: int, mmr: bool, rerank: bool, fields: bool,
+                  timings: Dict) -> Tuple[List[Dict], Optional[np.ndarray]]:
+        """向量检索（+ 可选重排序）；启用语义缓存时先生成查询向量，检索与缓存共用"""
+        query_vector = None
+        if self.cache is not None:
+            stage_start = time.perf_counter()
+            query_vector = self.vector_store.encode_query(user_intent)
+            encode_ms = (time.perf_counter() - stage_start) * 1000
+        retrieved = self.vector_store.search(user_intent, top_k=top_k, mmr=mmr, rerank=rerank, fields=fields,
+                                             query_vector=query_vector, timings=timings)
+        if query_vector is not None:
+            timings["encode_ms"] = encode_ms
+        return [item for item, _ in retrieved], query_vector
+    
+    def _cache_lookup(self, query_vector: Optional[np.ndarray], retrieved_items: List[Dict], use_cache: bool,
+                      timings: Dict, n_variants: int = 1) -> Tuple[Optional[str], Optional[str]]:
+        """
+        查询语义缓存
+        
+        Returns:
+            (命中的生成结果, 参考素材指纹)；未启用缓存时均为 None
+        """
+        if self.cache is None or query_vector is None or not use_cache:
+            return None, None
+        with tracing.span("rag.cache_lookup") as cache_span:
+            extra = (f"variants={n_variants}",) if n_variants > 1 else ()
+            fingerprint = SemanticCache.fingerprint(retrieved_items, self.client.model, self.system_prompt, *extra)
+            cached = self.cache.get(query_vector, fingerprint)
+            cache_span.set(hit=cached is not None)
+        timings["semantic_cache_hit"] = cached is not None
+        return cached, fingerprint
+    
+    @staticmethod
+    def _trace_request(request_span, user_intent: str, top_k: int, n_variants: int, timings: Dict) -> Dict:
+        """在请求的根 span 上记录参数，并把 trace_id 写入 timings（未启用追踪时不做任何事）"""
+        if request_span:
+            request_span.set(intent_chars=len(user_intent), top_k=top_k, n_variants=n_variants)
+            timings["trace_id"] = request_span.trace_id
+        return timings
+
+    @staticmethod
+    def _replay(text: str) -> Generator[str, None, None]:
+        """把缓存的结果按小段输出，调用方仍按流式处理"""
+        for i in range(0, len(text), _REPLAY_CHUNK):
+            yield text[i:i + _REPLAY_CHUNK]
+    
+    def _record_stream(self, tokens, query_vector: np.ndarray, fingerprint: str) -> Generator[str, None, None]:
+        """透传 token，完整结束后写入语义缓存（调用方中途停止读取时不缓存）"""
+        start = time.perf_counter()
+        buffer = []
+        for token in tokens:
+            buffer.append(token)
+            yield token
+        self.cache.put(query_vector, fingerprint, "".join(buffer).strip(), (time.perf_counter() - start) * 1000)
+    
+    def _llm_generate(self, user_intent: str, retrieved_items: List[Dict], timings: Dict,
+                      n_variants: int = 1, on_done=None) -> str:
+        """构建上下文并调用 LLM 生成最终 Prompt（同步），写入 context_ms / llm_ms；on_done 以 Ollama 的完整响应调用"""
+        stage_start = time.perf_counter()
+        user_prompt = self._build_user_prompt(user_intent, retrieved_items, n_variants)
+        timings["context_ms"] = (time.perf_counter() - stage_start) * 1000
+        
+        stage_start = time.perf_counter()
+        final_prompt = self.client.generate(
+            prompt=user_prompt,
+            system=self.system_prompt,
+            temperature=0.7,
+            on_done=on_done,
+        )
+        timings["llm_ms"] = (time.perf_counter() - stage_start) * 1000
+        
+        # 清理输出
+        return final_prompt.strip()
+    
+    @tracing.traced("rag.generate")
+    def generate(self, user_intent: str, top_k: int = None, mmr: bool = None, rerank: bool = None,
+                 fields: bool = None, use_cache: bool = True, n_variants: int = 1, on_done=None) -> Dict:
         """
         生成最终 Prompt
         
         Args:
             user_intent: 用户意图（中文或英文）
             top_k: 检索数量（默认使用配置值）
+            mmr: 是否使用 MMR 多样化检索，去除近似重复的参考素材（默认使用配置值）
+            rerank: 是否使用 Cross-Encoder 重排序（默认使用配置值）
+            fields: 是否使用分字段加权融合检索（默认使用配置值）
+            use_cache: 是否使用语义缓存（需启用 SEMANTIC_CACHE_ENABLED），False 时强制重新生成
+            n_variants: 备选提示词数量；大于 1 时在一次 LLM 调用中生成（检索和上下文预填充只做一次）
+            on_done: 可选，LLM 请求完成时以 Ollama 的完整响应调用（含耗时统计；命中缓存时不调用）
         
         Returns:
-            包含生成结果和参考素材的字典
+            包含生成结果、备选列表（variants）、参考素材和各阶段耗时（timings，毫秒）的字典；
+            final_prompt 为第一个备选。启用追踪时 timings 另含 trace_id
         """
         top_k = top_k or TOP_K
+        timings = self._trace_request(tracing.current(), user_intent, top_k, n_variants, {})
+        total_start = time.perf_counter()
         
-        # 1. 向量检索
-        retrieved = self.vector_store.search(user_intent, top_k=top_k)
-        retrieved_items = [item for item, _ in retrieved]
+        # 1. 向量检索（+ 可选重排序）
+        retrieved_items, query_vector = self._retrieve(user_intent, top_k, mmr, rerank, fields, timings)
         
-        # 2. 构建上下文
-        context = self._build_context(user_intent, retrieved_items)
+        # 2. 语义缓存：相似意图 + 相同参考素材时直接复用
+        cached, fingerprint = self._cache_lookup(query_vector, retrieved_items, use_cache, timings, n_variants)
+        if cached is not None:
+            timings["llm_ms"] = 0.0
+            timings["total_ms"] = (time.perf_counter() - total_start) * 1000
+            tracing.current().set(cache_hit=True)
+            final_prompt, variants = self._split_variants(cached, n_variants)
+            return {
+                "final_prompt": final_prompt,
+                "variants": variants,
+                "references": retrieved_items,
+                "user_intent": user_intent,
+                "timings": timings,
+            }
         
-        # 3. 生成最终 Prompt
-        user_prompt = f"{context}\n\n请根据以上信息，生成一段高质量的中文绘图提示词："
+        # 3. 构建上下文并生成最终 Prompt
+        text = self._llm_generate(user_intent, retrieved_items, timings, n_variants, on_done)
+        timings["total_ms"] = (time.perf_counter() - total_start) * 1000
         
-        final_prompt = self.client.generate(
-            prompt=user_prompt,
-            system=self.system_prompt,
-            temperature=0.7
-        )
-        
-        # 清理输出
-        final_prompt = final_prompt.strip()
+        if fingerprint is not None:
+            self.cache.put(query_vector, fingerprint, text, timings["llm_ms"])
         
+        final_prompt, variants = self._split_variants(text, n_variants)
         return {
             "final_prompt": final_prompt,
+            "variants": variants,
             "references": retrieved_items,
-            "user_intent": user_intent
+            "user_intent": user_intent,
+            "timings": timings,
         }
 
-    def stream_generate(self, user_intent: str, top_k: int = None):
+    def stream_generate(self, user_intent: str, top_k: int = None, mmr: bool = None, rerank: bool = None,
+                        fields: bool = None, timings: Dict = None, use_cache: bool = True, on_done=None,
+                        n_variants: int = 1):
         """
         流式生成 Prompt，返回 (token_generator, references)
+        
+        timings: 可选，写入检索各阶段耗时（毫秒）及 semantic_cache_hit
+        use_cache: 是否使用语义缓存；命中时 token_generator 立即输出缓存的结果
+        on_done: 可选，LLM 流结束时以 Ollama 的最终统计对象调用（命中缓存时不调用）
+        n_variants: 备选数量；大于 1 时输出带“【变体k】”标记的文本，可随时用 parse_variants 拆分已收到的部分
+
+        启用追踪时，trace 在 token_generator 读完（或被关闭）时结束，timings 另含 trace_id
         """
         top_k = top_k or TOP_K
+        timings = {} if timings is None else timings
+        request_span = tracing.span("rag.stream_generate")
+        self._trace_request(request_span, user_intent, top_k, n_variants, timings)
 
-        # 1. 向量检索
-        retrieved = self.vector_store.search(user_intent, top_k=top_k)
-        retrieved_items = [item for item, _ in retrieved]
+        try:
+            with tracing.use(request_span):
+                # 1. 向量检索（+ 可选重排序）
+                retrieved_items, query_vector = self._retrieve(user_intent, top_k, mmr, rerank, fields, timings)
 
-        # 2. 构建上下文
-        context = self._build_context(user_intent, retrieved_items)
-        user_prompt = f"{context}\n\n请根据以上信息，生成一段高质量的中文绘图提示词："
+                # 2. 语义缓存
+                cached, fingerprint = self._cache_lookup(query_vector, retrieved_items, use_cache, timings,
+                                                         n_variants)
+                if cached is not None:
+                    request_span.set(cache_hit=True)
+                    return tracing.traced_iter(self._replay(cached), request_span), retrieved_items
 
-        # 3. 调用流式接口
+                # 3. 构建上下文
+                user_prompt = self._build_user_prompt(user_intent, retrieved_items, n_variants)
+        except BaseException as e:
+            request_span.set(error=repr(e))
+            request_span.end()
+            raise
+
+        # 4. 调用流式接口（LLM 相关的 span 在读取 token 时产生）
         token_generator = self.client.stream_generate(
             prompt=user_prompt,
             system=self.system_prompt,
-            temperature=0.7
+            temperature=0.7,
+            on_done=on_done,
         )
+        if fingerprint is not None:
+            token_generator = self._record_stream(token_generator, query_vector, fingerprint)
+
+        return tracing.traced_iter(token_generator, request_span), retrieved_items
 
-        return token_generator, retrieved_items
+    def generate_many(self, intents: Iterable[str], top_k: int = None, mmr: bool = None, rerank: bool = None,
+                      fields: bool = None, use_cache: bool = True, concurrency: int = None,
+                      chunk_size: int = None, ordered: bool = True, n_variants: int = 1) -> Iterator[Dict]:
+        """
+        批量生成 Prompt（惰性读取 intents，可以直接传入逐行读取的文件，适合上千条无人值守运行）
+        
+        每 chunk_size 条意图一起编码、检索（一次编码 + 一次 FAISS 调用），LLM 请求在线程池中
+        最多 concurrency 个同时在途；在途与待输出的结果数有上限，内存占用不随 intents 总数增长。
+        
+        Args:
+            intents: 用户意图序列
+            concurrency: 同时在途的 LLM 请求数（默认使用配置 BATCH_CONCURRENCY）
+            chunk_size: 每次一起编码、检索的意图条数（默认使用配置 BATCH_CHUNK_SIZE）
+            ordered: True 按输入顺序返回，False 按完成顺序返回
+            n_variants: 每条意图的备选数量（同 generate）
+            其余参数同 generate
+        
+        Yields:
+            与 generate 相同的字典，另含 "index"（在 intents 中的序号）；单条失败时含 "error" 而非 "final_prompt"。
+            timings 中 encode_ms / search_ms 为整批耗时按条数均摊，queue_ms 为等待空闲并发位的时间，
+            total_ms 从所在批次开始检索计起
+        """
+        top_k = top_k or TOP_K
+        concurrency = max(1, concurrency or BATCH_CONCURRENCY)
+        chunk_size = max(1, chunk_size or BATCH_CHUNK_SIZE)
+        # 在途 + 已完成待输出的条数上限（按顺序返回时，慢请求之后完成的结果需要暂存）
+        window = max(concurrency * 4, chunk_size)
+        source = enumerate(intents)
+        pending = {}  # future → 序号
+        finished = {}  # 序号 → 结果（按顺序返回时暂存）
+        next_index = 0
+        exhausted = False
+        
+        pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="rag-batch")
+        try:
+            while True:
+                ready = []
+                while not exhausted and len(pending) + len(finished) < window:
+                    chunk = list(itertools.islice(source, chunk_size))
+                    if not chunk:
+                        exhausted = True
+                        break
+                    for item in self._retrieve_batch(chunk, top_k, mmr, rerank, fields, use_cache, n_variants):
+                        if "final_prompt" in item:  # 命中语义缓存
+                            ready.append(item)
+                        else:
+                            pending[pool.submit(self._generate_item, item, time.perf_counter())] = item["index"]
+                
+                if not ready:
+                    if not pending:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        del pending[future]
+                        ready.append(future.result())
+                
+                for result in ready:
+                    if not ordered:
+                        yield result
+                    else:
+                        finished[result["index"]] = result
+                while next_index in finished:
+                    yield finished.pop(next_index)
+                    next_index += 1
+        finally:
+            # 调用方中途停止读取时，丢弃尚未开始的请求
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=False)
+    
+    @tracing.traced("rag.retrieve_batch")
+    def _retrieve_batch(self, chunk: List[Tuple[int, str]], top_k: int, mmr: bool, rerank: bool, fields: bool,
+                        use_cache: bool, n_variants: int) -> List[Dict]:
+        """批量编码、检索一批意图并查询语义缓存；命中缓存的条目直接带上 final_prompt"""
+        batch_start = time.perf_counter()
+        intents = [intent for _, intent in chunk]
+        batch_span = tracing.current().set(batch_size=len(chunk))
+        batch_timings = {}
+        query_vectors = self.vector_store.encode_queries(intents)
+        encode_ms = (time.perf_counter() - batch_start) * 1000
+        all_results = self.vector_store.search_batch(intents, top_k=top_k, mmr=mmr, rerank=rerank, fields=fields,
+                                                     query_vectors=query_vectors, timings=batch_timings)
+        batch_timings["encode_ms"] = encode_ms
+        
+        items = []
+        for i, ((index, intent), retrieved) in enumerate(zip(chunk, all_results)):
+            timings = {name: value / len(chunk) for name, value in batch_timings.items()}
+            timings["batch_size"] = len(chunk)
+            query_vector = query_vectors[i:i + 1]
+            retrieved_items = [item for item, _ in retrieved]
+            cached, fingerprint = self._cache_lookup(query_vector, retrieved_items, use_cache, timings, n_variants)
+            item = {
+                "index": index,
+                "user_intent": intent,
+                "references": retrieved_items,
+                "timings": timings,
+                "_query_vector": query_vector,
+                "_fingerprint": fingerprint,
+                "_start": batch_start,
+                "_n_variants": n_variants,
+                "_batch_trace": batch_span.trace_id,
+            }
+            if cached is not None:
+                timings["llm_ms"] = 0.0
+                timings["total_ms"] = (time.perf_counter() - batch_start) * 1000
+                item["final_prompt"], item["variants"] = self._split_variants(cached, n_variants)
+            items.append(self._public(item) if cached is not None else item)
+        return items
+    
+    @tracing.traced("rag.batch_item")
+    def _generate_item(self, item: Dict, submitted: float) -> Dict:
+        """线程池中执行：为单条已检索的意图调用 LLM；失败时返回带 error 的结果而不是抛出"""
+        timings = item["timings"]
+        timings["queue_ms"] = (time.perf_counter() - submitted) * 1000
+        # 每条意图一条 trace，通过 batch_trace 关联到所在批次的检索 trace
+        tracing.current().set(index=item["index"], queue_ms=timings["queue_ms"], batch_trace=item["_batch_trace"])
+        try:
+            text = self._llm_generate(item["user_intent"], item["references"], timings, item["_n_variants"])
+            if item["_fingerprint"] is not None:
+                self.cache.put(item["_query_vector"], item["_fingerprint"], text, timings["llm_ms"])
+            item["final_prompt"], item["variants"] = self._split_variants(text, item["_n_variants"])
+        except Exception as e:
+            item["error"] = str(e)
+        timings["total_ms"] = (time.perf_counter() - item["_start"]) * 1000
+        return self._public(item)
+    
+    @staticmethod
+    def _public(item: Dict) -> Dict:
+        """去掉内部字段"""
+        return {key: value for key, value in item.items() if not key.startswith("_")}
+
+    @tracing.traced("rag.generate")
+    async def agenerate(self, user_intent: str, top_k: int = None, mmr: bool = None, rerank: bool = None,
+                        fields: bool = None, use_cache: bool = True, n_variants: int = 1, on_done=None) -> Dict:
+        """
+        generate 的异步版本：检索在线程池中执行，生成使用异步客户端，
+        单个事件循环即可同时处理大量请求
+
+        on_done: 可选，LLM 请求完成时以 Ollama 的完整响应调用（命中缓存时不调用）
+        """
+        top_k = top_k or TOP_K
+        timings = self._trace_request(tracing.current(), user_intent, top_k, n_variants, {})
+        total_start = time.perf_counter()
+        
+        retrieved_items, query_vector = await asyncio.get_running_loop().run_in_executor(
+            self.executor, tracing.wrap(self._retrieve), user_intent, top_k, mmr, rerank, fields, timings
+        )
+        
+        cached, fingerprint = self._cache_lookup(query_vector, retrieved_items, use_cache, timings, n_variants)
+        if cached is not None:
+            tracing.current().set(cache_hit=True)
+            timings["llm_ms"] = 0.0
+            timings["total_ms"] = (time.perf_counter() - total_start) * 1000
+            final_prompt, variants = self._split_variants(cached, n_variants)
+            return {
+                "final_prompt": final_prompt,
+                "variants": variants,
+                "references": retrieved_items,
+                "user_intent": user_intent,
+                "timings": timings,
+            }
+        
+        stage_start = time.perf_counter()
+        user_prompt = self._build_user_prompt(user_intent, retrieved_items, n_variants)
+        timings["context_ms"] = (time.perf_counter() - stage_start) * 1000
+        
+        stage_start = time.perf_counter()
+        text = await self.async_client.generate(
+            prompt=user_prompt,
+            system=self.system_prompt,
+            temperature=0.7,
+            on_done=on_done,
+        )
+        timings["llm_ms"] = (time.perf_counter() - stage_start) * 1000
+        timings["total_ms"] = (time.perf_counter() - total_start) * 1000
+        
+        text = text.strip()
+        if fingerprint is not None:
+            self.cache.put(query_vector, fingerprint, text, timings["llm_ms"])
+        
+        final_prompt, variants = self._split_variants(text, n_variants)
+        return {
+            "final_prompt": final_prompt,
+            "variants": variants,
+            "references": retrieved_items,
+            "user_intent": user_intent,
+            "timings": timings,
+        }
+    
+    async def astream_generate(self, user_intent: str, top_k: int = None, mmr: bool = None, rerank: bool = None,
+                               fields: bool = None, timings: Dict = None, use_cache: bool = True,
+                               n_variants: int = 1, on_done=None):
+        """
+        stream_generate 的异步版本，返回 (异步 token 生成器, references)
+        """
+        top_k = top_k or TOP_K
+        timings = {} if timings is None else timings
+        request_span = tracing.span("rag.stream_generate")
+        self._trace_request(request_span, user_intent, top_k, n_variants, timings)
+        
+        try:
+            with tracing.use(request_span):
+                retrieved_items, query_vector = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, tracing.wrap(self._retrieve), user_intent, top_k, mmr, rerank, fields, timings
+                )
+                
+                cached, fingerprint = self._cache_lookup(query_vector, retrieved_items, use_cache, timings,
+                                                         n_variants)
+                if cached is not None:
+                    async def replay():
+                        for chunk in self._replay(cached):
+                            yield chunk
+                    request_span.set(cache_hit=True)
+                    return tracing.atraced_iter(replay(), request_span), retrieved_items
+                
+                user_prompt = self._build_user_prompt(user_intent, retrieved_items, n_variants)
+        except BaseException as e:
+            request_span.set(error=repr(e))
+            request_span.end()
+            raise
+        
+        token_generator = self.async_client.stream_generate(
+            prompt=user_prompt,
+            system=self.system_prompt,
+            temperature=0.7,
+            on_done=on_done,
+        )
+        if fingerprint is not None:
+            token_generator = self._arecord_stream(token_generator, query_vector, fingerprint)
+        
+        return tracing.atraced_iter(token_generator, request_span), retrieved_items
+    
+    async def _arecord_stream(self, tokens, query_vector: np.ndarray, fingerprint: str):
+        """_record_stream 的异步版本"""
+        start = time.perf_counter()
+        buffer = []
+        async for token in tokens:
+            buffer.append(token)
+            yield token
+        self.cache.put(query_vector, fingerprint, "".join(buffer).strip(), (time.perf_counter() - start) * 1000)
 
 
 if __name__ == "__main__":
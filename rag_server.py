@@ -0,0 +1,389 @@
+"""
+RAG HTTP 服务：与 Streamlit 解耦的本地检索 / 生成接口，供 ComfyUI 节点、脚本以及 Streamlit（瘦客户端模式）调用
+
+进程内共享一份已加载的索引；查询编码与检索在有界线程池中执行，LLM 请求由异步调度器
+（AsyncOllamaClient 连接池 + 在途请求上限）发出，单个事件循环即可服务大量并发客户端。
+
+接口:
+    GET  /health            索引、模型与调度器状态
+    POST /search            {"query", "top_k", "mmr", "rerank", "fields"}
+    POST /generate          {"intent", "top_k", "mmr", "rerank", "fields", "use_cache", "n_variants"}
+    POST /generate/stream   参数同上（另可传 "retrieve": false 跳过参考素材），以 SSE 返回：
+                            references → token × N → done（出错时为 error）
+    GET  /metrics           Prometheus 文本格式的运行指标
+
+用法:
+    python rag_server.py [--host 127.0.0.1] [--port 8765] [--ollama-host http://192.168.1.100:11434]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+from aiohttp import web
+from async_ollama_client import AsyncOllamaClient
+from llm_telemetry import LLMTelemetry
+from metrics import REGISTRY
+from llm_scheduler import LLMScheduler
+from ollama_client import OllamaClient
+from rag_generator import RAGGenerator, variant_instruction
+from server_thread import AppServerThread
+from vector_store import VectorStore
+from config import (
+    TOP_K, OLLAMA_PRELOAD, RAG_SERVER_HOST, RAG_SERVER_PORT, RAG_SERVER_ENCODE_WORKERS, RAG_SERVER_LLM_CONCURRENCY,
+)
+
+_REQUESTS = REGISTRY.counter("rag_server_requests_total", "RAG 服务按接口与状态码统计的请求数")
+_REQUEST_SECONDS = REGISTRY.histogram(
+    "rag_server_request_seconds", "RAG 服务请求耗时（秒，流式接口为整个流）",
+    (0.005, 0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60),
+)
+_TTFT_SECONDS = REGISTRY.histogram(
+    "rag_server_ttft_seconds", "流式生成的首 token 延迟（秒，从收到请求计起）",
+    (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+)
+_LLM_QUEUE_SECONDS = REGISTRY.histogram(
+    "rag_server_llm_queue_seconds", "LLM 请求等待空闲并发位的时间（秒，启用主机调度器时为调度器排队时间）",
+    (0.001, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30),
+)
+_LLM_INFLIGHT = REGISTRY.gauge("rag_server_llm_inflight", "RAG 服务正在进行的 LLM 请求数")
+_LLM_WAITING = REGISTRY.gauge("rag_server_llm_waiting", "RAG 服务等待并发位的 LLM 请求数")
+
+# Ollama 最终统计中不返回给客户端的字段（context 为整段 token id 列表；非流式响应的 response 即生成文本，已在结果中）
+_DROP_STATS = ("context", "response")
+
+
+class _BadRequest(ValueError):
+    pass
+
+
+class LLMDispatcher:
+    """
+    异步 LLM 调度器：包装 AsyncOllamaClient，限制同时在途的请求数，超出的请求在事件循环中排队
+
+    传入 scheduler（主机级 LLMScheduler）时以调度器槽位作为唯一的并发限制：与同进程内其他客户端共享槽位，
+    排队时间与等待数即调度器中的真实排队情况（此时 client 应关闭自身的调度，避免重复申请槽位）；
+    未传入时用 concurrency 个并发位的信号量限制。
+    接口与 AsyncOllamaClient 的 generate / stream_generate 一致，可直接作为 RAGGenerator 的 async_client。
+    """
+
+    def __init__(self, client: AsyncOllamaClient, concurrency: int = None, scheduler: LLMScheduler = None):
+        self.client = client
+        self.host = client.host
+        self.model = client.model
+        self.scheduler = scheduler
+        if scheduler is not None:
+            self.concurrency = scheduler.slots
+        else:
+            self.concurrency = max(1, concurrency or RAG_SERVER_LLM_CONCURRENCY)
+        self.waiting = 0
+        self.inflight = 0
+        self._semaphore = None  # 在事件循环中首次使用时创建
+
+    @contextlib.asynccontextmanager
+    async def _slot(self, mode: str):
+        """申请并发位；启用调度器时返回调度器的 Ticket，否则返回 None"""
+        start = time.perf_counter()
+        ticket = None
+        self.waiting += 1
+        _LLM_WAITING.set(self.waiting)
+        try:
+            if self.scheduler is not None:
+                ticket = await self.scheduler.aacquire(self.client.priority)
+            else:
+                if self._semaphore is None:
+                    self._semaphore = asyncio.Semaphore(self.concurrency)
+                await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+            _LLM_WAITING.set(self.waiting)
+        queue_seconds = ticket.queue_ms / 1000 if ticket is not None else time.perf_counter() - start
+        _LLM_QUEUE_SECONDS.observe(queue_seconds, mode=mode)
+        self.inflight += 1
+        _LLM_INFLIGHT.set(self.inflight)
+        try:
+            yield ticket
+        finally:
+            self.inflight -= 1
+            _LLM_INFLIGHT.set(self.inflight)
+            if ticket is not None:
+                self.scheduler.release(ticket)
+            else:
+                self._semaphore.release()
+
+    @staticmethod
+    def _report(ticket, on_done):
+        """在最终统计中补充调度信息（与 AsyncOllamaClient 自行调度时的格式一致）"""
+        if ticket is None or on_done is None:
+            return on_done
+
+        def report(stats: Dict):
+            stats["scheduler"] = ticket.report()
+            on_done(stats)
+        return report
+
+    async def generate(self, prompt: str, system: str = None, temperature: float = 0.7,
+                       timeout: float = None, on_done=None) -> str:
+        async with self._slot("generate") as ticket:
+            return await self.client.generate(prompt, system, temperature, timeout, self._report(ticket, on_done))
+
+    async def stream_generate(self, prompt: str, system: str = None, temperature: float = 0.7,
+                              timeout: float = None, on_done=None):
+        async with self._slot("stream") as ticket:
+            async for token in self.client.stream_generate(prompt, system, temperature, timeout,
+                                                           self._report(ticket, on_done)):
+                yield token
+
+    async def close(self):
+        await self.client.close()
+
+
+def _optional_bool(body: Dict, name: str):
+    value = body.get(name)
+    if value is not None and not isinstance(value, bool):
+        raise _BadRequest(f"{name} 必须是 true / false")
+    return value
+
+
+def _optional_int(body: Dict, name: str, low: int, high: int, default=None):
+    value = body.get(name)
+    if value is None:
+        return default
+    if not isinstance(value, int) or isinstance(value, bool) or not low <= value <= high:
+        raise _BadRequest(f"{name} 必须是 {low}～{high} 之间的整数")
+    return value
+
+
+def _text(body: Dict, *names: str) -> str:
+    for name in names:
+        value = body.get(name)
+        if isinstance(value, str) and value.strip():
+            return value.strip()
+    raise _BadRequest(f"缺少 {names[0]}")
+
+
+def _retrieval_params(body: Dict) -> Dict:
+    return {
+        "top_k": _optional_int(body, "top_k", 1, 50),
+        "mmr": _optional_bool(body, "mmr"),
+        "rerank": _optional_bool(body, "rerank"),
+        "fields": _optional_bool(body, "fields"),
+    }
+
+
+def _generation_params(body: Dict) -> Dict:
+    params = _retrieval_params(body)
+    params["use_cache"] = _optional_bool(body, "use_cache") is not False
+    params["n_variants"] = _optional_int(body, "n_variants", 1, 10, default=1)
+    return params
+
+
+async def _send_event(response: web.StreamResponse, event: str, data: Dict):
+    payload = json.dumps(data, ensure_ascii=False)
+    await response.write(f"event: {event}\ndata: {payload}\n\n".encode('utf-8'))
+
+
+class RAGService:
+    """
+    RAG HTTP 服务：共享一份向量库，检索在 encode_workers 个线程中执行，LLM 请求最多 llm_concurrency 个同时在途
+    """
+
+    def __init__(self, store: VectorStore = None, ollama_host: str = None, model: str = None,
+                 encode_workers: int = None, llm_concurrency: int = None):
+        self._owns_store = store is None
+        self.store = store or VectorStore.acquire_shared()
+        if self.store.index is None:
+            if self._owns_store:
+                self.store.release()
+            raise RuntimeError("向量库不存在，请先运行 python build_index.py")
+        self.encode_workers = max(1, encode_workers or RAG_SERVER_ENCODE_WORKERS)
+        self.executor = ThreadPoolExecutor(max_workers=self.encode_workers, thread_name_prefix="rag-encode")
+        self.client = OllamaClient(host=ollama_host, model=model)
+        # 启用主机调度器时由 dispatcher 统一申请槽位，异步客户端不再重复调度
+        self.dispatcher = LLMDispatcher(
+            AsyncOllamaClient(host=self.client.host, model=self.client.model, scheduler=False),
+            llm_concurrency, scheduler=self.client.scheduler,
+        )
+        self.generator = RAGGenerator(self.store, self.client, async_client=self.dispatcher, executor=self.executor)
+
+    def make_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_get("/health", self.handle_health)
+        app.router.add_post("/search", self.handle_search)
+        app.router.add_post("/generate", self.handle_generate)
+        app.router.add_post("/generate/stream", self.handle_generate_stream)
+        app.router.add_get("/metrics", self.handle_metrics)
+        app.on_cleanup.append(self._cleanup)
+        return app
+
+    async def _cleanup(self, app: web.Application):
+        await self.dispatcher.close()
+        self.executor.shutdown(wait=False)
+        if self._owns_store:
+            self.store.release()
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        """统计请求数与耗时；参数错误返回 400，其余异常返回 500（JSON）"""
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        except (_BadRequest, json.JSONDecodeError) as e:
+            status = 400
+            return web.json_response({"error": str(e)}, status=400)
+        except Exception as e:
+            return web.json_response({"error": str(e)}, status=500)
+        finally:
+            _REQUESTS.inc(endpoint=request.path, status=str(status))
+            _REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=request.path)
+
+    @staticmethod
+    async def _json(request: web.Request) -> Dict:
+        body = await request.json()
+        if not isinstance(body, dict):
+            raise _BadRequest("请求体必须是 JSON 对象")
+        return body
+
+    async def _run(self, fn, *args, **kwargs):
+        """在检索线程池中执行（查询编码与 FAISS 检索会阻塞事件循环）"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, lambda: fn(*args, **kwargs))
+
+    def _llm_stats(self, stats: Dict, wall_ms: float) -> Dict:
+        """整理 Ollama 的最终统计：去掉 context 等字段，附加时间构成与冷热启动判断，并计入遥测"""
+        stats = {key: value for key, value in stats.items() if key not in _DROP_STATS}
+        stats["host"] = self.client.host
+        stats["residency"] = self.client.residency.observe(self.client.model, stats)
+        stats["telemetry"] = LLMTelemetry.shared().record(self.client.model, self.client.host, stats, wall_ms)
+        return stats
+
+    async def handle_health(self, request: web.Request):
+        return web.json_response({
+            "status": "ok",
+            "index_size": len(self.store.metadata),
+            "index_version": self.store.version,
+            "model": self.client.model,
+            "ollama_host": self.client.host,
+            "encode_workers": self.encode_workers,
+            "llm_concurrency": self.dispatcher.concurrency,
+            "llm_inflight": self.dispatcher.inflight,
+            "llm_waiting": self.dispatcher.waiting,
+            "scheduler": self.client.scheduler.stats() if self.client.scheduler is not None else None,
+        })
+
+    async def handle_metrics(self, request: web.Request):
+        return web.Response(text=REGISTRY.render(), content_type="text/plain")
+
+    async def handle_search(self, request: web.Request):
+        body = await self._json(request)
+        query = _text(body, "query")
+        params = _retrieval_params(body)
+        params["top_k"] = params["top_k"] or TOP_K
+        timings = {}
+        results = await self._run(self.store.search, query, timings=timings, **params)
+        return web.json_response({
+            "results": [{"item": item, "distance": distance} for item, distance in results],
+            "timings": timings,
+        })
+
+    async def handle_generate(self, request: web.Request):
+        body = await self._json(request)
+        stats = {}
+        result = await self.generator.agenerate(_text(body, "intent", "user_intent"), on_done=stats.update,
+                                                **_generation_params(body))
+        if stats:
+            result["llm"] = self._llm_stats(stats, result["timings"]["llm_ms"])
+        return web.json_response(result)
+
+    async def handle_generate_stream(self, request: web.Request):
+        body = await self._json(request)
+        intent = _text(body, "intent", "user_intent")
+        params = _generation_params(body)
+        retrieve = _optional_bool(body, "retrieve") is not False
+        start = time.perf_counter()
+        timings, stats = {}, {}
+
+        # 检索阶段的错误在建立流之前抛出，由中间件返回 JSON 错误
+        if retrieve:
+            tokens, references = await self.generator.astream_generate(intent, timings=timings,
+                                                                       on_done=stats.update, **params)
+        else:
+            # 低延迟模式：不带参考素材，只用用户意图生成
+            tokens = self.dispatcher.stream_generate(
+                prompt=f"用户意图: {intent}\n\n{variant_instruction(params['n_variants'])}",
+                system=self.generator.system_prompt, temperature=0.7, on_done=stats.update,
+            )
+            references = []
+        llm_start = time.perf_counter()
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache",
+                                               "X-Accel-Buffering": "no"})
+        await response.prepare(request)
+        ttft_ms = None
+        count = 0
+        try:
+            await _send_event(response, "references", {"references": references, "timings": timings})
+            async for token in tokens:
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - start) * 1000
+                    _TTFT_SECONDS.observe(ttft_ms / 1000)
+                count += 1
+                await _send_event(response, "token", {"text": token})
+            done = {"timings": timings, "ttft_ms": ttft_ms, "tokens": count,
+                    "total_ms": (time.perf_counter() - start) * 1000}
+            if stats:
+                done["llm"] = self._llm_stats(stats, (time.perf_counter() - llm_start) * 1000)
+            await _send_event(response, "done", done)
+        except ConnectionResetError:
+            # 客户端断开：停止读取 LLM 流（释放并发位）
+            return response
+        except Exception as e:
+            await _send_event(response, "error", {"error": str(e)})
+        finally:
+            await tokens.aclose()
+        await response.write_eof()
+        return response
+
+
+class RAGServerThread(AppServerThread):
+    """在后台线程中运行 RAG 服务（供压测脚本嵌入使用）"""
+
+    _thread_name = "rag-server"
+    _label = "RAG 服务"
+
+    def __init__(self, service: RAGService, host: str = "127.0.0.1", port: int = 0):
+        self.service = service
+        super().__init__(service.make_app, host, port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PromptRAG HTTP 服务")
+    parser.add_argument("--host", default=RAG_SERVER_HOST, help="监听地址")
+    parser.add_argument("--port", type=int, default=RAG_SERVER_PORT, help="端口")
+    parser.add_argument("--ollama-host", default=None, help="Ollama 服务地址（默认使用配置 OLLAMA_HOST）")
+    parser.add_argument("--model", default=None, help="模型名称（默认使用配置 OLLAMA_MODEL）")
+    parser.add_argument("--encode-workers", type=int, default=RAG_SERVER_ENCODE_WORKERS,
+                        help="执行查询编码与检索的线程数")
+    parser.add_argument("--llm-concurrency", type=int, default=RAG_SERVER_LLM_CONCURRENCY,
+                        help="同时在途的 LLM 请求数（启用 LLM_SCHEDULER 时由主机调度器的槽位数决定）")
+    args = parser.parse_args()
+
+    service = RAGService(ollama_host=args.ollama_host, model=args.model, encode_workers=args.encode_workers,
+                         llm_concurrency=args.llm_concurrency)
+    if OLLAMA_PRELOAD:
+        service.client.residency.start()
+    print(f"✓ RAG 服务已启动: http://{args.host}:{args.port}（索引 {len(service.store.metadata)} 条，"
+          f"模型 {service.client.model}@{service.client.host}，检索线程 {service.encode_workers}，"
+          f"LLM 并发 {service.dispatcher.concurrency}）")
+    web.run_app(service.make_app(), host=args.host, port=args.port, print=None, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+重排序模块：使用本地 Cross-Encoder 对向量检索的候选结果做二次排序（带延迟预算）
+"""
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from config import RERANK_MODEL, RERANK_BUDGET_MS, RERANK_BACKEND, MODEL_CACHE_DIR
+
+
+class CrossEncoderReranker:
+    """Cross-Encoder 重排序器（CPU / ONNX），超出延迟预算时自动跳过"""
+
+    # 类级别的缓存，所有实例共享同一个模型
+    _model_cache = {}
+    _lock = threading.Lock()
+
+    def __init__(self, model_name: str = None, budget_ms: float = None, backend: str = None):
+        self.model_name = model_name or RERANK_MODEL
+        self.budget_ms = RERANK_BUDGET_MS if budget_ms is None else budget_ms
+        self.backend = backend or RERANK_BACKEND
+        # 延迟模型：耗时 ≈ 固定开销 + 单对耗时 × 候选数（单对耗时按指数滑动平均更新）
+        self._overhead_ms = 0.0
+        self._ms_per_pair = 0.0
+        self._predict_lock = threading.Lock()
+        self.model = self._load_model()
+
+    def _load_model(self):
+        key = (self.model_name, self.backend)
+        with CrossEncoderReranker._lock:
+            if key not in CrossEncoderReranker._model_cache:
+                from sentence_transformers import CrossEncoder
+
+                print(f"正在加载重排序模型: {self.model_name}（{self.backend}）...")
+                kwargs = {"device": "cpu", "cache_folder": MODEL_CACHE_DIR}
+                if self.backend != "torch":
+                    kwargs["backend"] = self.backend
+                try:
+                    model = CrossEncoder(self.model_name, **kwargs)
+                except TypeError:
+                    # 旧版本 sentence-transformers 不支持 backend / cache_folder 参数
+                    model = CrossEncoder(self.model_name, device="cpu")
+                CrossEncoderReranker._model_cache[key] = model
+                print("✓ 重排序模型加载完成")
+            model = CrossEncoderReranker._model_cache[key]
+
+        # 预热，再用 1 对 / 8 对两次调用校准固定开销与单对耗时
+        self.model = model
+        probe = ("赛博朋克风格的雨夜猫咪", "赛博朋克 霓虹灯 雨 猫咪 城市街道 阴郁 8k 杰作")
+        self._predict([probe])
+        _, one_ms = self._predict([probe])
+        _, eight_ms = self._predict([probe] * 8)
+        self._ms_per_pair = max((eight_ms - one_ms) / 7, 0.01)
+        self._overhead_ms = max(one_ms - self._ms_per_pair, 0.0)
+        return model
+
+    def _predict(self, pairs: List[Tuple[str, str]]):
+        with self._predict_lock:
+            start = time.perf_counter()
+            scores = self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        return scores, elapsed_ms
+
+    def _timed_predict(self, pairs: List[Tuple[str, str]]):
+        """重排序并用实测耗时更新单对耗时估计"""
+        scores, elapsed_ms = self._predict(pairs)
+        per_pair = max(elapsed_ms - self._overhead_ms, 0.0) / len(pairs)
+        self._ms_per_pair = 0.8 * self._ms_per_pair + 0.2 * per_pair
+        return scores, elapsed_ms
+
+    def estimate_ms(self, n_pairs: int) -> float:
+        """预估对 n_pairs 个候选重排序的耗时（毫秒）"""
+        return self._overhead_ms + self._ms_per_pair * n_pairs
+
+    def affordable_pairs(self) -> int:
+        """在延迟预算内最多可以重排序的候选数"""
+        if self.budget_ms <= 0:
+            return 0
+        return int((self.budget_ms - self._overhead_ms) / max(self._ms_per_pair, 1e-3))
+
+    def score(
+        self,
+        query: str,
+        candidates: List[Tuple[Dict, float]],
+        top_k: int,
+        text_fn: Callable[[Dict], str],
+        timings: Optional[Dict] = None,
+    ) -> Optional[List[float]]:
+        """
+        在延迟预算内为候选打分（按一阶段顺序，预算不足时只为前若干个候选打分）
+
+        Returns:
+            前 n 个候选的 Cross-Encoder 分数（n ≤ len(candidates)）；预算内连 top_k 个候选都排不完时为 None
+        """
+        n_fit = min(len(candidates), self.affordable_pairs())
+        if n_fit < min(top_k, len(candidates)) or n_fit < 2:
+            # 预算内连 top_k 个候选都排不完，跳过重排序
+            if timings is not None:
+                timings["rerank_skipped"] = True
+                timings["rerank_estimate_ms"] = self.estimate_ms(len(candidates))
+            return None
+
+        pairs = [(query, text_fn(item)) for item, _ in candidates[:n_fit]]
+        scores, elapsed_ms = self._timed_predict(pairs)
+
+        if timings is not None:
+            timings["rerank_ms"] = elapsed_ms
+            timings["rerank_pairs"] = n_fit
+            timings["rerank_skipped"] = False
+        return [float(s) for s in scores]
+
+    def rerank(
+        self,
+        query: str,
+        candidates: List[Tuple[Dict, float]],
+        top_k: int,
+        text_fn: Callable[[Dict], str],
+        timings: Optional[Dict] = None,
+    ) -> List[Tuple[Dict, float]]:
+        """
+        对候选结果重排序
+
+        Args:
+            query: 查询文本
+            candidates: 一阶段检索得到的 (元数据, 距离) 列表，按相关性降序
+            top_k: 返回条数
+            text_fn: 从元数据构建候选文本的函数
+            timings: 可选，写入 rerank_ms / rerank_pairs / rerank_skipped
+
+        Returns:
+            (元数据, 距离) 列表；被重排序时按 Cross-Encoder 分数降序，距离仍为向量距离
+        """
+        scores = self.score(query, candidates, top_k, text_fn, timings)
+        if scores is None:
+            return candidates[:top_k]
+        order = sorted(range(len(scores)), key=lambda i: -scores[i])
+        return [candidates[i] for i in order[:top_k]]
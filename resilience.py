@@ -0,0 +1,147 @@
+"""
+尾延迟控制：按主机的熔断器 + 用于对冲请求的滚动延迟窗口
+"""
+import threading
+import time
+from collections import deque
+from typing import Dict
+import numpy as np
+from config import BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT
+from metrics import REGISTRY
+
+_BREAKER_STATE = REGISTRY.gauge("ollama_breaker_state", "熔断器状态：0 关闭，1 半开，2 打开")
+_BREAKER_TRIPS = REGISTRY.counter("ollama_breaker_trips_total", "熔断器打开次数")
+
+
+class CircuitOpenError(Exception):
+    """主机处于熔断状态，请求未发送"""
+
+
+class CircuitBreaker:
+    """
+    单个主机的熔断器
+
+    关闭：正常放行，连续失败 failure_threshold 次后打开。
+    打开：直接拒绝请求，reset_timeout 秒后进入半开。
+    半开：同一时刻只放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+    _STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    # 进程级注册表：同一主机的所有客户端共享熔断状态
+    _registry: Dict[str, "CircuitBreaker"] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, host: str, failure_threshold: int = None, reset_timeout: float = None):
+        self.host = host
+        self.failure_threshold = BREAKER_FAILURE_THRESHOLD if failure_threshold is None else failure_threshold
+        self.reset_timeout = BREAKER_RESET_TIMEOUT if reset_timeout is None else reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        _BREAKER_STATE.set(0, host=host)
+
+    @classmethod
+    def for_host(cls, host: str) -> "CircuitBreaker":
+        with cls._registry_lock:
+            breaker = cls._registry.get(host)
+            if breaker is None:
+                breaker = cls(host)
+                cls._registry[host] = breaker
+            return breaker
+
+    def _set_state(self, state: str):
+        if state == self.OPEN and self._state != self.OPEN:
+            _BREAKER_TRIPS.inc(host=self.host)
+            print(f"⚠️ Ollama 主机 {self.host} 连续失败 {self._failures} 次，熔断 {self.reset_timeout:g} 秒")
+        self._state = state
+        _BREAKER_STATE.set(self._STATE_VALUES[state], host=self.host)
+
+    def _refresh(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._set_state(self.HALF_OPEN)
+            self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    @property
+    def failures(self) -> int:
+        """连续失败次数"""
+        with self._lock:
+            return self._failures
+
+    def available(self) -> bool:
+        """是否可能放行请求（不占用半开状态的探测名额）"""
+        with self._lock:
+            self._refresh()
+            return self._state == self.CLOSED or (self._state == self.HALF_OPEN and not self._probing)
+
+    def allow(self) -> bool:
+        """申请发送一个请求；半开状态下只有第一个申请者获得探测名额"""
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            self._refresh()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            if self._state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def release(self):
+        """放弃探测名额而不记录结果（请求在本地被中断，无法判断主机是否健康）"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+
+class LatencyWindow:
+    """
+    滚动延迟窗口：记录最近 size 次请求的首字节延迟，用于推导对冲截止时间
+    """
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.size = size
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._samples: Dict[str, deque] = {}
+
+    def observe(self, key: str, seconds: float):
+        with self._lock:
+            window = self._samples.get(key)
+            if window is None:
+                window = self._samples[key] = deque(maxlen=self.size)
+            window.append(seconds)
+
+    def quantile(self, key: str, q: float):
+        """样本不足 min_samples 时返回 None"""
+        with self._lock:
+            window = self._samples.get(key)
+            if window is None or len(window) < self.min_samples:
+                return None
+            samples = list(window)
+        return float(np.quantile(samples, q))
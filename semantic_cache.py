@@ -0,0 +1,128 @@
+"""
+语义缓存模块：相似的用户意图 + 相同的参考素材 → 直接复用已生成的 Prompt，跳过 LLM 生成
+"""
+import hashlib
+import json
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional
+from config import SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL, SEMANTIC_CACHE_SIZE
+
+
+class _CacheEntry(NamedTuple):
+    query_vector: np.ndarray  # 归一化后的查询向量
+    fingerprint: str
+    response: str
+    generation_ms: float  # 生成该结果实际花费的 LLM 时间，命中时计入节省的 GPU 时间
+    created_at: float
+
+
+class SemanticCache:
+    """
+    语义缓存（线程安全，进程内所有会话共享）
+
+    键为查询向量 + 参考素材指纹：只有参考素材完全相同、且查询向量的余弦相似度
+    不低于阈值时才命中。条目超过 TTL 后失效，超过容量时按最近最少使用淘汰。
+    """
+
+    _shared_instance = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, threshold: float = None, ttl: float = None, max_entries: int = None):
+        self.threshold = SEMANTIC_CACHE_THRESHOLD if threshold is None else threshold
+        self.ttl = SEMANTIC_CACHE_TTL if ttl is None else ttl
+        self.max_entries = SEMANTIC_CACHE_SIZE if max_entries is None else max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # 条目 ID → _CacheEntry（按最近使用排序）
+        self._buckets = {}  # 参考素材指纹 → 条目 ID 集合
+        self._next_id = 0
+        self._hits = 0
+        self._misses = 0
+        self._saved_ms = 0.0
+
+    @classmethod
+    def shared(cls) -> "SemanticCache":
+        """进程级共享实例"""
+        with cls._shared_lock:
+            if cls._shared_instance is None:
+                cls._shared_instance = cls()
+            return cls._shared_instance
+
+    @staticmethod
+    def fingerprint(references: List[Dict], *extra) -> str:
+        """
+        参考素材指纹：参考素材集合（与顺序无关）+ 额外的区分项（如模型名、系统提示词）
+        """
+        raws = sorted(ref.get("raw", "") for ref in references)
+        payload = json.dumps([raws, [str(e) for e in extra]], ensure_ascii=False)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _normalize(query_vector: np.ndarray) -> np.ndarray:
+        v = np.asarray(query_vector, dtype='float32').reshape(-1)
+        norm = np.linalg.norm(v)
+        return v / norm if norm > 0 else v
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        bucket = self._buckets.get(entry.fingerprint)
+        if bucket is not None:
+            bucket.discard(entry_id)
+            if not bucket:
+                del self._buckets[entry.fingerprint]
+
+    def get(self, query_vector: np.ndarray, fingerprint: str) -> Optional[str]:
+        """查找缓存，命中时返回缓存的生成结果"""
+        q = self._normalize(query_vector)
+        now = time.time()
+        with self._lock:
+            best_id, best_sim = None, self.threshold
+            for entry_id in list(self._buckets.get(fingerprint, ())):
+                entry = self._entries[entry_id]
+                if self.ttl > 0 and now - entry.created_at > self.ttl:
+                    self._remove(entry_id)
+                    continue
+                sim = float(entry.query_vector @ q)
+                if sim >= best_sim:
+                    best_id, best_sim = entry_id, sim
+            if best_id is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            entry = self._entries[best_id]
+            self._hits += 1
+            self._saved_ms += entry.generation_ms
+            return entry.response
+
+    def put(self, query_vector: np.ndarray, fingerprint: str, response: str, generation_ms: float):
+        """写入缓存（空结果不缓存）"""
+        if not response or self.max_entries <= 0:
+            return
+        entry = _CacheEntry(self._normalize(query_vector), fingerprint, response, generation_ms, time.time())
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = entry
+            self._buckets.setdefault(fingerprint, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self) -> Dict:
+        """命中率与节省的 LLM 生成时间"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "lookups": lookups,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": self._hits / lookups if lookups else 0.0,
+                "saved_gpu_seconds": self._saved_ms / 1000,
+            }
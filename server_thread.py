@@ -0,0 +1,61 @@
+"""
+在后台线程中运行 aiohttp 应用：压测脚本与测试在同一进程内嵌入模拟 Ollama 服务或 RAG 服务时使用
+
+线程内创建独立的事件循环，start() 在端口就绪后返回（port=0 时由系统分配端口，可从 url 读取），
+stop() 停止事件循环并执行应用的清理回调。
+"""
+import asyncio
+import threading
+from typing import Callable
+from aiohttp import web
+
+
+class AppServerThread:
+    """在后台线程中运行 make_app() 返回的 aiohttp 应用；子类通过 _thread_name / _label 设置线程名与提示文字"""
+
+    _thread_name = "aiohttp-server"
+    _label = "服务"
+
+    def __init__(self, make_app: Callable[[], web.Application], host: str = "127.0.0.1", port: int = 0):
+        self.make_app = make_app
+        self.bind_host = host
+        self.port = port
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.bind_host}:{self.port}"
+
+    def start(self) -> "AppServerThread":
+        self._thread = threading.Thread(target=self._serve, name=self._thread_name, daemon=True)
+        self._thread.start()
+        if not self._ready.wait(10):
+            raise RuntimeError(f"{self._label}启动超时")
+        return self
+
+    def _serve(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self.bind_host, self.port)
+        self._loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+        self._loop.run_until_complete(self._runner.cleanup())
+        self._loop.close()
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(10)
+
+    def __enter__(self) -> "AppServerThread":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
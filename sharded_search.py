@@ -0,0 +1,472 @@
+"""
+分片检索模块：按 ID 区间将索引与元数据切分为 N 个分片，每个分片由独立的工作进程加载和检索
+
+主进程把查询向量分发给所有分片（scatter），收集各分片的 top-k（gather）后按距离归并；
+单个进程只需容纳一个分片，语料规模可以超过单进程的内存上限，各分片的扫描也能在多核上并行。
+
+磁盘布局（db/shards/）:
+    shard_0000.index / shard_0000.jsonl   第 0 个分片的索引与元数据（行号从 0 开始）
+    ...
+    shards.json                           分片清单（分片数、各分片起始 ID 与条数、版本号），最后写入
+
+用法:
+    python sharded_search.py split --shards 4   # 将 db/ 下已有的索引切分为 4 个分片
+    python sharded_search.py info               # 查看分片信息
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import weakref
+import numpy as np
+import faiss
+from collections import OrderedDict
+from collections.abc import Sequence
+from typing import Any, Dict, List, Optional, Tuple
+from config import (
+    SHARD_DIR, SHARD_TIMEOUT, INDEX_LOAD_MODE, FAISS_OMP_THREADS, INDEX_PATH, METADATA_PATH, MANIFEST_PATH,
+)
+
+SHARD_MANIFEST = "shards.json"
+# 工作进程启动（导入 FAISS、加载分片）允许的最长时间（秒）
+_STARTUP_TIMEOUT = 120
+
+
+def _shard_files(shard_id: int) -> Tuple[str, str]:
+    return f"shard_{shard_id:04d}.index", f"shard_{shard_id:04d}.jsonl"
+
+
+def read_shard_manifest(shard_dir: str) -> Dict:
+    with open(os.path.join(shard_dir, SHARD_MANIFEST), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_shards(index, metadata: List[Dict], shard_dir: str, n_shards: int, version: str = None) -> Dict:
+    """
+    按 ID 区间将索引与元数据切分为 n_shards 个分片（先写分片文件，最后写清单）
+
+    Returns:
+        分片清单
+    """
+    if n_shards < 1:
+        raise ValueError(f"分片数必须 >= 1: {n_shards}")
+    if index.ntotal != len(metadata):
+        raise ValueError(f"索引与元数据条数不一致 ({index.ntotal} vs {len(metadata)})")
+
+    os.makedirs(shard_dir, exist_ok=True)
+    bounds = np.linspace(0, index.ntotal, n_shards + 1).astype('int64')
+    shards = []
+    for shard_id in range(n_shards):
+        start, end = int(bounds[shard_id]), int(bounds[shard_id + 1])
+        index_file, metadata_file = _shard_files(shard_id)
+
+        shard_index = faiss.IndexFlatL2(index.d)
+        if end > start:
+            shard_index.add(index.reconstruct_n(start, end - start))
+        tmp_path = os.path.join(shard_dir, index_file + ".tmp")
+        faiss.write_index(shard_index, tmp_path)
+        os.replace(tmp_path, os.path.join(shard_dir, index_file))
+
+        tmp_path = os.path.join(shard_dir, metadata_file + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for i in range(start, end):
+                f.write(json.dumps(metadata[i], ensure_ascii=False) + '\n')
+        os.replace(tmp_path, os.path.join(shard_dir, metadata_file))
+
+        shards.append({"index": index_file, "metadata": metadata_file, "start": start, "count": end - start})
+
+    manifest = {
+        "version": version or str(time.time_ns()),
+        "count": int(index.ntotal),
+        "dimension": int(index.d),
+        "shards": shards,
+    }
+    tmp_path = os.path.join(shard_dir, SHARD_MANIFEST + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, os.path.join(shard_dir, SHARD_MANIFEST))
+    print(f"✓ 已切分为 {n_shards} 个分片: {shard_dir}")
+    return manifest
+
+
+def _read_shard_index(path: str, mode: str):
+    """工作进程内读取分片索引（mmap 模式下多个进程可共享页缓存）"""
+    if mode == "mmap":
+        for flag_name in ("IO_FLAG_MMAP_IFC", "IO_FLAG_MMAP"):
+            flag = getattr(faiss, flag_name, None)
+            if flag is None:
+                continue
+            try:
+                return faiss.read_index(path, flag | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError:
+                continue
+    return faiss.read_index(path)
+
+
+def _shard_worker(conn, index_path: str, metadata_path: str, load_mode: str, omp_threads: int):
+    """
+    分片工作进程：加载一个分片，循环处理主进程的请求
+
+    请求 / 应答（均为元组）:
+        ("search", 查询向量, k)        → ("ok", (距离, 分片内行号, 命中的元数据))
+        ("reconstruct", 分片内行号)    → ("ok", 向量)
+        ("get", 分片内行号列表)        → ("ok", 元数据列表)
+        ("close",)                     → 退出
+    处理出错时应答 ("error", 错误信息)，进程本身继续服务。
+    """
+    if omp_threads > 0:
+        faiss.omp_set_num_threads(omp_threads)
+    index = _read_shard_index(index_path, load_mode)
+    metadata = []
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                metadata.append(json.loads(line))
+    conn.send(("ready", int(index.ntotal)))
+
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            break
+        command = request[0]
+        if command == "close":
+            break
+        try:
+            if command == "search":
+                _, query_vectors, k = request
+                distances, indices = index.search(query_vectors, k)
+                rows = [[metadata[i] for i in row if i >= 0] for row in indices]
+                conn.send(("ok", (distances, indices, rows)))
+            elif command == "reconstruct":
+                conn.send(("ok", index.reconstruct_batch(request[1])))
+            elif command == "get":
+                conn.send(("ok", [metadata[i] for i in request[1]]))
+            else:
+                conn.send(("error", f"未知请求: {command}"))
+        except Exception as e:
+            conn.send(("error", repr(e)))
+    conn.close()
+
+
+class ShardWorkerError(RuntimeError):
+    """分片工作进程崩溃或超时，且重启后仍无法完成请求"""
+
+
+class _ShardWorker:
+    """单个分片的工作进程句柄"""
+
+    def __init__(self, shard_id: int, index_path: str, metadata_path: str, start: int, count: int,
+                 load_mode: str, omp_threads: int):
+        self.shard_id = shard_id
+        self.index_path = index_path
+        self.metadata_path = metadata_path
+        self.start = start
+        self.count = count
+        self.load_mode = load_mode
+        self.omp_threads = omp_threads
+        self.process = None
+        self.conn = None
+
+    def spawn(self, timeout: float):
+        # spawn 启动方式：fork 已初始化 OpenMP 线程池的进程可能死锁
+        ctx = multiprocessing.get_context("spawn")
+        parent_conn, child_conn = ctx.Pipe()
+        process = ctx.Process(
+            target=_shard_worker,
+            args=(child_conn, self.index_path, self.metadata_path, self.load_mode, self.omp_threads),
+            name=f"shard-{self.shard_id}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        self.process, self.conn = process, parent_conn
+        status, payload = self.receive(timeout)
+        if status != "ready" or payload != self.count:
+            raise ShardWorkerError(f"分片 {self.shard_id} 加载异常: {status} {payload}")
+
+    def send(self, request: Tuple):
+        self.conn.send(request)
+
+    def receive(self, timeout: float):
+        if not self.conn.poll(timeout):
+            raise TimeoutError(f"分片 {self.shard_id} 在 {timeout}s 内未响应")
+        return self.conn.recv()
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            self.conn.send(("close",))
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+        self.process, self.conn = None, None
+
+
+def _stop_workers(workers: List[_ShardWorker]):
+    for worker in workers:
+        worker.stop()
+
+
+class ShardedIndex:
+    """
+    分片索引：对外提供与 FAISS 索引相同的 search / reconstruct_batch / ntotal / d 接口，
+    可以直接放入 VectorStore 的索引快照
+
+    工作进程崩溃或超时时自动重启并重试一次。
+    """
+
+    # 最近命中的元数据缓存条数（检索结果组装时直接使用，无需再次请求工作进程）
+    _ROW_CACHE_SIZE = 1024
+
+    def __init__(self, shard_dir: str = None, load_mode: str = None, omp_threads: int = None,
+                 timeout: float = None):
+        self.shard_dir = shard_dir or SHARD_DIR
+        self.timeout = timeout or SHARD_TIMEOUT
+        manifest = read_shard_manifest(self.shard_dir)
+        self.version = manifest["version"]
+        self.ntotal = int(manifest["count"])
+        self.d = int(manifest["dimension"])
+        self.restarts = 0
+
+        load_mode = (load_mode or INDEX_LOAD_MODE).lower()
+        omp_threads = FAISS_OMP_THREADS if omp_threads is None else omp_threads
+        self._workers = [
+            _ShardWorker(shard_id, os.path.join(self.shard_dir, shard["index"]),
+                         os.path.join(self.shard_dir, shard["metadata"]),
+                         shard["start"], shard["count"], load_mode, omp_threads)
+            for shard_id, shard in enumerate(manifest["shards"])
+        ]
+        self._starts = np.array([w.start for w in self._workers], dtype='int64')
+        # 管道不支持并发读写，一次 scatter / gather 期间独占所有工作进程
+        self._lock = threading.Lock()
+        self._closed = False
+        # 检索命中行的元数据缓存（LRU），多个会话并发读写，由独立的锁保护
+        self._row_cache = OrderedDict()
+        self._row_cache_lock = threading.Lock()
+        # 对象被回收（例如热加载替换为新索引）时停止工作进程
+        self._finalizer = weakref.finalize(self, _stop_workers, self._workers)
+
+        start = time.perf_counter()
+        for worker in self._workers:
+            worker.spawn(max(self.timeout, _STARTUP_TIMEOUT))
+        print(f"✓ 已启动 {len(self._workers)} 个分片工作进程（共 {self.ntotal} 条，"
+              f"{time.perf_counter() - start:.1f}s）")
+
+    @property
+    def n_shards(self) -> int:
+        return len(self._workers)
+
+    def close(self):
+        """停止所有工作进程（等待进行中的请求完成）；关闭后不再重启工作进程，检索抛出 ShardWorkerError"""
+        with self._lock:
+            self._closed = True
+            self._finalizer()
+
+    def _restart(self, worker: _ShardWorker, reason: str):
+        print(f"⚠️  分片 {worker.shard_id} 工作进程异常（{reason}），正在重启...")
+        worker.stop()
+        worker.spawn(max(self.timeout, _STARTUP_TIMEOUT))
+        self.restarts += 1
+
+    def check_workers(self) -> int:
+        """检查工作进程存活状态并重启已退出的进程，返回本次重启的数量"""
+        restarted = 0
+        with self._lock:
+            if self._closed:
+                return 0
+            for worker in self._workers:
+                if not worker.alive():
+                    self._restart(worker, "进程已退出")
+                    restarted += 1
+        return restarted
+
+    def _scatter_gather(self, requests: Dict[int, Tuple]) -> Dict[int, Any]:
+        """向指定分片发送请求并收集应答；失败的分片重启后重试一次（需持有 _lock）"""
+        if self._closed:
+            raise ShardWorkerError("分片索引已关闭")
+        for shard_id in requests:
+            worker = self._workers[shard_id]
+            if not worker.alive():
+                self._restart(worker, "进程已退出")
+        pending = []
+        for shard_id, request in requests.items():
+            try:
+                self._workers[shard_id].send(request)
+                pending.append(shard_id)
+            except (OSError, ValueError) as e:
+                self._restart(self._workers[shard_id], repr(e))
+                self._workers[shard_id].send(request)
+                pending.append(shard_id)
+
+        replies = {}
+        for shard_id in pending:
+            worker = self._workers[shard_id]
+            try:
+                status, payload = worker.receive(self.timeout)
+            except (EOFError, OSError, TimeoutError) as e:
+                self._restart(worker, repr(e))
+                try:
+                    worker.send(requests[shard_id])
+                    status, payload = worker.receive(self.timeout)
+                except (EOFError, OSError, TimeoutError) as retry_error:
+                    raise ShardWorkerError(f"分片 {shard_id} 重启后仍无法完成请求: {retry_error!r}")
+            if status != "ok":
+                raise ShardWorkerError(f"分片 {shard_id} 处理失败: {payload}")
+            replies[shard_id] = payload
+        return replies
+
+    def search(self, query_vectors: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        分片检索：分发到所有分片，各取 top-k 后按距离归并
+
+        Returns:
+            与 faiss search 相同形状的 (distances, indices)，indices 为全局 ID
+        """
+        query_vectors = np.ascontiguousarray(query_vectors, dtype='float32')
+        with self._lock:
+            replies = self._scatter_gather({i: ("search", query_vectors, k) for i in range(self.n_shards)})
+
+        distances = np.concatenate([replies[i][0] for i in range(self.n_shards)], axis=1)
+        local_ids = [replies[i][1] for i in range(self.n_shards)]
+        indices = np.concatenate([np.where(ids >= 0, ids + self._starts[i], -1) for i, ids in enumerate(local_ids)],
+                                 axis=1)
+        distances = np.where(indices >= 0, distances, np.inf).astype('float32')
+        order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+        top_distances = np.take_along_axis(distances, order, axis=1)
+        top_indices = np.take_along_axis(indices, order, axis=1)
+
+        # 命中的元数据随检索结果一并返回，缓存后组装结果时无需再次请求
+        hits = [
+            (int(local_id) + int(self._starts[i]), item)
+            for i in range(self.n_shards)
+            for row_ids, row_items in zip(replies[i][1], replies[i][2])
+            for local_id, item in zip(row_ids[row_ids >= 0], row_items)
+        ]
+        with self._row_cache_lock:
+            for global_id, item in hits:
+                self._row_cache[global_id] = item
+                self._row_cache.move_to_end(global_id)
+            while len(self._row_cache) > self._ROW_CACHE_SIZE:
+                self._row_cache.popitem(last=False)
+        return top_distances, top_indices
+
+    def _group_by_shard(self, ids: np.ndarray) -> Dict[int, np.ndarray]:
+        ids = np.asarray(ids, dtype='int64')
+        if len(ids) and (ids.min() < 0 or ids.max() >= self.ntotal):
+            raise IndexError(f"ID 超出范围: [0, {self.ntotal})")
+        shard_of = np.searchsorted(self._starts, ids, side='right') - 1
+        return {int(s): np.nonzero(shard_of == s)[0] for s in np.unique(shard_of)}
+
+    def reconstruct_batch(self, ids) -> np.ndarray:
+        """按全局 ID 取回原始向量（MMR、两阶段检索使用）"""
+        ids = np.asarray(ids, dtype='int64')
+        groups = self._group_by_shard(ids)
+        with self._lock:
+            replies = self._scatter_gather(
+                {s: ("reconstruct", ids[pos] - self._starts[s]) for s, pos in groups.items()}
+            )
+        vectors = np.zeros((len(ids), self.d), dtype='float32')
+        for s, pos in groups.items():
+            vectors[pos] = replies[s]
+        return vectors
+
+    def get_metadata(self, ids) -> List[Dict]:
+        """按全局 ID 取回元数据"""
+        ids = np.asarray(ids, dtype='int64')
+        items = [None] * len(ids)
+        missing = []
+        with self._row_cache_lock:
+            for pos, i in enumerate(ids):
+                item = self._row_cache.get(int(i))
+                if item is None:
+                    missing.append(pos)
+                else:
+                    items[pos] = item
+        if missing:
+            missing = np.asarray(missing, dtype='int64')
+            groups = self._group_by_shard(ids[missing])
+            with self._lock:
+                replies = self._scatter_gather(
+                    {s: ("get", (ids[missing][pos] - self._starts[s]).tolist()) for s, pos in groups.items()}
+                )
+            for s, pos in groups.items():
+                for p, item in zip(missing[pos], replies[s]):
+                    items[p] = item
+        return items
+
+    def metadata(self) -> "ShardedMetadata":
+        return ShardedMetadata(self)
+
+
+class ShardedMetadata(Sequence):
+    """分片元数据：只读序列，按需从工作进程取回（检索命中的行直接读缓存）"""
+
+    def __init__(self, sharded: ShardedIndex):
+        self._sharded = sharded
+
+    def __len__(self) -> int:
+        return self._sharded.ntotal
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self._sharded.get_metadata(list(range(*i.indices(len(self)))))
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._sharded.get_metadata([i])[0]
+
+
+def _print_info(shard_dir: str):
+    manifest = read_shard_manifest(shard_dir)
+    print(f"分片目录: {shard_dir}")
+    print(f"  版本: {manifest['version']}，共 {manifest['count']} 条，{manifest['dimension']} 维")
+    for shard_id, shard in enumerate(manifest["shards"]):
+        size = os.path.getsize(os.path.join(shard_dir, shard["index"])) / (1024 * 1024)
+        print(f"  分片 {shard_id}: ID [{shard['start']}, {shard['start'] + shard['count']})，索引 {size:.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="分片索引工具")
+    sub = parser.add_subparsers(dest="command")
+    p_split = sub.add_parser("split", help="将已有索引按 ID 区间切分为多个分片")
+    p_split.add_argument("--shards", type=int, required=True, help="分片数")
+    p_split.add_argument("--shard-dir", default=SHARD_DIR)
+    p_info = sub.add_parser("info", help="查看分片信息")
+    p_info.add_argument("--shard-dir", default=SHARD_DIR)
+    args = parser.parse_args()
+
+    if args.command == "split":
+        if not os.path.exists(INDEX_PATH) or not os.path.exists(METADATA_PATH):
+            print("✗ 索引不存在，请先运行 python build_index.py")
+            sys.exit(1)
+        index = faiss.read_index(INDEX_PATH)
+        with open(METADATA_PATH, 'r', encoding='utf-8') as f:
+            metadata = [json.loads(line) for line in f if line.strip()]
+        version = None
+        try:
+            with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+                version = str(json.load(f)["version"])
+        except (OSError, ValueError, KeyError):
+            pass
+        write_shards(index, metadata, args.shard_dir, args.shards, version=version)
+        _print_info(args.shard_dir)
+    elif args.command == "info":
+        if not os.path.exists(os.path.join(args.shard_dir, SHARD_MANIFEST)):
+            print(f"✗ 分片不存在: {args.shard_dir}")
+            sys.exit(1)
+        _print_info(args.shard_dir)
+    else:
+        parser.print_help()
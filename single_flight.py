@@ -0,0 +1,186 @@
+"""
+请求合并（single-flight）：相同的请求同时在途时只向上游发送一次，结果由所有调用方共享
+
+非流式请求：后到的调用方阻塞等待第一个调用方的结果（或异常）。
+流式请求：上游 token 由后台线程写入扇出缓冲区，每个订阅者从头读取（晚加入的订阅者先补齐已到达的 token，
+再与其他订阅者同步接收后续 token）；所有订阅者都提前退出时停止读取上游。
+上游生成器的返回值（如流结束时的统计对象）会作为每个订阅者迭代器的返回值。
+请求完成后立即从在途表中移除，之后的相同请求会重新发送（结果复用由语义缓存负责）。
+"""
+import threading
+import weakref
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, Optional, Tuple
+
+
+class _Call:
+    """一次在途的非流式请求"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class _StreamFanout:
+    """流式请求的扇出缓冲区"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._tokens = []
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._result = None
+        self._subscribers = 0
+        self._detached = 0
+
+    def publish(self, token: str):
+        with self._cond:
+            self._tokens.append(token)
+            self._cond.notify_all()
+
+    def finish(self, error: BaseException = None, result=None):
+        with self._cond:
+            if self._done:
+                return
+            self._done = True
+            self._error = error
+            self._result = result
+            self._cond.notify_all()
+
+    def abandoned(self) -> bool:
+        """所有订阅者都已提前退出"""
+        with self._cond:
+            return self._subscribers > 0 and self._detached >= self._subscribers
+
+    def subscribe(self) -> Iterator[str]:
+        with self._cond:
+            self._subscribers += 1
+        detached = []
+        subscription = self._iterate(detached)
+        # 拿到迭代器却从未开始读取的订阅者（如 Streamlit 重跑打断）不会执行生成器的 finally，
+        # 迭代器被回收时同样计为已退出，避免后台线程为无人读取的流继续消费上游
+        finalizer = weakref.finalize(subscription, self._detach, detached)
+        finalizer.atexit = False
+        return subscription
+
+    def _detach(self, detached: list):
+        """订阅者退出（读完、被关闭或被回收），每个订阅者只计一次"""
+        with self._cond:
+            if not detached:
+                detached.append(True)
+                self._detached += 1
+
+    def _iterate(self, detached: list) -> Iterator[str]:
+        position = 0
+        try:
+            while True:
+                with self._cond:
+                    while position >= len(self._tokens) and not self._done:
+                        self._cond.wait()
+                    batch = self._tokens[position:]
+                    position = len(self._tokens)
+                    finished = self._done and position >= len(self._tokens)
+                    error = self._error
+                    result = self._result
+                for token in batch:
+                    yield token
+                if finished:
+                    if error is not None:
+                        raise error
+                    return result
+        finally:
+            self._detach(detached)
+
+
+class SingleFlight:
+    """按键合并同时在途的相同请求（线程安全）"""
+
+    def __init__(self, name: str = "single-flight"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._streams: Dict[Hashable, _StreamFanout] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        执行 fn，若相同 key 的调用正在进行则等待其结果
+
+        Returns:
+            (结果, 是否复用了其他调用方的请求)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def stream(self, key: Hashable, start: Callable[[], Iterable[str]]) -> Tuple[Iterator[str], bool]:
+        """
+        订阅流式请求：相同 key 的流正在进行时加入该流，否则调用 start() 开启上游流
+
+        Returns:
+            (token 迭代器, 是否复用了其他调用方的流)
+        """
+        with self._lock:
+            fanout = self._streams.get(key)
+            shared = fanout is not None
+            if not shared:
+                fanout = _StreamFanout()
+                self._streams[key] = fanout
+            subscription = fanout.subscribe()
+
+        if not shared:
+            threading.Thread(target=self._pump, args=(key, fanout, start),
+                             name=f"{self.name}-stream", daemon=True).start()
+        return subscription, shared
+
+    def _pump(self, key: Hashable, fanout: _StreamFanout, start: Callable[[], Iterable[str]]):
+        """后台线程：读取上游流并写入扇出缓冲区"""
+        error = None
+        result = None
+        upstream = None
+        try:
+            upstream = iter(start())
+            while True:
+                try:
+                    token = next(upstream)
+                except StopIteration as stop:
+                    result = stop.value
+                    break
+                fanout.publish(token)
+                if fanout.abandoned():
+                    break
+        except BaseException as e:
+            error = e
+        finally:
+            # 关闭上游生成器（释放 HTTP 连接）
+            close = getattr(upstream, "close", None)
+            if close is not None:
+                close()
+            with self._lock:
+                if self._streams.get(key) is fanout:
+                    del self._streams[key]
+            fanout.finish(error, result)
+
+    def inflight(self) -> int:
+        """当前在途的请求数（非流式 + 流式）"""
+        with self._lock:
+            return len(self._calls) + len(self._streams)
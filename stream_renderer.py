@@ -0,0 +1,98 @@
+"""
+流式输出的界面渲染：把 token 合并成帧再刷新，避免每个 token 都重绘一次
+
+Streamlit 每次调用 placeholder.text() 都会通过 websocket 推送完整文本。逐 token 刷新时，
+界面更新次数等于 token 数，且每次都要重新拼接已收到的全部文本（总代价随长度平方增长），
+解码速度较快时浏览器和 Streamlit 服务端都会落后于模型。
+
+StreamRenderer 在以下任一条件满足时输出一帧：
+- 距上一帧超过时间预算（STREAM_RENDER_INTERVAL_MS）
+- 未刷新的字符数超过字节预算（STREAM_RENDER_MAX_CHARS），大段文本到达时不必等待
+首个 token 立即显示，流结束时（finish）补上最后一帧。已收到的文本按帧增量拼接。
+"""
+import time
+from typing import Callable, Dict, List
+from config import STREAM_RENDER_INTERVAL_MS, STREAM_RENDER_MAX_CHARS
+
+
+class StreamRenderer:
+    """
+    按时间 / 字节预算合并 token 的渲染器
+
+    render: 以截至当前的完整文本调用，负责实际刷新界面（如 placeholder.text）
+    """
+
+    def __init__(self, render: Callable[[str], None], interval_ms: float = None, max_chars: int = None):
+        self.render = render
+        self.interval = (STREAM_RENDER_INTERVAL_MS if interval_ms is None else interval_ms) / 1000
+        self.max_chars = STREAM_RENDER_MAX_CHARS if max_chars is None else max_chars
+        self.text = ""
+        self._pending: List[str] = []
+        self._pending_chars = 0
+        self.chunks = 0
+        self.frames = 0
+        self.render_seconds = 0.0
+        self._first_at = None
+        self._last_at = None
+        self._last_frame_at = None
+
+    def feed(self, token: str) -> bool:
+        """收到一个 token；返回本次是否刷新了界面"""
+        now = time.perf_counter()
+        if self._first_at is None:
+            self._first_at = now
+        self._last_at = now
+        self.chunks += 1
+        self._pending.append(token)
+        self._pending_chars += len(token)
+        if (self._last_frame_at is None or now - self._last_frame_at >= self.interval
+                or self._pending_chars >= self.max_chars):
+            self._flush(now)
+            return True
+        return False
+
+    def finish(self) -> str:
+        """流结束：刷新剩余的 token，返回完整文本"""
+        if self._pending:
+            self._flush(time.perf_counter())
+        return self.text
+
+    def _flush(self, now: float):
+        self.text += "".join(self._pending)
+        self._pending.clear()
+        self._pending_chars = 0
+        self.render(self.text)
+        self._last_frame_at = time.perf_counter()
+        self.render_seconds += self._last_frame_at - now
+        self.frames += 1
+
+    def stats(self) -> Dict:
+        """
+        渲染统计：帧数、token 数、每帧平均 token 数、界面刷新率（帧/秒，从首个 token 到最后一帧）、
+        token 到达速度（token/秒）、渲染耗时（调用 render 的总时间）
+        """
+        span = (self._last_frame_at - self._first_at) if self.frames > 1 else 0.0
+        receive_span = (self._last_at - self._first_at) if self.chunks > 1 else 0.0
+        return {
+            "frames": self.frames,
+            "chunks": self.chunks,
+            "chars": len(self.text),
+            "chunks_per_frame": self.chunks / self.frames if self.frames else 0.0,
+            "fps": (self.frames - 1) / span if span > 0 else None,
+            "chunks_per_second": (self.chunks - 1) / receive_span if receive_span > 0 else None,
+            "render_ms": self.render_seconds * 1000,
+        }
+
+
+def format_render_stats(stats: Dict, decode_tps: float = None) -> str:
+    """把渲染统计格式化为一行说明；decode_tps 为模型解码速度（token/秒），缺省时显示 token 到达速度"""
+    parts = [f"界面刷新 {stats['frames']} 帧"]
+    if stats["fps"] is not None:
+        parts.append(f"{stats['fps']:.1f} 帧/秒")
+    if decode_tps:
+        parts.append(f"模型 {decode_tps:.1f} token/秒")
+    elif stats["chunks_per_second"] is not None:
+        parts.append(f"接收 {stats['chunks_per_second']:.1f} token/秒")
+    parts.append(f"每帧 {stats['chunks_per_frame']:.1f} 个 token")
+    parts.append(f"渲染耗时 {stats['render_ms']:.0f}ms")
+    return "渲染: " + " · ".join(parts)
@@ -0,0 +1,125 @@
+"""
+测试公共设施：模块位于仓库根目录
+
+- mock_ollama：在进程内启动模拟 Ollama 服务（测试结束时自动停止）
+- fake_encoder：用离线的确定性编码器代替 Embedding 模型，向量库、RAG 生成与 RAG 服务可以不下载模型端到端测试
+- corpus / store：写入一份小语料并在临时目录中构建向量库
+"""
+import json
+import os
+import sys
+import threading
+import zlib
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_ollama_server import MockOllama, MockServerThread  # noqa: E402
+
+_SUBJECTS = ["雨夜的猫", "雪山日出", "海边灯塔", "森林小屋", "城市街道", "古寺钟楼", "沙漠骆驼", "星空下的帐篷"]
+_STYLES = ["赛博朋克", "水彩", "油画", "写实摄影", "动漫"]
+_MOODS = ["阴郁", "宁静", "梦幻", "充满活力"]
+_ELEMENTS = ["霓虹灯", "雨", "雾气", "星空", "古建筑", "海浪", "森林"]
+
+
+class FakeEncoder:
+    """
+    离线的确定性编码器（接口与 SentenceTransformer.encode 一致）：单字与相邻字对哈希到固定维度后归一化，
+    共有的字越多，两段文本的向量越接近
+    """
+
+    max_seq_length = 512
+    tokenizer = None
+
+    def __init__(self, dimension: int = 64):
+        self.dimension = dimension
+        self.calls = 0
+
+    def encode(self, texts, batch_size: int = 32, show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        self.calls += 1
+        vectors = np.zeros((len(texts), self.dimension), dtype='float32')
+        for row, text in enumerate(texts):
+            for gram in list(text) + [text[i:i + 2] for i in range(len(text) - 1)]:
+                vectors[row, zlib.crc32(gram.encode('utf-8')) % self.dimension] += 1.0
+            norm = np.linalg.norm(vectors[row])
+            if norm > 0:
+                vectors[row] /= norm
+        return vectors
+
+
+def make_records(count: int, start: int = 0):
+    """生成 ETL 输出格式的结构化记录（raw 各不相同）"""
+    records = []
+    for i in range(start, start + count):
+        subject = _SUBJECTS[i % len(_SUBJECTS)]
+        style = _STYLES[i % len(_STYLES)]
+        mood = _MOODS[i % len(_MOODS)]
+        elements = [_ELEMENTS[i % len(_ELEMENTS)], _ELEMENTS[(i * 3 + 1) % len(_ELEMENTS)]]
+        records.append({
+            "subject": subject,
+            "art_style": style,
+            "visual_elements": elements,
+            "mood": mood,
+            "technical": ["8k", "杰作"],
+            "raw": f"{style}风格的{subject}，{'、'.join(elements)}，{mood}，第 {i} 号",
+        })
+    return records
+
+
+def write_records(path, records):
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return str(path)
+
+
+@pytest.fixture
+def mock_ollama():
+    """返回启动函数：mock_ollama(**MockOllama 参数) → 已启动的 MockServerThread（默认不模拟模型加载耗时）"""
+    servers = []
+
+    def start(**kwargs) -> MockServerThread:
+        kwargs.setdefault("load_ms", 0)
+        kwargs.setdefault("decode_tps", 1000)
+        server = MockServerThread(MockOllama(**kwargs)).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def fake_encoder(monkeypatch):
+    """用 FakeEncoder 代替 Embedding 模型（vector_store 在模块级导入 sentence-transformers，未安装时跳过）"""
+    pytest.importorskip("sentence_transformers")
+    from config import EMBEDDING_MODEL
+    from vector_store import VectorStore
+
+    encoder = FakeEncoder()
+    monkeypatch.setattr(VectorStore, "_encoder_cache", {EMBEDDING_MODEL: encoder})
+    monkeypatch.setattr(VectorStore, "_dimension_cache", {EMBEDDING_MODEL: encoder.dimension})
+    monkeypatch.setattr(VectorStore, "_encoder_locks", {EMBEDDING_MODEL: threading.Lock()})
+    monkeypatch.setattr(VectorStore, "_probe_cache", {})
+    return encoder
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    """40 条结构化记录的 JSONL 路径"""
+    return write_records(tmp_path / "structured.jsonl", make_records(40))
+
+
+@pytest.fixture
+def store(fake_encoder, corpus, tmp_path):
+    """在临时目录中全量构建好的向量库"""
+    from vector_store import VectorStore
+
+    db_dir = tmp_path / "db"
+    vector_store = VectorStore(index_path=str(db_dir / "knowledge.index"), metadata_path=str(db_dir / "metadata.jsonl"))
+    vector_store.build_index(corpus, incremental=False)
+    yield vector_store
+    vector_store.close()
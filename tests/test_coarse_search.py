@@ -0,0 +1,51 @@
+"""两阶段检索：构建时只生成 COARSE_MODE 配置的粗排码；候选覆盖全库时结果与全精度检索一致"""
+import os
+
+import numpy as np
+import pytest
+
+
+def _build(tmp_path, corpus, monkeypatch, mode):
+    import vector_store
+    from vector_store import VectorStore
+
+    monkeypatch.setattr(vector_store, "COARSE_MODE", mode)
+    db_dir = tmp_path / f"db_{mode}"
+    store = VectorStore(index_path=str(db_dir / "knowledge.index"), metadata_path=str(db_dir / "metadata.jsonl"))
+    store.build_index(corpus, incremental=False)
+    return store
+
+
+@pytest.mark.parametrize("mode", ["none", "binary", "pca"])
+def test_build_writes_only_configured_coarse_index(fake_encoder, corpus, tmp_path, monkeypatch, mode):
+    store = _build(tmp_path, corpus, monkeypatch, mode)
+    written = sorted(name for name, path in store.coarse_paths.items() if os.path.exists(path))
+
+    assert written == ([] if mode == "none" else [mode])
+    assert store._snapshot.coarse is None if mode == "none" else store._snapshot.coarse[0] == mode
+
+
+@pytest.mark.parametrize("mode", ["binary", "pca"])
+def test_coarse_to_fine_matches_exact_search(fake_encoder, corpus, tmp_path, monkeypatch, mode):
+    exact = _build(tmp_path, corpus, monkeypatch, "none")
+    coarse = _build(tmp_path, corpus, monkeypatch, mode)
+
+    for query in ["雨夜的猫", "水彩风格的海边灯塔", "宁静的森林小屋"]:
+        # 候选数 top_k × COARSE_SHORTLIST_FACTOR 覆盖全部 40 条时，精排结果必须与全精度检索相同
+        expected = [(item["raw"], round(d, 4)) for item, d in exact.search(query, top_k=3, mmr=False, rerank=False)]
+        actual = [(item["raw"], round(d, 4)) for item, d in coarse.search(query, top_k=3, mmr=False, rerank=False)]
+        assert actual == expected
+
+
+def test_coarse_to_fine_returns_exact_distances_for_shortlist(fake_encoder, corpus, tmp_path, monkeypatch):
+    from vector_store import VectorStore
+
+    store = _build(tmp_path, corpus, monkeypatch, "binary")
+    query_vector = store.encode_query("雪山日出")
+    distances, indices = VectorStore._coarse_to_fine(store._snapshot.index, store._snapshot.coarse, query_vector,
+                                                    top_k=5, shortlist_factor=2)
+
+    assert indices.shape == (1, 5) and (indices >= 0).all()
+    assert list(distances[0]) == sorted(distances[0])
+    vectors = store._snapshot.index.reconstruct_batch(indices[0])
+    np.testing.assert_allclose(distances[0], ((vectors - query_vector[0]) ** 2).sum(axis=1), rtol=1e-5)
@@ -0,0 +1,43 @@
+"""按 token 长度分桶编码：批次覆盖全部文本、不超过预算与条数上限，编码结果恢复原始顺序"""
+import numpy as np
+import pytest
+
+pytest.importorskip("sentence_transformers")
+
+from vector_store import VectorStore  # noqa: E402
+
+
+def test_plan_batches_respects_budget_and_max_batch():
+    lengths = [5, 120, 30, 30, 7, 480, 64, 1, 0, 200, 33, 12]
+    batches = VectorStore._plan_batches(lengths, token_budget=256, max_batch=4)
+
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+    for batch in batches:
+        assert len(batch) <= 4
+        padded = max(max(lengths[i], 1) for i in batch) * len(batch)
+        # 单条超过预算的文本独占一批
+        assert padded <= 256 or len(batch) == 1
+    # 长度降序：每批第一条即为批内最长，且批次之间不增
+    firsts = [lengths[batch[0]] for batch in batches]
+    assert firsts == sorted(firsts, reverse=True)
+    assert all(lengths[batch[0]] == max(lengths[i] for i in batch) for batch in batches)
+
+
+def test_plan_batches_groups_short_texts_together():
+    batches = VectorStore._plan_batches([10] * 8 + [100], token_budget=100, max_batch=32)
+    assert batches == [[8], list(range(8))]
+    assert VectorStore._plan_batches([], token_budget=100, max_batch=4) == []
+
+
+def test_encode_texts_restores_input_order(store, fake_encoder, monkeypatch):
+    import vector_store
+
+    monkeypatch.setattr(vector_store, "EMBED_TOKEN_BUDGET", 40)
+    texts = ["短", "一段明显更长的文本，用来让分桶改变顺序", "中等长度的文本", "猫", "雨夜的霓虹灯下的猫咪"]
+    calls = fake_encoder.calls
+
+    vectors = store._encode_texts(texts)
+
+    assert fake_encoder.calls - calls > 1
+    np.testing.assert_allclose(vectors, fake_encoder.encode(texts))
+    assert store._encode_texts([]).shape == (0, fake_encoder.dimension)
@@ -0,0 +1,56 @@
+"""索引热加载：磁盘版本变化时原子替换快照，读取方始终看到一致的索引与元数据"""
+from conftest import make_records, write_records
+
+
+def _reader(store):
+    from vector_store import VectorStore
+
+    reader = VectorStore(index_path=store.index_path, metadata_path=store.metadata_path)
+    reader.load_index()
+    return reader
+
+
+def test_reload_if_changed_swaps_in_rebuilt_index(store, corpus):
+    reader = _reader(store)
+    assert len(reader.metadata) == 40
+    assert reader.reload_if_changed() is False
+
+    # 增量追加 10 条后重新构建
+    write_records(corpus, make_records(50))
+    store.build_index(corpus, incremental=True)
+    assert store.index.ntotal == 50
+
+    old_version = reader.version
+    assert reader.reload_if_changed() is True
+    assert reader.version != old_version and reader.version == store.version
+    assert reader.index.ntotal == len(reader.metadata) == 50
+    # 新增的记录可以被检索到
+    raw = make_records(1, start=45)[0]["raw"]
+    assert reader.search(raw, top_k=1, mmr=False, rerank=False)[0][0]["raw"] == raw
+    assert reader.reload_if_changed() is False
+
+
+def test_reload_clears_search_cache(store, corpus):
+    reader = _reader(store)
+    query = make_records(1, start=45)[0]["raw"]
+    before = reader.search(query, top_k=1, mmr=False, rerank=False)
+
+    write_records(corpus, make_records(50))
+    store.build_index(corpus, incremental=True)
+    reader.reload_if_changed()
+
+    assert reader.search(query, top_k=1, mmr=False, rerank=False) != before
+
+
+def test_assigning_metadata_keeps_snapshot_parts(store):
+    version, coarse, fields = store.version, store._snapshot.coarse, store._snapshot.fields
+    store.metadata = list(store.metadata)
+    assert (store.version, store._snapshot.coarse, store._snapshot.fields) == (version, coarse, fields)
+
+
+def test_auto_reload_thread_stops(store):
+    store.start_auto_reload(interval=0.01)
+    thread = store._reload_thread
+    assert thread.is_alive()
+    store.stop_auto_reload()
+    assert not thread.is_alive() and store._reload_thread is None
@@ -0,0 +1,115 @@
+"""知识包：写入后重新打开，索引（反序列化 / 零拷贝映射）、元数据与模型指纹一致；VectorStore 按 INDEX_FORMAT 生成与加载"""
+import os
+
+import faiss
+import numpy as np
+import pytest
+
+from knowledge_pack import PROBE_TEXTS, PackFormatError, open_pack, write_pack
+
+DIM = 16
+
+
+@pytest.fixture
+def pack_data():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((50, DIM)).astype('float32')
+    index = faiss.IndexFlatL2(DIM)
+    index.add(vectors)
+    metadata = [{"raw": f"素材 {i}", "art_style": ["赛博朋克", "水彩"][i % 2]} for i in range(50)]
+    probes = rng.standard_normal((len(PROBE_TEXTS), DIM)).astype('float32')
+    return index, vectors, metadata, probes
+
+
+@pytest.fixture
+def pack(tmp_path, pack_data):
+    index, _, metadata, probes = pack_data
+    path = write_pack(str(tmp_path / "knowledge.pack"), index, metadata, "test-model", probes, version="v1")
+    pack = open_pack(path)
+    yield pack
+    pack.close()
+
+
+@pytest.mark.parametrize("mmap_index", [False, True])
+def test_index_round_trip(pack, pack_data, mmap_index):
+    index, vectors, _, _ = pack_data
+    loaded = pack.read_index(mmap_index=mmap_index)
+    assert loaded.ntotal == index.ntotal and loaded.d == DIM
+    expected = index.search(vectors[:5], 3)
+    actual = loaded.search(vectors[:5], 3)
+    np.testing.assert_array_equal(actual[1], expected[1])
+    np.testing.assert_allclose(actual[0], expected[0])
+
+
+def test_metadata_and_header(pack, pack_data):
+    _, _, metadata, _ = pack_data
+    packed = pack.metadata()
+    assert len(packed) == 50
+    assert packed[7] == metadata[7]
+    assert packed[-1] == metadata[-1]
+    assert packed[2:4] == metadata[2:4]
+    with pytest.raises(IndexError):
+        packed[50]
+    assert pack.version == "v1"
+    assert pack.fingerprint["model"] == "test-model" and pack.fingerprint["dimension"] == DIM
+
+
+def test_check_fingerprint(pack, pack_data):
+    _, _, _, probes = pack_data
+    pack.check_fingerprint("test-model", DIM, probes.copy())
+    with pytest.raises(PackFormatError, match="维度"):
+        pack.check_fingerprint("other-model", DIM + 1, probes)
+    with pytest.raises(PackFormatError, match="不匹配"):
+        pack.check_fingerprint("other-model", DIM, probes[::-1].copy())
+
+
+def test_rejects_non_pack_file(tmp_path):
+    path = tmp_path / "bad.pack"
+    path.write_bytes(b"NOTAPACK" + bytes(64))
+    with pytest.raises(PackFormatError):
+        open_pack(str(path))
+
+
+def _build_store(tmp_path, corpus, monkeypatch, index_format):
+    import vector_store
+    from vector_store import VectorStore
+
+    monkeypatch.setattr(vector_store, "INDEX_FORMAT", index_format)
+    db_dir = tmp_path / "db"
+    store = VectorStore(index_path=str(db_dir / "knowledge.index"), metadata_path=str(db_dir / "metadata.jsonl"))
+    store.build_index(corpus, incremental=False)
+    return store
+
+
+def test_store_builds_and_loads_pack(fake_encoder, corpus, tmp_path, monkeypatch):
+    from knowledge_pack import PackedMetadata
+
+    store = _build_store(tmp_path, corpus, monkeypatch, "auto")
+    assert os.path.exists(store.pack_path)
+    assert open_pack(store.pack_path).version == store.version
+
+    store.load_index()
+    assert isinstance(store.metadata, PackedMetadata) and len(store.metadata) == 40
+    raw = store.metadata[3]["raw"]
+    assert store.search(raw, top_k=1, mmr=False, rerank=False)[0][0]["raw"] == raw
+
+
+def test_files_format_skips_pack_and_removes_stale_one(fake_encoder, corpus, tmp_path, monkeypatch):
+    store = _build_store(tmp_path, corpus, monkeypatch, "auto")
+    assert os.path.exists(store.pack_path)
+
+    store = _build_store(tmp_path, corpus, monkeypatch, "files")
+    assert not os.path.exists(store.pack_path)
+    store.load_index()
+    assert isinstance(store.metadata, list) and len(store.metadata) == 40
+
+
+def test_store_refuses_pack_from_other_model(fake_encoder, corpus, tmp_path, monkeypatch):
+    from config import EMBEDDING_MODEL
+
+    store = _build_store(tmp_path, corpus, monkeypatch, "pack")
+    # 模拟换了 Embedding 模型：探针向量不同
+    probes = store.model_fingerprint()
+    monkeypatch.setitem(type(store)._probe_cache, EMBEDDING_MODEL, probes[::-1].copy())
+    with pytest.raises(PackFormatError, match="不匹配"):
+        store.load_index()
@@ -0,0 +1,174 @@
+"""LLM 调度器：交互请求优先、批量请求上限、排队已满 / 超时拒绝、取消等待"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from async_ollama_client import AsyncOllamaClient
+from llm_scheduler import BATCH, INTERACTIVE, LLMScheduler, SchedulerRejected, parse_class_values
+
+
+def _scheduler(**kwargs) -> LLMScheduler:
+    kwargs.setdefault("weights", {INTERACTIVE: 4.0, BATCH: 1.0})
+    kwargs.setdefault("max_queue", {INTERACTIVE: 32, BATCH: 256})
+    return LLMScheduler("http://test", **kwargs)
+
+
+def _acquire_in_thread(scheduler, priority, order):
+    def run():
+        ticket = scheduler.acquire(priority)
+        order.append(priority)
+        scheduler.release(ticket)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def _wait_for_waiting(scheduler, priority, count):
+    deadline = time.monotonic() + 5
+    while scheduler.stats()[priority]["waiting"] < count:
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.01)
+
+
+def test_interactive_request_overtakes_queued_batch_requests():
+    scheduler = _scheduler(slots=1, reserved=0)
+    held = scheduler.acquire(BATCH)
+    order = []
+    threads = [_acquire_in_thread(scheduler, BATCH, order) for _ in range(3)]
+    _wait_for_waiting(scheduler, BATCH, 3)
+    threads.append(_acquire_in_thread(scheduler, INTERACTIVE, order))
+    _wait_for_waiting(scheduler, INTERACTIVE, 1)
+
+    scheduler.release(held)
+    for t in threads:
+        t.join(5)
+    assert order == [INTERACTIVE, BATCH, BATCH, BATCH]
+
+
+def test_batch_requests_leave_reserved_slots_for_interactive():
+    scheduler = _scheduler(slots=3, reserved=1)
+    batch = [scheduler.acquire(BATCH, timeout=1) for _ in range(2)]
+    with pytest.raises(SchedulerRejected):
+        scheduler.acquire(BATCH, timeout=0.05)
+    interactive = scheduler.acquire(INTERACTIVE, timeout=0.05)
+    assert interactive.queue_ms < 50
+
+    stats = scheduler.stats()
+    assert stats[BATCH]["inflight"] == 2 and stats[INTERACTIVE]["inflight"] == 1
+    assert stats[BATCH]["rejected"] == 1
+    for ticket in batch + [interactive]:
+        scheduler.release(ticket)
+    assert scheduler.stats()[BATCH]["inflight"] == 0
+
+
+def test_full_interactive_queue_rejects_and_full_batch_queue_defers():
+    scheduler = _scheduler(slots=1, reserved=0, max_queue={INTERACTIVE: 1, BATCH: 1})
+    held = scheduler.acquire(INTERACTIVE)
+    order = []
+    threads = [_acquire_in_thread(scheduler, INTERACTIVE, order)]
+    _wait_for_waiting(scheduler, INTERACTIVE, 1)
+    with pytest.raises(SchedulerRejected, match="排队已满"):
+        scheduler.acquire(INTERACTIVE)
+
+    threads += [_acquire_in_thread(scheduler, BATCH, order) for _ in range(2)]
+    deadline = time.monotonic() + 5
+    while scheduler.stats()[BATCH]["deferred"] < 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    scheduler.release(held)
+    for t in threads:
+        t.join(5)
+    # 延后的批量请求不丢弃
+    assert order == [INTERACTIVE, BATCH, BATCH]
+
+
+def test_release_is_idempotent():
+    scheduler = _scheduler(slots=1)
+    ticket = scheduler.acquire(INTERACTIVE)
+    scheduler.release(ticket)
+    scheduler.release(ticket)
+    assert scheduler.stats()[INTERACTIVE]["inflight"] == 0
+    assert ticket.report()["priority"] == INTERACTIVE
+
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    scheduler = _scheduler(slots=1, reserved=0)
+
+    async def main():
+        held = await scheduler.aacquire(INTERACTIVE)
+        waiter = asyncio.ensure_future(scheduler.aacquire(INTERACTIVE))
+        await asyncio.sleep(0.01)
+        assert scheduler.stats()[INTERACTIVE]["waiting"] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.stats()[INTERACTIVE]["waiting"] == 0
+
+        scheduler.release(held)
+        # 槽位没有被已取消的等待者占用
+        ticket = await asyncio.wait_for(scheduler.aacquire(INTERACTIVE), 1)
+        scheduler.release(ticket)
+
+    asyncio.run(main())
+
+
+def test_async_waiter_times_out():
+    scheduler = _scheduler(slots=1)
+
+    async def main():
+        async with scheduler.aslot(INTERACTIVE):
+            with pytest.raises(SchedulerRejected, match="超过"):
+                await scheduler.aacquire(INTERACTIVE, timeout=0.05)
+        assert scheduler.stats()[INTERACTIVE]["inflight"] == 0
+
+    asyncio.run(main())
+
+
+def test_parse_class_values():
+    assert parse_class_values("interactive:4, batch:0.5") == {INTERACTIVE: 4.0, BATCH: 0.5}
+    with pytest.raises(ValueError):
+        parse_class_values("urgent:1")
+
+
+def test_async_client_reports_queue_time(mock_ollama, monkeypatch):
+    server = mock_ollama(slots=4, decode_tps=200, max_tokens=10)
+    scheduler = _scheduler(slots=1, reserved=0)
+    monkeypatch.setitem(LLMScheduler._registry, server.url, scheduler)
+
+    async def main():
+        async with AsyncOllamaClient(host=server.url, scheduler=True) as client:
+            stats = [{} for _ in range(3)]
+            await asyncio.gather(*(client.generate(f"提示词{i}", on_done=stats[i].update) for i in range(3)))
+        return stats
+
+    stats = asyncio.run(main())
+    queue_ms = sorted(s["scheduler"]["queue_ms"] for s in stats)
+    # 调度器只有一个槽位：请求依次执行，后面的请求排队
+    assert queue_ms[-1] > queue_ms[0] + 20
+    assert server.mock.stats["max_in_flight"] == 1
+
+
+def test_scheduler_is_off_by_default():
+    from ollama_client import OllamaClient
+
+    assert OllamaClient(host="http://test", hosts=[]).scheduler is None
+    assert AsyncOllamaClient(host="http://test").scheduler is None
+
+
+def test_etl_reports_concurrency_capped_by_batch_slots(mock_ollama, tmp_path, monkeypatch, capsys):
+    pytest.importorskip("pandas")
+    from etl_pipeline import ETLPipeline
+
+    server = mock_ollama(max_tokens=5)
+    monkeypatch.setitem(LLMScheduler._registry, server.url, _scheduler(slots=4, reserved=1))
+    pipeline = ETLPipeline(async_client=AsyncOllamaClient(host=server.url, priority=BATCH, scheduler=True))
+
+    pipeline.process_batch(["猫", "狗"], output_path=str(tmp_path / "out.jsonl"), concurrency=8)
+    assert "最多占用 3 个槽位，实际并发低于 8" in capsys.readouterr().out
+
+    pipeline = ETLPipeline(async_client=AsyncOllamaClient(host=server.url, priority=BATCH, scheduler=True))
+    pipeline.process_batch(["猫", "狗"], output_path=str(tmp_path / "out.jsonl"), concurrency=3)
+    assert "槽位" not in capsys.readouterr().out
@@ -0,0 +1,57 @@
+"""LLM 遥测：由 Ollama 耗时字段推导时间构成，按模型 / 主机聚合滚动窗口统计"""
+import pytest
+
+from llm_telemetry import LLMTelemetry, derive, format_breakdown, trace_attributes
+
+STATS = {"load_duration": 100e6, "prompt_eval_count": 400, "prompt_eval_duration": 200e6,
+         "eval_count": 50, "eval_duration": 1000e6}
+
+
+def test_derive_splits_wall_time():
+    record = derive(STATS, wall_ms=1500)
+
+    assert (record["load_ms"], record["prefill_ms"], record["decode_ms"]) == (100, 200, 1000)
+    assert record["queue_ms"] == pytest.approx(200)
+    assert record["prefill_tps"] == pytest.approx(2000) and record["decode_tps"] == pytest.approx(50)
+    assert "预填充 200ms（400 tokens，2000 tok/s）" in format_breakdown(record)
+
+
+def test_derive_handles_missing_fields():
+    record = derive({}, wall_ms=30)
+    assert record["queue_ms"] == 30 and record["prompt_tokens"] == record["eval_tokens"] == 0
+    assert record["prefill_tps"] is None and record["decode_tps"] is None
+    # 服务端耗时超过墙钟（时钟误差）时排队时间不为负
+    assert derive(STATS, wall_ms=1000)["queue_ms"] == 0
+
+
+def test_summary_groups_and_rolls_window():
+    telemetry = LLMTelemetry(window=3)
+    for i in range(5):
+        telemetry.record("qwen", "http://a", dict(STATS, prompt_eval_count=100 * (i + 1),
+                                                  prompt_eval_duration=50e6 * (i + 1)), wall_ms=1500 + 50 * i)
+    telemetry.record("qwen", "http://b", STATS, wall_ms=1500)
+
+    by_model = telemetry.summary()
+    assert by_model["qwen"]["requests"] == 4
+    by_host = telemetry.summary(group_by="host")
+    assert by_host["http://a"]["requests"] == 3 and by_host["http://b"]["requests"] == 1
+    # 窗口只保留最近 3 次：300/400/500 tokens
+    assert by_host["http://a"]["prompt_tokens"]["p50"] == 400
+    assert by_host["http://a"]["prefill_ttft_correlation"] == pytest.approx(1.0)
+    assert by_host["http://b"]["prefill_ttft_correlation"] is None
+    assert set(telemetry.summary(group_by=None)) == {"all"}
+
+    telemetry.clear()
+    assert telemetry.summary() == {}
+    assert "ollama_decode_tokens_per_second" in LLMTelemetry.render()
+
+
+def test_trace_attributes_prefers_recorded_telemetry():
+    stats = dict(STATS, host="http://a", residency="warm", scheduler={"queue_ms": 12.5},
+                 telemetry=derive(STATS, wall_ms=2000))
+    attributes = trace_attributes(stats)
+    assert attributes["host"] == "http://a" and attributes["residency"] == "warm"
+    assert attributes["scheduler_queue_ms"] == 12.5 and attributes["eval_tokens"] == 50
+
+    assert trace_attributes(STATS, wall_ms=1500)["prefill_ms"] == 200
+    assert trace_attributes(STATS) == {}
@@ -0,0 +1,46 @@
+"""MMR 多样化检索：λ=1 时退化为相关性排序，λ<1 时跳过与已选结果近似重复的候选"""
+import numpy as np
+import pytest
+
+pytest.importorskip("sentence_transformers")
+
+from vector_store import VectorStore  # noqa: E402
+
+
+def test_mmr_select_skips_near_duplicates():
+    query = np.array([1.0, 0.0, 0.0], dtype='float32')
+    candidates = np.array([
+        [1.0, 0.0, 0.0],   # 最相关
+        [0.99, 0.05, 0.0],  # 与第一条几乎相同
+        [0.6, 0.0, 0.8],   # 相关性较低但与第一条差异大
+    ], dtype='float32')
+
+    assert VectorStore._mmr_select(query, candidates, 2, mmr_lambda=1.0) == [0, 1]
+    assert VectorStore._mmr_select(query, candidates, 2, mmr_lambda=0.3) == [0, 2]
+    assert VectorStore._mmr_select(query, candidates, 10, mmr_lambda=0.3) == [0, 2, 1]
+
+
+def test_mmr_select_uses_given_relevance():
+    query = np.array([1.0, 0.0], dtype='float32')
+    candidates = np.array([[1.0, 0.0], [0.0, 1.0]], dtype='float32')
+    relevance = np.array([0.0, 1.0], dtype='float32')
+    assert VectorStore._mmr_select(query, candidates, 1, mmr_lambda=0.7, relevance=relevance) == [1]
+
+
+def test_search_mmr_with_lambda_one_matches_plain_search(store):
+    query = "雨夜的猫"
+    plain = store.search(query, top_k=5, mmr=False, rerank=False)
+    diverse = store.search(query, top_k=5, mmr=True, fetch_k=20, mmr_lambda=1.0, rerank=False)
+    assert [item["raw"] for item, _ in diverse] == [item["raw"] for item, _ in plain]
+
+
+def test_search_mmr_returns_distinct_results(store):
+    query = "赛博朋克风格的雨夜的猫"
+    plain = store.search(query, top_k=5, mmr=False, rerank=False)
+    diverse = store.search(query, top_k=5, mmr=True, fetch_k=30, mmr_lambda=0.3, rerank=False)
+
+    raws = [item["raw"] for item, _ in diverse]
+    assert len(raws) == len(set(raws)) == 5
+    assert raws[0] == plain[0][0]["raw"]
+    # 多样化后覆盖的主体不少于纯相关性排序
+    assert len({item["subject"] for item, _ in diverse}) >= len({item["subject"] for item, _ in plain})
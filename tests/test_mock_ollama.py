@@ -0,0 +1,106 @@
+"""在进程内的模拟 Ollama 服务上端到端调用同步 / 异步客户端：token 顺序、最终统计、并行槽位与取消"""
+import asyncio
+import time
+
+import pytest
+import requests
+
+from async_ollama_client import AsyncOllamaClient
+from ollama_client import OllamaClient
+
+
+def _client(server, **kwargs) -> OllamaClient:
+    kwargs.setdefault("single_flight", False)
+    return OllamaClient(host=server.url, hosts=[], hedge=False, scheduler=False, **kwargs)
+
+
+def _wait_until(predicate, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("等待超时")
+        time.sleep(0.01)
+
+
+def test_stream_matches_unary_response_and_reports_stats(mock_ollama):
+    server = mock_ollama(max_tokens=12)
+    client = _client(server)
+    unary_stats, stream_stats = {}, {}
+
+    text = client.generate("雨夜的猫", system="s", on_done=unary_stats.update)
+    tokens = list(client.stream_generate("雨夜的猫", system="s", on_done=stream_stats.update))
+
+    assert len(tokens) == 12
+    assert "".join(tokens) == text
+    for stats in (unary_stats, stream_stats):
+        assert stats["done"] and stats["eval_count"] == 12
+        assert stats["host"] == server.url
+        assert stats["residency"] in ("warm", "cold")
+        assert "telemetry" in stats
+    assert server.mock.stats["stream"] == 1
+
+
+def test_variant_request_returns_marked_sections(mock_ollama):
+    server = mock_ollama(max_tokens=4)
+    text = _client(server).generate("请生成 3 段不同的提示词")
+    assert [f"【变体{k}】" in text for k in (1, 2, 3)] == [True, True, True]
+    assert text.index("【变体1】") < text.index("【变体2】") < text.index("【变体3】")
+
+
+def test_mock_limits_parallel_slots(mock_ollama):
+    server = mock_ollama(slots=2, decode_tps=100, max_tokens=5)
+
+    async def main():
+        async with AsyncOllamaClient(host=server.url, scheduler=False) as client:
+            return await asyncio.gather(*(client.generate(f"提示词{i}") for i in range(6)))
+
+    results = asyncio.run(main())
+    assert len(results) == 6 and all(results)
+    assert server.mock.stats["max_in_flight"] == 2
+    assert server.mock.stats["in_flight"] == 0
+
+
+def test_closing_stream_early_releases_server_slot(mock_ollama):
+    server = mock_ollama(slots=1, decode_tps=50, max_tokens=500)
+    tokens = _client(server).stream_generate("很长的输出")
+    assert next(tokens)
+    assert server.mock.stats["in_flight"] == 1
+    tokens.close()
+    # 与 Ollama 一样，客户端断开后服务端停止生成并归还槽位
+    _wait_until(lambda: server.mock.stats["in_flight"] == 0)
+    server.mock.max_tokens = 5
+    assert _client(server).generate("下一个请求")
+
+
+def test_async_stream_cancellation_releases_server_slot(mock_ollama):
+    server = mock_ollama(slots=1, decode_tps=50, max_tokens=500)
+
+    async def main():
+        async with AsyncOllamaClient(host=server.url, scheduler=False) as client:
+            stream = client.stream_generate("很长的输出")
+            first = await stream.__anext__()
+            await stream.aclose()
+            return first
+
+    assert asyncio.run(main())
+    _wait_until(lambda: server.mock.stats["in_flight"] == 0)
+
+
+def test_etl_parse_against_mock(mock_ollama):
+    pytest.importorskip("pandas")
+    from etl_pipeline import ETLPipeline
+
+    server = mock_ollama()
+    record = ETLPipeline(ollama_client=_client(server))._parse_with_llm("赛博朋克风格的雨夜猫咪，霓虹灯，8k")
+    assert record is not None
+    assert record["subject"] and record["art_style"] and isinstance(record["visual_elements"], list)
+
+
+def test_tags_and_failure_injection(mock_ollama):
+    server = mock_ollama(models=["m1", "m2"], fail_rate=1.0)
+    tags = requests.get(f"{server.url}/api/tags", timeout=5).json()
+    assert [m["name"] for m in tags["models"]] == ["m1", "m2"]
+    response = requests.post(f"{server.url}/api/generate", json={"model": "m1", "prompt": "x", "stream": False},
+                             timeout=5)
+    assert response.status_code == 500
+    assert server.mock.stats["failures"] == 1
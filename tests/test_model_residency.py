@@ -0,0 +1,40 @@
+"""模型常驻管理：按 (主机, 模型) 共享实例，同一主机上不同模型的客户端各自预加载并常驻自己的模型"""
+import pytest
+
+import model_residency
+from model_residency import ModelResidency
+from ollama_client import OllamaClient
+
+
+@pytest.fixture(autouse=True)
+def isolated_instances(monkeypatch):
+    monkeypatch.setattr(ModelResidency, "_instances", {})
+    monkeypatch.setattr(model_residency, "OLLAMA_PIN_MODELS", [])
+
+
+def _client(server, model: str) -> OllamaClient:
+    return OllamaClient(host=server.url, model=model, hosts=[], hedge=False, scheduler=False, single_flight=False)
+
+
+def test_shared_instance_is_keyed_by_host_and_model(mock_ollama):
+    server = mock_ollama()
+    chat, code = _client(server, "qwen2.5:7b"), _client(server, "qwen2.5-coder:7b")
+
+    assert chat.residency is _client(server, "qwen2.5:7b").residency
+    assert chat.residency is not code.residency
+    assert chat.residency.pinned == ["qwen2.5:7b"] and code.residency.pinned == ["qwen2.5-coder:7b"]
+
+
+def test_each_client_keeps_its_own_model_loaded(mock_ollama):
+    server = mock_ollama()
+    chat, code = _client(server, "qwen2.5:7b"), _client(server, "qwen2.5-coder:7b")
+    assert chat.residency.is_loaded() is None
+
+    assert chat.residency.ensure_pinned() == ["qwen2.5:7b"]
+    assert code.residency.ensure_pinned() == ["qwen2.5-coder:7b"]
+
+    assert chat.residency.is_loaded() and code.residency.is_loaded()
+    assert server.mock.stats["loads"] == 2
+    # 两个模型都已常驻：再次检查不重复加载
+    assert chat.residency.ensure_pinned() == [] and code.residency.ensure_pinned() == []
+    assert server.mock.stats["loads"] == 2
@@ -0,0 +1,34 @@
+"""Ollama 流式响应的 NDJSON 解析：跨数据块拼行、跳过无效行、每行到达即返回"""
+import json
+
+from ollama_client import iter_ndjson
+
+
+def _ndjson(*objects) -> bytes:
+    return b"".join(json.dumps(o, ensure_ascii=False).encode('utf-8') + b"\n" for o in objects)
+
+
+def test_iter_ndjson_reassembles_lines_split_across_chunks():
+    data = _ndjson({"response": "雨夜"}, {"response": "猫咪"}, {"done": True})
+    # 按 3 字节切分：每个汉字（3 字节）与 JSON 行都会被截断
+    chunks = [data[i:i + 3] for i in range(0, len(data), 3)]
+    assert list(iter_ndjson(chunks)) == [{"response": "雨夜"}, {"response": "猫咪"}, {"done": True}]
+
+
+def test_iter_ndjson_skips_blank_and_invalid_lines_and_keeps_trailing_object():
+    chunks = [b'{"a": 1}\n\nnot json\n[1, 2]\n', b'{"b": 2}']
+    assert list(iter_ndjson(chunks)) == [{"a": 1}, {"b": 2}]
+
+
+def test_iter_ndjson_yields_each_object_as_soon_as_its_line_completes():
+    seen = []
+
+    def chunks():
+        yield b'{"n": 1}\n{"n"'
+        seen.append("second chunk")
+        yield b': 2}\n'
+
+    objects = iter_ndjson(chunks())
+    assert next(objects) == {"n": 1}
+    assert seen == []
+    assert next(objects) == {"n": 2}
@@ -0,0 +1,76 @@
+"""RAG 生成端到端：离线编码器构建的向量库 + 进程内模拟 Ollama（同步 / 批量 / 流式 / 异步）"""
+import asyncio
+
+import pytest
+
+from ollama_client import OllamaClient
+
+
+@pytest.fixture
+def ollama(mock_ollama):
+    return mock_ollama(max_tokens=8)
+
+
+@pytest.fixture
+def generator(store, ollama):
+    from rag_generator import RAGGenerator
+
+    client = OllamaClient(host=ollama.url, hosts=[], single_flight=False, hedge=False, scheduler=False)
+    return RAGGenerator(store, client)
+
+
+def test_generate(generator, ollama):
+    stats = {}
+    result = generator.generate("雨夜的猫", top_k=3, on_done=stats.update)
+
+    assert result["final_prompt"] and result["variants"] == [result["final_prompt"]]
+    assert len(result["references"]) == 3
+    assert {"encode_ms", "search_ms", "context_ms", "llm_ms", "total_ms"} <= set(result["timings"])
+    assert stats["eval_count"] == 8 and stats["residency"] in ("warm", "cold")
+    assert ollama.mock.stats["generate"] == 1
+
+
+def test_generate_many_yields_every_intent_in_order(generator, ollama):
+    intents = ["雨夜的猫", "雪山日出", "海边灯塔", "森林小屋", "城市街道"]
+    results = list(generator.generate_many(intents, top_k=2, concurrency=2, chunk_size=2))
+
+    assert [r["index"] for r in results] == list(range(len(intents)))
+    assert [r.get("error") for r in results] == [None] * len(intents)
+    assert all(r["final_prompt"] and len(r["references"]) == 2 for r in results)
+    assert [r["user_intent"] for r in results] == intents
+    assert ollama.mock.stats["generate"] == len(intents)
+
+
+def test_generate_many_reports_llm_errors_per_item(generator, ollama, monkeypatch):
+    import ollama_client
+
+    monkeypatch.setattr(ollama_client, "MAX_RETRIES", 0)
+    ollama.mock.fail_rate = 1.0
+    results = list(generator.generate_many(["雨夜的猫"], top_k=2, concurrency=1))
+    assert len(results) == 1 and "error" in results[0] and "final_prompt" not in results[0]
+
+
+def test_stream_generate(generator):
+    stats = {}
+    tokens, references = generator.stream_generate("雪山日出", top_k=2, on_done=stats.update)
+    text = "".join(tokens)
+
+    assert text and len(references) == 2
+    assert stats["eval_count"] == 8
+
+
+def test_agenerate_and_astream_generate(generator):
+    async def main():
+        try:
+            stats = {}
+            result = await generator.agenerate("海边灯塔", top_k=2, n_variants=2, on_done=stats.update)
+            tokens, references = await generator.astream_generate("海边灯塔", top_k=2)
+            text = "".join([token async for token in tokens])
+            return result, stats, text, references
+        finally:
+            await generator.async_client.close()
+
+    result, stats, text, references = asyncio.run(main())
+    assert len(result["variants"]) == 2
+    assert stats["eval_count"] > 0
+    assert text and len(references) == 2
@@ -0,0 +1,116 @@
+"""RAG HTTP 服务端到端：离线编码器构建的向量库 + 模拟 Ollama，经 RAGServiceClient 调用各接口"""
+import pytest
+import requests
+
+from rag_client import RAGServiceClient, RAGServiceError, iter_sse
+
+
+@pytest.fixture
+def service_factory(store, mock_ollama):
+    """返回启动函数：start(**MockOllama 参数) → (RAGServiceClient, 模拟 Ollama)；测试结束时停止服务"""
+    from rag_server import RAGServerThread, RAGService
+
+    threads = []
+
+    def start(**kwargs):
+        kwargs.setdefault("max_tokens", 6)
+        ollama = mock_ollama(**kwargs)
+        thread = RAGServerThread(RAGService(store=store, ollama_host=ollama.url, llm_concurrency=2)).start()
+        threads.append(thread)
+        return RAGServiceClient(thread.url), ollama
+
+    yield start
+    for thread in threads:
+        thread.stop()
+
+
+@pytest.fixture
+def service(service_factory):
+    return service_factory()
+
+
+def test_health_and_search(service):
+    from config import TOP_K
+
+    client, _ = service
+    health = client.health()
+    assert health["status"] == "ok" and health["index_size"] == 40
+
+    assert len(client.search("雨夜的猫", top_k=3)) == 3
+    # 未指定 top_k 时使用配置的 TOP_K
+    response = client.session.post(f"{client.url}/search", json={"query": "雨夜的猫"}, timeout=10)
+    assert len(response.json()["results"]) == TOP_K
+
+
+def test_generate_returns_prompt_and_llm_stats(service):
+    client, ollama = service
+    result = client.generate("雪山日出", top_k=2, n_variants=2)
+
+    assert len(result["variants"]) == 2 and len(result["references"]) == 2
+    llm = result["llm"]
+    assert llm["eval_count"] > 0 and llm["residency"] in ("warm", "cold") and "telemetry" in llm
+    # 上下文 token 与完整回复不回传给客户端
+    assert "context" not in llm and "response" not in llm
+    assert ollama.mock.stats["generate"] == 1
+
+
+def test_stream_generate(service):
+    client, ollama = service
+    timings, stats = {}, {}
+    tokens, references = client.stream_generate("海边灯塔", top_k=2, timings=timings, on_done=stats.update)
+    text = "".join(tokens)
+
+    assert text and len(references) == 2
+    assert "search_ms" in timings
+    assert stats["eval_count"] == 6
+    assert ollama.mock.stats["stream"] == 1
+
+
+def test_stream_generate_without_retrieval(service):
+    client, _ = service
+    tokens, references = client.stream_generate("森林小屋", retrieve=False)
+    assert references == [] and "".join(tokens)
+
+
+def test_invalid_requests_return_400(service):
+    client, _ = service
+    with pytest.raises(RAGServiceError, match="400"):
+        client.search("雨夜的猫", top_k=0)
+    with pytest.raises(RAGServiceError, match="400"):
+        client.generate("   ")
+    response = requests.post(f"{client.url}/generate", data="[1]", timeout=10)
+    assert response.status_code == 400
+
+
+def test_llm_errors_are_reported(service_factory, monkeypatch):
+    import async_ollama_client
+
+    monkeypatch.setattr(async_ollama_client, "MAX_RETRIES", 0)
+    client, _ = service_factory(fail_rate=1.0)
+    with pytest.raises(RAGServiceError, match="500"):
+        client.generate("雨夜的猫", top_k=2)
+
+
+def test_metrics_count_requests(service):
+    client, _ = service
+    client.search("雨夜的猫", top_k=1)
+    text = client.metrics()
+    assert 'rag_server_requests_total{endpoint="/search",status="200"}' in text
+    assert "rag_server_llm_inflight" in text
+
+
+def test_iter_sse_parses_events_split_across_chunks():
+    data = ('event: references\ndata: {"references": []}\n\n'
+            'event: token\ndata: {"text": "猫"}\n\n'
+            'data: {"plain": true}\n\n').encode('utf-8')
+    chunks = [data[i:i + 5] for i in range(0, len(data), 5)]
+    assert list(iter_sse(chunks)) == [
+        ("references", {"references": []}),
+        ("token", {"text": "猫"}),
+        ("message", {"plain": True}),
+    ]
+
+
+def test_iter_sse_joins_multiline_data_and_ignores_events_without_data():
+    data = b'event: ping\n\nevent: done\ndata: {"a":\ndata: 1}\n\n'
+    assert list(iter_sse([data])) == [("done", {"a": 1})]
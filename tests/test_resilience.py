@@ -0,0 +1,144 @@
+"""熔断器：关闭 → 打开 → 半开（单个探测）→ 关闭 / 重新打开，客户端在熔断时不再请求主机；重试与对冲占用实际应答主机的调度槽位"""
+import time
+
+import pytest
+
+from llm_scheduler import INTERACTIVE, LLMScheduler
+from ollama_client import OllamaClient
+from resilience import CircuitBreaker
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr("resilience.time.monotonic", clock)
+    return clock
+
+
+def test_opens_after_consecutive_failures_and_rejects(clock):
+    breaker = CircuitBreaker("http://h", failure_threshold=3, reset_timeout=10)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()  # 成功清零连续失败次数
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert not breaker.available()
+
+
+def test_half_open_admits_a_single_probe(clock):
+    breaker = CircuitBreaker("http://h", failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    clock.now += 9.9
+    assert not breaker.allow()
+
+    clock.now += 0.2
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+    assert not breaker.available()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_failed_probe_reopens(clock):
+    breaker = CircuitBreaker("http://h", failure_threshold=5, reset_timeout=10)
+    for _ in range(5):
+        breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record_failure()  # 半开状态下一次失败即重新打开，并重新计时
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 5
+    assert not breaker.allow()
+
+
+def test_released_probe_can_be_taken_again(clock):
+    breaker = CircuitBreaker("http://h", failure_threshold=1, reset_timeout=1)
+    breaker.record_failure()
+    clock.now += 1
+    assert breaker.allow()
+    breaker.release()  # 请求在本地被中断：不记录结果，归还探测名额
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+
+
+def test_disabled_breaker_never_opens():
+    breaker = CircuitBreaker("http://h", failure_threshold=0, reset_timeout=10)
+    for _ in range(10):
+        breaker.record_failure()
+    assert breaker.allow() and breaker.state == CircuitBreaker.CLOSED
+
+
+def test_client_stops_calling_open_host_and_recovers(mock_ollama, monkeypatch):
+    server = mock_ollama(fail_rate=1.0)
+    breaker = CircuitBreaker(server.url, failure_threshold=1, reset_timeout=0.2)
+    monkeypatch.setitem(CircuitBreaker._registry, server.url, breaker)
+    client = OllamaClient(host=server.url, hosts=[], single_flight=False, hedge=False, scheduler=False)
+
+    with pytest.raises(Exception, match="熔断"):
+        client.generate("雨夜的猫")
+    assert breaker.state == CircuitBreaker.OPEN
+    assert server.mock.stats["requests"] == 1
+
+    # 熔断期间不发送请求，立即失败
+    with pytest.raises(Exception, match="熔断"):
+        client.generate("雨夜的猫")
+    assert server.mock.stats["requests"] == 1
+
+    # 半开后的探测请求成功，熔断器关闭
+    server.mock.fail_rate = 0.0
+    time.sleep(0.25)
+    assert client.generate("雨夜的猫")
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert server.mock.stats["requests"] == 2
+
+
+def _slots(host):
+    stats = LLMScheduler.for_host(host).stats()[INTERACTIVE]
+    return stats["granted"], stats["inflight"]
+
+
+def test_retry_on_backup_host_uses_backup_scheduler(mock_ollama):
+    primary, backup = mock_ollama(fail_rate=1.0), mock_ollama(max_tokens=4)
+    client = OllamaClient(host=primary.url, hosts=[backup.url], single_flight=False, hedge=False, scheduler=True)
+    unary_stats, stream_stats = {}, {}
+
+    assert client.generate("雨夜的猫", on_done=unary_stats.update)
+    assert "".join(client.stream_generate("雨夜的猫", on_done=stream_stats.update))
+
+    for stats in (unary_stats, stream_stats):
+        assert stats["host"] == backup.url and stats["scheduler"]["priority"] == INTERACTIVE
+    # 每次请求先在主主机上失败一次（占用并归还其槽位），再在备用主机上成功
+    assert _slots(primary.url) == (primary.mock.stats["requests"], 0)
+    assert _slots(backup.url) == (2, 0)
+
+
+def test_hedged_request_takes_slot_on_hedge_host(mock_ollama, monkeypatch):
+    monkeypatch.setattr(OllamaClient, "_hedge_delay", lambda self, key: 0.05)
+    slow, fast = mock_ollama(stall_rate=1.0, stall_seconds=0.5), mock_ollama(max_tokens=4)
+    client = OllamaClient(host=slow.url, hosts=[fast.url], single_flight=False, hedge=True, scheduler=True)
+
+    stats = {}
+    assert client.generate("雪山日出", on_done=stats.update)
+    assert stats["host"] == fast.url
+    assert _slots(fast.url) == (1, 0)
+    # 落选的请求在主主机上返回后归还槽位
+    deadline = time.monotonic() + 5
+    while _slots(slow.url)[1] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert _slots(slow.url) == (1, 0)
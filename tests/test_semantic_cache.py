@@ -0,0 +1,66 @@
+"""语义缓存：相似度阈值、参考素材指纹、TTL 与 LRU 淘汰"""
+import numpy as np
+
+from semantic_cache import SemanticCache
+
+
+def _vector(*values) -> np.ndarray:
+    return np.asarray(values, dtype='float32')
+
+
+def test_hit_requires_same_fingerprint_and_similar_query():
+    cache = SemanticCache(threshold=0.95, ttl=0, max_entries=10)
+    cache.put(_vector(1, 0, 0), "refs-a", "雨夜的猫", generation_ms=1200)
+
+    assert cache.get(_vector(1, 0.05, 0), "refs-a") == "雨夜的猫"
+    assert cache.get(_vector(1, 0.05, 0), "refs-b") is None
+    assert cache.get(_vector(0, 1, 0), "refs-a") is None
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 1)
+    assert stats["saved_gpu_seconds"] == 1.2
+
+
+def test_returns_most_similar_entry_and_normalizes_vectors():
+    cache = SemanticCache(threshold=0.5, ttl=0, max_entries=10)
+    cache.put(_vector(1, 1, 0), "refs", "对角线", generation_ms=100)
+    cache.put(_vector(10, 0, 0), "refs", "x 轴", generation_ms=100)
+    # 向量长度不影响余弦相似度
+    assert cache.get(_vector(3, 0.1, 0), "refs") == "x 轴"
+
+
+def test_fingerprint_ignores_reference_order_but_not_extra_keys():
+    refs = [{"raw": "猫"}, {"raw": "雨夜"}]
+    assert SemanticCache.fingerprint(refs, "qwen") == SemanticCache.fingerprint(refs[::-1], "qwen")
+    assert SemanticCache.fingerprint(refs, "qwen") != SemanticCache.fingerprint(refs, "llama")
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("semantic_cache.time.time", lambda: now[0])
+    cache = SemanticCache(threshold=0.9, ttl=60, max_entries=10)
+    cache.put(_vector(1, 0), "refs", "结果", generation_ms=100)
+
+    now[0] += 59
+    assert cache.get(_vector(1, 0), "refs") == "结果"
+    now[0] += 2
+    assert cache.get(_vector(1, 0), "refs") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_evicts_least_recently_used_entry():
+    cache = SemanticCache(threshold=0.99, ttl=0, max_entries=2)
+    cache.put(_vector(1, 0), "a", "A", generation_ms=100)
+    cache.put(_vector(1, 0), "b", "B", generation_ms=100)
+    assert cache.get(_vector(1, 0), "a") == "A"  # a 变为最近使用
+    cache.put(_vector(1, 0), "c", "C", generation_ms=100)
+
+    assert cache.get(_vector(1, 0), "b") is None
+    assert cache.get(_vector(1, 0), "a") == "A"
+    assert cache.get(_vector(1, 0), "c") == "C"
+
+
+def test_empty_response_is_not_cached():
+    cache = SemanticCache(threshold=0.9, ttl=0, max_entries=10)
+    cache.put(_vector(1, 0), "refs", "", generation_ms=10)
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,124 @@
+"""分片检索：多进程 scatter / gather 的结果与单个 Flat 索引一致；工作进程崩溃后重启，热加载与释放时关闭旧分片"""
+import faiss
+import numpy as np
+import pytest
+
+from sharded_search import ShardedIndex, ShardWorkerError, write_shards
+
+DIM = 16
+
+
+@pytest.fixture
+def flat():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((50, DIM)).astype('float32')
+    index = faiss.IndexFlatL2(DIM)
+    index.add(vectors)
+    metadata = [{"raw": f"素材 {i}"} for i in range(50)]
+    return index, vectors, metadata
+
+
+@pytest.fixture
+def sharded(tmp_path, flat):
+    index, _, metadata = flat
+    write_shards(index, metadata, str(tmp_path / "shards"), 3, version="v1")
+    sharded = ShardedIndex(str(tmp_path / "shards"), load_mode="memory", omp_threads=1, timeout=10)
+    yield sharded
+    sharded.close()
+
+
+def _alive(sharded):
+    return [worker.alive() for worker in sharded._workers]
+
+
+def test_search_matches_flat_index(sharded, flat):
+    index, vectors, metadata = flat
+    assert (sharded.ntotal, sharded.d, sharded.n_shards) == (50, DIM, 3)
+
+    expected_distances, expected_ids = index.search(vectors[:8], 5)
+    distances, ids = sharded.search(vectors[:8], 5)
+    np.testing.assert_array_equal(ids, expected_ids)
+    np.testing.assert_allclose(distances, expected_distances, rtol=1e-5)
+
+    np.testing.assert_allclose(sharded.reconstruct_batch([0, 17, 49]), vectors[[0, 17, 49]])
+    assert sharded.get_metadata([49, 0, 20]) == [metadata[49], metadata[0], metadata[20]]
+    packed = sharded.metadata()
+    assert len(packed) == 50 and packed[-1] == metadata[-1] and packed[16:18] == metadata[16:18]
+
+
+def test_crashed_worker_is_restarted(sharded, flat):
+    _, vectors, _ = flat
+    sharded._workers[1].process.kill()
+    sharded._workers[1].process.join()
+
+    _, ids = sharded.search(vectors[20:21], 1)
+    assert ids[0, 0] == 20
+    assert sharded.restarts == 1 and all(_alive(sharded))
+    assert sharded.check_workers() == 0
+
+
+def test_closed_index_stops_workers_and_rejects_requests(sharded, flat):
+    _, vectors, _ = flat
+    workers = list(sharded._workers)
+    sharded.close()
+
+    assert all(worker.process is None for worker in workers)
+    assert sharded.check_workers() == 0
+    with pytest.raises(ShardWorkerError, match="已关闭"):
+        sharded.search(vectors[:1], 1)
+
+
+@pytest.fixture
+def sharded_stores(fake_encoder, corpus, tmp_path, monkeypatch):
+    """(构建方, 以分片模式加载的读取方)，共用同一目录"""
+    import vector_store
+    from vector_store import VectorStore
+
+    monkeypatch.setattr(vector_store, "SHARD_COUNT", 2)
+    monkeypatch.setattr(vector_store, "INDEX_FORMAT", "files")
+    paths = {"index_path": str(tmp_path / "db" / "knowledge.index"),
+             "metadata_path": str(tmp_path / "db" / "metadata.jsonl")}
+    builder = VectorStore(**paths)
+    builder.build_index(corpus, incremental=False)
+    reader = VectorStore(**paths)
+    reader.load_index()
+    yield builder, reader
+    reader.close()
+    builder.close()
+
+
+def _rebuild(builder, corpus):
+    from conftest import make_records, write_records
+
+    write_records(corpus, make_records(50))
+    builder.build_index(corpus, incremental=True)
+
+
+def test_store_searches_shards_and_closes_them_on_reload_and_close(sharded_stores, corpus):
+    builder, reader = sharded_stores
+    first = reader.index
+    assert isinstance(first, ShardedIndex) and first.ntotal == 40
+    raw = reader.metadata[7]["raw"]
+    assert reader.search(raw, top_k=1, mmr=False, rerank=False)[0][0]["raw"] == raw
+
+    _rebuild(builder, corpus)
+    assert reader.reload_if_changed()
+    second = reader.index
+    assert isinstance(second, ShardedIndex) and second.ntotal == 50
+    # 被替换的分片索引没有读取方，立即关闭
+    assert first._closed and all(worker.process is None for worker in first._workers)
+
+    reader.close()
+    assert second._closed and reader.index is None
+
+
+def test_retired_shards_close_after_last_reader(sharded_stores, corpus):
+    builder, reader = sharded_stores
+    with reader._reading() as snapshot:
+        _rebuild(builder, corpus)
+        assert reader.reload_if_changed()
+        # 检索仍持有旧快照：旧分片保持可用
+        assert not snapshot.index._closed
+        assert snapshot.index.search(reader.encode_query("雨夜的猫"), 1)[1].shape == (1, 1)
+    assert snapshot.index._closed
+    assert not reader.index._closed
@@ -0,0 +1,170 @@
+"""请求合并：非流式共享结果 / 异常，流式扇出（晚加入补齐、返回值、全部退出时停止读取上游）"""
+import gc
+import threading
+import time
+
+import pytest
+
+from ollama_client import OllamaClient
+from single_flight import SingleFlight
+
+
+def _wait_until(predicate, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("等待超时")
+        time.sleep(0.01)
+
+
+def test_do_coalesces_concurrent_calls():
+    flight = SingleFlight("test")
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return "结果"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("k", fn))) for _ in range(5)]
+    threads[0].start()
+    _wait_until(lambda: calls)
+    for t in threads[1:]:
+        t.start()
+    _wait_until(lambda: flight.inflight() == 1)
+    time.sleep(0.05)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert len(calls) == 1
+    assert sorted(results, key=lambda r: r[1]) == [("结果", False)] + [("结果", True)] * 4
+    assert flight.inflight() == 0
+    # 完成后不再复用
+    assert flight.do("k", lambda: "新结果") == ("新结果", False)
+
+
+def test_do_shares_leader_error():
+    flight = SingleFlight("test")
+    started, release = threading.Event(), threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError("上游失败")
+
+    errors = []
+
+    def call(fn):
+        try:
+            flight.do("k", fn)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call, args=(fail,))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call, args=(lambda: "不应调用",))
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert len(errors) == 2 and errors[0] is errors[1]
+
+
+def test_stream_late_subscriber_catches_up_and_gets_return_value():
+    flight = SingleFlight("test")
+    gate = threading.Event()
+
+    def upstream():
+        yield "a"
+        yield "b"
+        gate.wait(5)
+        yield "c"
+        return {"eval_count": 3}
+
+    first, shared = flight.stream("k", upstream)
+    assert not shared
+    assert next(first) == "a"
+    second, shared = flight.stream("k", lambda: pytest.fail("不应再次开启上游"))
+    assert shared
+    gate.set()
+
+    def drain(it):
+        tokens = []
+        while True:
+            try:
+                tokens.append(next(it))
+            except StopIteration as stop:
+                return tokens, stop.value
+
+    assert drain(first) == (["b", "c"], {"eval_count": 3})
+    assert drain(second) == (["a", "b", "c"], {"eval_count": 3})
+    _wait_until(lambda: flight.inflight() == 0)
+
+
+def test_stream_stops_upstream_when_all_subscribers_leave():
+    flight = SingleFlight("test")
+    produced, closed = [], threading.Event()
+
+    def upstream():
+        try:
+            for i in range(1000):
+                produced.append(i)
+                yield str(i)
+                time.sleep(0.001)
+        finally:
+            closed.set()
+
+    tokens, _ = flight.stream("k", upstream)
+    assert next(tokens) == "0"
+    tokens.close()
+    assert closed.wait(5)
+    assert len(produced) < 1000
+
+
+def test_stream_subscriber_that_never_iterates_is_detached():
+    flight = SingleFlight("test")
+    closed = threading.Event()
+
+    def upstream():
+        try:
+            for i in range(1000):
+                yield str(i)
+                time.sleep(0.001)
+        finally:
+            closed.set()
+
+    tokens, _ = flight.stream("k", upstream)
+    del tokens
+    gc.collect()
+    assert closed.wait(5)
+    _wait_until(lambda: flight.inflight() == 0)
+
+
+@pytest.mark.parametrize("single_flight", [True, False])
+def test_client_coalesces_identical_streams_only_when_enabled(mock_ollama, single_flight):
+    server = mock_ollama(decode_tps=200, max_tokens=20)
+    clients = [OllamaClient(host=server.url, hosts=[], single_flight=single_flight, hedge=False, scheduler=False)
+               for _ in range(4)]
+    outputs = [None] * len(clients)
+    barrier = threading.Barrier(len(clients))
+
+    def run(i):
+        barrier.wait(5)
+        outputs[i] = "".join(clients[i].stream_generate("合并测试", system="s"))
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(clients))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+
+    assert all(outputs)
+    assert server.mock.stats["generate"] == (1 if single_flight else len(clients))
+    if single_flight:
+        assert len(set(outputs)) == 1
+
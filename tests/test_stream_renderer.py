@@ -0,0 +1,52 @@
+"""流式渲染：首 token 立即显示，之后按时间 / 字节预算合并成帧，结束时补上最后一帧"""
+from stream_renderer import StreamRenderer, format_render_stats
+
+
+def test_coalesces_tokens_within_interval():
+    frames = []
+    renderer = StreamRenderer(frames.append, interval_ms=60_000, max_chars=1000)
+    assert renderer.feed("雨")
+    assert not any(renderer.feed(token) for token in ["夜", "的", "猫"])
+    assert frames == ["雨"]
+
+    assert renderer.finish() == "雨夜的猫"
+    assert frames == ["雨", "雨夜的猫"]
+    stats = renderer.stats()
+    assert (stats["frames"], stats["chunks"], stats["chars"]) == (2, 4, 4)
+    assert stats["chunks_per_frame"] == 2.0
+
+
+def test_flushes_when_pending_text_exceeds_max_chars():
+    frames = []
+    renderer = StreamRenderer(frames.append, interval_ms=60_000, max_chars=5)
+    renderer.feed("a")
+    results = [renderer.feed(token) for token in ["bb", "cc", "dd", "e"]]
+    assert results == [False, False, True, False]
+    assert frames == ["a", "abbccdd"]
+    renderer.finish()
+    assert frames[-1] == "abbccdde"
+
+
+def test_zero_interval_renders_every_token():
+    frames = []
+    renderer = StreamRenderer(frames.append, interval_ms=0, max_chars=1000)
+    for token in "abc":
+        assert renderer.feed(token)
+    assert frames == ["a", "ab", "abc"]
+    # 没有未刷新的 token 时 finish 不再重绘
+    renderer.finish()
+    assert len(frames) == 3
+
+
+def test_finish_without_tokens():
+    frames = []
+    renderer = StreamRenderer(frames.append, interval_ms=50, max_chars=10)
+    assert renderer.finish() == ""
+    assert frames == []
+    assert renderer.stats()["fps"] is None
+
+
+def test_format_render_stats():
+    stats = {"frames": 3, "fps": 20.0, "chunks_per_second": 100.0, "chunks_per_frame": 5.0, "render_ms": 1.2}
+    assert format_render_stats(stats) == "渲染: 界面刷新 3 帧 · 20.0 帧/秒 · 接收 100.0 token/秒 · 每帧 5.0 个 token · 渲染耗时 1ms"
+    assert "模型 40.0 token/秒" in format_render_stats(stats, decode_tps=40)
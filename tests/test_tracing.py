@@ -0,0 +1,111 @@
+"""请求追踪：span 嵌套与导出、线程池与流式生成中的父子关系、未启用时的空 span"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import tracing
+from ollama_client import OllamaClient
+
+
+@pytest.fixture
+def traces(monkeypatch):
+    """启用追踪，导出到内存；返回已导出的 trace 列表"""
+    exporter = tracing.MemoryExporter()
+    monkeypatch.setattr(tracing, "_enabled", True)
+    monkeypatch.setattr(tracing, "_exporters", [exporter])
+    monkeypatch.setattr(tracing, "_min_ms", 0.0)
+    return exporter.traces
+
+
+def _names(trace):
+    spans = {s["span_id"]: s for s in trace["spans"]}
+    return {s["name"]: spans[s["parent_id"]]["name"] if s["parent_id"] else None for s in trace["spans"]}
+
+
+def test_nested_spans_are_exported_when_root_ends(traces):
+    @tracing.traced("inner")
+    def inner():
+        tracing.current().set(rows=3)
+
+    with tracing.span("root", user="u") as root:
+        inner()
+        with pytest.raises(ValueError):
+            with tracing.span("failing"):
+                raise ValueError("坏了")
+        assert traces == []
+
+    (trace,) = traces
+    assert trace["trace_id"] == root.trace_id and trace["attributes"] == {"user": "u"}
+    assert _names(trace) == {"root": None, "inner": "root", "failing": "root"}
+    inner_span, failing = trace["spans"][1:]
+    assert inner_span["attributes"] == {"rows": 3} and "坏了" in failing["attributes"]["error"]
+    assert "  inner" in tracing.format_trace(trace)
+
+
+def test_wrap_keeps_parent_across_thread_pool(traces):
+    with tracing.span("root"):
+        with ThreadPoolExecutor(1) as pool:
+            pool.submit(tracing.wrap(lambda: tracing.span("in_pool").end())).result()
+        # 未绑定上下文的线程开始一条新 trace
+        thread = threading.Thread(target=lambda: tracing.span("orphan").end())
+        thread.start()
+        thread.join()
+
+    orphan, trace = traces
+    assert _names(orphan) == {"orphan": None}
+    assert _names(trace) == {"root": None, "in_pool": "root"}
+
+
+def test_traced_iter_ends_span_when_closed(traces):
+    active = tracing.span("stream", parent=None)
+
+    def tokens():
+        for token in "abc":
+            tracing.span("token").end()
+            yield token
+
+    iterator = tracing.traced_iter(tokens(), active)
+    assert next(iterator) == "a"
+    iterator.close()
+
+    (trace,) = traces
+    assert trace["attributes"]["cancelled"] is True
+    assert _names(trace) == {"stream": None, "token": "stream"}
+
+
+def test_disabled_tracing_returns_noop_span(monkeypatch):
+    monkeypatch.setattr(tracing, "_enabled", False)
+    with tracing.span("root") as span:
+        assert span is tracing.NOOP_SPAN and not span
+        assert tracing.current() is tracing.NOOP_SPAN
+    iterator = iter([1])
+    assert tracing.traced_iter(iterator, span) is iterator
+
+
+def test_min_ms_drops_fast_traces(traces, monkeypatch):
+    monkeypatch.setattr(tracing, "_min_ms", 60_000.0)
+    tracing.span("fast", parent=None).end()
+    assert traces == []
+
+
+def test_stream_generate_trace_covers_retrieval_and_llm_stages(traces, store, mock_ollama):
+    from rag_generator import RAGGenerator
+
+    server = mock_ollama(max_tokens=6)
+    client = OllamaClient(host=server.url, hosts=[], single_flight=False, hedge=False, scheduler=False)
+    generator = RAGGenerator(store, client)
+    timings = {}
+
+    tokens, _ = generator.stream_generate("雨夜的猫", top_k=3, use_cache=False, timings=timings)
+    assert traces == []
+    assert len(list(tokens)) == 6
+
+    (trace,) = traces
+    assert trace["trace_id"] == timings["trace_id"]
+    names = _names(trace)
+    assert names["rag.retrieve"] == "rag.stream_generate"
+    assert names["retrieval.faiss"] == "retrieval.search"
+    assert names["llm.stream"] == "rag.stream_generate"
+    assert names["llm.ttft"] == names["llm.decode"] == "llm.stream"
+    assert all(s["duration_ms"] is not None for s in trace["spans"])
@@ -0,0 +1,30 @@
+"""一次调用生成多个备选提示词：生成指令与输出拆分（含流式输出中途的部分文本）"""
+import pytest
+
+pytest.importorskip("sentence_transformers")
+
+from rag_generator import RAGGenerator, parse_variants, variant_instruction  # noqa: E402
+
+
+def test_variant_instruction_asks_for_marked_sections():
+    assert "【变体k】" in variant_instruction(3) and "3 段" in variant_instruction(3)
+    assert "【变体" not in variant_instruction(1)
+
+
+def test_parse_variants():
+    text = "【变体1】雨夜的猫\n【变体2】雪山日出\n【变体3】海边"
+    assert parse_variants(text) == ["雨夜的猫", "雪山日出", "海边"]
+    assert parse_variants(text, 2) == ["雨夜的猫", "雪山日出"]
+    # 流式输出过程中：最后一段的标记尚未写完
+    assert parse_variants("【变体1】雨夜的猫\n【变") == ["雨夜的猫"]
+    # 模型没有使用标记、改用编号列表
+    assert parse_variants("1. 猫\n2. 狗") == ["猫", "狗"]
+    assert parse_variants("  只有一段  ") == ["只有一段"]
+    assert parse_variants("") == []
+
+
+def test_split_variants_uses_first_variant_as_final_prompt():
+    assert RAGGenerator._split_variants("【变体1】猫\n【变体2】狗", 2) == ("猫", ["猫", "狗"])
+    # 单个备选时不拆分，保留原文
+    assert RAGGenerator._split_variants("1. 猫", 1) == ("1. 猫", ["1. 猫"])
+    assert RAGGenerator._split_variants("", 2) == ("", [])
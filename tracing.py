@@ -0,0 +1,389 @@
+"""
+请求追踪：记录检索增强生成路径上各阶段的嵌套耗时（span）与属性，用于定位慢请求的时间花在了哪里
+
+    with tracing.span("retrieval.search", top_k=5) as s:
+        ...
+        s.set(cache_hit=False)
+
+    @tracing.traced("rag.retrieve")     # 整个函数作为一个 span，函数内用 tracing.current().set(...) 添加属性
+
+根 span（没有父 span）结束时，整条 trace（根 span 与其全部子 span）交给导出器（TRACE_EXPORTERS）：
+    jsonl    每条 trace 写一行 JSON 到 TRACE_PATH
+    console  以缩进树的形式打印到标准错误
+
+未启用（TRACING=false）时 span() 返回共享的空 span，开销只有一次函数调用与一次判断；
+空 span 的布尔值为 False，计算代价较高的属性可以先判断 `if s:`。
+
+父子关系通过 contextvars 传递：同一线程、同一 asyncio 任务内自动嵌套。
+提交到线程池执行时用 wrap() 带上当前上下文；跨越多次 yield 的 span（流式生成）用 parent= 显式指定父 span，
+并由 traced_iter() / atraced_iter() 在每次取 token 时激活。
+"""
+import contextlib
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+from config import TRACING, TRACE_EXPORTERS, TRACE_PATH, TRACE_MIN_MS
+
+_current: contextvars.ContextVar = contextvars.ContextVar("trace_span", default=None)
+# 省略 parent 参数时使用当前上下文中的 span
+_CURRENT = object()
+
+
+class _Trace:
+    """一条 trace：根 span 与其全部子 span（按开始顺序）"""
+
+    __slots__ = ("trace_id", "spans", "_ids")
+
+    def __init__(self):
+        self.trace_id = os.urandom(8).hex()
+        self.spans: List["Span"] = []
+        self._ids = itertools.count(1)
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+
+class Span:
+    """一个阶段：名称、起止时间与属性；可作为上下文管理器使用（进入时激活，退出时结束）"""
+
+    __slots__ = ("name", "trace", "span_id", "parent_id", "start", "start_time", "end_time", "attributes", "_token")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict):
+        self.name = name
+        self.trace = parent.trace if parent is not None else _Trace()
+        self.span_id = self.trace.next_id()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+        self.end_time = None
+        self.attributes = attributes
+        self._token = None
+        self.trace.spans.append(self)
+
+    @property
+    def trace_id(self) -> str:
+        return self.trace.trace_id
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        if self.end_time is None:
+            return None
+        return (self.end_time - self.start) * 1000
+
+    def set(self, **attributes) -> "Span":
+        self.attributes.update(attributes)
+        return self
+
+    def end(self):
+        """结束 span（重复调用无效）；根 span 结束时导出整条 trace"""
+        if self.end_time is not None:
+            return
+        self.end_time = time.perf_counter()
+        if self.parent_id is None:
+            _export(self)
+
+    def __enter__(self) -> "Span":
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        if exc is not None:
+            self.attributes["error"] = repr(exc)
+        self.end()
+
+
+class _NoopSpan:
+    """未启用追踪时返回的共享空 span"""
+
+    __slots__ = ()
+    trace_id = None
+    duration_ms = None
+
+    def set(self, **attributes) -> "_NoopSpan":
+        return self
+
+    def end(self):
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+    def __bool__(self) -> bool:
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, parent=_CURRENT, **attributes):
+    """
+    开始一个 span（未启用追踪时返回空 span）
+
+    parent: 父 span，默认取当前上下文中的 span；传 None 表示开始一条新 trace
+    """
+    if not _enabled:
+        return NOOP_SPAN
+    if parent is _CURRENT:
+        parent = _current.get()
+    elif parent is NOOP_SPAN:
+        parent = None
+    return Span(name, parent, attributes)
+
+
+def traced(name: str):
+    """装饰器：函数执行期间处于名为 name 的 span 中（函数内可用 current().set(...) 添加属性），支持协程函数"""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not _enabled:
+                    return await fn(*args, **kwargs)
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current():
+    """当前上下文中的 span（没有时为空 span）"""
+    if not _enabled:
+        return NOOP_SPAN
+    return _current.get() or NOOP_SPAN
+
+
+@contextlib.contextmanager
+def use(active):
+    """在代码块内把 active 设为当前 span（不结束它）"""
+    if not active:
+        yield active
+        return
+    token = _current.set(active)
+    try:
+        yield active
+    finally:
+        _current.reset(token)
+
+
+def wrap(fn: Callable) -> Callable:
+    """绑定当前上下文，提交到线程池后产生的 span 仍挂在当前 span 之下（未启用追踪时原样返回）"""
+    if not _enabled or _current.get() is None:
+        return fn
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.run(fn, *args, **kwargs)
+    return run
+
+
+def traced_iter(iterator: Iterator, active) -> Iterator:
+    """
+    逐个透传元素，每次取值时激活 active（其中新建的 span 挂在它下面）；迭代结束或被关闭时结束 active
+
+    未启用追踪时原样返回 iterator
+    """
+    if not active:
+        return iterator
+    return _traced_iter(iterator, active)
+
+
+def _traced_iter(iterator: Iterator, active) -> Iterator:
+    try:
+        while True:
+            token = _current.set(active)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _current.reset(token)
+            yield item
+    except GeneratorExit:
+        active.set(cancelled=True)
+        raise
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+        active.end()
+
+
+def atraced_iter(iterator, active):
+    """traced_iter 的异步版本（未启用追踪时原样返回 iterator）"""
+    if not active:
+        return iterator
+    return _atraced_iter(iterator, active)
+
+
+async def _atraced_iter(iterator, active):
+    try:
+        while True:
+            token = _current.set(active)
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+            finally:
+                _current.reset(token)
+            yield item
+    except GeneratorExit:
+        active.set(cancelled=True)
+        raise
+    finally:
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+        active.end()
+
+
+# ---- 导出 ----
+
+def trace_to_dict(root: Span) -> Dict:
+    """整条 trace 的 JSON 表示：子 span 的 start_ms 为相对根 span 开始的偏移"""
+    return {
+        "trace_id": root.trace_id,
+        "name": root.name,
+        "start_time": root.start_time,
+        "duration_ms": root.duration_ms,
+        "attributes": root.attributes,
+        "spans": [
+            {
+                "name": s.name,
+                "span_id": s.span_id,
+                "parent_id": s.parent_id,
+                "start_ms": (s.start - root.start) * 1000,
+                "duration_ms": s.duration_ms,
+                "attributes": s.attributes,
+            }
+            for s in root.trace.spans
+        ],
+    }
+
+
+def format_trace(trace: Dict) -> str:
+    """把 trace 格式化为缩进树（console 导出器使用）"""
+    children: Dict[Optional[int], list] = {}
+    for s in trace["spans"]:
+        children.setdefault(s["parent_id"], []).append(s)
+    lines = []
+
+    def walk(parent_id: Optional[int], depth: int):
+        for s in children.get(parent_id, []):
+            duration = "未结束" if s["duration_ms"] is None else f"{s['duration_ms']:.1f}ms"
+            attrs = " ".join(f"{k}={_short(v)}" for k, v in s["attributes"].items())
+            lines.append(f"{'  ' * depth}{s['name']} {duration} @+{s['start_ms']:.1f}ms {attrs}".rstrip())
+            walk(s["span_id"], depth + 1)
+
+    lines.append(f"[trace {trace['trace_id']}]")
+    walk(None, 1)
+    return "\n".join(lines)
+
+
+def _short(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.1f}"
+    text = str(value)
+    return text if len(text) <= 40 else text[:37] + "..."
+
+
+class JsonlExporter:
+    """每条 trace 写一行 JSON（追加写入，多线程安全）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, trace: Dict):
+        line = json.dumps(trace, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+
+class ConsoleExporter:
+    """以缩进树的形式打印到标准错误"""
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def export(self, trace: Dict):
+        text = format_trace(trace)
+        with self._lock:
+            print(text, file=self.stream or sys.stderr, flush=True)
+
+
+class MemoryExporter:
+    """保留在内存中（测试与基准脚本使用）"""
+
+    def __init__(self):
+        self.traces: List[Dict] = []
+
+    def export(self, trace: Dict):
+        self.traces.append(trace)
+
+
+def _default_exporters() -> list:
+    exporters = []
+    for name in (n.strip() for n in TRACE_EXPORTERS.split(",")):
+        if name == "jsonl":
+            exporters.append(JsonlExporter(TRACE_PATH))
+        elif name == "console":
+            exporters.append(ConsoleExporter())
+        elif name:
+            print(f"⚠️ 未知的追踪导出器: {name}（可选: jsonl, console）")
+    return exporters
+
+
+_enabled = TRACING
+_exporters = _default_exporters() if TRACING else []
+_min_ms = TRACE_MIN_MS
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def configure(enabled: bool = None, exporters: list = None, min_ms: float = None):
+    """运行时修改追踪配置（命令行工具、基准脚本使用）；exporters 为导出器实例列表"""
+    global _enabled, _exporters, _min_ms
+    if exporters is not None:
+        _exporters = list(exporters)
+    elif enabled and not _exporters:
+        _exporters = _default_exporters()
+    if enabled is not None:
+        _enabled = enabled
+    if min_ms is not None:
+        _min_ms = min_ms
+
+
+def _export(root: Span):
+    if root.duration_ms < _min_ms or not _exporters:
+        return
+    trace = trace_to_dict(root)
+    for exporter in _exporters:
+        try:
+            exporter.export(trace)
+        except Exception as e:
+            print(f"⚠️ 导出追踪失败: {e}")
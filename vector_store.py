@@ -1,14 +1,77 @@
 """
 向量化与索引模块：使用 Embedding 模型生成向量，构建 FAISS 索引
 """
+import contextlib
 import json
 import jsonlines
 import os
+import threading
+import time
 import numpy as np
 import faiss
 from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Tuple
-from config import EMBEDDING_MODEL, INDEX_PATH, METADATA_PATH, MODEL_CACHE_DIR
+from tqdm import tqdm
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+from config import (
+    EMBEDDING_MODEL, INDEX_PATH, METADATA_PATH, MANIFEST_PATH, MODEL_CACHE_DIR,
+    EMBED_TOKEN_BUDGET, EMBED_MAX_BATCH, INDEX_RELOAD_INTERVAL, SEARCH_CACHE_SIZE,
+    FAISS_OMP_THREADS, INDEX_LOAD_MODE, PACK_PATH, INDEX_FORMAT,
+    RETRIEVAL_MMR, MMR_FETCH_K, MMR_LAMBDA, RERANK_ENABLED, RERANK_CANDIDATES,
+    COARSE_MODE, COARSE_PCA_DIM, COARSE_SHORTLIST_FACTOR, BINARY_INDEX_PATH, PCA_INDEX_PATH,
+    SHARD_COUNT, SHARD_DIR, FIELD_INDEXES, FIELD_INDEX_DIR, RETRIEVAL_FIELD_FUSION, FIELD_WEIGHTS,
+    FIELD_FETCH_FACTOR,
+)
+import tracing
+from knowledge_pack import KnowledgePack, PROBE_TEXTS, write_pack
+from sharded_search import ShardedIndex, SHARD_MANIFEST, write_shards
+
+
+class _IndexSnapshot(NamedTuple):
+    """索引快照：索引、元数据与版本号作为一个整体替换，检索时不会看到不一致的状态"""
+    index: Any
+    metadata: List[Dict]
+    version: Optional[str]
+    # 粗排索引：(模式, 索引)，未启用时为 None
+    coarse: Optional[Tuple[str, Any]] = None
+    # 分字段向量索引：字段名 → 索引（向量已归一化，内积即余弦相似度），未启用时为 None
+    fields: Optional[Dict[str, Any]] = None
+
+
+# 分字段向量索引：字段名 → 从结构化数据中提取该字段文本的函数
+FIELD_EXTRACTORS = {
+    "subject": lambda item: item.get("subject") or "",
+    "style": lambda item: item.get("art_style") or "",
+    "elements": lambda item: " ".join(item.get("visual_elements") or []),
+    "mood": lambda item: item.get("mood") or "",
+}
+
+
+def parse_field_weights(spec: str) -> Dict[str, float]:
+    """
+    解析字段融合权重（如 "subject:0.4,style:0.2"），并归一化为和为 1
+    
+    Raises:
+        ValueError: 字段名未知、格式错误或权重全为 0
+    """
+    weights = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, value = part.partition(":")
+        name = name.strip()
+        if name not in FIELD_EXTRACTORS:
+            raise ValueError(f"未知的检索字段: {name}（可选: {', '.join(FIELD_EXTRACTORS)}）")
+        weights[name] = float(value)
+    total = sum(w for w in weights.values() if w > 0)
+    if total <= 0:
+        raise ValueError(f"字段融合权重至少需要一个大于 0: {spec}")
+    return {name: w / total for name, w in weights.items() if w > 0}
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
 
 
 class VectorStore:
@@ -17,18 +80,47 @@ class VectorStore:
     # 类级别的缓存，所有实例共享同一个 encoder
     _encoder_cache = {}
     _dimension_cache = {}
+    # 同一 encoder 的 tokenizer 不支持并发调用，按模型加锁串行化编码
+    _encoder_locks = {}
+    # 模型指纹探针向量（知识包校验用），按模型缓存
+    _probe_cache = {}
     
-    def __init__(self, model_name: str = None, index_path: str = None, metadata_path: str = None):
+    # 进程级共享实例（多个 Streamlit 会话共用同一份只读索引和元数据），按引用计数释放
+    _shared_lock = threading.Lock()
+    _shared_instances = {}
+    _shared_refcounts = {}
+    
+    def __init__(self, model_name: str = None, index_path: str = None, metadata_path: str = None,
+                 manifest_path: str = None, pack_path: str = None):
         self.model_name = model_name or EMBEDDING_MODEL
         self.index_path = index_path or INDEX_PATH
         self.metadata_path = metadata_path or METADATA_PATH
+        if manifest_path:
+            self.manifest_path = manifest_path
+        elif index_path:
+            self.manifest_path = os.path.join(os.path.dirname(self.index_path), os.path.basename(MANIFEST_PATH))
+        else:
+            self.manifest_path = MANIFEST_PATH
+        if pack_path:
+            self.pack_path = pack_path
+        elif index_path:
+            self.pack_path = os.path.join(os.path.dirname(self.index_path), os.path.basename(PACK_PATH))
+        else:
+            self.pack_path = PACK_PATH
+        # 粗排索引与主索引放在同一目录
+        db_dir = os.path.dirname(self.index_path)
+        self.coarse_paths = {
+            "binary": os.path.join(db_dir, os.path.basename(BINARY_INDEX_PATH)),
+            "pca": os.path.join(db_dir, os.path.basename(PCA_INDEX_PATH)),
+        }
+        self.shard_dir = os.path.join(db_dir, os.path.basename(SHARD_DIR))
+        self.field_dir = os.path.join(db_dir, os.path.basename(FIELD_INDEX_DIR))
         
         # 使用缓存的 encoder，避免重复加载
         if self.model_name not in VectorStore._encoder_cache:
             print(f"正在加载 Embedding 模型: {self.model_name}...")
             # 检查模型是否已下载
             try:
-                import os
                 # 使用配置的本地缓存目录
                 model_cache_path = os.path.join(MODEL_CACHE_DIR, f"models--{self.model_name.replace('/', '--')}")
                 
@@ -49,6 +141,7 @@ class VectorStore:
                 # 缓存 encoder 和维度
                 VectorStore._encoder_cache[self.model_name] = encoder
                 VectorStore._dimension_cache[self.model_name] = dimension
+                VectorStore._encoder_locks[self.model_name] = threading.Lock()
             except Exception as e:
                 print(f"✗ 模型加载失败: {e}")
                 raise
@@ -58,9 +151,154 @@ class VectorStore:
         # 使用缓存的 encoder
         self.encoder = VectorStore._encoder_cache[self.model_name]
         self.dimension = VectorStore._dimension_cache[self.model_name]
+        self._encode_lock = VectorStore._encoder_locks.setdefault(self.model_name, threading.Lock())
+        self._shared_key = None
+        self._reranker = None
         
-        self.index = None
-        self.metadata = []
+        # 当前索引快照（整体替换，读取方只需取一次引用）
+        self._snapshot = _IndexSnapshot(None, [], None)
+        # 正在检索的读取方数（按索引对象计数）；被替换的分片索引在最后一个读取方结束后关闭
+        self._snapshot_lock = threading.Lock()
+        self._index_readers = {}
+        self._retired_indexes = {}
+        
+        # 热加载线程
+        self._reload_lock = threading.Lock()
+        self._reload_stop = threading.Event()
+        self._reload_thread = None
+        
+        # 检索结果缓存（LRU），索引切换时清空
+        self._cache_lock = threading.Lock()
+        self._search_cache = OrderedDict()
+    
+    @classmethod
+    def acquire_shared(cls, model_name: str = None, index_path: str = None,
+                       metadata_path: str = None) -> "VectorStore":
+        """
+        获取进程级共享的向量库实例（引用计数 +1）
+        
+        同一进程内的所有会话共用一份索引和元数据，首次获取时加载索引并启动热加载；
+        使用完毕后调用 release() 归还，最后一个引用释放时卸载索引。
+        """
+        key = (
+            model_name or EMBEDDING_MODEL,
+            os.path.abspath(index_path or INDEX_PATH),
+            os.path.abspath(metadata_path or METADATA_PATH),
+        )
+        with cls._shared_lock:
+            store = cls._shared_instances.get(key)
+            if store is None:
+                store = cls(model_name=model_name, index_path=index_path, metadata_path=metadata_path)
+                if store.exists():
+                    store.load_index()
+                # 索引尚未构建时也启动轮询，构建完成后自动加载
+                store.start_auto_reload()
+                # 预热 encoder（进行一次 encode，避免首次检索时慢）
+                store.encode_query("预热")
+                store._shared_key = key
+                cls._shared_instances[key] = store
+                cls._shared_refcounts[key] = 0
+            cls._shared_refcounts[key] += 1
+            return store
+    
+    def release(self):
+        """归还共享实例（引用计数 -1），计数归零时停止热加载并释放索引内存"""
+        key = self._shared_key
+        if key is None:
+            return
+        with VectorStore._shared_lock:
+            if key not in VectorStore._shared_refcounts:
+                return
+            VectorStore._shared_refcounts[key] -= 1
+            if VectorStore._shared_refcounts[key] > 0:
+                return
+            del VectorStore._shared_refcounts[key]
+            VectorStore._shared_instances.pop(key, None)
+        self.close()
+        print(f"✓ 共享向量库已释放: {self.index_path}")
+    
+    def close(self):
+        """停止热加载并卸载索引（分片模式下同时停止工作进程）"""
+        self.stop_auto_reload()
+        self._swap(None, [], None)
+    
+    @classmethod
+    def shared_refcount(cls, store: "VectorStore") -> int:
+        """查询共享实例当前的引用计数"""
+        with cls._shared_lock:
+            return cls._shared_refcounts.get(store._shared_key, 0)
+    
+    @property
+    def index(self):
+        return self._snapshot.index
+    
+    @index.setter
+    def index(self, value):
+        self._assign(index=value)
+    
+    @property
+    def metadata(self) -> List[Dict]:
+        return self._snapshot.metadata
+    
+    @metadata.setter
+    def metadata(self, value: List[Dict]):
+        self._assign(metadata=value)
+    
+    def _assign(self, **changes):
+        """替换快照中的索引或元数据，保留版本号、粗排索引与分字段索引；辅助索引的行数与新索引不一致时停用并提示"""
+        snapshot = self._snapshot._replace(**changes)
+        rows = snapshot.index.ntotal if snapshot.index is not None else len(snapshot.metadata)
+        coarse, fields = snapshot.coarse, snapshot.fields
+        if coarse is not None and coarse[1].ntotal != rows:
+            print(f"⚠️ 粗排索引（{coarse[1].ntotal} 条）与新索引（{rows} 条）不一致，已停用两阶段检索")
+            coarse = None
+        if fields is not None and any(field_index.ntotal != rows for field_index in fields.values()):
+            print(f"⚠️ 分字段索引与新索引（{rows} 条）不一致，已停用分字段检索")
+            fields = None
+        self._swap(snapshot.index, snapshot.metadata, snapshot.version, coarse, fields)
+    
+    @property
+    def version(self) -> Optional[str]:
+        """当前已加载索引的版本号"""
+        return self._snapshot.version
+    
+    def _swap(self, index, metadata: List[Dict], version: Optional[str], coarse: Optional[Tuple[str, Any]] = None,
+              fields: Optional[Dict[str, Any]] = None):
+        """原子替换索引快照，并使检索缓存失效；被替换的分片索引没有读取方时立即关闭，否则由最后一个读取方关闭"""
+        with self._snapshot_lock:
+            old_index = self._snapshot.index
+            self._snapshot = _IndexSnapshot(index, metadata, version, coarse, fields)
+            retired = isinstance(old_index, ShardedIndex) and old_index is not index
+            if retired and self._index_readers.get(id(old_index)):
+                self._retired_indexes[id(old_index)] = old_index
+                retired = False
+        if retired:
+            old_index.close()
+        self.clear_cache()
+    
+    @contextlib.contextmanager
+    def _reading(self):
+        """取当前快照并登记为读取方，检索期间快照中的分片索引不会被关闭"""
+        with self._snapshot_lock:
+            snapshot = self._snapshot
+            key = id(snapshot.index)
+            self._index_readers[key] = self._index_readers.get(key, 0) + 1
+        try:
+            yield snapshot
+        finally:
+            with self._snapshot_lock:
+                self._index_readers[key] -= 1
+                retired = None
+                if not self._index_readers[key]:
+                    del self._index_readers[key]
+                    retired = self._retired_indexes.pop(key, None)
+            if retired is not None:
+                retired.close()
+    
+    def clear_cache(self):
+        """清空检索结果缓存"""
+        with self._cache_lock:
+            self._search_cache.clear()
     
     def build_index(self, jsonl_path: str, incremental: bool = True):
         """
@@ -83,6 +321,7 @@ class VectorStore:
         # 检查是否使用增量模式
         existing_metadata = []
         existing_raws = set()
+        field_indexes = None
         
         if incremental and self.exists():
             print("\n检测到现有索引，使用增量模式...")
@@ -106,29 +345,31 @@ class VectorStore:
                 
                 print(f"  新增记录: {len(new_items)} 条")
                 
-                # 加载现有索引
-                self.index = faiss.read_index(self.index_path)
-                print(f"  已加载现有索引: {self.index.ntotal} 条")
+                # 加载现有索引（需要追加向量，始终整体读入内存，不使用 mmap）
+                index = faiss.read_index(self.index_path)
+                print(f"  已加载现有索引: {index.ntotal} 条")
                 
                 # 只处理新增数据
-                texts = []
-                metadata_list = []
-                for item in new_items:
-                    search_text = self._build_search_text(item)
-                    texts.append(search_text)
-                    metadata_list.append(item)
+                metadata_list = list(new_items)
                 
                 # 生成新数据的向量
-                if texts:
-                    print(f"\n正在为 {len(texts)} 条新记录生成向量...")
-                    # 使用更大的批量大小加快处理速度
-                    batch_size = min(64, len(texts))
-                    embeddings = self.encoder.encode(texts, show_progress_bar=True, batch_size=batch_size)
-                    embeddings = np.array(embeddings).astype('float32')
+                if metadata_list:
+                    print(f"\n正在为 {len(metadata_list)} 条新记录生成向量...")
+                    embeddings, new_field_vectors = self._encode_items(metadata_list, with_fields=FIELD_INDEXES)
                     
                     # 添加到现有索引
                     print("正在将新向量添加到索引...")
-                    self.index.add(embeddings)
+                    index.add(embeddings)
+                    
+                    if FIELD_INDEXES:
+                        field_indexes = self._read_field_indexes(len(existing_metadata), mode="full")
+                        if field_indexes is None:
+                            print("  字段索引缺失或与现有索引不一致，为现有记录重新生成字段向量...")
+                            _, old_field_vectors = self._encode_items(existing_metadata, with_text=False,
+                                                                      with_fields=True)
+                            field_indexes = self._new_field_indexes(old_field_vectors)
+                        for field, vectors in new_field_vectors.items():
+                            field_indexes[field].add(vectors)
                     
                     # 合并元数据
                     existing_metadata.extend(metadata_list)
@@ -144,44 +385,178 @@ class VectorStore:
         # 全量重建模式
         if not incremental or not self.exists():
             print("\n使用全量重建模式...")
-            texts = []
-            metadata_list = []
-            
-            for item in all_items:
-                search_text = self._build_search_text(item)
-                texts.append(search_text)
-                metadata_list.append(item)
+            metadata_list = list(all_items)
             
-            # 生成向量
-            print(f"正在为 {len(texts)} 条记录生成向量...")
-            # 使用更大的批量大小加快处理速度
-            batch_size = min(64, len(texts))
-            embeddings = self.encoder.encode(texts, show_progress_bar=True, batch_size=batch_size)
-            embeddings = np.array(embeddings).astype('float32')
+            # 生成向量（启用分字段索引时，组合文本与各字段文本在同一遍编码中完成）
+            print(f"正在为 {len(metadata_list)} 条记录生成向量...")
+            embeddings, field_vectors = self._encode_items(metadata_list, with_fields=FIELD_INDEXES)
+            field_indexes = self._new_field_indexes(field_vectors) if FIELD_INDEXES else None
             
             # 构建 FAISS 索引
             print("正在构建 FAISS 索引...")
-            self.index = faiss.IndexFlatL2(self.dimension)  # L2 距离
-            self.index.add(embeddings)
+            index = faiss.IndexFlatL2(self.dimension)  # L2 距离
+            index.add(embeddings)
         
-        # 确保目录存在
+        version = self._save_index_files(index, metadata_list, field_indexes)
+        self._swap(index, metadata_list, version, self._read_coarse_index(index), field_indexes)
+        
+        print(f"\n✓ 向量库构建完成！")
+        print(f"  索引大小: {index.ntotal} 条")
+    
+    def _save_index_files(self, index, metadata_list: List[Dict], field_indexes: Dict[str, Any] = None) -> str:
+        """
+        保存索引、元数据和版本清单
+        
+        索引与元数据先写临时文件再原子替换，最后写入 manifest；
+        运行中的应用以 manifest 版本变化作为“新索引已完整落盘”的信号。
+        
+        Returns:
+            新的索引版本号
+        """
         os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        os.makedirs(os.path.dirname(self.metadata_path), exist_ok=True)
         
         # 保存索引
-        faiss.write_index(self.index, self.index_path)
+        tmp_index_path = self.index_path + ".tmp"
+        faiss.write_index(index, tmp_index_path)
+        os.replace(tmp_index_path, self.index_path)
         print(f"✓ 索引已保存: {self.index_path}")
         
         # 保存元数据
-        self.metadata = metadata_list
-        os.makedirs(os.path.dirname(self.metadata_path), exist_ok=True)
-        with open(self.metadata_path, 'w', encoding='utf-8') as f:
+        tmp_metadata_path = self.metadata_path + ".tmp"
+        with open(tmp_metadata_path, 'w', encoding='utf-8') as f:
             for item in metadata_list:
                 f.write(json.dumps(item, ensure_ascii=False) + '\n')
+        os.replace(tmp_metadata_path, self.metadata_path)
         print(f"✓ 元数据已保存: {self.metadata_path}")
         
-        print(f"\n✓ 向量库构建完成！")
-        print(f"  索引大小: {self.index.ntotal} 条")
+        # 保存 COARSE_MODE 配置的粗排索引（二值码 / PCA 降维码）
+        self._save_coarse_indexes(index)
+        
+        # 保存分字段向量索引
+        if field_indexes:
+            self._save_field_indexes(field_indexes)
+        
+        # 保存单文件知识包（便于分发，加载比解析 JSONL 快得多）；INDEX_FORMAT=files 时不从知识包加载，不生成
+        version = str(time.time_ns())
+        if INDEX_FORMAT.lower() in ("pack", "auto"):
+            self.save_pack(index=index, metadata=metadata_list, version=version)
+        elif os.path.exists(self.pack_path):
+            # 旧知识包已过期，保留会在切换回 auto 时被优先加载
+            os.remove(self.pack_path)
+            print(f"✓ 已删除过期的知识包: {self.pack_path}")
+        
+        # 按 ID 区间切分分片（由多个工作进程并行检索）
+        if SHARD_COUNT > 0:
+            write_shards(index, metadata_list, self.shard_dir, SHARD_COUNT, version=version)
+        
+        # 保存版本清单（最后写入）
+        manifest = {
+            "version": version,
+            "count": int(index.ntotal),
+            "model": self.model_name,
+            "dimension": self.dimension,
+            "index_path": os.path.basename(self.index_path),
+            "metadata_path": os.path.basename(self.metadata_path),
+        }
+        tmp_manifest_path = self.manifest_path + ".tmp"
+        with open(tmp_manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_manifest_path, self.manifest_path)
+        return version
     
+    def _token_lengths(self, texts: List[str]) -> List[int]:
+        """计算每条文本截断后的 token 数（tokenizer 不可用时退化为字符数）"""
+        tokenizer = getattr(self.encoder, "tokenizer", None)
+        if tokenizer is None:
+            return [len(t) for t in texts]
+        max_len = getattr(self.encoder, "max_seq_length", None) or 512
+        encoded = tokenizer(
+            texts,
+            add_special_tokens=True,
+            truncation=True,
+            max_length=max_len,
+        )["input_ids"]
+        return [len(ids) for ids in encoded]
+
+    @staticmethod
+    def _plan_batches(lengths: List[int], token_budget: int = None, max_batch: int = None) -> List[List[int]]:
+        """
+        按 token 长度分桶：先按长度降序排序，再按 token 预算切分批次
+        
+        每批 padding 后的 token 数 = 批内最长文本长度 × 条数，
+        长文本批次条数少、短文本批次条数多，尽量减少 padding 浪费。
+        
+        Returns:
+            每个批次对应的原始下标列表
+        """
+        token_budget = token_budget or EMBED_TOKEN_BUDGET
+        max_batch = max_batch or EMBED_MAX_BATCH
+        order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+        
+        batches = []
+        current = []
+        current_max = 0
+        for idx in order:
+            length = max(lengths[idx], 1)
+            # 降序排列，批内第一条即为最长文本
+            padded_max = current_max or length
+            if current and (len(current) + 1 > max_batch or (len(current) + 1) * padded_max > token_budget):
+                batches.append(current)
+                current = []
+                padded_max = length
+            current.append(idx)
+            current_max = padded_max
+        if current:
+            batches.append(current)
+        return batches
+
+    def _encode_texts(self, texts: List[str], show_progress_bar: bool = False) -> np.ndarray:
+        """
+        批量生成向量（按 token 长度分桶，编码后恢复原始顺序）
+        
+        Args:
+            texts: 待编码文本列表
+            show_progress_bar: 是否显示进度条
+        
+        Returns:
+            float32 向量矩阵，行顺序与 texts 一致
+        """
+        if not texts:
+            return np.zeros((0, self.dimension), dtype='float32')
+        
+        batches = self._plan_batches(self._token_lengths(texts))
+        embeddings = np.zeros((len(texts), self.dimension), dtype='float32')
+        
+        with tqdm(total=len(texts), desc="Embedding", disable=not show_progress_bar) as pbar:
+            for batch in batches:
+                with self._encode_lock:
+                    batch_embeddings = self.encoder.encode(
+                        [texts[i] for i in batch],
+                        batch_size=len(batch),
+                        show_progress_bar=False,
+                    )
+                embeddings[batch] = np.asarray(batch_embeddings, dtype='float32')
+                pbar.update(len(batch))
+        
+        return embeddings
+
+    @tracing.traced("retrieval.encode")
+    def encode_query(self, query: str) -> np.ndarray:
+        """生成单条查询向量（线程安全），返回形状为 (1, dim) 的 float32 矩阵"""
+        wait_start = time.perf_counter()
+        with self._encode_lock:
+            # 并发请求在编码锁上排队的时间
+            tracing.current().set(lock_wait_ms=(time.perf_counter() - wait_start) * 1000, chars=len(query))
+            query_vector = self.encoder.encode([query], show_progress_bar=False, batch_size=1)
+        return np.asarray(query_vector, dtype='float32')
+
+    @tracing.traced("retrieval.encode")
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        """批量生成查询向量（一次编码多条，比逐条 encode_query 快得多），返回形状为 (n, dim) 的矩阵"""
+        tracing.current().set(queries=len(queries))
+        return self._encode_texts(list(queries))
+
     def _build_search_text(self, item: Dict) -> str:
         """构建用于检索的文本（组合多个字段）"""
         parts = []
@@ -203,57 +578,713 @@ class VectorStore:
         
         return " ".join(parts)
     
+    def _encode_items(self, items: List[Dict], with_text: bool = True,
+                      with_fields: bool = False) -> Tuple[Optional[np.ndarray], Optional[Dict[str, np.ndarray]]]:
+        """
+        一遍编码生成组合文本向量和（可选）各字段向量
+        
+        所有待编码文本去重后合并为一批，交给按长度分桶的批量编码；
+        字段取值重复度很高（风格、氛围），去重后额外的编码量通常远小于字段数 × 条数。
+        
+        Returns:
+            (组合文本向量, 字段名 → 归一化字段向量)；未请求的部分为 None
+        """
+        texts = [self._build_search_text(item) for item in items] if with_text else []
+        field_texts = {}
+        if with_fields:
+            field_texts = {field: [extract(item) for item in items] for field, extract in FIELD_EXTRACTORS.items()}
+        
+        unique = dict.fromkeys(texts)
+        n_text = len(unique)
+        for values in field_texts.values():
+            unique.update(dict.fromkeys(t for t in values if t))
+        unique_texts = list(unique)
+        
+        start = time.perf_counter()
+        vectors = self._encode_texts(unique_texts, show_progress_bar=True)
+        elapsed = time.perf_counter() - start
+        if with_fields:
+            print(f"  字段文本额外编码 {len(unique_texts) - n_text} 条（去重后），共编码 {len(unique_texts)} 条，"
+                  f"耗时 {elapsed:.1f}s")
+        
+        position = {text: i for i, text in enumerate(unique_texts)}
+        embeddings = vectors[[position[t] for t in texts]] if with_text else None
+        field_vectors = None
+        if with_fields:
+            field_vectors = {}
+            for field, values in field_texts.items():
+                matrix = np.zeros((len(items), self.dimension), dtype='float32')
+                present = [i for i, t in enumerate(values) if t]
+                if present:
+                    matrix[present] = vectors[[position[values[i]] for i in present]]
+                # 字段缺失的记录保持零向量（与任何查询的相似度为 0）
+                field_vectors[field] = _normalize_rows(matrix)
+        return embeddings, field_vectors
+    
+    def _new_field_indexes(self, field_vectors: Dict[str, np.ndarray]) -> Dict[str, Any]:
+        indexes = {}
+        for field, vectors in field_vectors.items():
+            indexes[field] = faiss.IndexFlatIP(self.dimension)
+            indexes[field].add(vectors)
+        return indexes
+    
+    def _save_field_indexes(self, field_indexes: Dict[str, Any]):
+        os.makedirs(self.field_dir, exist_ok=True)
+        for field, index in field_indexes.items():
+            path = os.path.join(self.field_dir, f"{field}.index")
+            tmp_path = path + ".tmp"
+            faiss.write_index(index, tmp_path)
+            os.replace(tmp_path, path)
+        print(f"✓ 字段索引已保存（{', '.join(field_indexes)}）: {self.field_dir}")
+    
+    def _read_field_indexes(self, count: int, mode: str = None) -> Optional[Dict[str, Any]]:
+        """加载分字段向量索引；未启用、文件缺失或与主索引条数不一致时返回 None"""
+        if not FIELD_INDEXES:
+            return None
+        indexes = {}
+        for field in FIELD_EXTRACTORS:
+            path = os.path.join(self.field_dir, f"{field}.index")
+            if not os.path.exists(path):
+                print(f"⚠️  字段索引不存在: {path}（重新运行 build_index.py 生成）")
+                return None
+            indexes[field] = self._read_faiss_index(path, mode)
+            if indexes[field].ntotal != count:
+                print(f"⚠️  字段索引 {field} 条数 ({indexes[field].ntotal}) 与主索引 ({count}) 不一致，已忽略字段索引")
+                return None
+        return indexes
+    
     def load_index(self):
         """加载已保存的索引"""
+        index, metadata, version = self._read_index_files()
+        self._swap(index, metadata, version, self._read_coarse_index(index), self._read_field_indexes(index.ntotal))
+    
+    @staticmethod
+    def _build_coarse_index(vectors: np.ndarray, mode: str, pca_dim: int = None):
+        """
+        构建粗排索引
+        
+        Args:
+            vectors: 全精度向量矩阵 (n, dim)
+            mode: "binary" 按符号二值化，Hamming 距离检索（每条 dim/8 字节）；
+                  "pca" PCA 降维到 pca_dim 维后 L2 检索
+        """
+        vectors = np.ascontiguousarray(vectors, dtype='float32')
+        dim = vectors.shape[1]
+        if mode == "binary":
+            index = faiss.IndexBinaryFlat(dim)
+            index.add(np.packbits(vectors > 0, axis=1))
+            return index
+        if mode == "pca":
+            # 训练样本上限 5 万条，足够估计主成分；主成分个数不超过样本数
+            sample = vectors if len(vectors) <= 50000 else vectors[np.random.default_rng(0).choice(len(vectors), 50000, replace=False)]
+            pca_dim = min(pca_dim or COARSE_PCA_DIM, dim, len(sample))
+            pca = faiss.PCAMatrix(dim, pca_dim)
+            pca.train(sample)
+            index = faiss.IndexPreTransform(pca, faiss.IndexFlatL2(pca_dim))
+            index.add(vectors)
+            return index
+        raise ValueError(f"未知的粗排模式: {mode}")
+    
+    def _save_coarse_indexes(self, index):
+        """从全精度索引取回全部向量，重建并保存 COARSE_MODE 配置的粗排索引（none 时跳过）"""
+        mode = COARSE_MODE.lower()
+        if mode == "none":
+            return
+        path = self.coarse_paths.get(mode)
+        if path is None:
+            print(f"⚠️  未知的粗排模式: {mode}，跳过粗排索引构建")
+            return
+        try:
+            vectors = index.reconstruct_n(0, index.ntotal)
+        except RuntimeError:
+            print("⚠️  当前索引类型不支持取回原始向量，跳过粗排索引构建")
+            return
+        if len(vectors) == 0:
+            return
+        if mode == "binary" and vectors.shape[1] % 8 != 0:
+            print(f"⚠️  向量维度 {vectors.shape[1]} 不是 8 的倍数，无法构建二值码，跳过粗排索引构建")
+            return
+        
+        print(f"正在构建粗排索引（{mode}）...")
+        start = time.perf_counter()
+        coarse = self._build_coarse_index(vectors, mode)
+        tmp_path = path + ".tmp"
+        if mode == "binary":
+            faiss.write_index_binary(coarse, tmp_path)
+        else:
+            faiss.write_index(coarse, tmp_path)
+        os.replace(tmp_path, path)
+        print(f"✓ 粗排索引已保存（{mode}，{time.perf_counter() - start:.1f}s）: {path}")
+    
+    def _read_coarse_index(self, index, mode: str = None) -> Optional[Tuple[str, Any]]:
+        """加载配置的粗排索引；未启用、文件缺失或与主索引条数不一致时返回 None"""
+        mode = (mode or COARSE_MODE).lower()
+        if mode == "none" or index is None:
+            return None
+        path = self.coarse_paths.get(mode)
+        if path is None:
+            print(f"⚠️  未知的粗排模式: {mode}，使用全精度检索")
+            return None
+        if not os.path.exists(path):
+            print(f"⚠️  粗排索引不存在: {path}，使用全精度检索（重新运行 build_index.py 生成）")
+            return None
+        
+        coarse = faiss.read_index_binary(path) if mode == "binary" else faiss.read_index(path)
+        if coarse.ntotal != index.ntotal:
+            print(f"⚠️  粗排索引条数 ({coarse.ntotal}) 与主索引 ({index.ntotal}) 不一致，使用全精度检索")
+            return None
+        return mode, coarse
+    
+    @staticmethod
+    def _coarse_to_fine(index, coarse: Tuple[str, Any], query_vector: np.ndarray, top_k: int,
+                        shortlist_factor: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        两阶段检索：先在粗排码上取 top_k × shortlist_factor 个候选，再用全精度向量精确重算 L2 距离
+        
+        Returns:
+            与 faiss search 相同形状的 (distances, indices)
+        """
+        mode, coarse_index = coarse
+        shortlist = max(top_k * (shortlist_factor or COARSE_SHORTLIST_FACTOR), top_k)
+        if mode == "binary":
+            _, ids = coarse_index.search(np.packbits(query_vector > 0, axis=1), shortlist)
+        else:
+            _, ids = coarse_index.search(query_vector, shortlist)
+        ids = ids[0][ids[0] >= 0]
+        
+        candidates = index.reconstruct_batch(ids)
+        exact = np.sum((candidates - query_vector[0]) ** 2, axis=1)
+        order = np.argsort(exact)[:top_k]
+        
+        distances = np.full((1, top_k), np.inf, dtype='float32')
+        indices = np.full((1, top_k), -1, dtype='int64')
+        distances[0, :len(order)] = exact[order]
+        indices[0, :len(order)] = ids[order]
+        return distances, indices
+    
+    @staticmethod
+    def _first_stage(snapshot: _IndexSnapshot, query_vector: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """一阶段召回：配置了粗排索引时走两阶段检索，否则直接全精度检索"""
+        if snapshot.coarse is not None:
+            return VectorStore._coarse_to_fine(snapshot.index, snapshot.coarse, query_vector, k)
+        return snapshot.index.search(query_vector, k)
+    
+    def model_fingerprint(self) -> np.ndarray:
+        """当前 Embedding 模型的指纹：对固定探针文本生成的向量"""
+        if self.model_name not in VectorStore._probe_cache:
+            VectorStore._probe_cache[self.model_name] = self._encode_texts(PROBE_TEXTS)
+        return VectorStore._probe_cache[self.model_name]
+    
+    def save_pack(self, path: str = None, index=None, metadata: List[Dict] = None, version: str = None) -> str:
+        """
+        将索引和元数据写入单文件知识包（默认使用当前已加载的索引）
+        
+        Returns:
+            知识包路径
+        """
+        path = path or self.pack_path
+        snapshot = self._snapshot
+        index = index if index is not None else snapshot.index
+        metadata = metadata if metadata is not None else snapshot.metadata
+        if index is None:
+            raise ValueError("索引未加载，无法打包")
+        
+        write_pack(path, index, list(metadata), self.model_name, self.model_fingerprint(),
+                   version=version or snapshot.version)
+        print(f"✓ 知识包已保存: {path}")
+        return path
+    
+    def _use_pack(self) -> bool:
+        """是否从知识包加载（INDEX_FORMAT: files / pack / auto）"""
+        fmt = INDEX_FORMAT.lower()
+        if fmt == "pack":
+            return True
+        if fmt == "auto":
+            return os.path.exists(self.pack_path)
+        return False
+    
+    def _read_pack(self) -> Tuple[Any, List[Dict], Optional[str]]:
+        """从知识包读取索引与元数据，模型指纹不匹配时拒绝加载"""
+        if not os.path.exists(self.pack_path):
+            raise FileNotFoundError(f"知识包不存在: {self.pack_path}")
+        
+        version = self._disk_version()
+        
+        print(f"正在加载知识包: {self.pack_path}...")
+        pack = KnowledgePack(self.pack_path)
+        pack.check_fingerprint(self.model_name, self.dimension, self.model_fingerprint())
+        
+        if FAISS_OMP_THREADS > 0:
+            faiss.omp_set_num_threads(FAISS_OMP_THREADS)
+        index = pack.read_index(mmap_index=INDEX_LOAD_MODE.lower() == "mmap")
+        # 元数据直接映射，检索命中时才逐条解码
+        metadata = pack.metadata()
+        print(f"✓ 知识包加载完成，包含 {index.ntotal} 条记录")
+        
+        return index, metadata, version
+    
+    def _use_shards(self) -> bool:
+        """是否以分片模式加载（配置了 SHARD_COUNT 且分片清单存在）"""
+        return SHARD_COUNT > 0 and os.path.exists(os.path.join(self.shard_dir, SHARD_MANIFEST))
+    
+    def _read_shards(self) -> Tuple[Any, List[Dict], Optional[str]]:
+        """启动分片工作进程；主进程只持有分片句柄，不加载向量和元数据"""
+        version = self._disk_version()
+        print(f"正在加载分片索引: {self.shard_dir}...")
+        sharded = ShardedIndex(self.shard_dir)
+        if sharded.d != self.dimension:
+            sharded.close()
+            raise ValueError(f"分片索引维度 {sharded.d} 与当前模型 {self.model_name} 的维度 {self.dimension} 不一致")
+        if sharded.n_shards != SHARD_COUNT:
+            print(f"⚠️  磁盘上的分片数 ({sharded.n_shards}) 与配置 SHARD_COUNT ({SHARD_COUNT}) 不同，"
+                  f"重新构建索引或运行 python sharded_search.py split 调整")
+        return sharded, sharded.metadata(), version
+    
+    def _read_index_files(self) -> Tuple[Any, List[Dict], Optional[str]]:
+        """从磁盘读取索引、元数据和版本号（不修改当前快照）"""
+        if self._use_shards():
+            return self._read_shards()
+        if self._use_pack():
+            return self._read_pack()
+        return self._read_loose_files()
+    
+    def _read_loose_files(self) -> Tuple[Any, List[Dict], Optional[str]]:
+        """从索引文件和 JSONL 元数据读取"""
         if not os.path.exists(self.index_path):
             raise FileNotFoundError(f"索引文件不存在: {self.index_path}")
         
         if not os.path.exists(self.metadata_path):
             raise FileNotFoundError(f"元数据文件不存在: {self.metadata_path}")
         
+        # 先读版本号：若读取过程中索引被更新，版本号落后，下次轮询会再次加载
+        version = self._disk_version()
+        
         print(f"正在加载索引: {self.index_path}...")
-        self.index = faiss.read_index(self.index_path)
-        print(f"✓ 索引加载完成，包含 {self.index.ntotal} 条记录")
+        # 多会话并发检索时限制 OpenMP 线程数，避免线程过度订阅
+        if FAISS_OMP_THREADS > 0:
+            faiss.omp_set_num_threads(FAISS_OMP_THREADS)
+        index = self._read_faiss_index(self.index_path)
+        print(f"✓ 索引加载完成，包含 {index.ntotal} 条记录")
         
         print(f"正在加载元数据: {self.metadata_path}...")
-        self.metadata = []
+        metadata = []
         with open(self.metadata_path, 'r', encoding='utf-8') as f:
             for line in f:
                 if line.strip():
-                    self.metadata.append(json.loads(line))
-        print(f"✓ 元数据加载完成，包含 {len(self.metadata)} 条记录")
+                    metadata.append(json.loads(line))
+        print(f"✓ 元数据加载完成，包含 {len(metadata)} 条记录")
+        
+        return index, metadata, version
+    
+    @staticmethod
+    def _read_faiss_index(path: str, mode: str = None):
+        """
+        读取 FAISS 索引
+        
+        Args:
+            path: 索引文件路径
+            mode: "full" 整体读入内存；"mmap" 内存映射，页面按需载入并可在进程间共享
+                  （默认使用配置 INDEX_LOAD_MODE）
+        
+        mmap 模式得到的索引是只读的，增量构建请使用 full 模式读取；
+        索引类型不支持 mmap 时自动退化为 full 模式。
+        """
+        mode = (mode or INDEX_LOAD_MODE).lower()
+        if mode == "mmap":
+            # IO_FLAG_MMAP_IFC（faiss>=1.8）可零拷贝映射 Flat 索引的向量数据；
+            # IO_FLAG_MMAP 适用于 IVF 等倒排列表索引
+            for flag_name in ("IO_FLAG_MMAP_IFC", "IO_FLAG_MMAP"):
+                flag = getattr(faiss, flag_name, None)
+                if flag is None:
+                    continue
+                try:
+                    return faiss.read_index(path, flag | faiss.IO_FLAG_READ_ONLY)
+                except RuntimeError:
+                    continue
+            print("⚠️  当前索引类型或 FAISS 版本不支持 mmap 加载，改为整体读入内存")
+        elif mode != "full":
+            print(f"⚠️  未知的索引加载模式: {mode}，改为整体读入内存")
+        return faiss.read_index(path)
+    
+    def _disk_version(self) -> Optional[str]:
+        """读取磁盘上索引的版本号（优先 manifest，旧索引退化为文件修改时间）"""
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return str(json.load(f)["version"])
+        except (OSError, ValueError, KeyError):
+            pass
+        paths = [self.pack_path] if self._use_pack() else [self.index_path, self.metadata_path]
+        try:
+            mtime = max(os.stat(path).st_mtime_ns for path in paths)
+            return f"mtime-{mtime}"
+        except OSError:
+            return None
+    
+    def reload_if_changed(self) -> bool:
+        """
+        检查磁盘上的索引版本，有变化时在当前线程加载新索引并原子替换
+        
+        Returns:
+            是否发生了替换
+        """
+        with self._reload_lock:
+            disk_version = self._disk_version()
+            if disk_version is None or disk_version == self._snapshot.version:
+                return False
+            
+            index, metadata, version = self._read_index_files()
+            if index.ntotal != len(metadata):
+                # 构建尚未完成（索引与元数据不一致），等待下次轮询
+                print(f"⚠️  索引与元数据条数不一致 ({index.ntotal} vs {len(metadata)})，暂不切换")
+                return False
+            
+            self._swap(index, metadata, version, self._read_coarse_index(index),
+                       self._read_field_indexes(index.ntotal))
+            print(f"✓ 索引已热加载，版本: {version}，共 {index.ntotal} 条")
+            return True
+    
+    def start_auto_reload(self, interval: float = None):
+        """启动后台线程，定期检查索引版本并热加载"""
+        interval = interval or INDEX_RELOAD_INTERVAL
+        if interval <= 0 or (self._reload_thread and self._reload_thread.is_alive()):
+            return
+        
+        self._reload_stop.clear()
+        
+        def _loop():
+            while not self._reload_stop.wait(interval):
+                try:
+                    self.reload_if_changed()
+                except Exception as e:
+                    print(f"⚠️  索引热加载失败: {e}")
+                # 分片模式下顺带检查工作进程，已退出的进程在下一次检索之前重启
+                check_workers = getattr(self._snapshot.index, "check_workers", None)
+                if check_workers is not None:
+                    try:
+                        check_workers()
+                    except Exception as e:
+                        print(f"⚠️  分片工作进程检查失败: {e}")
+        
+        self._reload_thread = threading.Thread(target=_loop, name="vector-store-reload", daemon=True)
+        self._reload_thread.start()
+    
+    def stop_auto_reload(self):
+        """停止后台热加载线程"""
+        self._reload_stop.set()
+        if self._reload_thread:
+            self._reload_thread.join(timeout=5)
+            self._reload_thread = None
     
-    def search(self, query: str, top_k: int = 5) -> List[Tuple[Dict, float]]:
+    @tracing.traced("retrieval.search")
+    def search(self, query: str, top_k: int = 5, mmr: bool = None, fetch_k: int = None,
+               mmr_lambda: float = None, rerank: bool = None, fields: bool = None,
+               field_weights: Dict[str, float] = None, query_vector: np.ndarray = None,
+               timings: Dict = None) -> List[Tuple[Dict, float]]:
         """
         向量检索
         
         Args:
             query: 查询文本
             top_k: 返回 Top-K 个结果
+            mmr: 是否使用 MMR 多样化检索（默认使用配置 RETRIEVAL_MMR）
+            fetch_k: MMR 模式下先召回的候选数（默认使用配置 MMR_FETCH_K）
+            mmr_lambda: MMR 相关性权重，1 只看相关性，0 只看多样性（默认使用配置 MMR_LAMBDA）
+            rerank: 是否用 Cross-Encoder 对前 RERANK_CANDIDATES 个候选重排序（默认使用配置 RERANK_ENABLED）
+            fields: 是否使用分字段加权融合检索（默认使用配置 RETRIEVAL_FIELD_FUSION；与 MMR 同时开启时使用 MMR）
+            field_weights: 字段融合权重，如 {"subject": 0.6, "style": 0.4}（默认使用配置 FIELD_WEIGHTS）
+            query_vector: 可选，调用方已生成的查询向量（encode_query 的结果），传入时跳过编码
+            timings: 可选，写入各阶段耗时（毫秒）：encode_ms / search_ms / rerank_ms 等
         
         Returns:
             (元数据, 距离) 元组列表
         """
-        if self.index is None:
-            raise ValueError("索引未加载，请先调用 load_index() 或 build_index()")
+        timings = {} if timings is None else timings
+        # 只取一次快照引用，检索过程中即使发生热加载也不会读到不一致的索引/元数据（被替换的分片索引在检索结束后才关闭）
+        with self._reading() as snapshot:
+            if snapshot.index is None:
+                raise ValueError("索引未加载，请先调用 load_index() 或 build_index()")
         
-        # 生成查询向量（这一步通常很快，但可能因为模型加载而慢）
-        query_vector = self.encoder.encode([query], show_progress_bar=False, batch_size=1)
-        query_vector = np.array(query_vector).astype('float32')
+            mmr = RETRIEVAL_MMR if mmr is None else mmr
+            fetch_k = fetch_k or MMR_FETCH_K
+            mmr_lambda = MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+            rerank = RERANK_ENABLED if rerank is None else rerank
+            fields = (RETRIEVAL_FIELD_FUSION if fields is None else fields) and not mmr
+            if fields and snapshot.fields is None:
+                # 未构建 / 未加载字段索引，退化为组合文本检索
+                timings["fields_skipped"] = True
+                fields = False
+            if fields:
+                weights = parse_field_weights(FIELD_WEIGHTS) if field_weights is None else field_weights
+                weights = tuple(sorted(weights.items()))
+            else:
+                weights = None
         
-        # 检索（FAISS 检索非常快）
-        distances, indices = self.index.search(query_vector, top_k)
+            search_span = tracing.current().set(top_k=top_k, mmr=mmr, rerank=rerank, fields=fields)
+            cache_key = (query, top_k, mmr and (fetch_k, mmr_lambda), rerank, weights)
+            if SEARCH_CACHE_SIZE > 0:
+                with self._cache_lock:
+                    cached = self._search_cache.get(cache_key)
+                    if cached is not None and cached[0] == snapshot.version:
+                        self._search_cache.move_to_end(cache_key)
+                        timings["cache_hit"] = True
+                        search_span.set(cache_hit=True)
+                        return list(cached[1])
+            timings["cache_hit"] = False
+            search_span.set(cache_hit=False)
+        
+            # 生成查询向量（这一步通常很快，但可能因为模型加载而慢）
+            stage_start = time.perf_counter()
+            if query_vector is None:
+                query_vector = self.encode_query(query)
+            timings["encode_ms"] = (time.perf_counter() - stage_start) * 1000
+        
+            # 一阶段召回：启用重排序时多召回一些候选
+            first_k = max(top_k, RERANK_CANDIDATES) if rerank else top_k
+            stage_start = time.perf_counter()
+            if mmr and rerank:
+                # 先用 Cross-Encoder 为整个候选池打分，再以该分数作为相关性做 MMR 选出 top_k；
+                # 若先用 MMR 选出 first_k 个再精排，候选池与 first_k 相同时 MMR 不起作用，结果只按相关性排列
+                def rerank_scores(candidates):
+                    with tracing.span("retrieval.rerank", candidates=len(candidates)) as rerank_span:
+                        scores = self.get_reranker().score(query, candidates, top_k, self._build_search_text, timings)
+                        rerank_span.set(skipped=scores is None)
+                    return scores
+            
+                pool_k = max(fetch_k, first_k)
+                with tracing.span("retrieval.mmr", fetch_k=pool_k, k=top_k):
+                    results = self._search_mmr(snapshot, query_vector, top_k, pool_k, mmr_lambda, rerank_scores)
+                rerank = False
+            elif mmr:
+                with tracing.span("retrieval.mmr", fetch_k=fetch_k, k=first_k):
+                    results = self._search_mmr(snapshot, query_vector, first_k, fetch_k, mmr_lambda)
+            elif fields:
+                with tracing.span("retrieval.fields", k=first_k):
+                    results = self._search_fields(snapshot, query_vector, first_k, dict(weights))
+            else:
+                results = self._search_vector(snapshot, query_vector, first_k)
+            timings["search_ms"] = (time.perf_counter() - stage_start) * 1000
+        
+            # 二阶段重排序（超出延迟预算时自动跳过）
+            if rerank:
+                with tracing.span("retrieval.rerank", candidates=len(results)) as rerank_span:
+                    results = self.get_reranker().rerank(query, results, top_k, self._build_search_text, timings=timings)
+                    rerank_span.set(skipped=bool(timings.get("rerank_skipped")))
         
-        # 组装结果
-        results = []
-        for i, (idx, dist) in enumerate(zip(indices[0], distances[0])):
-            if idx < len(self.metadata):
-                results.append((self.metadata[idx], float(dist)))
+            if SEARCH_CACHE_SIZE > 0 and snapshot is self._snapshot:
+                with self._cache_lock:
+                    self._search_cache[cache_key] = (snapshot.version, results)
+                    self._search_cache.move_to_end(cache_key)
+                    while len(self._search_cache) > SEARCH_CACHE_SIZE:
+                        self._search_cache.popitem(last=False)
         
+            return list(results)
+
+    @tracing.traced("retrieval.search_batch")
+    def search_batch(self, queries: List[str], top_k: int = 5, mmr: bool = None, rerank: bool = None,
+                     fields: bool = None, field_weights: Dict[str, float] = None,
+                     query_vectors: np.ndarray = None, timings: Dict = None) -> List[List[Tuple[Dict, float]]]:
+        """
+        批量向量检索：一次编码全部查询，普通检索时用一次 FAISS 调用检索全部查询向量
+
+        MMR、分字段融合和粗排两阶段检索按条执行（复用批量生成的查询向量）；
+        重排序按条执行。结果不写入检索缓存。
+
+        Args:
+            queries: 查询文本列表
+            query_vectors: 可选，调用方已生成的查询向量矩阵（encode_queries 的结果），行顺序与 queries 一致
+            timings: 可选，写入整批的 encode_ms / search_ms / rerank_ms
+            其余参数同 search
+
+        Returns:
+            与 queries 一一对应的 (元数据, 距离) 元组列表
+        """
+        timings = {} if timings is None else timings
+        with self._reading() as snapshot:
+            if snapshot.index is None:
+                raise ValueError("索引未加载，请先调用 load_index() 或 build_index()")
+            if not queries:
+                return []
+
+            mmr = RETRIEVAL_MMR if mmr is None else mmr
+            rerank = RERANK_ENABLED if rerank is None else rerank
+            fields = (RETRIEVAL_FIELD_FUSION if fields is None else fields) and not mmr and snapshot.fields is not None
+
+            stage_start = time.perf_counter()
+            if query_vectors is None:
+                query_vectors = self.encode_queries(queries)
+            timings["encode_ms"] = (time.perf_counter() - stage_start) * 1000
+
+            first_k = max(top_k, RERANK_CANDIDATES) if rerank else top_k
+            stage_start = time.perf_counter()
+            if mmr and rerank:
+                # MMR 与精排同时开启时由 search 先精排候选池再做多样化选择（见 search）
+                all_results = [
+                    self.search(query, top_k=top_k, mmr=True, rerank=True, query_vector=query_vectors[i:i + 1])
+                    for i, query in enumerate(queries)
+                ]
+                timings["search_ms"] = (time.perf_counter() - stage_start) * 1000
+                return all_results
+            if mmr or fields or snapshot.coarse is not None:
+                all_results = [
+                    self.search(query, top_k=first_k, mmr=mmr, rerank=False, fields=fields, field_weights=field_weights,
+                                query_vector=query_vectors[i:i + 1])
+                    for i, query in enumerate(queries)
+                ]
+            else:
+                with tracing.span("retrieval.faiss", queries=len(queries), k=first_k, ntotal=snapshot.index.ntotal):
+                    distances, indices = snapshot.index.search(query_vectors, first_k)
+                with tracing.span("retrieval.metadata", count=int(indices.size)):
+                    all_results = [
+                        [(snapshot.metadata[idx], float(dist)) for idx, dist in zip(row_ids, row_dists)
+                         if 0 <= idx < len(snapshot.metadata)]
+                        for row_ids, row_dists in zip(indices, distances)
+                    ]
+            timings["search_ms"] = (time.perf_counter() - stage_start) * 1000
+
+            if rerank:
+                stage_start = time.perf_counter()
+                reranker = self.get_reranker()
+                with tracing.span("retrieval.rerank", queries=len(queries)):
+                    all_results = [reranker.rerank(query, results, top_k, self._build_search_text)
+                                   for query, results in zip(queries, all_results)]
+                timings["rerank_ms"] = (time.perf_counter() - stage_start) * 1000
+            else:
+                all_results = [results[:top_k] for results in all_results]
+
+            return all_results
+
+    def get_reranker(self):
+        """按需加载 Cross-Encoder 重排序器（模型在类级别缓存）"""
+        if self._reranker is None:
+            from reranker import CrossEncoderReranker
+            self._reranker = CrossEncoderReranker()
+        return self._reranker
+    
+    @staticmethod
+    def _search_vector(snapshot: _IndexSnapshot, query_vector: np.ndarray, top_k: int) -> List[Tuple[Dict, float]]:
+        """在指定快照上按查询向量检索"""
+        # 检索（FAISS 检索非常快）
+        with tracing.span("retrieval.faiss", k=top_k, ntotal=snapshot.index.ntotal,
+                          coarse=snapshot.coarse[0] if snapshot.coarse is not None else None):
+            distances, indices = VectorStore._first_stage(snapshot, query_vector, top_k)
+        
+        # 组装结果（知识包 / 分片模式下元数据按需读取）
+        with tracing.span("retrieval.metadata", count=int(indices.shape[1])):
+            results = []
+            for idx, dist in zip(indices[0], distances[0]):
+                if 0 <= idx < len(snapshot.metadata):
+                    results.append((snapshot.metadata[idx], float(dist)))
         return results
     
+    @staticmethod
+    def _search_fields(snapshot: _IndexSnapshot, query_vector: np.ndarray, top_k: int,
+                       weights: Dict[str, float]) -> List[Tuple[Dict, float]]:
+        """
+        分字段加权融合检索
+        
+        每个字段索引各召回 top_k × FIELD_FETCH_FACTOR 个候选，对候选并集精确计算
+        融合分数 Σ 权重 × 余弦相似度，按融合分数取 top_k。
+        返回的距离为 2 × (1 − 融合分数)，与单位向量的 L2 距离同尺度（越小越相似）。
+        """
+        q = _normalize_rows(query_vector)
+        active = {field: w for field, w in weights.items() if w > 0 and field in snapshot.fields}
+        fetch = max(top_k * FIELD_FETCH_FACTOR, top_k)
+        
+        candidate_ids = []
+        for field in active:
+            _, ids = snapshot.fields[field].search(q, fetch)
+            candidate_ids.append(ids[0][ids[0] >= 0])
+        if not candidate_ids:
+            return []
+        candidates = np.unique(np.concatenate(candidate_ids))
+        
+        fused = np.zeros(len(candidates), dtype='float32')
+        for field, weight in active.items():
+            fused += weight * (snapshot.fields[field].reconstruct_batch(candidates) @ q[0])
+        order = np.argsort(-fused, kind='stable')[:top_k]
+        return [(snapshot.metadata[candidates[i]], float(2 * (1 - fused[i]))) for i in order]
+    
+    def _search_mmr(self, snapshot: _IndexSnapshot, query_vector: np.ndarray, top_k: int,
+                    fetch_k: int, mmr_lambda: float,
+                    relevance_fn: Callable[[List[Tuple[Dict, float]]], Optional[List[float]]] = None
+                    ) -> List[Tuple[Dict, float]]:
+        """
+        先召回 fetch_k 个候选，再按最大边际相关性（MMR）选出 top_k 个
+        
+        relevance_fn: 可选，以候选 (元数据, 距离) 列表调用，返回前 n 个候选的相关性分数（如 Cross-Encoder 分数），
+                      MMR 只在这 n 个候选中选择并以该分数代替查询向量相似度；返回 None 时使用向量相似度
+        """
+        fetch_k = max(fetch_k, top_k)
+        distances, indices = self._first_stage(snapshot, query_vector, fetch_k)
+        valid = (indices[0] >= 0) & (indices[0] < len(snapshot.metadata))
+        ids = indices[0][valid]
+        dists = distances[0][valid]
+        
+        relevance = None
+        if relevance_fn is not None:
+            pool = [(snapshot.metadata[idx], float(dist)) for idx, dist in zip(ids, dists)]
+            scores = relevance_fn(pool)
+            if scores is not None:
+                ids, dists = ids[:len(scores)], dists[:len(scores)]
+                # 分数缩放到 [0, 1]，与候选之间的余弦相似度处于同一量级
+                scores = np.asarray(scores, dtype='float32')
+                relevance = (scores - scores.min()) / (float(scores.max() - scores.min()) or 1.0)
+                if len(ids) <= top_k:
+                    order = np.argsort(-relevance, kind='stable')
+                    return [pool[i] for i in order]
+        
+        if len(ids) <= top_k:
+            return [(snapshot.metadata[idx], float(dist)) for idx, dist in zip(ids, dists)]
+        
+        try:
+            candidates = snapshot.index.reconstruct_batch(ids)
+        except RuntimeError:
+            # 索引类型不支持取回原始向量，退化为按相关性排序
+            order = np.argsort(-relevance, kind='stable')[:top_k] if relevance is not None else range(top_k)
+            return [(snapshot.metadata[ids[i]], float(dists[i])) for i in order]
+        
+        order = self._mmr_select(query_vector[0], candidates, top_k, mmr_lambda, relevance)
+        return [(snapshot.metadata[ids[i]], float(dists[i])) for i in order]
+    
+    @staticmethod
+    def _mmr_select(query_vector: np.ndarray, candidates: np.ndarray, top_k: int, mmr_lambda: float,
+                    relevance: np.ndarray = None) -> List[int]:
+        """
+        最大边际相关性选择（向量化实现）
+        
+        每一步选择 score = λ·sim(q, d) − (1−λ)·max sim(d, 已选) 最大的候选；
+        传入 relevance 时用它代替 sim(q, d)
+        
+        Returns:
+            被选中候选在 candidates 中的下标（按选择顺序）
+        """
+        c = candidates / (np.linalg.norm(candidates, axis=1, keepdims=True) + 1e-12)
+        if relevance is None:
+            q = query_vector / (np.linalg.norm(query_vector) + 1e-12)
+            relevance = c @ q
+        similarity = c @ c.T
+        
+        selected = [int(np.argmax(relevance))]
+        max_sim = similarity[selected[0]].copy()
+        available = np.ones(len(c), dtype=bool)
+        available[selected[0]] = False
+        
+        while len(selected) < min(top_k, len(c)):
+            scores = mmr_lambda * relevance - (1 - mmr_lambda) * max_sim
+            scores[~available] = -np.inf
+            pick = int(np.argmax(scores))
+            selected.append(pick)
+            available[pick] = False
+            np.maximum(max_sim, similarity[pick], out=max_sim)
+        
+        return selected
+    
     def exists(self) -> bool:
-        """检查索引文件是否存在"""
+        """检查索引文件（或知识包、分片）是否存在"""
+        if self._use_shards():
+            return True
+        if self._use_pack():
+            return os.path.exists(self.pack_path)
         return os.path.exists(self.index_path) and os.path.exists(self.metadata_path)
 
 